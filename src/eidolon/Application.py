@@ -32,6 +32,7 @@ import argparse
 from . import VisualizerUI
 from . import Utils
 from . import Concurrency  
+from . import BatchConvert
 from .SceneUtils import cleanupMatrices
 from .ImageAlgorithms import hounsfieldToUnit
 from .Utils import ConfVars,py3
@@ -139,6 +140,11 @@ def generateConfig(inargs):
     parser.add_argument('-t',help='Enable line tracing in stdout or log file',action='store_const',const='trace')
     parser.add_argument('-l',help='Enable logging to file',action='store_const',const='log')
     parser.add_argument('-c',help='Display the console at startup',action='store_const',const='console')
+    parser.add_argument('--convert',help='Convert the data files headless with the named plugin and exit',dest='convert',metavar='PLUGIN')
+    parser.add_argument('--outdir',help='Output directory for --convert',dest='outdir',metavar='DIR')
+    parser.add_argument('--ext',help='Output file extension for --convert',dest='ext',metavar='EXT')
+    parser.add_argument('--procs',help='Number of processes for --convert',dest='procs',metavar='N')
+    parser.add_argument('--memlimit',help='Memory budget in MB for files being converted at once by --convert',dest='memlimit',metavar='MB')
     parser.add_argument('files',help='Python Script Files, Project Directories, or Data Files',nargs='*')
     parser.add_argument('--help','-h',nargs=0,action=HelpAction,help='Display this help text and exit')
 
@@ -212,6 +218,40 @@ def generateConfig(inargs):
     return conf
 
 
+def initSharedMemory(conf):
+    '''Clean up and set up the shared memory matrix directory and initialize the global ProcessServer instance.'''
+    userappdir=conf.get(platformID,ConfVars.userappdir)
+
+    # cleanup matrices in shared memory to make sure we've got enough room in Linux
+    cleanupMatrices()
+
+    # change the shm directory location to be the per-user application data directory
+    if platformID!='Linux':
+        conf.set(platformID,ConfVars.shmdir,userappdir+'/shm/') 
+
+    # nominate shared memory directory to store ref count files
+    initSharedDir(conf.get(platformID,ConfVars.shmdir))
+
+    # initialize the singleton instance of the ProcessServer type using the specified CPU count or the actual count if not present
+    Concurrency.ProcessServer.createGlobalServer(int(conf.get(platformID,ConfVars.maxprocs) or Concurrency.cpu_count()))
+
+
+def initHeadless(conf):
+    '''
+    Initialize Eidolon without a UI for batch processing. This sets up tracing, logging, and concurrency as in
+    initDefault() and creates the SceneManager with no main window. Returns the manager.
+    '''
+    if conf.hasValue('args','l'):
+        Utils.setLogging(conf.get(platformID,ConfVars.logfile))
+
+    if conf.hasValue('args','t'):
+        Utils.setTrace()
+
+    initSharedMemory(conf)
+
+    return createSceneMgr(None,conf)
+
+
 def initDefault(conf):
     '''
     Initialize the default components of Eidolon. This sets up tracing, concurrency, inits the UI, sets the
@@ -231,18 +271,7 @@ def initDefault(conf):
     if conf.hasValue('args','t'):
         Utils.setTrace()
 
-    # cleanup matrices in shared memory to make sure we've got enough room in Linux
-    cleanupMatrices()
-
-    # change the shm directory location to be the per-user application data directory
-    if platformID!='Linux':
-        conf.set(platformID,ConfVars.shmdir,userappdir+'/shm/') 
-
-    # nominate shared memory directory to store ref count files
-    initSharedDir(conf.get(platformID,ConfVars.shmdir))
-
-    # initialize the singleton instance of the ProcessServer type using the specified CPU count or the actual count if not present
-    Concurrency.ProcessServer.createGlobalServer(int(conf.get(platformID,ConfVars.maxprocs) or Concurrency.cpu_count()))
+    initSharedMemory(conf)
 
     # initialize the UI, for Qt this is creating the QApplication object
     app=VisualizerUI.initUI()
@@ -399,6 +428,12 @@ def initDefaultAssets(mgr):
 def defaultMain(args=None):
     '''Default entry point for the application, calls the standard sequence of init steps and then starts the UI.'''
     conf=generateConfig(args if args else sys.argv[1:])
+
+    if conf.hasValue('args','convert'): # convert files headless instead of starting the UI
+        initHeadless(conf)
+        BatchConvert.batchConvertMain(conf)
+        return
+
     win,mgr=initDefault(conf)
     initDefaultAssets(mgr)
     mgr.loadFilesTask(*conf.get('args','files').split('|'))
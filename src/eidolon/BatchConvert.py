@@ -0,0 +1,278 @@
+# Eidolon Biomedical Framework
+# Copyright (C) 2016-8 Eric Kerfoot, King's College London, all rights reserved
+#
+# This file is part of Eidolon.
+#
+# Eidolon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eidolon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program (LICENSE.txt).  If not, see <http://www.gnu.org/licenses/>
+'''
+Batch conversion of data files between formats using the registered plugins. Each file is loaded by the first plugin
+accepting it and saved with the nominated output plugin. Independent files are converted in parallel in forked worker
+processes, each of which loads, converts, and saves one file at a time so that the stages of different files overlap.
+The number of files in flight is bounded by a memory budget estimated from input file sizes. This is intended to be
+used headless, either through convertFiles() in a script or through the --convert command line option, since forking
+a process with a running UI isn't safe. Without a UI there's no renderer, so loaders relying on it, such as image
+stacks loaded without imageio, will fail with an IOError which is recorded in that file's result.
+'''
+
+import os
+import time
+import threading
+import multiprocessing
+import collections
+
+from .Utils import Future, first, taskroutine, toIterable, splitPathExt, printFlush
+from .Concurrency import cpu_count, ProcessServer
+from .SceneManager import getSceneMgr
+
+
+ConvertJob=collections.namedtuple('ConvertJob','infile outpath plugin loadargs saveargs')
+
+ConvertResult=collections.namedtuple('ConvertResult','infile outpaths size loadtime savetime error')
+
+
+def getPathSize(path):
+    '''Returns the size of file `path' in bytes, the sum of the file sizes within `path' if it's a directory, or 0.'''
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(d,f)) for d,_,files in os.walk(path) for f in files)
+    elif os.path.isfile(path):
+        return os.path.getsize(path)
+    else:
+        return 0
+
+
+def getLoadPlugin(path):
+    '''Returns the first registered plugin which accepts `path' for loading, or None if there is none.'''
+    mgr=getSceneMgr()
+    return first(p for p in map(mgr.getPlugin,mgr.getPluginNames()) if p.acceptFile(path))
+
+
+def createConvertJobs(files,outdir,plugin,ext='',loadargs={},saveargs={}):
+    '''
+    Returns a list of ConvertJob objects to convert each of `files' with the plugin named `plugin' into directory
+    `outdir'. Each output path is the input file's name without its extension plus `ext', which may be left empty to
+    have the plugin add its default extension. The dictionaries `loadargs' and `saveargs' are passed as keyword
+    arguments to loadObject() and saveObject() respectively.
+    '''
+    jobs=[]
+    for f in files:
+        outpath=os.path.join(outdir,splitPathExt(os.path.abspath(f),True)[1]+ext)
+        jobs.append(ConvertJob(f,outpath,plugin,dict(loadargs),dict(saveargs)))
+
+    return jobs
+
+
+def convertFile(job):
+    '''
+    Convert the file for ConvertJob `job', returning a ConvertResult. This must be called within a task so that the
+    plugins' loading and saving tasks are executed immediately. If the loader produces multiple objects each is saved
+    to the output path with a numeric suffix.
+    '''
+    mgr=getSceneMgr()
+    size=getPathSize(job.infile)
+    inplugin=getLoadPlugin(job.infile)
+    outplugin=mgr.getPlugin(job.plugin)
+
+    if inplugin is None:
+        raise IOError('No plugin accepts file %r'%job.infile)
+
+    if outplugin is None:
+        raise ValueError('Cannot find plugin %r'%job.plugin)
+
+    start=time.time()
+    objs=Future.get(inplugin.loadObject(job.infile,**job.loadargs),None)
+    loadtime=time.time()-start
+
+    if objs is None:
+        raise IOError('Plugin %r loaded nothing from %r'%(inplugin.name,job.infile))
+
+    objs=list(toIterable(objs))
+
+    outpaths=[job.outpath] if len(objs)==1 else ['%s_%i'%(job.outpath,i) for i in range(len(objs))]
+
+    start=time.time()
+    for obj,outpath in zip(objs,outpaths):
+        Future.get(outplugin.saveObject(obj,outpath,**job.saveargs),None)
+
+    savetime=time.time()-start
+
+    return ConvertResult(job.infile,outpaths,size,loadtime,savetime,None)
+
+
+def _initConvertWorker():
+    '''
+    Worker process initializer, the forked process has no task thread so tasks are run in the worker's thread. The
+    process server inherited from the parent has no thread dispatching its jobs in the fork, so a server is created
+    which runs @concurrent routines in the worker itself, the workers being the parallelism here.
+    '''
+    ProcessServer.createGlobalServer(1)
+
+    mgr=getSceneMgr()
+    mgr.taskthread=threading.current_thread()
+    mgr.tasklist=[]
+    mgr.currentTask=None
+
+
+def _convertJobProcess(job):
+    '''Convert `job' in a worker process by running convertFile() as the current task, returning a ConvertResult.'''
+    mgr=getSceneMgr()
+
+    @taskroutine('Converting File')
+    def _convert(job,task):
+        return convertFile(job)
+
+    task=_convert(job)
+    mgr.currentTask=task
+
+    try:
+        task.start()
+        return task.result
+    except Exception as e:
+        return ConvertResult(job.infile,[],getPathSize(job.infile),0,0,'%s: %s'%(type(e).__name__,e))
+    finally:
+        mgr.currentTask=None
+
+
+def _convertJobLocal(job):
+    '''Convert `job' in this process through the manager's task queue, returning a ConvertResult.'''
+    mgr=getSceneMgr()
+    f=Future()
+
+    @taskroutine('Converting File')
+    def _convert(job,task):
+        with f:
+            f.setObject(convertFile(job))
+
+    try:
+        result=Future.get(mgr.runTasks([_convert(job)],f),None) # large files can take arbitrarily long to convert
+        if result is None:
+            raise IOError('Conversion produced no result')
+
+        return result
+    except Exception as e:
+        return ConvertResult(job.infile,[],getPathSize(job.infile),0,0,'%s: %s'%(type(e).__name__,e))
+
+
+def formatConvertResult(result):
+    '''Returns a one line summary of the ConvertResult `result' stating the per-file throughput.'''
+    if result.error:
+        return 'FAILED %s: %s'%(result.infile,result.error)
+
+    total=result.loadtime+result.savetime
+    rate=result.size/(1024.0*1024.0*total) if total>0 else 0
+
+    return '%s -> %s: %.1fMB load %.2fs save %.2fs (%.1fMB/s)'%(result.infile,', '.join(result.outpaths),
+        result.size/(1024.0*1024.0),result.loadtime,result.savetime,rate)
+
+
+def convertFiles(jobs,numprocs=None,memlimit=None,expansion=4.0,callback=printFlush):
+    '''
+    Convert the files for the ConvertJob objects `jobs', returning a list of ConvertResult objects in the same order.
+    Jobs are run in `numprocs' forked processes (default is the CPU count), or in this process through the task queue
+    if this is 1. The memory a job uses is estimated as its input size times `expansion', jobs are only started while
+    the total estimate for those running stays below `memlimit' bytes (no limit if None) but at least one is always
+    running. When each job completes, formatConvertResult() is applied to its result and passed to `callback' if given.
+    '''
+    numprocs=numprocs or cpu_count()
+    jobs=list(jobs)
+    results=[None]*len(jobs)
+
+    def _report(result):
+        if callback:
+            callback(formatConvertResult(result))
+
+    if numprocs==1 or len(jobs)<2:
+        for i,job in enumerate(jobs):
+            results[i]=_convertJobLocal(job)
+            _report(results[i])
+
+        return results
+
+    estimates=[getPathSize(j.infile)*expansion for j in jobs]
+    done=collections.deque() # indices of completed jobs, appended by the pool's result thread
+    cond=threading.Condition()
+    running={}
+    pending=collections.deque(range(len(jobs)))
+
+    def _finished(index,result):
+        with cond:
+            results[index]=result
+            done.append(index)
+            cond.notify()
+
+    pool=multiprocessing.get_context('fork').Pool(numprocs,_initConvertWorker)
+
+    try:
+        while pending or running:
+            # start jobs while under the memory budget, always keeping at least one job running
+            while pending and len(running)<numprocs:
+                index=pending[0]
+                used=sum(running.values())
+                if running and memlimit is not None and used+estimates[index]>memlimit:
+                    break
+
+                pending.popleft()
+                running[index]=estimates[index]
+                failed=lambda e,i=index:_finished(i,ConvertResult(jobs[i].infile,[],estimates[i]/expansion,0,0,repr(e)))
+                pool.apply_async(_convertJobProcess,(jobs[index],),callback=lambda r,i=index:_finished(i,r),error_callback=failed)
+
+            with cond:
+                while not done:
+                    cond.wait()
+
+                finished=list(done)
+                done.clear()
+
+            for index in finished:
+                del running[index]
+                _report(results[index])
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+
+def batchConvertMain(conf):
+    '''
+    Run a batch conversion from the command line, arguments are given in `conf' in the "args" group:
+        --convert PLUGIN : name of the plugin to save files with, eg. Nifti, VTK, X4DF
+        --outdir DIR : directory to save files to, default is the current directory
+        --ext EXT : extension to give the output files, default is the plugin's default extension
+        --procs N : number of worker processes, default is the number of CPUs
+        --memlimit MB : memory budget in megabytes for files being converted at once, default is unlimited
+    The files to convert are the command line files other than Python scripts. Returns the list of ConvertResults.
+    '''
+    getarg=lambda name,default: conf.get('args',name) if conf.hasValue('args',name) else default
+
+    plugin=conf.get('args','convert')
+    outdir=getarg('outdir','.')
+    ext=getarg('ext','')
+    numprocs=int(getarg('procs',0)) or None
+    memlimit=getarg('memlimit',None)
+    memlimit=float(memlimit)*1024*1024 if memlimit else None
+
+    files=[f for f in conf.get('args','files').split('|') if f.strip() and not f.endswith('.py')]
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    start=time.time()
+    results=convertFiles(createConvertJobs(files,outdir,plugin,ext),numprocs,memlimit)
+    total=time.time()-start
+
+    failed=sum(1 for r in results if r.error)
+    size=sum(r.size for r in results if not r.error)/(1024.0*1024.0)
+    printFlush('Converted %i of %i files, %.1fMB in %.2fs (%.1fMB/s)'%(len(results)-failed,len(results),size,total,size/total if total>0 else 0))
+
+    return results
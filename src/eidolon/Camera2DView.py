@@ -17,6 +17,8 @@
 # with this program (LICENSE.txt).  If not, see <http://www.gnu.org/licenses/>
 
 
+import numpy as np
+
 import renderer
 from . import Utils
 from . import SceneUtils
@@ -24,7 +26,7 @@ from . import SceneComponents
 from . import ImageAlgorithms
 from . import MeshAlgorithms
 
-from renderer import vec3, transform, color, rotator, PyVertexBuffer, PyIndexBuffer, pointSearchLinTet, FT_TRILIST, FT_LINELIST
+from renderer import vec3, transform, color, rotator, PyVertexBuffer, PyIndexBuffer, FT_TRILIST, FT_LINELIST
 from .Utils import epsilon, clamp, first, delayedcall, delayedMethodWeak, isMainThread, EventType, minmaxIndices
 from .SceneUtils import BoundBox
 from .MathDef import ElemType
@@ -423,18 +425,24 @@ class BaseCamera2DWidget(Base2DWidget):
         
         screennodes,indices,xis=self._imagePlaneMesh(rep,self.viewplane,imgstackpos,True)
         
-        for tri in indices:
-            nodes=[screennodes[i] for i in tri]
-            trixis=[xis[i] for i in tri]
-            nodes+=[nodes[0]+nodes[0].planeNorm(nodes[1],nodes[2])]
-            
-            xi=pointSearchLinTet(pos,*nodes)
-            
-            if xi.isInUnitCube() and sum(xi)<=1.0:
-                imgxi=ElemType.Tri1NL.applyBasis(trixis,xi.x(),xi.y(),0)
-                return imgxi*trans.getScale().abs(),imgstackpos
+        if len(indices)==0:
+            return None,imgstackpos
+        
+        # search every triangle at once by extruding each into a tet along its normal
+        trinodes=np.asarray([[tuple(screennodes[i]) for i in tri] for tri in indices],dtype=float)
+        norms=np.cross(trinodes[:,1]-trinodes[:,0],trinodes[:,2]-trinodes[:,0])
+        norms/=np.maximum(np.linalg.norm(norms,axis=1),epsilon)[:,np.newaxis]
+        tetnodes=np.concatenate([trinodes,(trinodes[:,0]+norms)[:,np.newaxis]],axis=1)
+        
+        trixis,found=SceneUtils.pointSearchElemArray(ElemType.Tet1NL,tetnodes,np.tile(tuple(pos),(len(indices),1)))
+        
+        if not found.any():
+            return None,imgstackpos
         
-        return None,imgstackpos
+        # Tet1NL places its second and third nodes at xi (0,1,0) and (1,0,0) so the first two xi components are swapped
+        i=np.flatnonzero(found)[0]
+        imgxi=ElemType.Tri1NL.applyBasis([xis[j] for j in indices[i]],trixis[i,1],trixis[i,0],0)
+        return imgxi*trans.getScale().abs(),imgstackpos
 
     def setFigTransforms(self):
         '''Set the transforms for all figures to fit them in the viewing area and translate/scale as inputed by user.'''
@@ -43,6 +43,7 @@ import functools
 import types
 import inspect
 import marshal
+from collections import deque
 from multiprocessing import Pipe, Process, cpu_count, Array, Value, Lock, Event
 
 try:
@@ -516,6 +517,21 @@ def sumResultMap(result):
 def listResults(result):
     '''Returns a list of the results from the given result map in process order.'''
     return [result[i] for i in sorted(result)]
+
+
+def boundedMap(pool,func,items,window):
+    '''
+    Yields the results of `func' applied to each of `items' using the executor `pool', in order. At most `window' items
+    are submitted ahead of the result being yielded so only that many results are held in memory at once.
+    '''
+    pending=deque()
+    for item in items:
+        pending.append(pool.submit(func,item))
+        if len(pending)>=window:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
     
 
 def concurrent(func):
@@ -21,6 +21,7 @@ import math
 import os
 import contextlib
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import numpy as np
 import scipy.ndimage
@@ -168,47 +169,37 @@ def loadImageFile(filename,imgobj,pos=vec3(),rot=rotator(),spacing=(1.0,1.0)):
 
 
 @timing
-def loadImageStack(files,imgLoadFunc,positions,rot=rotator(),spacing=(1.0,1.0),task=None):
+def loadImageStack(files,imgLoadFunc,positions,rot=rotator(),spacing=(1.0,1.0),task=None,numthreads=1):
+    '''
+    Load the image files `files' using `imgLoadFunc' to decode each, returning a list of SharedImage objects placed
+    at the matching positions in `positions' with orientation `rot' and pixel dimensions `spacing'. Files are decoded
+    by a pool of `numthreads' threads, each filling the image matrix it allocates for its file. The default of 1 is
+    required for the renderer's loadImageFile() which holds the GIL and isn't known to be thread-safe, more threads
+    should only be used with a thread-safe decoder which releases the GIL. The returned list is in the order of
+    `files', files which fail to load are reported and omitted.
+    '''
     assert len(files)==len(positions)
 
-    def createLoadImageThread(filenames,positions,imgq):
-        def readImages():
-            for f,p in zip(filenames,positions):
-                try:
-                    i=imgLoadFunc(f)
-                    imgq.put((f,i,p))
-                except Exception as e:
-                    printFlush(e)
-
-        readthread=threading.Thread(target=readImages)
-        readthread.start()
-
-        return readthread
+    results=[None]*len(files)
 
-    imgq=queue.Queue()
-    numthreads=1
-    threads=[]
-    results=[]
+    def _loadImage(i):
+        imgobj=imgLoadFunc(files[i])
+        results[i]=loadImageFile(files[i],imgobj,positions[i],rot,spacing)
 
     if task:
         task.setMaxProgress(len(files))
 
-    for n in range(numthreads):
-        start,end=Utils.partitionSequence(len(files),n,numthreads)
-        threads.append(createLoadImageThread(files[start:end],positions[start:end],imgq))
+    with ThreadPoolExecutor(numthreads or 1) as pool:
+        loads=[pool.submit(_loadImage,i) for i in range(len(files))]
 
-    while any(t.isAlive() for t in threads) or not imgq.empty():
-        try:
-            filename,imgobj,position=imgq.get(True,0.01)
-            results.append(loadImageFile(filename,imgobj,position,rot,spacing))
-            del imgobj
-        except Exception as e:
-            printFlush(e)
+        for count,load in enumerate(as_completed(loads)):
+            if load.exception() is not None:
+                printFlush(load.exception())
 
-        if task:
-            task.setProgress(len(results))
+            if task:
+                task.setProgress(count+1)
 
-    return results
+    return [r for r in results if r is not None]
 
 
 def generateImageStack(width,height,slices,timesteps=1,pos=vec3(),rot=rotator(),spacing=vec3(1),name='img'):
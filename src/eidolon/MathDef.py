@@ -100,7 +100,7 @@ GeomType=enum(
 class ElemTypeDef(object):
     ''' Defines an element type as its basis function. This includes geometry and face type information.'''
 
-    def __init__(self,geom,basisname,desc,order,xis,vertices,faces,internalxis,basis,pointsearch,facetype):
+    def __init__(self,geom,basisname,desc,order,xis,vertices,faces,internalxis,basis,pointsearch,facetype,vbasis=None):
         self.geom=geom # geometry (tet, hex, etc)
         self.dim=GeomType[geom][1]
         self.isSimplex=GeomType[geom][2]
@@ -112,6 +112,7 @@ class ElemTypeDef(object):
         self.vertices=list(vertices) # list of vertex indices, [] if node count not fixed
         self.faces=list(faces) # list of face node indices, [] if node count not fixed
         self.basis=basis # basis callable, maps xi values to node coefficients, must accept x, y, z coordinate arguments plus any further positional and keyword args
+        self.vbasis=vbasis # vectorized basis callable, maps a (N,3) xi array to a (N,K) coefficient array, accepts the same further args as `basis', None if not provided
         self.pointsearch=pointsearch # callable which implements point search for this type
         self.facetype=facetype if facetype else self# ElemTypeDef defining faces as 2D elements (assumes all faces same shape)
         self.internalxis=list(internalxis) # per-face xi sub values to convert a xi value on face to internal xi
@@ -203,6 +204,54 @@ class ElemTypeDef(object):
         else:
             return mulsum(vals,coeffs)
 
+    def basisArray(self,xis,*args,**kwargs):
+        '''
+        Evaluates the basis function at every xi point in `xis', which is a (N,D) array-like with D<=3, and returns the 
+        coefficients as a (N,K) array. This uses the vectorized basis `self.vbasis' if present, otherwise `self.basis' 
+        is called for each point. The further arguments are passed to the basis function as with `applyBasis'.
+        '''
+        xis=np.asarray(xis,dtype=float)
+        if xis.ndim==1:
+            xis=xis.reshape((-1,1))
+
+        if xis.shape[1]<3: # pad out to 3 columns so that basis functions always get 3 xi components
+            xis=np.hstack([xis,np.zeros((xis.shape[0],3-xis.shape[1]))])
+
+        if self.vbasis is not None:
+            return np.asarray(self.vbasis(xis,*args,**kwargs),dtype=float)
+        else:
+            return np.asarray([self.basis(xi0,xi1,xi2,*args,**kwargs) for xi0,xi1,xi2 in xis[:,:3]],dtype=float)
+
+    def applyBasisArray(self,vals,xis,*args,**kwargs):
+        '''
+        Evaluates the basis function at every xi point in `xis' and applies the coefficients to the control values `vals'
+        as done by `applyCoeffsArray', where `paired' may be given as a keyword argument. This is the vectorized 
+        equivalent of calling `applyBasis' for each xi point.
+        '''
+        paired=kwargs.pop('paired',False)
+        return self.applyCoeffsArray(vals,self.basisArray(xis,*args,**kwargs),paired)
+
+    def applyCoeffsArray(self,vals,coeffs,paired=False):
+        '''
+        Apply the (N,K) coefficient array `coeffs' to the control values `vals' and return the summed results. If `paired'
+        is False `vals' is a (K,...) array-like whose first axis is the control point, eg. (K,) for scalars or (K,3) for
+        vectors of one element, or (K,E,3) for vectors of E elements, and the result is a (N,...) array of every xi point 
+        applied to these. If `paired' is True `vals' must be a (N,K,...) array defining the values for each xi point's 
+        element and the result is the (N,...) array of each point applied to its own element. Values in a `vals' list 
+        may be scalars or vector types like vec3 which are converted to tuples.
+        '''
+        coeffs=np.asarray(coeffs,dtype=float)
+        
+        if not isinstance(vals,np.ndarray):
+            vals=np.asarray([tuple(v) if isIterable(v) else v for v in vals],dtype=float)
+
+        if paired:
+            assert vals.shape[:2]==coeffs.shape, '%r != %r' % (vals.shape[:2],coeffs.shape)
+            return np.einsum('nk,nk...->n...',coeffs,vals)
+        else:
+            assert vals.shape[0]==coeffs.shape[1], '%i != %i' % (vals.shape[0],coeffs.shape[1])
+            return np.tensordot(coeffs,vals,axes=(1,0))
+
     def faceXiToElemXi(self,face,xi0,xi1):
         '''
         Convert the xi value (xi0,xi1) on face number `face' to an element xi value for a 3D element. If self.dim
@@ -410,6 +459,34 @@ def lagrangeBasis(K,dim,alpha,beta):
     return lambda xi0,xi1,xi2,*args,**kwargs : eval(c)
 
 
+def lagrangeBasisArray(dim,alpha,beta):
+    '''
+    Create a vectorized lagrange basis function which accepts a (N,3) xi array and calculates the (N,K) array of 
+    coefficients for each node. The polynomial terms for every point are computed from `beta' and multiplied by `alpha'.
+    '''
+    alphaT=np.asarray(alpha,dtype=float).T # (M,K) polynomial coefficients per node
+    beta=np.asarray(beta,dtype=int) # (dim,M) xi exponents per polynomial
+
+    def _basis(xis,*args,**kwargs):
+        terms=np.prod(xis[:,:dim,np.newaxis]**beta[np.newaxis],axis=1) # (N,M) polynomial term values
+        return terms.dot(alphaT)
+
+    return _basis
+
+
+def vectorizedBasis(basis):
+    '''
+    Create a vectorized basis function from `basis', which must be composed of arithmetic expressions only so that it
+    computes elementwise when given the xi columns of a (N,3) array as arguments. The result accepts a (N,3) xi array
+    and produces a (N,K) coefficient array.
+    '''
+    def _basis(xis,*args,**kwargs):
+        coeffs=basis(xis[:,0],xis[:,1],xis[:,2],*args,**kwargs)
+        return np.stack(np.broadcast_arrays(*coeffs),axis=-1) # broadcast any constant coefficients to the point count
+
+    return _basis
+
+
 def lagrangeAlpha(beta,xicoords):
     '''
     Calculate an alpha matrix for a nodal lagrange basis function by applying the Vandermonde matrix method to a beta
@@ -501,6 +578,7 @@ def nodalLagrangeType(geom,desc,order):
     xis=xiCoords(order,beta)
     alpha=lagrangeAlpha(beta,xis)
     basis=lagrangeBasis(len(xis),dim,alpha,beta)
+    vbasis=lagrangeBasisArray(dim,alpha,beta)
 
     # determine faces and face basis function(s)
     faces=[]
@@ -515,7 +593,7 @@ def nodalLagrangeType(geom,desc,order):
     if dim==3: # TODO: this assumes all faces the same shape, change if this isn't true anymore (eg. prisms)
         facetype=nodalLagrangeType(GeomType._Tri if isSimplex else GeomType._Quad,'Face type',order)
 
-    return ElemTypeDef(geom,'NL',desc,order,xis,list(range(numVertices)),faces,internalxis,basis,pointSearchElem,facetype)
+    return ElemTypeDef(geom,'NL',desc,order,xis,list(range(numVertices)),faces,internalxis,basis,pointSearchElem,facetype,vbasis)
 
 
 def jacobiPoly(n,a,b,x):
@@ -556,7 +634,7 @@ def modalPolyLineType(geom,desc,order):
     xis=[(float(i)/order,) for i in range(order+1)]
     nodeinds=range(order+1)
 
-    return ElemTypeDef(geom,'MPL',desc,order,xis,nodeinds,[],[],basis,None,None)
+    return ElemTypeDef(geom,'MPL',desc,order,xis,nodeinds,[],[],basis,None,None,vectorizedBasis(basis))
 
 
 def jacobiEvaluate(x,order,a,b):
@@ -715,7 +793,7 @@ def bezierLineType(geom,desc,order):
     xis=[(float(i)/order,) for i in range(order+1)]
     nodeinds=list(range(order+1))
 
-    return ElemTypeDef(geom,'BL',desc,order,xis,nodeinds,[],[],basis,None,None)
+    return ElemTypeDef(geom,'BL',desc,order,xis,nodeinds,[],[],basis,None,None,vectorizedBasis(basis))
     
     
 def cubicHermiteCoeffs1D(t,u=0,v=0):
@@ -778,7 +856,7 @@ def cubicHermiteType(geom,desc,order):
 
     xis=[tuple(reversed(xi)) for xi in itertools.product([-1.0,0.0,1.0,2.0],repeat=order)]
 
-    return ElemTypeDef(geom,'CH',desc,order,xis,vertices,faces,internalxis,basis,pointsearch,facetype)
+    return ElemTypeDef(geom,'CH',desc,order,xis,vertices,faces,internalxis,basis,pointsearch,facetype,vectorizedBasis(basis))
 
 
 def catmullRomCoeffs1D(t,u=0,v=0):
@@ -930,7 +1008,7 @@ def catmullRomType(geom,desc,order):
         
     xis=[tuple(reversed(xi)) for xi in itertools.product([-1.0,0.0,1.0,2.0],repeat=order)]
     
-    return ElemTypeDef(geom,'CR',desc,order,xis,vertices,faces,internalxis,basis,pointsearch,facetype)
+    return ElemTypeDef(geom,'CR',desc,order,xis,vertices,faces,internalxis,basis,pointsearch,facetype,vectorizedBasis(basis))
 
 
 def piecewiseCatmullRomType(geom,desc,order):
@@ -963,8 +1041,38 @@ def piecewiseCatmullRomType(geom,desc,order):
             coeffs[ind]+=c
             
         return coeffs
+    
+    baseoffsets=np.asarray(basetype.xis,dtype=int) # xi offsets of the local element's control points in the grid
+    
+    def _vbasisPCR(xis,ul,vl=1,wl=1,*args,**kwargs):
+        '''Vectorized version of _basisPCR, coefficients for every point in the local elements are summed in one step.'''
+        dims=(ul,vl,wl)
+        limits=kwargs.get('limits',None) or [(1,1)]*3
+        circular=kwargs.get('circular',[False]*3)
+        numdims=min(len(limits),len(circular),baseoffsets.shape[1]) # only dimensions present in all of these are used, as in _basisPCR
+        numpts=xis.shape[0]
+        pxis=np.zeros((numpts,3))
+        ctrlinds=np.zeros((numpts,len(baseoffsets)),dtype=int)
+        stride=1
+        
+        # calculate local element xis and the flattened grid index of every local control point like xisToPiecewiseXis and arrayIndex
+        for d in range(numdims):
+            lmin,lmax=limits[d]
+            xx=xis[:,d]*(dims[d]-lmax-lmin-1)
+            ixx=xx.astype(int) # truncates towards zero like int()
+            pxis[:,d]=xx-ixx
+            
+            inds=(ixx+lmin)[:,np.newaxis]+baseoffsets[np.newaxis,:,d]
+            inds=inds%dims[d] if circular[d] else np.clip(inds,0,dims[d]-1)
+            ctrlinds+=inds*stride
+            stride*=dims[d]
+            
+        coeffs=np.zeros((numpts,ul*vl*wl))
+        np.add.at(coeffs,(np.arange(numpts)[:,np.newaxis],ctrlinds),basetype.basisArray(pxis))
+        
+        return coeffs
             
-    return ElemTypeDef(geom,'PCR',desc,order,[],[],[],[],_basisPCR,None,facetype)
+    return ElemTypeDef(geom,'PCR',desc,order,[],[],[],[],_basisPCR,None,facetype,_vbasisPCR)
         
 
 
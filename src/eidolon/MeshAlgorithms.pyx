@@ -27,6 +27,8 @@ tuple.
 
 from codeop import CommandCompiler
 
+import numpy as np
+
 from .Utils import *
 from .Concurrency import concurrent,chooseProcCount,cpu_count,checkResultMap
 from .MathDef import GeomType,ElemType
@@ -613,6 +615,142 @@ def generateTriDataSet(dataset,str name,int refine,bint externalOnly=False,task=
     return ds,indlist
 
 
+def isTopologyShared(dataset,otherds,list indlist):
+    '''
+    Returns True if `otherds' has as many nodes as `dataset' and contains index matrices identical to those in `indlist',
+    which should be the index matrices of `dataset' returned by a representation generation algorithm. This is the case
+    for timesteps of the same mesh which either share index matrix objects or store copies of the same topology.
+    '''
+    cdef IndexMatrix ind,other
+
+    if dataset.getNodes().n()!=otherds.getNodes().n():
+        return False
+
+    for ind in indlist:
+        other=otherds.getIndexSet(ind.getName())
+
+        if other is ind:
+            continue
+
+        if other is None or other.getType()!=ind.getType() or other.n()!=ind.n() or other.m()!=ind.m():
+            return False
+
+        if not np.array_equal(np.asarray(other),np.asarray(ind)):
+            return False
+
+    return True
+
+
+@timing
+def generateSharedTopologyDataSet(reprdata,dataset,str name,task=None):
+    '''
+    Generate a triangle representation dataset for `dataset' which shares the topology of `reprdata', the (DataSet,
+    index list) pair produced by generateTriDataSet for another dataset with the same topology as determined by
+    isTopologyShared, typically another timestep of the same mesh. The triangle, node property, and external index
+    matrices of `reprdata' are shared rather than regenerated so only the node matrix is created. Node positions are
+    calculated by applying the basis function at the xi coordinate stored for each representation node to the nodes of
+    `dataset', and normals are calculated from the shared triangles. Returns a (DataSet,index list) tuple.
+    '''
+    cdef Vec3Matrix nodes=dataset.getNodes(),refnodes,outnodes
+    cdef IndexMatrix props,tris,extinds,ind
+    cdef int indnum
+    cdef str refname
+
+    refds,indlist=reprdata
+    refname=refds.getName()
+    refnodes=refds.getNodes()
+    props=refds.getIndexSet(refname+MatrixType.props[1])
+    tris=refds.getIndexSet(refname+MatrixType.tris[1])
+    extinds=refds.getIndexSet(refname+MatrixType.extinds[1])
+
+    if props is None or tris is None or refnodes.m()<3:
+        raise ValueError('Representation dataset %r does not store the node properties and xis needed to share topology'%refname)
+
+    for ind in indlist:
+        if not ElemType[ind.getType()].isFixedNodeCount():
+            raise ValueError('Cannot share topology of index matrix %r with element type %r'%(ind.getName(),ind.getType()))
+
+    if task:
+        task.setMaxProgress(len(indlist)+1)
+
+    outnodes=refnodes.clone(name+MatrixType.nodes[1]) # copies xi and uvw columns, position and normal columns are replaced below
+
+    srcnodes=np.asarray(nodes)[:,:3]
+    outarr=np.asarray(outnodes)
+    proparr=np.asarray(props)
+    triarr=np.asarray(tris)
+
+    # calculate node positions for each index matrix by applying the basis coefficients for each unique xi to the element nodes
+    for indnum,ind in enumerate(indlist):
+        elemtype=ElemType[ind.getType()]
+        rows=np.flatnonzero(proparr[:,2]==indnum)
+
+        if len(rows)>0:
+            uniquexis,xiinds=np.unique(outarr[rows,6:9],axis=0,return_inverse=True)
+            coeffs=elemtype.basisArray(uniquexis)
+            elemnodes=srcnodes[np.asarray(ind)[proparr[rows,0]]] # (len(rows),elemtype.numNodes(),3) array of element node positions
+            outarr[rows,:3]=np.einsum('ij,ijk->ik',coeffs[xiinds.ravel()],elemnodes)
+
+        if task:
+            task.setProgress(indnum+1)
+
+    # sum the normals of each triangle into its vertices then normalize, nodes are not shared between element faces
+    trinodes=outarr[:,:3][triarr]
+    trinorms=np.cross(trinodes[:,1]-trinodes[:,0],trinodes[:,2]-trinodes[:,0])
+    norms=np.zeros((outarr.shape[0],3))
+
+    for i in range(3):
+        np.add.at(norms,triarr[:,i],trinorms)
+
+    # orient normals the same way as the reference, triangle winding need not agree with the generated normals
+    norms[np.einsum('ij,ij->i',norms,outarr[:,3:6])<0]*=-1
+    normlens=np.linalg.norm(norms,axis=1)
+    normlens[normlens==0]=1.0
+    outarr[:,3:6]=norms/normlens[:,np.newaxis]
+
+    if task:
+        task.setProgress(len(indlist)+1)
+
+    # store shared matrices under names derived from `name' so that they are found by representation objects
+    indices={
+        name+MatrixType.props[1]:props,
+        name+MatrixType.extinds[1]:extinds,
+        name+MatrixType.tris[1]:tris
+    }
+
+    ds=PyDataSet(name,outnodes,indices,dataset.fields)
+    ds.meta(StdProps._sharedtopology,'True')
+    return ds,indlist
+
+
+def fillMorphNodes(Vec3Matrix morphnodes,Vec3Matrix startnodes,Vec3Matrix endnodes):
+    '''
+    Fill the 4 column matrix `morphnodes' with (position, normal, start position, end position) rows for morphing from
+    the representation nodes `startnodes' to `endnodes', which must be the same length. The position column is set to
+    the start position so that the morph vertex program interpolates from column 0 to column 3 (texture coordinate).
+    '''
+    assert morphnodes.m()==4
+    assert startnodes.n()==endnodes.n()
+
+    morphnodes.setN(startnodes.n())
+
+    morpharr=np.asarray(morphnodes)
+    startarr=np.asarray(startnodes)
+
+    morpharr[:,:6]=startarr[:,:6]
+    morpharr[:,6:9]=startarr[:,:3]
+    morpharr[:,9:12]=np.asarray(endnodes)[:,:3]
+
+
+def interpolateMorphNodes(Vec3Matrix morphnodes,float value):
+    '''
+    Set the position column of `morphnodes' to the linear interpolation at `value' between the start and end position
+    columns, this is the software equivalent of the morph vertex program used when it isn't available.
+    '''
+    morpharr=np.asarray(morphnodes)
+    morpharr[:,:3]=morpharr[:,6:9]*(1.0-value)+morpharr[:,9:12]*value
+
+
 @concurrent
 def generateMeshPlanecutRange(process,str name,vec3 pt,vec3 norm,float width,Vec3Matrix innodes,ColorMatrix nodecolors,IndexMatrix inds,IndexMatrix octree,list slicedleaves):
     cdef tuple indextype=MatrixType.lines if width==0 else MatrixType.tris
@@ -957,13 +1095,20 @@ def calculateDataColoration(mat,parentds,ColorMatrix cols,Vec3Matrix nodes,Index
 
 @concurrent
 def applyBasisConcurrentRange(process,Vec3Matrix xis,ctrls,output,str typename,tuple args,dict kwargs):
-    cdef int i
-    cdef float x,y,z
+    cdef int start,end,blocksize=10000
     et=ElemType[typename]
-    for i in process.prange():
-        x,y,z=xis.getAt(i)
-        val=et.applyBasis(ctrls,x,y,z,*args,**kwargs)
-        output.setAt(val,i)
+    xiarr=np.asarray(xis)
+    outarr=np.asarray(output)
+    ctrlarr=np.asarray([tuple(c) if isIterable(c) else c for c in ctrls],dtype=float)
+
+    # apply the vectorized basis function to blocks of xi values, all xis in a block are read before output is written
+    for start in range(process.startval,process.endval,blocksize):
+        end=min(process.endval,start+blocksize)
+        vals=et.applyBasisArray(ctrlarr,xiarr[start:end],*args,**kwargs)
+        outarr[start:end]=vals.reshape(outarr[start:end].shape)
+        process.setProgress(end-process.startval)
+
+    process.setProgress(process.endval-process.startval,True)
 
 
 @timing
@@ -980,6 +1125,141 @@ def applyBasisConcurrent(Vec3Matrix xis,ctrls,output,str typename,tuple args,dic
     applyBasisConcurrentRange(xis.n(),proccount,task,xis,ctrls,output,typename,args,kwargs)
 
 
+def calculateElemBoxes(nodes,ind,int blocksize=100000):
+    '''
+    Returns the (E,3) minimal and maximal corner arrays of the axis-aligned bounding boxes for every element of `ind'
+    whose nodes are in `nodes', these may be matrices or arrays. Elements are processed in blocks of `blocksize'.
+    '''
+    cdef int start
+    nodearr=np.asarray(nodes)[:,:3]
+    indarr=np.asarray(ind)
+    minv=np.empty((indarr.shape[0],3))
+    maxv=np.empty((indarr.shape[0],3))
+
+    for start in range(0,indarr.shape[0],blocksize):
+        elemnodes=nodearr[indarr[start:start+blocksize]]
+        minv[start:start+blocksize]=elemnodes.min(axis=1)
+        maxv[start:start+blocksize]=elemnodes.max(axis=1)
+
+    return minv,maxv
+
+
+def findBoxCandidates(minv,maxv,pts):
+    '''
+    Returns the (point index, box index) arrays of every pair where a point from the (N,3) array `pts' is within a box
+    defined by the (E,3) corner arrays `minv' and `maxv'. The boxes are binned into a uniform grid whose cell size is the
+    median box size so that each point is only tested against the boxes overlapping its cell.
+    '''
+    pts=np.asarray(pts,dtype=float)
+    numboxes=minv.shape[0]
+
+    if numboxes==0 or pts.shape[0]==0:
+        return np.zeros((0,),dtype=int),np.zeros((0,),dtype=int)
+
+    gridmin=minv.min(axis=0)
+    cellsize=np.median((maxv-minv).max(axis=1))
+    if cellsize<=0:
+        cellsize=max(epsilon,(maxv.max(axis=0)-gridmin).max()/max(1.0,numboxes**(1.0/3)))
+
+    # determine the range of cells each box overlaps and the dimensions of the grid
+    lo=np.floor((minv-gridmin)/cellsize).astype(np.int64)
+    hi=np.floor((maxv-gridmin)/cellsize).astype(np.int64)
+    dims=hi.max(axis=0)+1
+    spans=hi-lo+1
+    counts=np.prod(spans,axis=1)
+
+    # list every (cell, box) pair by enumerating the cells in each box's range, then sort by cell ID
+    boxinds=np.repeat(np.arange(numboxes),counts)
+    local=np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts,counts)
+    bspans=spans[boxinds]
+    cx=lo[boxinds,0]+local%bspans[:,0]
+    cy=lo[boxinds,1]+(local//bspans[:,0])%bspans[:,1]
+    cz=lo[boxinds,2]+local//(bspans[:,0]*bspans[:,1])
+    cellids=(cz*dims[1]+cy)*dims[0]+cx
+    order=np.argsort(cellids,kind='stable')
+    cellids=cellids[order]
+    boxinds=boxinds[order]
+
+    # find the range of boxes in each point's cell, points outside the grid have no candidates
+    ptcells=np.floor((pts-gridmin)/cellsize).astype(np.int64)
+    inside=np.all((ptcells>=0) & (ptcells<dims),axis=1)
+    ptids=(ptcells[:,2]*dims[1]+ptcells[:,1])*dims[0]+ptcells[:,0]
+    left=np.searchsorted(cellids,ptids,'left')
+    numcands=np.where(inside,np.searchsorted(cellids,ptids,'right')-left,0)
+
+    ptinds=np.repeat(np.arange(pts.shape[0]),numcands)
+    local=np.arange(numcands.sum())-np.repeat(np.cumsum(numcands)-numcands,numcands)
+    candinds=boxinds[np.repeat(left,numcands)+local]
+
+    # keep only those pairs where the point is actually within the box
+    within=np.all((pts[ptinds]>=minv[candinds]) & (pts[ptinds]<=maxv[candinds]),axis=1)
+
+    return ptinds[within],candinds[within]
+
+
+@concurrent
+def pointSearchElemsRange(process,Vec3Matrix nodes,IndexMatrix ind,Vec3Matrix pts,IndexMatrix outelems,Vec3Matrix outxis,int blocksize):
+    cdef int start,end=process.endval
+    elemtype=ElemType[ind.getType()]
+    nodearr=np.asarray(nodes)[:,:3]
+    indarr=np.asarray(ind)
+    ptarr=np.asarray(pts)[process.startval:end,:3]
+    elemarr=np.asarray(outelems)[process.startval:end]
+    xiarr=np.asarray(outxis)[process.startval:end]
+
+    minv,maxv=calculateElemBoxes(nodearr,indarr)
+    margin=max(epsilon,(maxv.max(axis=0)-minv.min(axis=0)).max()*1e-5) if len(minv)>0 else epsilon
+    ptinds,eleminds=findBoxCandidates(minv-margin,maxv+margin,ptarr)
+
+    # search in blocks of candidate pairs, the first element found for each point is accepted
+    for start in range(0,len(ptinds),blocksize):
+        pinds=ptinds[start:start+blocksize]
+        einds=eleminds[start:start+blocksize]
+        unfound=elemarr[pinds,1]==0
+        pinds=pinds[unfound]
+        einds=einds[unfound]
+
+        xis,found=SceneUtils.pointSearchElemArray(elemtype,nodearr[indarr[einds]],ptarr[pinds])
+
+        pinds,first=np.unique(pinds[found],return_index=True)
+        elemarr[pinds,0]=einds[found][first]
+        elemarr[pinds,1]=1
+        xiarr[pinds]=xis[found][first]
+
+        process.setProgress(min(len(ptinds),start+blocksize)*(end-process.startval)//len(ptinds))
+
+    process.setProgress(end-process.startval,True)
+
+
+@timing
+def pointSearchElems(Vec3Matrix nodes,IndexMatrix ind,Vec3Matrix pts,str name='search',int blocksize=100000,task=None):
+    '''
+    Finds the elements of `ind', which must define 3D elements, and their xi coordinates containing each point in `pts'.
+    Candidate elements for each point are chosen by binning element bounding boxes in a uniform grid, then the xi
+    values for every candidate pair are computed together by SceneUtils.pointSearchElemArray. The result is a pair of
+    matrices with a row per point: an IndexMatrix of (element index, found) rows where `found' is 1 if the point is in
+    the element and 0 if the point is not in any element, and a Vec3Matrix of xi coordinates for the found points.
+    '''
+    cdef int proccount=chooseProcCount(pts.n(),1,2000)
+    cdef IndexMatrix elems=IndexMatrix(name+' Elems',pts.n(),2,proccount!=1)
+    cdef Vec3Matrix xis=Vec3Matrix(name+' Xis',pts.n(),1,proccount!=1)
+
+    elemtype=ElemType[ind.getType()]
+
+    if not elemtype.isFixedNodeCount() or elemtype.dim!=3:
+        raise ValueError('Cannot search elements of type %r, only 3D elements with fixed node counts are supported'%ind.getType())
+
+    elems.fill(0)
+    xis.fill(vec3())
+
+    if proccount!=1:
+        shareMatrices(nodes,ind,pts)
+
+    pointSearchElemsRange(pts.n(),proccount,task,nodes,ind,pts,elems,xis,blocksize)
+
+    return elems,xis
+
+
 @concurrent
 def calculateLinearTriangulationRange(process,int numnodes,IndexMatrix ind,IndexMatrix ext,bint externalOnly,int indnum):
     cdef object elemtype=ElemType[ind.getType()]
@@ -1659,29 +1939,24 @@ def generateRibbonDataSet(dataset,str name,int refine,bint externalOnly=False,ta
 
 @concurrent
 def reinterpolateVerticesRange(process,Vec3Matrix vertices,Vec3Matrix newnodes,Vec3Matrix oldnodes,IndexMatrix oldnodeprops,indlist):
-    cdef int n,elem,indnum,ind
-    cdef list elemnodes,elemtypelist=[ElemType[ind.getType()] for ind in indlist]
-    cdef dict elemnodemap={}
+    cdef int indnum,start=process.startval,end=process.endval
+    srcnodes=np.asarray(newnodes)[:,:3]
+    oldarr=np.asarray(oldnodes)[start:end]
+    proparr=np.asarray(oldnodeprops)[start:end]
+    outarr=np.asarray(vertices)[start:end]
 
-    for n in process.prange():
-        elem=oldnodeprops.getAt(n,0)
-#       face=oldnodeprops.getAt(n,1)
-        indnum=oldnodeprops.getAt(n,2)
-        ind=indlist[indnum]
-        elemtype=elemtypelist[indnum]
+    outarr[:,3:]=oldarr[:,3:] # copy normals, xis, and any further columns
 
-#       elemnodes=newnodes.mapIndexRow(ind,elem)
+    # interpolate the vertices of each index set's elements in one vectorized step from their stored xi/elem# values
+    for indnum,ind in enumerate(indlist):
+        rows=np.flatnonzero(proparr[:,2]==indnum)
 
-        if (elem,indnum) not in elemnodemap:
-            elemnodemap[(elem,indnum)]=newnodes.mapIndexRow(ind,elem)
+        if len(rows)>0:
+            elemtype=ElemType[ind.getType()]
+            elemnodes=srcnodes[np.asarray(ind)[proparr[rows,0]]] # (len(rows),elemtype.numNodes(),3) array of element node positions
+            outarr[rows,:3]=elemtype.applyBasisArray(elemnodes,oldarr[rows,6:9],paired=True)
 
-        elemnodes=elemnodemap[(elem,indnum)]
-
-        vertxi=oldnodes.getAt(n,2)
-        vert=elemtype.applyBasis(elemnodes,vertxi.x(),vertxi.y(),vertxi.z())
-#       norm=calculateFaceNormal(elemnodes,elemtype,face)
-
-        vertices.setRow(n,vert,oldnodes.getAt(n,1),vertxi)
+    process.setProgress(end-start,True)
 
 
 @timing
@@ -1974,57 +2249,67 @@ def generateIsoplaneDataSet(dataset,name,refine,pt,norm,indexAcceptFunc=None,tas
 
 
 @concurrent
-def calculateIsosurfaceRange(process,nodes,ind,refine,field,fieldtopo,minv,maxv,planevals,indnum):
+def calculateIsosurfaceRange(process,nodes,ind,refine,field,fieldtopo,minv,maxv,planevals,indnum,int blocksize=2000000):
     elemtype=ElemType[ind.getType()]
     fieldtype=ElemType[fieldtopo.getType()]
     name='calculateIsosurfaceRange'
-    count=1
-
-    outnodes=Vec3Matrix(name+' Nodes'+str(process.index),0,3)
-    outprops=IndexMatrix(name+MatrixType.props[1]+str(process.index),0,3)
-    outinds=IndexMatrix(name+MatrixType.tris[1]+str(process.index),0,3)
-
-    def addNode(node,norm,xi,elem):
-        outnodes.append(node,norm,vec3(*xi))
-        outprops.append(elem,0,indnum)
-
-    for elem in xrange(process.maxval):
-        if elem%process.total!=process.index:
-            continue
-
-        elemnodes=nodes.mapIndexRow(ind,elem) #getElemNodes(elem,ind,nodes)
-        fieldvals=field.mapIndexRow(fieldtopo,elem) #getElemNodes(elem,fieldtopo,field)
-        process.setProgress(count)
-        count+=1
-
-        for val in planevals:
-            for a,b,c in SceneUtils.calculateElemIsosurf(fieldvals,fieldtype,elemtype,val,refine):
-                n1=elemtype.applyBasis(elemnodes,*a)
-                n2=elemtype.applyBasis(elemnodes,*b)
-                n3=elemtype.applyBasis(elemnodes,*c)
-
-                norm=n1.planeNorm(n2,n3)
-
-                nodeslen=outnodes.n()
-                addNode(n1,norm,a,elem)
-                addNode(n2,norm,b,elem)
-                addNode(n3,norm,c,elem)
-
-                addNode(n1,-norm,a,elem)
-                addNode(n3,-norm,c,elem)
-                addNode(n2,-norm,b,elem)
+    isovals=np.asarray(planevals,dtype=float)
+    nodearr=np.asarray(nodes)[:,:3]
+    indarr=np.asarray(ind)
+    fieldarr=np.asarray(field)[:,0]
+    elemfield=fieldarr[np.asarray(fieldtopo)[process.startval:process.endval]] # field values for each element in range
+    trixislist=[]
+    elemslist=[]
+
+    # cull elements not spanning any value, these have all node values above or all below each value
+    elemmin=elemfield.min(axis=1)[:,np.newaxis]
+    elemmax=elemfield.max(axis=1)[:,np.newaxis]
+    active=np.flatnonzero(np.any((elemmin<isovals) & (elemmax>=isovals),axis=1))
+
+    # compute field values at the template points and slice the active elements in blocks of bounded size
+    xis,tets=SceneUtils.calculateIsosurfTemplate(elemtype.geom,max(0,refine,elemtype.order-1))
+    coeffs=fieldtype.basisArray(xis)
+    step=max(1,blocksize//len(xis))
+
+    for start in range(0,len(active),step):
+        elems=active[start:start+step]
+        vals=np.ascontiguousarray(elemfield[elems].dot(coeffs.T))
+        triinds,trixis=SceneUtils.calculateTetIsosurfArray(vals,tets,xis,isovals)
+        elemslist.append(elems[triinds[:,0]]+process.startval)
+        trixislist.append(trixis)
+        process.setProgress(min(len(active),start+step)*(process.endval-process.startval)//len(active))
+
+    if len(trixislist)==0 or sum(len(t) for t in trixislist)==0:
+        return None,None,None
+
+    trielems=np.concatenate(elemslist)
+    trixis=np.concatenate(trixislist)
+    numtris=len(trielems)
+
+    # calculate the node positions of each triangle vertex and the triangle normals
+    elemnodes=nodearr[indarr[trielems]]
+    tripos=np.stack([elemtype.applyBasisArray(elemnodes,trixis[:,i],paired=True) for i in range(3)],axis=1)
+    norms=np.cross(tripos[:,1]-tripos[:,0],tripos[:,2]-tripos[:,0])
+    lens=np.linalg.norm(norms,axis=1)[:,np.newaxis]
+    norms=np.divide(norms,lens,out=np.zeros_like(norms),where=lens>0)
+
+    # each triangle is stored twice with opposite windings and normals so that it's visible from both sides
+    outnodes=Vec3Matrix(name+' Nodes'+str(process.index),numtris*6,3,True)
+    outprops=IndexMatrix(name+MatrixType.props[1]+str(process.index),numtris*6,3,True)
+    outinds=IndexMatrix(name+MatrixType.tris[1]+str(process.index),numtris*2,3,True)
+    
+    nodesarr=np.asarray(outnodes).reshape(numtris,6,9)
+    for i,(v,sign) in enumerate(((0,1),(1,1),(2,1),(0,-1),(2,-1),(1,-1))):
+        nodesarr[:,i,:3]=tripos[:,v]
+        nodesarr[:,i,3:6]=norms*sign
+        nodesarr[:,i,6:]=trixis[:,v]
 
-                outinds.append(nodeslen,nodeslen+1,nodeslen+2)
-                outinds.append(nodeslen+3,nodeslen+4,nodeslen+5)
+    propsarr=np.asarray(outprops)
+    propsarr[:,0]=np.repeat(trielems,6)
+    propsarr[:,1]=0
+    propsarr[:,2]=indnum
 
-    if outnodes.n()>0:
-        outnodes.setShared(True)
-        outprops.setShared(True)
-        outinds.setShared(True)
-    else:
-        outnodes=None
-        outprops=None
-        outinds=None
+    np.asarray(outinds)[:]=np.arange(numtris*6).reshape(numtris*2,3)
 
     return outnodes,outinds,outprops
 
@@ -2035,7 +2320,6 @@ def calculateIsolineRange(process,nodes,ind,ext,refine,field,fieldtopo,minv,maxv
     fieldtype=ElemType[fieldtopo.getType()]
     geom=elemtype.geom
     name='calculateIsosurfaceRange'
-    count=1
 
     endCaps=True
     ringSize=cylrefine+3
@@ -2050,39 +2334,48 @@ def calculateIsolineRange(process,nodes,ind,ext,refine,field,fieldtopo,minv,maxv
     lines=[list() for i in linevals]
 
     if geom in (GeomType._Hex, GeomType._Tet):
-        for elem in xrange(process.maxval):
-            if elem%process.total!=process.index:
+        isovals=np.asarray(linevals,dtype=float)
+        nodearr=np.asarray(nodes)[:,:3]
+        indarr=np.asarray(ind)
+        fieldarr=np.asarray(field)[:,0]
+        elemrange=np.arange(process.startval,process.endval)
+        extarr=np.asarray(ext)[elemrange] if ext else np.ones((len(elemrange),elemtype.numFaces()),dtype=int)
+        topoarr=np.asarray(fieldtopo)[elemrange]
+
+        # slice each external face of every element in range using the vectorized triangle isoline kernel
+        for face in range(elemtype.numFaces()):
+            faceinds=fieldtype.getFaceIndices(face)
+            facetype=fieldtype.getFaceType(face)
+            facexis=np.asarray(indexList(faceinds,fieldtype.xis),dtype=float)
+            facevals=fieldarr[topoarr[:,faceinds]]
+
+            # cull internal faces and those not spanning any value
+            facemin=facevals.min(axis=1)[:,np.newaxis]
+            facemax=facevals.max(axis=1)[:,np.newaxis]
+            active=np.flatnonzero((extarr[:,face]==1) & np.any((facemin<isovals) & (facemax>=isovals),axis=1))
+
+            if len(active)==0:
                 continue
 
-            process.setProgress(count)
-            count+=1
+            xis,tris=SceneUtils.calculateIsolineTemplate(facetype.geom,max(0,refine))
+            vals=np.ascontiguousarray(facevals[active].dot(facetype.basisArray(xis).T))
+            seginds,segxis=SceneUtils.calculateTriIsolineArray(vals,tris,xis,isovals)
 
-            extfaces=ext.getRow(elem) if ext else [1]*elemtype.numFaces()
-
-            if sum(extfaces)==0:
+            if len(seginds)==0:
                 continue
 
-            elemnodes=nodes.mapIndexRow(ind,elem) #getElemNodes(elem,ind,nodes)
-
-            for face,isext in enumerate(extfaces):
-                if isext==0:
-                    continue
-
-                faceinds=fieldtype.getFaceIndices(face)
-                facetype=fieldtype.getFaceType(face)
-                facexis=indexList(faceinds,fieldtype.xis)
-                nodeinds=indexList(faceinds,fieldtopo.getRow(elem)) # indices of the face nodes/values
-
-                facevals=[field.getAt(i) for i in nodeinds]
+            # convert face xis to element xis then calculate the segment end points
+            segelems=elemrange[active[seginds[:,0]]]
+            elemnodes=nodearr[indarr[segelems]]
+            xi0=facetype.applyCoeffsArray(facexis,facetype.basisArray(segxis[:,0]))
+            xi1=facetype.applyCoeffsArray(facexis,facetype.basisArray(segxis[:,1]))
+            p0=elemtype.applyBasisArray(elemnodes,xi0,paired=True)
+            p1=elemtype.applyBasisArray(elemnodes,xi1,paired=True)
 
-                for ln,val in enumerate(linevals):
-                    for a,b in SceneUtils.calculateElemIsoline(facevals,facetype,val,refine):
-                        xi0=facetype.applyBasis(facexis,*a)
-                        xi1=facetype.applyBasis(facexis,*b)
-                        p0=elemtype.applyBasis(elemnodes,*xi0)
-                        p1=elemtype.applyBasis(elemnodes,*xi1)
+            for i,ln in enumerate(seginds[:,1]):
+                lines[ln].append((vec3(*p0[i]),vec3(*p1[i]),tuple(xi0[i]),tuple(xi1[i]),int(segelems[i])))
 
-                        lines[ln].append((p0,p1,xi0,xi1,elem))
+            process.setProgress((face+1)*len(elemrange)//elemtype.numFaces())
 
     otherlines=process.shareObject('lines',lines) # communicate the collected line segments to all procs, though not every proc needs every segment
 
@@ -2213,17 +2506,18 @@ def generateIsoObjectDataSet(dataset,name,refine,externalOnly=False,task=None,**
         return elemtype.dim>2 and elemtype.geom in (GeomType._Tet,GeomType._Hex)
 
     for ind,ext,adj in findIndexSets(dataset,acceptFunc=acceptFunc):
-        shareMatrices(nodes,ind,field,fieldtopo)
+        shareMatrices(nodes,ind,fieldvals,fieldtopo)
 
+        # the computed single-value field is used so that vector fields are reduced with `valfunc'
         if objtype=='surface':
             proccount=chooseProcCount(ind.n(),refine,2000)
-            result=calculateIsosurfaceRange(ind.n(),proccount,task,nodes,ind,refine,field,fieldtopo,minv,maxv,vals,len(indlist))
+            result=calculateIsosurfaceRange(ind.n(),proccount,task,nodes,ind,refine,fieldvals,fieldtopo,minv,maxv,vals,len(indlist))
         else:
             if ext:
                 ext.setShared(True)
             numelems=ext.n() if ext else ind.n()
             proccount=chooseProcCount(ind.n(),refine,2000)
-            result=calculateIsolineRange(numelems,proccount,task,nodes,ind,ext,refine,field,fieldtopo,minv,maxv,radius,cylrefine,vals,len(indlist))
+            result=calculateIsolineRange(numelems,proccount,task,nodes,ind,ext,refine,fieldvals,fieldtopo,minv,maxv,radius,cylrefine,vals,len(indlist))
 
         indlist.append(ind)
 
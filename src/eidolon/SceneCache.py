@@ -0,0 +1,523 @@
+# Eidolon Biomedical Framework
+# Copyright (C) 2016-8 Eric Kerfoot, King's College London, all rights reserved
+#
+# This file is part of Eidolon.
+#
+# Eidolon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eidolon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program (LICENSE.txt).  If not, see <http://www.gnu.org/licenses/>
+'''
+Project scene cache. When a project script is executed the plugin variables in its environment are replaced with
+proxies which route load calls through a SceneCache object. The first time a load call is made the objects the plugin
+returns are stored in a cache file in the project's cache directory, on subsequent loads these are reconstructed from
+the cache instead if the source files have not changed since. Cache files are a small JSON header describing the
+objects followed by the raw data of every matrix, each aligned so that the data can be memory-mapped directly.
+
+Calls to the plugin methods named in `cachedLoadMethods' are cached, this includes CHeart's loadSceneObject(). Dicom's
+loadSeries() isn't cached since the series it loads is found by ID in the directories loaded by previous loadDirDataset()
+calls rather than named by file, and its objects' DicomSeries source can't be stored; reopening Dicom projects is
+instead sped up by the Dicom plugin's own directory index. Object sources and keyword arguments must be JSON values
+or Numpy arrays and scalars (eg. the Nifti header dictionary), objects with other sources are loaded normally.
+'''
+
+import os
+import json
+import struct
+import hashlib
+import base64
+import numpy as np
+
+from renderer import vec3, rotator, RealMatrix, IndexMatrix, Vec3Matrix, ColorMatrix
+from .Utils import Future, toIterable
+from .SceneUtils import PyDataSet, MatrixType
+from .SceneObject import MeshSceneObject
+from .ImageObject import ImageSceneObject, SharedImage
+
+
+cacheDirName='.scenecache' # name of the cache directory in a project directory
+cacheFileExt='.ecache'
+cacheMagic=b'EIDCACHE'
+cacheVersion=1
+cacheHeaderFormat='<8sIQ' # magic, version, JSON header length
+cacheAlign=64 # byte alignment of the header end and each matrix's data
+
+cachedLoadMethods=('loadObject','loadSequence','loadSceneObject') # plugin methods whose results are cached
+
+matrixTypes=dict((m.__name__,m) for m in (RealMatrix,IndexMatrix,Vec3Matrix,ColorMatrix))
+
+derivedIndexSuffixes=(MatrixType.adj[1],MatrixType.external[1]) # suffixes of index sets calculated after loading
+
+
+def _alignOffset(offset):
+    return offset+(-offset)%cacheAlign
+
+
+def encodeValue(val):
+    '''
+    Returns `val' as a JSON-compatible value from which decodeValue() recovers an equivalent value. Numpy arrays and
+    scalars are stored as tagged dictionaries with their raw data, raises ValueError if `val' can't be stored.
+    '''
+    if val is None or isinstance(val,(bool,int,float,str)):
+        return val
+    elif isinstance(val,(np.ndarray,np.generic)) and val.dtype.kind!='O':
+        arr=np.array(val,order='C') # keeps scalars 0-dimensional unlike np.ascontiguousarray()
+        return {
+            '__ndarray__':base64.b64encode(arr.tobytes()).decode('ascii'),
+            'dtype':arr.dtype.str,
+            'shape':arr.shape,
+            'isScalar':isinstance(val,np.generic)
+        }
+    elif isinstance(val,(list,tuple)):
+        return [encodeValue(v) for v in val]
+    elif isinstance(val,dict) and all(isinstance(k,str) for k in val):
+        return dict((k,encodeValue(v)) for k,v in val.items())
+
+    raise ValueError('Cannot store value of type %r in a scene cache'%type(val).__name__)
+
+
+def decodeValue(val):
+    '''Returns the value stored by encodeValue() as `val', with Numpy arrays and scalars restored.'''
+    if isinstance(val,list):
+        return [decodeValue(v) for v in val]
+    elif isinstance(val,dict) and '__ndarray__' in val:
+        arr=np.frombuffer(base64.b64decode(val['__ndarray__']),np.dtype(val['dtype'])).reshape(val['shape']).copy()
+        return arr[()] if val['isScalar'] else arr
+    elif isinstance(val,dict):
+        return dict((k,decodeValue(v)) for k,v in val.items())
+
+    return val
+
+
+def _isEncodable(val):
+    try:
+        encodeValue(val)
+        return True
+    except ValueError:
+        return False
+
+
+def writeCacheFile(filename,header,arrays):
+    '''
+    Write the JSON-compatible dictionary `header' and the list of Numpy arrays `arrays' to the cache file `filename'.
+    The offset, dtype, and shape of each array is stored in header['chunks'] so that readCacheFile() can recover them.
+    The file is written to a temporary name first and then moved into place so a partial file is never read.
+    '''
+    arrays=[np.ascontiguousarray(a) for a in arrays]
+    chunks=[]
+
+    # compute the header length iteratively since the chunk offsets depend on it
+    datastart=0
+    while True:
+        offset=datastart
+        chunks=[]
+        for a in arrays:
+            chunks.append((offset,a.dtype.str,a.shape))
+            offset=_alignOffset(offset+a.nbytes)
+
+        header['chunks']=chunks
+        hbytes=json.dumps(header).encode('utf-8')
+        start=_alignOffset(struct.calcsize(cacheHeaderFormat)+len(hbytes))
+
+        if start==datastart:
+            break
+
+        datastart=start
+
+    tmpname=filename+'.tmp'
+    with open(tmpname,'wb') as o:
+        o.write(struct.pack(cacheHeaderFormat,cacheMagic,cacheVersion,len(hbytes)))
+        o.write(hbytes)
+
+        for (offset,_,_),a in zip(chunks,arrays):
+            o.write(b'\0'*(offset-o.tell()))
+            o.write(a.tobytes())
+
+    os.replace(tmpname,filename)
+
+
+def readCacheHeader(filename):
+    '''Read the header dictionary from cache file `filename', raising IOError if this isn't a valid cache file.'''
+    with open(filename,'rb') as o:
+        hsize=struct.calcsize(cacheHeaderFormat)
+        magic,version,hlen=struct.unpack(cacheHeaderFormat,o.read(hsize))
+
+        if magic!=cacheMagic or version!=cacheVersion:
+            raise IOError('File %r is not a version %i scene cache file'%(filename,cacheVersion))
+
+        return json.loads(o.read(hlen).decode('utf-8'))
+
+
+def readCacheFile(filename):
+    '''
+    Read cache file `filename', returning the header dictionary and a list of arrays which are read-only views of the
+    memory-mapped file, in the order they were passed to writeCacheFile().
+    '''
+    header=readCacheHeader(filename)
+    mm=np.memmap(filename,np.uint8,'r')
+    arrays=[]
+
+    for offset,dtype,shape in header['chunks']:
+        dtype=np.dtype(dtype)
+        nbytes=int(np.prod(shape))*dtype.itemsize
+        arrays.append(mm[offset:offset+nbytes].view(dtype).reshape(shape))
+
+    return header,arrays
+
+
+def getSourceStats(paths):
+    '''
+    Returns a list of (path,size,mtime) triples for each existing file in `paths', and for the files directly within
+    each existing directory in `paths'. These are used to determine if cached objects are still valid.
+    '''
+    stats={}
+
+    for p in set(map(os.path.abspath,paths)):
+        if os.path.isdir(p):
+            stats[p]=(p,0,os.stat(p).st_mtime_ns)
+            for f in os.listdir(p):
+                fp=os.path.join(p,f)
+                if os.path.isfile(fp):
+                    st=os.stat(fp)
+                    stats[fp]=(fp,st.st_size,st.st_mtime_ns)
+        elif os.path.isfile(p):
+            st=os.stat(p)
+            stats[p]=(p,st.st_size,st.st_mtime_ns)
+
+    return [stats[p] for p in sorted(stats)]
+
+
+def getLoadKey(plugin,methodname,args,kwargs):
+    '''
+    Returns a string uniquely identifying the call `plugin.methodname(*args,**kwargs)', or None if the arguments have
+    no stable representation (eg. arbitrary objects whose repr includes their address) so the call can't be cached.
+    '''
+    key='%s.%s(%r,%r)'%(plugin.name,methodname,args,sorted(kwargs.items()))
+    return None if ' at 0x' in key else key
+
+
+def getArgPaths(args,kwargs):
+    '''Returns the list of string arguments in `args' and `kwargs' (or within list arguments) naming existing paths.'''
+    paths=[]
+    for a in list(args)+list(kwargs.values()):
+        for p in toIterable(a):
+            if isinstance(p,str) and os.path.exists(p):
+                paths.append(p)
+
+    return paths
+
+
+def _vecArgs(v):
+    return v.__reduce__()[1]
+
+
+class SceneCacheWriter(object):
+    '''Accumulates the header description and array list for a set of objects being written to a cache file.'''
+    def __init__(self):
+        self.arrays=[]
+        self.matrices={} # maps id(matrix) to its index in self.arrays so shared matrices are stored once
+
+    def addMatrix(self,mat):
+        if id(mat) not in self.matrices:
+            self.matrices[id(mat)]=len(self.arrays)
+            self.arrays.append(np.asarray(mat))
+
+        return {
+            'index':self.matrices[id(mat)],
+            'class':type(mat).__name__,
+            'name':mat.getName(),
+            'type':mat.getType(),
+            'n':mat.n(),
+            'm':mat.m(),
+            'isShared':mat.isShared(),
+            'meta':dict((k,mat.meta(k)) for k in mat.getMetaKeys())
+        }
+
+    def addMesh(self,obj):
+        datasets=[]
+        for ds in obj.datasets:
+            datasets.append({
+                'name':ds.getName(),
+                'meta':dict((k,ds.meta(k)) for k in ds.getMetaKeys()),
+                'nodes':self.addMatrix(ds.getNodes()),
+                'indices':[self.addMatrix(ds.getIndexSet(n)) for n in sorted(ds.getIndexNames())],
+                'fields':[(n,self.addMatrix(ds.getDataField(n))) for n in sorted(ds.getFieldNames())]
+            })
+
+        return {
+            'kind':'mesh',
+            'name':obj.getName(),
+            'kwargs':encodeValue(obj.kwargs),
+            'timesteps':obj.getTimestepList(),
+            'datasets':datasets
+        }
+
+    def addImage(self,obj):
+        images=[]
+        for im in obj.images:
+            images.append({
+                'filename':im.filename,
+                'position':_vecArgs(im.position),
+                'orientation':_vecArgs(im.orientation),
+                'dimensions':list(map(int,im.dimensions)),
+                'spacing':list(map(float,im.spacing)),
+                'timestep':float(im.timestep),
+                'imgmin':float(im.imgmin),
+                'imgmax':float(im.imgmax),
+                'img':self.addMatrix(im.img)
+            })
+
+        return {
+            'kind':'image',
+            'name':obj.getName(),
+            'kwargs':encodeValue(obj.kwargs),
+            'source':encodeValue(obj.source),
+            'isTimeDependent':obj.isTimeDependent,
+            'images':images
+        }
+
+
+class SceneCacheReader(object):
+    '''Reconstructs objects from a cache header and the arrays read from its file.'''
+    def __init__(self,arrays,plugin):
+        self.arrays=arrays
+        self.plugin=plugin
+        self.matrices={} # maps array indices to created matrices so shared matrices are restored as shared
+
+    def getMatrix(self,desc):
+        index=desc['index']
+        if index not in self.matrices:
+            mat=matrixTypes[desc['class']](desc['name'],desc['type'],desc['n'],desc['m'],desc['isShared'])
+            arr=np.asarray(mat)
+            arr[...]=self.arrays[index].reshape(arr.shape)
+
+            for k,v in desc['meta'].items():
+                mat.meta(k,v)
+
+            self.matrices[index]=mat
+
+        return self.matrices[index]
+
+    def getMesh(self,desc):
+        datasets=[]
+        for dsdesc in desc['datasets']:
+            nodes=self.getMatrix(dsdesc['nodes'])
+            indices=dict((i['name'],self.getMatrix(i)) for i in dsdesc['indices'])
+            fields=dict((n,self.getMatrix(f)) for n,f in dsdesc['fields'])
+
+            ds=PyDataSet(dsdesc['name'],nodes,indices,fields,False)
+            for k,v in dsdesc['meta'].items():
+                ds.meta(k,v)
+
+            datasets.append(ds)
+
+        obj=MeshSceneObject(desc['name'],datasets,self.plugin,**decodeValue(desc['kwargs']))
+        obj.setTimestepList(desc['timesteps'])
+        return obj
+
+    def getImage(self,desc):
+        images=[]
+        for i in desc['images']:
+            img=self.getMatrix(i['img'])
+            pos=vec3(*i['position'])
+            rot=rotator(*i['orientation'])
+            images.append(SharedImage(i['filename'],pos,rot,tuple(i['dimensions']),tuple(i['spacing']),i['timestep'],img,i['imgmin'],i['imgmax']))
+
+        source=decodeValue(desc['source'])
+        return ImageSceneObject(desc['name'],source,images,self.plugin,desc['isTimeDependent'],**decodeValue(desc['kwargs']))
+
+
+class SceneCachePluginProxy(object):
+    '''
+    Stands in for a plugin in a project script's environment, routing calls to the methods named in `cachedLoadMethods'
+    through the cache and passing everything else through to the plugin.
+    '''
+    def __init__(self,cache,plugin):
+        self._cache=cache
+        self._plugin=plugin
+
+    def __getattr__(self,name):
+        attr=getattr(self._plugin,name)
+
+        if name in cachedLoadMethods and callable(attr):
+            return lambda *args,**kwargs:self._cache.load(self._plugin,name,attr,args,kwargs)
+
+        return attr
+
+
+class SceneCache(object):
+    '''
+    Stores objects loaded by plugins in cache files in directory `cachedir', keyed by the plugin and load arguments.
+    Only plain MeshSceneObject and ImageSceneObject instances whose keyword arguments and sources can be stored by
+    encodeValue() are cached, and only if the load arguments name files or directories that can be checked for changes.
+    Entries whose sources have changed are removed when next loaded, prune() removes entries not loaded since creation.
+    '''
+    def __init__(self,cachedir):
+        self.cachedir=cachedir
+        self.entries={} # maps load keys to (objs,islist,sources,indexnames) for objects loaded through this cache
+
+    def getCacheFile(self,key):
+        return os.path.join(self.cachedir,hashlib.sha1(key.encode('utf-8')).hexdigest()+cacheFileExt)
+
+    def createProxy(self,plugin):
+        return SceneCachePluginProxy(self,plugin)
+
+    def isCacheable(self,obj):
+        if type(obj) is MeshSceneObject:
+            return _isEncodable(obj.kwargs)
+        elif type(obj) is ImageSceneObject:
+            return _isEncodable(obj.kwargs) and _isEncodable(obj.source) and all(i.img is not None for i in obj.images)
+
+        return False
+
+    def load(self,plugin,methodname,method,args,kwargs):
+        '''
+        Load the objects for the call `method(*args,**kwargs)' from the cache if a valid entry exists, otherwise call
+        the method and store the result in the cache. The result is returned in the same form the method returns it.
+        '''
+        key=getLoadKey(plugin,methodname,args,kwargs)
+
+        if key is not None:
+            result=self.loadEntry(key,plugin)
+            if result is not None:
+                return result
+
+        result=Future.get(method(*args,**kwargs))
+
+        if key is not None:
+            try:
+                self.storeEntry(key,plugin,result,getArgPaths(args,kwargs))
+            except Exception:
+                pass # failing to cache isn't an error, the objects will be loaded normally next time
+
+        return result
+
+    def loadEntry(self,key,plugin):
+        '''
+        Returns the objects cached for `key' or None if there's no entry or the source files have changed, in which case
+        the stale entry is deleted.
+        '''
+        filename=self.getCacheFile(key)
+
+        if not os.path.isfile(filename):
+            return None
+
+        try:
+            header=readCacheHeader(filename)
+            sources=[tuple(s) for s in header['sources']]
+
+            if header['key']!=key:
+                return None
+
+            if getSourceStats(s[0] for s in sources)!=sources:
+                os.remove(filename)
+                return None
+
+            header,arrays=readCacheFile(filename)
+            reader=SceneCacheReader(arrays,plugin)
+            objs=[reader.getMesh(o) if o['kind']=='mesh' else reader.getImage(o) for o in header['objects']]
+        except Exception:
+            return None
+
+        self.entries[key]=(objs,header['islist'],header['sources'],header['indexnames'])
+
+        return objs if header['islist'] else objs[0]
+
+    def storeEntry(self,key,plugin,result,paths,sources=None):
+        '''
+        Store the object or list of objects `result' loaded by `plugin' in the cache for `key'. The files these were
+        loaded from are taken from `paths' plus whatever plugin.getObjFiles() states for each object. If `sources' is
+        given this is used as the stats list instead of calculating it from these files.
+        '''
+        islist=isinstance(result,(list,tuple))
+        objs=list(toIterable(result))
+
+        if not objs or not all(self.isCacheable(o) for o in objs):
+            return
+
+        if sources is None:
+            paths=list(paths)
+            for o in objs:
+                paths+=plugin.getObjFiles(o) or []
+
+            sources=getSourceStats(paths)
+
+        if not sources:
+            return
+
+        writer=SceneCacheWriter()
+        descs=[writer.addMesh(o) if isinstance(o,MeshSceneObject) else writer.addImage(o) for o in objs]
+        indexnames=[[sorted(ds.getIndexNames()) for ds in o.datasets] if isinstance(o,MeshSceneObject) else [] for o in objs]
+
+        header={'key':key,'islist':islist,'sources':sources,'indexnames':indexnames,'objects':descs}
+
+        if not os.path.isdir(self.cachedir):
+            os.makedirs(self.cachedir)
+
+        writeCacheFile(self.getCacheFile(key),header,writer.arrays)
+        self.entries[key]=(objs,islist,sources,indexnames)
+
+    def update(self):
+        '''
+        Rewrite cache entries whose mesh objects have since had derived topology (adjacency and external face index
+        sets) calculated, so that these don't need to be recalculated when the project is next loaded. The rest of
+        the cached data is left as loaded, and entries whose sources have changed are left alone.
+        '''
+        for key,(objs,islist,sources,indexnames) in list(self.entries.items()):
+            filename=self.getCacheFile(key)
+            derived=[]
+
+            for o,names in zip(objs,indexnames):
+                if isinstance(o,MeshSceneObject):
+                    for ds,dsnames in zip(o.datasets,names):
+                        for n in ds.getIndexNames():
+                            if n not in dsnames and n.endswith(derivedIndexSuffixes):
+                                derived.append((ds,ds.getIndexSet(n)))
+
+            if not derived or not os.path.isfile(filename):
+                continue
+
+            try:
+                header=readCacheHeader(filename)
+                if getSourceStats(s[0] for s in sources)!=[tuple(s) for s in sources]:
+                    continue
+
+                # reload the originally cached objects and add the derived index sets from the live objects
+                header,arrays=readCacheFile(filename)
+                reader=SceneCacheReader(arrays,objs[0].plugin)
+                cached=[reader.getMesh(d) if d['kind']=='mesh' else reader.getImage(d) for d in header['objects']]
+                dsmap=dict((id(ds),cds) for o,c in zip(objs,cached) if isinstance(o,MeshSceneObject) for ds,cds in zip(o.datasets,c.datasets))
+
+                for ds,mat in derived:
+                    dsmap[id(ds)].setIndexSet(mat)
+
+                del arrays,reader # release the memory map before replacing the file
+                self.storeEntry(key,objs[0].plugin,cached if islist else cached[0],[],sources)
+                self.entries[key]=(objs,islist,sources,self.entries[key][3])
+            except Exception:
+                pass
+
+    def prune(self):
+        '''
+        Delete the cache files in the cache directory which weren't loaded or stored by this cache, ie. those of objects
+        no longer loaded by the project, and any temporary files left by interrupted writes.
+        '''
+        if not os.path.isdir(self.cachedir):
+            return
+
+        current=set(os.path.basename(self.getCacheFile(k)) for k in self.entries)
+
+        for f in os.listdir(self.cachedir):
+            if f.endswith((cacheFileExt,cacheFileExt+'.tmp')) and f not in current:
+                try:
+                    os.remove(os.path.join(self.cachedir,f))
+                except OSError:
+                    pass
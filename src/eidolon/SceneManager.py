@@ -52,6 +52,7 @@ from .Utils import avg, first, timing, uniqueStr, EventType, listSum, taskroutin
 from .VisualizerUI import QtWidgets, Qt, screenshotWidget, setChecked, selectBoxIndex, setColorButton, fillList
 from .SceneObject import SceneObject, SceneObjectRepr, MeshSceneObject
 from .SceneComponents import LightType, CenterType, AxesType, SceneLight, ScriptWriter
+from .SceneCache import SceneCache, cacheDirName
 
 globalMgr=None
 globalPlugins=[]
@@ -266,6 +267,12 @@ class Project(object):
 
         self.saveConfig()
 
+        # store any topology calculated since loading in the project's scene cache and remove unused entries
+        cache=self.mgr.sceneCache
+        if cache and cache.cachedir==os.path.join(projdir,cacheDirName):
+            cache.update()
+            cache.prune()
+
     def loadConfig(self,filename=None):
         '''Load the config file (or `filename' if given) and update `self.configMap' with its contents.'''
         try:
@@ -373,6 +380,7 @@ class SceneManager(TaskQueue):
         self.evtHandler=Utils.EventHandler()
 
         self.project=None # project object, only non-None when there's an existing project
+        self.sceneCache=None # SceneCache object for the last project loaded, None if no project loaded or caching disabled
 
         # camera controller
         self.controller=None # the camera controller
@@ -740,6 +748,7 @@ class SceneManager(TaskQueue):
             for filename in files:
                 updateLocals=True
                 tryHard=False
+                localvars=None
                 
                 if os.path.isdir(filename): # if a directory, append to it the script file of the same name (ie. load project)
                     scriptfilename=os.path.join(filename,os.path.basename(os.path.abspath(filename))+'.py')
@@ -747,10 +756,11 @@ class SceneManager(TaskQueue):
                         filename=scriptfilename
                         updateLocals=False # don't update locals with project's loading variables, these make a mess
                         tryHard=True # ignore exceptions when exec'ing, this allows a project with missing data to load as much as possible
+                        localvars=self.createSceneCacheVars(os.path.dirname(scriptfilename))
 
                 if filename.endswith('.py'):
                     if os.path.isfile(filename):
-                        self.execScript(filename,updateLocals,tryHard)
+                        self.execScript(filename,updateLocals,tryHard,localvars)
                     else:
                         self.logError("Error: Cannot find script file %r"%filename)
                 else:
@@ -765,6 +775,21 @@ class SceneManager(TaskQueue):
         if len(files)>0:
             self.addTasks(_loadFiles(files))
 
+    def createSceneCacheVars(self,projdir):
+        '''
+        Returns a dictionary mapping the variable name of each plugin in the script environment to a proxy for that
+        plugin which loads objects through the scene cache of project directory `projdir'. This cache is also stored
+        in `self.sceneCache' so the project can update it when saved. If caching is disabled in the config then None
+        is returned instead.
+        '''
+        if self.conf.get(platformID,Utils.ConfVars.scenecache).lower()=='false':
+            self.sceneCache=None
+            return None
+
+        self.sceneCache=SceneCache(os.path.join(os.path.abspath(projdir),cacheDirName))
+
+        return dict((n,self.sceneCache.createProxy(p)) for n,p in self.scriptlocals.items() if isinstance(p,ScenePlugin.ScenePlugin))
+
     def execBatchProgramTask(self,exefile,*exeargs,**kwargs):
         '''
         Executes the program `exefile' with the string arguments `exeargs'. This is done in a task so the result
@@ -850,8 +875,11 @@ class SceneManager(TaskQueue):
         self.project=None
 
     @Utils.argtiming
-    def execScript(self,filename,updateLocals=True,tryHard=False):
-        '''Executes the given script file using internal environment, updates local/console variables if `updateLocals'.'''
+    def execScript(self,filename,updateLocals=True,tryHard=False,localvars=None):
+        '''
+        Executes the given script file using internal environment, updates local/console variables if `updateLocals'.
+        If `localvars' is a dictionary and `updateLocals' is False, its values are added to the copied environment.
+        '''
         if not os.path.isfile(filename):
             raise IOError("Cannot execute %r; not a file" % filename)
 
@@ -866,6 +894,7 @@ class SceneManager(TaskQueue):
         scriptlocals=self.scriptlocals
         if not updateLocals: # if we're not updating local variables, copy `scriptlocals' so the stored version isn't changed
             scriptlocals=dict(scriptlocals)
+            scriptlocals.update(localvars or {})
 
         if tryHard:
             excs=Utils.execfileExc(filename,scriptlocals)
@@ -24,9 +24,10 @@ representations of that data respectively.
 
 import functools
 import inspect
+import bisect
 
-from renderer import vec3, color, rotator, transform, FT_POINTLIST, FT_LINELIST, FT_TRILIST, FT_GLYPH, \
-        IndexMatrix, ColorMatrix,MatrixIndexBuffer, MatrixVertexBuffer, PyIndexBuffer, PyVertexBuffer
+from renderer import vec3, color, rotator, transform, FT_POINTLIST, FT_LINELIST, FT_TRILIST, FT_GLYPH, PT_VERTEX, \
+        IndexMatrix, Vec3Matrix, ColorMatrix,MatrixIndexBuffer, MatrixVertexBuffer, PyIndexBuffer, PyVertexBuffer
 from .Utils import enum, avgspan, first, toIterable, listSum, minmax, clamp,radCircularConvert, isMainThread
 from .SceneUtils import StdProps, MatrixType, getDatasetSummaryTuples, BoundBox
 
@@ -899,11 +900,29 @@ class MeshSceneObjectRepr(SceneObjectRepr):
         return self.figs
 
     def addModifier(self,mod):
+        self._unshareTopology()
         self.bufferGen.addModifier(mod)
 
     def removeModifier(self,mod):
         self.bufferGen.removeModifier(mod)
 
+    def _unshareTopology(self):
+        '''
+        Replace the index and property matrices this representation's dataset shares with that of another timestep with
+        copies. This must be done before modifiers are applied since these append values to these matrices.
+        '''
+        if self.dataset.meta(StdProps._sharedtopology)=='True':
+            name=self.dataset.getName()
+
+            for attr,mtype in (('lines',MatrixType.lines),('tris',MatrixType.tris),('nodeprops',MatrixType.props)):
+                mat=getattr(self,attr)
+                if mat:
+                    mat=mat.clone(name+mtype[1])
+                    self.dataset.setIndexSet(mat)
+                    setattr(self,attr,mat)
+
+            self.dataset.meta(StdProps._sharedtopology,'False')
+
     def setDataFuncs(self,**funcs):
         self.datafuncs.update(funcs)
 
@@ -1026,7 +1045,13 @@ class MeshSceneObjectRepr(SceneObjectRepr):
 
 
 class TDMeshSceneObjectRepr(SceneObjectRepr):
-    def __init__(self,subreprs,parent,reprtype,reprcount,matname='Default'):
+    '''
+    Time-dependent representation composed of one MeshSceneObjectRepr per timestep. Playback normally shows only the
+    subrepresentation nearest the current timestep. If `morph' is True the subrepresentations must share topology and
+    playback instead uses a single figure whose vertices are interpolated between adjacent timesteps by the morph
+    vertex program, or in software if that program isn't available, so that fractional timesteps animate smoothly.
+    '''
+    def __init__(self,subreprs,parent,reprtype,reprcount,matname='Default',morph=False):
         assert len(subreprs)>0
         self.subreprs=subreprs
         self.timestep=0
@@ -1035,6 +1060,16 @@ class TDMeshSceneObjectRepr(SceneObjectRepr):
         self.drawInternal=self.isDrawInternal()
         self.proptuples=[]
 
+        self.morph=morph
+        self.morphFig=None # figure used for morphing animation
+        self.morphMat=None # internal material for self.morphFig with the morph vertex program
+        self.morphNodes=None # (position, normal, start position, end position) matrix for self.morphFig
+        self.morphBuffers=None # buffer objects for self.morphFig kept here so they exist until the figure is filled
+        self.morphPair=None # indices of the subrepresentations currently stored in self.morphNodes
+
+        if morph and not self.canMorph():
+            raise ValueError('Morphing requires every timestep to share the same triangle topology')
+
         if len(parent.timestepList)==len(subreprs):
             self.timestepList=parent.timestepList  
         else: 
@@ -1057,12 +1092,72 @@ class TDMeshSceneObjectRepr(SceneObjectRepr):
 
         self.timestepIndex=min((abs(self.timestep-v),i) for i,v in enumerate(self.timestepList))[1]
 
-        for i,r in enumerate(self.subreprs):
-            r.setVisible(self._isVisible and i==self.timestepIndex)
+        if self.morphFig!=None:
+            start,end,value=self._getMorphPosition()
+
+            if self.morphPair!=(start,end):
+                self._fillMorphBuffers(start,end,value)
+            elif not self.morphMat.setGPUParamReal(PT_VERTEX,'morphValue',value):
+                self._fillMorphBuffers(start,end,value) # vertex program unavailable, interpolate in software
+
+            for r in self.subreprs:
+                r.setVisible(False)
+
+            self.morphFig.setVisible(self._isVisible)
+        else:
+            for i,r in enumerate(self.subreprs):
+                r.setVisible(self._isVisible and i==self.timestepIndex)
 
     def getTimestep(self):
         return self.timestep
 
+    def canMorph(self):
+        '''Returns True if every subrepresentation shares the triangle topology of the first so that morphing can be used.'''
+        first=self.subreprs[0]
+        return first.tris!=None and all(r.tris is first.tris and r.nodes.n()==first.nodes.n() for r in self.subreprs[1:])
+
+    def isMorphing(self):
+        '''Returns True if playback interpolates between timesteps rather than switching subrepresentations.'''
+        return self.morphFig!=None
+
+    def _getMorphPosition(self):
+        '''Returns the subrepresentation indices bracketing the current timestep and the interpolation value between them.'''
+        tslist=self.timestepList
+        start=max(0,bisect.bisect_right(tslist,self.timestep)-1)
+        end=min(start+1,len(tslist)-1)
+        span=tslist[end]-tslist[start]
+        value=clamp(float(self.timestep-tslist[start])/span,0.0,1.0) if span>0 else 0.0
+
+        return start,end,value
+
+    def _fillMorphBuffers(self,start,end,value):
+        '''
+        Fill the morph figure with the topology and colors of subrepresentation `start' and the node positions of
+        subrepresentations `start' and `end'. If the morph vertex program isn't present the interpolated positions for
+        `value' are calculated here instead, otherwise this is only needed when the pair of timesteps changes.
+        '''
+        r0=self.subreprs[start]
+        self.morphPair=(start,end)
+
+        MeshAlgorithms.fillMorphNodes(self.morphNodes,r0.nodes,self.subreprs[end].nodes)
+
+        if not self.morphMat.setGPUParamReal(PT_VERTEX,'morphValue',value):
+            MeshAlgorithms.interpolateMorphNodes(self.morphNodes,value)
+
+        vbuff=MatrixVertexBuffer(self.morphNodes,r0.nodecolors,None)
+        ibuff=MatrixIndexBuffer(r0.tris,None if r0.isDrawInternal() else r0.extinds)
+        self.morphBuffers=(vbuff,ibuff)
+
+        self.morphFig.fillData(vbuff,ibuff,True,r0.kwargs.get('doubleSided',True))
+
+    def _updateMorphMaterial(self):
+        '''Copy the properties of the applied material to the internal morph material and set the morph vertex program.'''
+        mat=self.plugin.mgr.getMaterial(self.matname) if self.plugin.mgr else None
+        if mat:
+            mat.copyTo(self.morphMat,True,True,False)
+
+        self.morphMat.setGPUProgram('morphVP',PT_VERTEX)
+
     def getDataset(self):
         return [r.getDataset() for r in self.enumSubreprs()] or None
 
@@ -1125,6 +1220,10 @@ class TDMeshSceneObjectRepr(SceneObjectRepr):
         for r in self.subreprs:
             r.removeFromScene(scene)
 
+        self.morphFig=None
+        self.morphBuffers=None
+        self.morphPair=None
+
     def isDrawInternal(self):
         return all(r.isDrawInternal() for r in self.subreprs)
 
@@ -1134,6 +1233,9 @@ class TDMeshSceneObjectRepr(SceneObjectRepr):
             r.setDrawInternal(drawInternal)
 
     def addModifier(self,mod):
+        if self.morph:
+            raise ValueError('Modifiers cannot be applied to morphing representations')
+
         for r in self.subreprs:
             r.addModifier(mod)
 
@@ -1186,6 +1288,9 @@ class TDMeshSceneObjectRepr(SceneObjectRepr):
         for r in self.subreprs:
             r.setMaterialName(matname)
 
+        if self.morphMat!=None:
+            self._updateMorphMaterial()
+
     def setVisible(self,isVisible):
         self._isVisible=isVisible
 
@@ -1195,6 +1300,9 @@ class TDMeshSceneObjectRepr(SceneObjectRepr):
             for r in self.subreprs:
                 r.setVisible(False)
 
+            if self.morphFig!=None:
+                self.morphFig.setVisible(False)
+
     def setTransparent(self,isTrans):
         for r in self.subreprs:
             r.setTransparent(isTrans)
@@ -1205,24 +1313,49 @@ class TDMeshSceneObjectRepr(SceneObjectRepr):
     def isExternalOnly(self):
         return all(r.isExternalOnly() for r in self.subreprs)
 
+    def _getInteralFigures(self):
+        return [self.morphFig] if self.morphFig!=None else []
+
+    def enumInternalMaterials(self):
+        return [self.morphMat] if self.morphMat!=None else []
+
     def addToScene(self,scene):
         for r in self.subreprs:
             r.addToScene(scene)
 
+        if self.morph and self.morphFig==None:
+            fname=self.getName()+' Morph'
+            self.morphNodes=Vec3Matrix(fname+MatrixType.nodes[1],0,4)
+            self.morphMat=scene.createMaterial(fname+' Mat')
+            self._updateMorphMaterial()
+            self.morphFig=scene.createFigure(fname,self.morphMat.getName(),ReprType[self.reprtype][2])
+            self.update(scene)
+
         self.setVisible(True)
 
     def prepareBuffers(self):
         for r in self.subreprs:
             r.prepareBuffers()
 
+        if self.morphFig!=None: # refill the morph figure since node colors may have changed
+            self._fillMorphBuffers(*self._getMorphPosition())
+
     def update(self,scene):
         for r in self.subreprs:
             r.update(scene)
 
+        if self.morphFig!=None:
+            self.morphFig.setPosition(self.getPosition())
+            self.morphFig.setRotation(rotator(*self.getRotation()))
+            self.morphFig.setScale(self.getScale())
+
     def setPosition(self,pos):
         for r in self.subreprs:
             r.setPosition(pos)
 
+        if self.morphFig!=None:
+            self.morphFig.setPosition(pos)
+
     def getPosition(self,isDerived=False):
         return self.subreprs[0].getPosition(isDerived)
 
@@ -1230,6 +1363,9 @@ class TDMeshSceneObjectRepr(SceneObjectRepr):
         for r in self.subreprs:
             r.setRotation(yaw,pitch,roll)
 
+        if self.morphFig!=None:
+            self.morphFig.setRotation(rotator(*self.subreprs[0].rotation))
+
     def getRotation(self,isDerived=False):
         return self.subreprs[0].getRotation(isDerived)
 
@@ -1237,6 +1373,9 @@ class TDMeshSceneObjectRepr(SceneObjectRepr):
         for r in self.subreprs:
             r.setScale(scale)
 
+        if self.morphFig!=None:
+            self.morphFig.setScale(scale)
+
     def getScale(self,isDerived=False):
         return self.subreprs[0].getScale(isDerived)
 
@@ -744,6 +744,10 @@ class MeshScenePlugin(ScenePlugin):
                 else:
                     subreprs=[]
                     srcdsmap={}
+                    topods=None # (source dataset,repr data) pair of the first timestep whose topology may be shared by others
+
+                    # triangle representations generated with the default algorithm can share topology between timesteps
+                    canShare=reprtype in (ReprType._volume,ReprType._surface) and 'algorithm' not in kwargs
 
                     for i,dds in enumerate(obj.datasets):
                         name='%s %s %i [%i/%i]' %(obj.name,ReprType[reprtype][0],obj.reprcount,i+1,len(obj.datasets))
@@ -757,16 +761,22 @@ class MeshScenePlugin(ScenePlugin):
                                 dataset.setDataField(field)
 
                             ds=dataset,origindices
+                        elif topods and MeshAlgorithms.isTopologyShared(topods[0],dds,topods[1][1]):
+                            ds=MeshAlgorithms.generateSharedTopologyDataSet(topods[1],dds,name,task)
                         else:
                             ds=self.createReprDataset(dds,reprtype,name,refine,externalOnly,task,**kwargs)
 
+                            if canShare and topods is None:
+                                topods=(dds,ds)
+
                         srcdsmap[ddsorig]=ds
 
                         rep=MeshSceneObjectRepr(obj,reprtype,obj.reprcount,refine,ds,dds,drawInternal,externalOnly,matname,**kwargs)
                         rep.name+=' [%i/%i]'%(i+1,len(obj.datasets))
                         subreprs.append(rep)
 
-                    rep=TDMeshSceneObjectRepr(subreprs,obj,reprtype,obj.reprcount,matname)
+                    # if 'morph' is True playback interpolates between the shared-topology timesteps
+                    rep=TDMeshSceneObjectRepr(subreprs,obj,reprtype,obj.reprcount,matname,kwargs.get('morph',False))
                     
                 if matname!='Default':
                     self.applyMaterial(rep,matname,**kwargs)
@@ -1322,8 +1332,7 @@ class ImageScenePlugin(ScenePlugin):
         shape=tuple(array.shape)+(1,1) # add extra dimensions to the shape to make a 4D shape
         shape=shape[:4] # clip extra dimensions off so that this is a 4D shape description
         width,height,slices,timesteps=shape
-        datatype=np.dtype('<f8')
-        array=array.astype(datatype).reshape(shape) # convert to little endian double and reshape into a 4D array
+        array=array.reshape(shape) # reshape into a 4D array, data is converted to double a slice at a time below so memmaps are read lazily
 
         obj=self.createImageStackObject(name,width,height,slices,timesteps,pos,rot,spacing)
 
@@ -1344,6 +1353,27 @@ class ImageScenePlugin(ScenePlugin):
 
         return obj
 
+    @delegatedmethod
+    def getImageObjectInfo(self,obj):
+        '''
+        Returns the spatial and temporal parameters of the 4D array getImageObjectArray() would create for `obj'
+        without creating the array, allowing writers to read image data a slice at a time. The result is a dictionary
+        with the keys of getImageObjectArray()'s result except `array', plus `shape' which is the 4D array shape.
+        '''
+        assert isinstance(obj,ImageSceneObject)
+        assert len(obj.getOrientMap())==1, 'Cannot produce a array from non-stack image objects'
+
+        shape=obj.getArrayDims()
+        timesteps=obj.getTimestepList()
+        trans=obj.getTransform()
+        pos=trans.getTranslation()
+        rot=trans.getRotation()
+        spacing=trans.getScale().abs()*vec3(shape[0],shape[1],shape[2]-1).inv()
+        toffset=timesteps[0]
+        interval=Utils.avgspan(timesteps) if len(timesteps)>1 else 0
+
+        return dict(pos=pos,spacing=spacing,rot=rot,shape=shape,toffset=toffset,interval=interval)
+
     @delegatedmethod
     def getImageObjectArray(self,obj,datatype=float):
         '''
@@ -1356,19 +1386,12 @@ class ImageScenePlugin(ScenePlugin):
             toffset : time offset
             interval : time interval
         '''
-        assert isinstance(obj,ImageSceneObject)
-        assert len(obj.getOrientMap())==1, 'Cannot produce a array from non-stack image objects'
+        info=self.getImageObjectInfo(obj)
 
         with ImageAlgorithms.processImageNp(obj,False,datatype) as array:
-            timesteps=obj.getTimestepList()
-            trans=obj.getTransform()
-            pos=trans.getTranslation()
-            rot=trans.getRotation()
-            spacing=trans.getScale().abs()*vec3(array.shape[0],array.shape[1],array.shape[2]-1).inv()
-            toffset=timesteps[0]
-            interval=Utils.avgspan(timesteps) if len(timesteps)>1 else 0
-            
-            return dict(pos=pos,spacing=spacing,rot=rot,array=array,toffset=toffset,interval=interval)
+            info['array']=array
+            del info['shape']
+            return info
 
 
 class CombinedScenePlugin(MeshScenePlugin,ImageScenePlugin):
@@ -26,6 +26,14 @@ import itertools
 import atexit
 import os
 import glob
+import json
+import struct
+import zlib
+
+import numpy as np
+
+cimport cython
+from libc.math cimport fabs
 
 import renderer.Renderer as ren
 cimport renderer.Renderer as ren
@@ -61,6 +69,8 @@ StdProps=enum(
     ('isspatial','Spatial Topology Indicator (True/False)'),
     # if a dataset is cloned, this is the original's name
     ('isdsclone','Dataset Clone\'s Original Name'),
+    # True if a representation dataset shares its index and property matrices with that of another dataset (eg. a timestep)
+    ('sharedtopology','Dataset shares topology matrices with another dataset (True/False)'),
     # if a matrix is loaded from a file with header info, this should be put here
     ('header','Source File Header Data'),
     # this should be set for all matrices loaded from files
@@ -1019,90 +1029,159 @@ def listToMatrix(mat,name='mat',mtype='',isShared=False,objtype=None):
     return m
 
 
-def storeMatrixToFile(filename,mat,metanames=[]):
-    '''Store a matrix to a file in a format understood by readMatrixFromFile().'''
-    strfunc=str
-    mtype='index'
+# matrix file format: magic, version, JSON header length, the JSON header, then the matrix data at the next aligned offset
+matrixFileMagic=b'EIDMATRX'
+matrixFileVersion=1
+matrixFileFormat='<8sIQ'
+matrixFileAlign=64
+
+matrixFileTypes={'index':IndexMatrix,'real':RealMatrix,'vec3':Vec3Matrix,'color':ColorMatrix}
+
+
+def getMatrixFileType(mat):
+    '''Returns the name `mat' is stored under in matrix files, one of the keys of `matrixFileTypes'.'''
+    return first(k for k,v in matrixFileTypes.items() if isinstance(mat,v))
 
-    if isinstance(mat,Vec3Matrix):
-        strfunc=lambda v:'%f %f %f' % (v.x(),v.y(),v.z())
-        mtype='vec3'
-    elif isinstance(mat,ColorMatrix):
-        strfunc=lambda c:'%f %f %f %f' %(c.r(),c.g(),c.b(),c.a())
-        mtype='color'
-    elif isinstance(mat,RealMatrix):
-        mtype='real'
+
+def storeMatrixToFile(filename,mat,metanames=None):
+    '''
+    Store a matrix to a binary file in a format understood by readMatrixFromFile(). The file starts with a JSON header
+    stating the name, matrix type, element type, shape, Numpy dtype, CRC32 checksum of the data, and the metadata
+    values of `mat' named in `metanames' (all metadata if this is None). The raw matrix data then follows, aligned to
+    a 64 byte boundary so that it can be memory-mapped directly.
+    '''
+    arr=np.ascontiguousarray(np.asarray(mat))
+    metanames=mat.getMetaKeys() if metanames is None else metanames
+
+    header={
+        'name':mat.getName(),
+        'mtype':getMatrixFileType(mat),
+        'elemtype':mat.getType(),
+        'n':mat.n(),
+        'm':mat.m(),
+        'dtype':arr.dtype.str,
+        'shape':arr.shape,
+        'crc32':zlib.crc32(arr),
+        'meta':dict((mn,mat.meta(mn)) for mn in metanames)
+    }
+
+    hbytes=json.dumps(header).encode('utf-8')
+    hlen=struct.calcsize(matrixFileFormat)+len(hbytes)
 
     o=None
-    try: #with open(filename,'w') as o: # with block has problems with Cython
-        o=open(filename,'w')
-        lines=[mat.getName(),mtype,mat.getType(),'%i %i'%(mat.n(),mat.m())]
+    try: #with open(filename,'wb') as o: # with block has problems with Cython
+        o=open(filename,'wb')
+        o.write(struct.pack(matrixFileFormat,matrixFileMagic,matrixFileVersion,len(hbytes)))
+        o.write(hbytes)
+        o.write(b'\0'*((-hlen)%matrixFileAlign))
+        o.write(arr.tobytes())
+    finally:
+        if o:
+            o.close()
 
-        for mn in metanames:
-            lines.append('%s = %s'%(mn,mat.meta(mn)))
 
-        o.write('\n'.join(lines)+'\n')
+def mapMatrixFile(filename):
+    '''
+    Memory-map the matrix file `filename' stored by storeMatrixToFile(), returning the JSON header dictionary and a
+    read-only Numpy array of the data in the file. Nothing is read from the data section until the array is accessed.
+    '''
+    o=None
+    try:
+        o=open(filename,'rb')
+        magic,version,hlen=struct.unpack(matrixFileFormat,o.read(struct.calcsize(matrixFileFormat)))
+
+        if magic!=matrixFileMagic:
+            raise IOError('File %r is not a matrix file'%filename)
+        if version>matrixFileVersion:
+            raise IOError('File %r has unsupported matrix file version %i'%(filename,version))
 
-        for n in xrange(mat.n()):
-            vals=mat.getRow(n)
-            o.write(' '.join(map(strfunc,vals))+'\n')
+        header=json.loads(o.read(hlen).decode('utf-8'))
+        offset=o.tell()
+        offset+=(-offset)%matrixFileAlign
     finally:
-        o.close()
+        if o:
+            o.close()
 
+    shape=tuple(header['shape'])
+    if np.prod(shape)==0: # memmap can't map zero-length regions
+        arr=np.zeros(shape,np.dtype(header['dtype']))
+    else:
+        arr=np.memmap(filename,np.dtype(header['dtype']),'r',offset,shape)
+
+    return header,arr
 
-def readMatrixFromFile(filename):
-    '''Read a matrix stored in a file by storeMatrixToFile().'''
+
+def readMatrixFromFile(filename,isShared=False,verify=True):
+    '''
+    Read a matrix stored in a file by storeMatrixToFile(). The data is memory-mapped and copied into the new matrix,
+    which is created in shared memory if `isShared' is True so that it can be passed to processes directly. If
+    `verify' is True the data's checksum is compared against that stored in the file and an IOError raised if they
+    differ. Text files written by earlier versions of storeMatrixToFile() are also read.
+    '''
     filename=os.path.abspath(filename)
-    mat=None
 
     o=None
-    try: #with open(filename,'w') as o: # with block has problems with Cython
-        o=open(filename,'w')
+    try:
+        o=open(filename,'rb')
+        magic=o.read(len(matrixFileMagic))
+    finally:
+        if o:
+            o.close()
+
+    if magic!=matrixFileMagic:
+        return _readMatrixTextFile(filename,isShared)
+
+    header,arr=mapMatrixFile(filename)
+
+    if verify and zlib.crc32(arr)!=header['crc32']:
+        raise IOError('Checksum mismatch in matrix file %r'%filename)
+
+    mattype=matrixFileTypes[header['mtype']]
+    mat=mattype(header['name'],header['elemtype'],header['n'],header['m'],isShared)
+
+    if mat.n()>0:
+        dest=np.asarray(mat)
+        dest[...]=arr.reshape(dest.shape)
+
+    for name,value in header['meta'].items():
+        mat.meta(name,value)
+
+    mat.meta(StdProps._filename,filename)
+
+    return mat
+
+
+def _readMatrixTextFile(filename,isShared=False):
+    '''Read a matrix stored in the text format previously written by storeMatrixToFile().'''
+    o=None
+    try: #with open(filename) as o: # with block has problems with Cython
+        o=open(filename)
         name=o.readline().strip()
         mtype=o.readline().strip()
         elemtype=o.readline().strip()
         n,m=map(int,o.readline().split())
 
-        assert mtype in ('index','real','vec3','color'),mtype
-
-        elemlen=1
-        if mtype=='vec3':
-            elemlen=3
-            convfunc=lambda x,y,z:vec3(float(x),float(y),float(z))
-            mattype=Vec3Matrix
-        elif mtype=='color':
-            elemlen=4
-            convfunc=lambda r,g,b,a:color(float(r),float(g),float(b),float(a))
-            mattype=ColorMatrix
-        elif mtype=='real':
-            convfunc=float
-            mattype=RealMatrix
-        else:
-            convfunc=int
-            mattype=IndexMatrix
+        assert mtype in matrixFileTypes,mtype
 
-        mat=mattype(name,elemtype,n,m)
+        mat=matrixFileTypes[mtype](name,elemtype,n,m,isShared)
         mat.meta(StdProps._filename,filename)
 
         line=o.readline()
         while '=' in line:
-            name,value=line.split('=')
+            name,value=line.split('=',1)
             mat.meta(name.strip(),value.strip())
             line=o.readline()
 
-        index=0
-        while line!='':
-            vals=line.split()
-            if elemlen==1:
-                rvals=map(convfunc,vals)
-            else:
-                rvals=[convfunc(*vals[i:i+elemlen]) for i in range(0,len(vals),elemlen)]
-
-            mat.setRow(index,*rvals)
-            index+=1
-            line=o.readline()
+        rows=[line]+o.readlines()
     finally:
-        o.close()
+        if o:
+            o.close()
+
+    if n>0:
+        dest=np.asarray(mat)
+        values=np.array(' '.join(rows).split(),dest.dtype)
+        dest[...]=values.reshape(dest.shape)
+
     return mat
 
 
@@ -1439,6 +1518,227 @@ def calculateElemIsoline(nodevals,elemtype,val,int refine=-1):
         yield line
 
 
+@memoized()
+def calculateIsosurfTemplate(str geom,int refine):
+    '''
+    Returns the (xis,tets) pair of arrays defining the linear tets which divide a tet or hex element with refinement
+    `refine' as used by calculateTetIsosurf and calculateHexIsosurf. The (P,3) array `xis' contains every unique xi
+    point and the (S,4) array `tets' indexes these to define each tet. Hexes are divided into subhexes then into tets.
+    '''
+    assert geom in (GeomType._Tet,GeomType._Hex)
+
+    if geom==GeomType._Tet:
+        tets=list(divideTettoTet(1,refine))
+    else:
+        tets=[[subhex[i] for i in inds] for subhex in divideHextoHex(1,refine) for inds in hexTo6TetInds]
+
+    return _uniqueTemplateXis(tets)
+
+
+@memoized()
+def calculateIsolineTemplate(str geom,int refine):
+    '''
+    Returns the (xis,tris) pair of arrays defining the linear triangles which divide a tri or quad element with refinement
+    `refine' as used by calculateTriIsoline and calculateQuadIsoline, with quads divided into 2 triangles each. The 
+    (P,3) array `xis' contains every unique face xi point (with a zero third component) and the (S,3) array `tris' 
+    indexes these to define each triangle.
+    '''
+    assert geom in (GeomType._Tri,GeomType._Quad)
+
+    if geom==GeomType._Tri:
+        tris=list(divideTritoTris(refine))
+    else:
+        tris=listSum([(q[0],q[1],q[2]),(q[2],q[1],q[3])] for q in divideQuadtoQuads(refine))
+
+    return _uniqueTemplateXis([[tuple(xi)+(0.0,) for xi in tri] for tri in tris])
+
+
+def _uniqueTemplateXis(elems):
+    '''Returns the unique xi points of the list of subelements `elems' and the indices of these defining each subelement.'''
+    xis=np.asarray(elems,dtype=float)
+    numverts=xis.shape[1]
+    xis,inds=np.unique(np.round(xis.reshape(-1,3),10),axis=0,return_inverse=True)
+    return xis,inds.reshape(-1,numverts).astype(np.int32)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void _lerpIsoXi(double[:,:,:] out,Py_ssize_t row,Py_ssize_t col,double[:,:] xis,int i1,int i2,double v1,double v2,double val) nogil:
+    '''Store in out[row,col] the xi point between xis[i1] and xis[i2] where the value `val' is found, as in calculateTetIsosurf.'''
+    cdef double val1=fabs(v1-val)
+    cdef double val2=val1+fabs(v2-val)
+    cdef double t=0 if val2==0 else val1/val2
+    cdef int d
+
+    for d in range(3):
+        out[row,col,d]=xis[i1,d]+t*(xis[i2,d]-xis[i1,d])
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def calculateTetIsosurfArray(double[:,:] vals,int[:,:] tets,double[:,:] xis,double[:] isovals):
+    '''
+    Marching tets kernel computing the isosurface triangles of many elements for many values in one pass without the GIL.
+    The (E,P) array `vals' contains the field values of E elements at the P template points `xis', and the (S,4) array
+    `tets' indexes these to define linear tets (see calculateIsosurfTemplate). Each tet of each element is sliced for 
+    every value in `isovals' in the same way as calculateTetIsosurf. A first pass counts the triangles so that the 
+    results can be stored in preallocated arrays. Returns the (T,2) array of (element row, isovals index) pairs and the 
+    (T,3,3) array of xi triples for the T triangles found.
+    '''
+    cdef Py_ssize_t e,s,v,k,j,count=0
+    cdef Py_ssize_t numelems=vals.shape[0],numtets=tets.shape[0],numvals=isovals.shape[0]
+    cdef int numpos,tmpi
+    cdef int order[4]
+    cdef double f[4]
+    cdef double val,tmpf
+    cdef Py_ssize_t[:,:] indsview
+    cdef double[:,:,:] xisview
+
+    assert tets.shape[1]==4
+    assert xis.shape[1]==3
+
+    with nogil:
+        for e in range(numelems):
+            for s in range(numtets):
+                for v in range(numvals):
+                    numpos=0
+                    for k in range(4):
+                        if vals[e,tets[s,k]]>=isovals[v]:
+                            numpos+=1
+
+                    if numpos==2:
+                        count+=2
+                    elif numpos==1 or numpos==3:
+                        count+=1
+
+    triinds=np.empty((count,2),dtype=np.intp)
+    trixis=np.empty((count,3,3),dtype=np.float64)
+    indsview=triinds
+    xisview=trixis
+    count=0
+
+    with nogil:
+        for e in range(numelems):
+            for s in range(numtets):
+                for v in range(numvals):
+                    val=isovals[v]
+                    numpos=0
+                    for k in range(4):
+                        order[k]=tets[s,k]
+                        f[k]=vals[e,order[k]]
+                        if f[k]>=val:
+                            numpos+=1
+
+                    if numpos==0 or numpos==4: # tet not sliced
+                        continue
+
+                    # stable insertion sort of vertices by descending value
+                    for k in range(1,4):
+                        j=k
+                        while j>0 and f[j-1]<f[j]:
+                            tmpf=f[j];f[j]=f[j-1];f[j-1]=tmpf
+                            tmpi=order[j];order[j]=order[j-1];order[j-1]=tmpi
+                            j-=1
+
+                    if numpos==3: # 1 node below value, reverse so that this node is first
+                        tmpf=f[0];f[0]=f[3];f[3]=tmpf
+                        tmpf=f[1];f[1]=f[2];f[2]=tmpf
+                        tmpi=order[0];order[0]=order[3];order[3]=tmpi
+                        tmpi=order[1];order[1]=order[2];order[2]=tmpi
+
+                    if numpos==2: # slice is rectangular, store as 2 triangles
+                        _lerpIsoXi(xisview,count,0,xis,order[0],order[2],f[0],f[2],val)
+                        _lerpIsoXi(xisview,count,1,xis,order[0],order[3],f[0],f[3],val)
+                        _lerpIsoXi(xisview,count,2,xis,order[1],order[2],f[1],f[2],val)
+                        indsview[count,0]=e
+                        indsview[count,1]=v
+                        count+=1
+
+                        _lerpIsoXi(xisview,count,0,xis,order[0],order[3],f[0],f[3],val)
+                        _lerpIsoXi(xisview,count,1,xis,order[1],order[3],f[1],f[3],val)
+                        _lerpIsoXi(xisview,count,2,xis,order[1],order[2],f[1],f[2],val)
+                    else: # slice is triangular
+                        _lerpIsoXi(xisview,count,0,xis,order[0],order[1],f[0],f[1],val)
+                        _lerpIsoXi(xisview,count,1,xis,order[0],order[2],f[0],f[2],val)
+                        _lerpIsoXi(xisview,count,2,xis,order[0],order[3],f[0],f[3],val)
+
+                    indsview[count,0]=e
+                    indsview[count,1]=v
+                    count+=1
+
+    return triinds,trixis
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def calculateTriIsolineArray(double[:,:] vals,int[:,:] tris,double[:,:] xis,double[:] isovals):
+    '''
+    Marching triangles kernel computing the isoline segments of many elements for many values in one pass without the
+    GIL. The (E,P) array `vals' contains the field values of E elements at the P template points `xis', and the (S,3)
+    array `tris' indexes these to define linear triangles (see calculateIsolineTemplate). Each triangle of each element
+    is sliced for every value in `isovals' in the same way as calculateLinearTriIsoline. Returns the (T,2) array of 
+    (element row, isovals index) pairs and the (T,2,3) array of xi pairs for the T segments found.
+    '''
+    cdef Py_ssize_t e,s,v,k,count=0
+    cdef Py_ssize_t numelems=vals.shape[0],numtris=tris.shape[0],numvals=isovals.shape[0]
+    cdef int numpos,lone,a,b,c
+    cdef double val
+    cdef Py_ssize_t[:,:] indsview
+    cdef double[:,:,:] xisview
+
+    assert tris.shape[1]==3
+    assert xis.shape[1]==3
+
+    with nogil:
+        for e in range(numelems):
+            for s in range(numtris):
+                for v in range(numvals):
+                    numpos=0
+                    for k in range(3):
+                        if vals[e,tris[s,k]]>=isovals[v]:
+                            numpos+=1
+
+                    if numpos==1 or numpos==2:
+                        count+=1
+
+    seginds=np.empty((count,2),dtype=np.intp)
+    segxis=np.empty((count,2,3),dtype=np.float64)
+    indsview=seginds
+    xisview=segxis
+    count=0
+
+    with nogil:
+        for e in range(numelems):
+            for s in range(numtris):
+                for v in range(numvals):
+                    val=isovals[v]
+                    numpos=0
+                    lone=0
+                    for k in range(3):
+                        if vals[e,tris[s,k]]>=val:
+                            numpos+=1
+
+                    if numpos!=1 and numpos!=2: # triangle not sliced
+                        continue
+
+                    # find the vertex on the other side of the value from the others, retaining winding order for the rest
+                    for k in range(3):
+                        if (vals[e,tris[s,k]]>=val)==(numpos==1):
+                            lone=k
+
+                    a=tris[s,lone]
+                    b=tris[s,(lone+1)%3]
+                    c=tris[s,(lone+2)%3]
+
+                    _lerpIsoXi(xisview,count,0,xis,a,b,vals[e,a],vals[e,b],val)
+                    _lerpIsoXi(xisview,count,1,xis,a,c,vals[e,a],vals[e,c],val)
+                    indsview[count,0]=e
+                    indsview[count,1]=v
+                    count+=1
+
+    return seginds,segxis
+
+
 def calculateLinePlaneIntersect(vec3 start,vec3 end,vec3 planept, vec3 planenorm):
     '''
     Calculates the intersection point of the line defined by `start'->`end'  with plane (`planept',`planenorm').
@@ -2367,6 +2667,64 @@ def pointSearchElem(elemtype,elemnodes,pt,refine):
     return None
 
 
+def pointSearchElemArray(elemtype,elemnodes,pts,int maxIters=20,double tol=1e-8,double margin=1e-5):
+    '''
+    Performs a vectorized point search for N point/element pairs. Each point in the (N,3) array `pts' is searched for
+    in the element of type `elemtype' whose control points are the (N,K,3) array `elemnodes'. Unlike pointSearchElem
+    the xi values are computed directly for the element using Newton iteration, all pairs being iterated together using
+    the vectorized basis function of `elemtype' and finite difference Jacobians. Only 3D element types are supported,
+    a ValueError is raised for others. The result is a pair of the (N,3) xi array and a (N,) boolean array stating
+    which points were found within their elements, that is those whose iteration converged to a xi value within
+    `margin' of the element's xi space.
+    '''
+    cdef int it,d
+    cdef double h=1e-6
+    cdef bint isSimplex=GeomType[elemtype.geom][2]
+
+    if elemtype.dim!=3:
+        raise ValueError('Point search is only defined for 3D element types, not %r'%elemtype)
+
+    elemnodes=np.asarray(elemnodes,dtype=float)
+    pts=np.asarray(pts,dtype=float)
+    numpairs=pts.shape[0]
+    xis=np.full((numpairs,3),0.25 if isSimplex else 0.5) # start at the element centers
+    active=np.ones((numpairs,),dtype=bool)
+    converged=np.zeros((numpairs,),dtype=bool)
+
+    for it in range(maxIters):
+        inds=np.flatnonzero(active)
+        if len(inds)==0:
+            break
+
+        xi=xis[inds]
+        nodes=elemnodes[inds]
+        pos=elemtype.applyCoeffsArray(nodes,elemtype.basisArray(xi),True)
+        jac=np.empty((len(inds),3,3))
+
+        for d in range(3):
+            dxi=xi.copy()
+            dxi[:,d]+=h
+            jac[:,:,d]=(elemtype.applyCoeffsArray(nodes,elemtype.basisArray(dxi),True)-pos)/h
+
+        scale=np.abs(jac).max(axis=(1,2))
+        solvable=np.abs(np.linalg.det(jac))>epsilon*scale**3 # degenerate elements are abandoned
+        active[inds[~solvable]]=False
+        inds=inds[solvable]
+
+        delta=np.linalg.solve(jac[solvable],(pts[inds]-pos[solvable])[...,np.newaxis])[...,0]
+        xis[inds]=np.clip(xi[solvable]+delta,-1.0,2.0) # keep iteration bounded for points far outside their elements
+
+        done=np.abs(delta).max(axis=1)<tol
+        converged[inds[done]]=True
+        active[inds[done]]=False
+
+    found=converged & np.all(xis>=-margin,axis=1) & np.all(xis<=1.0+margin,axis=1)
+    if isSimplex:
+        found&=xis.sum(axis=1)<=1.0+margin
+
+    return xis,found
+
+
 def collectFieldTopos(dataset,fields,indlist=[]):
     '''
     For each field matrix in in `fields'
@@ -339,6 +339,7 @@ ConfVars=enum(
     'stylesheet', 'winsize', 'camerazlock', 'maxprocs', 'configfile', 
     'rtt_preferred_mode', 'vsync', 'rendersystem', # renderer related values
     'consolelogfile','consoleloglen', # console config values
+    'scenecache', # project related values
     desc='Variables in the Config object loaded from config files, these should be present and keyed to platformID group'
 )
 
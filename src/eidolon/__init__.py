@@ -30,6 +30,8 @@ from eidolon.ImageObject import *
 from eidolon.MathDef import *
 from eidolon.Camera2DView import *
 from eidolon.SceneManager import *
+from eidolon.SceneCache import *
+from eidolon.BatchConvert import *
 from eidolon.SceneObject import *
 from eidolon.ScenePlugin import *
 from eidolon.SceneComponents import *
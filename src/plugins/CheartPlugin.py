@@ -17,9 +17,14 @@
 # with this program (LICENSE.txt).  If not, see <http://www.gnu.org/licenses/>
 
 
+import io
 import os.path
 import shutil
-from struct import unpack
+import gzip
+import unittest
+import tempfile
+
+import numpy as np
 
 from eidolon import *
 
@@ -71,18 +76,6 @@ def readCheartBuffer(data, pydatatype, dim,numHeaders,isBinary=False,buff=None,b
         elif pydatatype==float:
             buff=RealMatrix(buffname,0,dim)
 
-    if pydatatype==vec3: # replace the data type for vec3 with a pseudo-constructor that takes 1-3 numbers and returns a vec3
-        def readVec3(*vals):
-            if len(vals)==2:
-                return vec3(vals[0],vals[1],0)
-            elif len(vals)==1:
-                return vec3(vals[0],0,0)
-
-            return vec3(vals[0],vals[1],vals[2])
-
-        pydatatype=readVec3
-
-
     elemsize=3 if pydatatype==vec3 else 1
     doClose=False
 
@@ -90,19 +83,19 @@ def readCheartBuffer(data, pydatatype, dim,numHeaders,isBinary=False,buff=None,b
         doClose=True
         data=open(data,'rb' if isBinary else 'r')
 
-    isFileSrc=hasattr(data,'name') and os.path.isfile(data.name)
+    filename=getStreamFilename(data)
 
-    if isFileSrc:
-        buff.meta(StdProps._filename,os.path.abspath(data.name))
+    if filename:
+        buff.meta(StdProps._filename,filename)
 
     try:
         if isBinary:
-            header=[unpack('i',data.read(4))[0] for i in range(numHeaders)]
+            header=np.frombuffer(data.read(4*numHeaders),np.int32).tolist()
         else:
             header=list(map(int,data.readline().replace(',',' ').split()))
 
         buff.meta(StdProps._header,' '.join(map(str,header)))
-        buff.addRows(header[0]-buff.n())
+        buff.setN(header[0]) # a provided matrix may be larger than the header states so resize rather than add rows
 
         if header[1]==2 and elemsize==3:
             elemsize=2
@@ -110,56 +103,36 @@ def readCheartBuffer(data, pydatatype, dim,numHeaders,isBinary=False,buff=None,b
         if task:
             task.setMaxProgress(header[0])
 
-        if isFileSrc: # read from file
+        if filename: # read from file
             if isBinary:
-                buff.readBinaryFile(os.path.abspath(data.name),numHeaders*4)
+                buff.readBinaryFile(filename,numHeaders*4)
             else:
-                buff.readTextFile(os.path.abspath(data.name),numHeaders)
-
-            if task:
-                task.setProgress(header[0])
-        elif isBinary: # read binary stream data
-            done=False
-            numlines=0
-
-            while not done:
-                for j in range(dim):
-                    comps=[]
-                    for i in range(elemsize):
-                        d=data.read(4 if pydatatype==int else 8)
-                        if d!='':
-                            comps.append(unpack('i' if pydatatype==int else 'd',d)[0])
-                        else:
-                            done=True
-                            break
+                buff.readTextFile(filename,numHeaders)
+        else: # read the rest of the stream in one go and decode it in bulk
+            width=dim*elemsize
+            dtype=np.int32 if pydatatype==int else np.float64
 
-                    if not done:
-                        buff.setAt(pydatatype(*comps),numlines,j)
-
-                if task:
-                    task.setProgress(numlines)
-
-                numlines+=1
-        else: # read text stream data
-            i=0
-            line=data.readline()
-            mapfunc=int if pydatatype==int else float
-
-            while line!='':
-                if line.strip()!='':
-                    if i==buff.n():
-                        buff.addRows(1)
+            if isBinary:
+                arr=np.frombuffer(data.read(header[0]*width*np.dtype(dtype).itemsize),dtype)
+            else:
+                text=data.read()
+                if isinstance(text,bytes):
+                    text=text.decode('ascii')
+                arr=np.fromstring(text.replace(',',' '),dtype=dtype,sep=' ') if text.strip() else np.zeros((0,),dtype)
 
-                    comps=list(map(mapfunc, line.replace(',',' ').split()))
+            if arr.shape[0]%width!=0:
+                raise IOError('Number of values (%i) is not a multiple of the row width (%i)'%(arr.shape[0],width))
 
-                    if task:
-                        task.setProgress(i)
+            arr=arr.reshape((arr.shape[0]//width,dim,elemsize))
+            if elemsize==2: # 2D nodes, pad with a zero z component
+                arr=np.concatenate([arr,np.zeros(arr.shape[:2]+(1,),dtype)],axis=2)
 
-                    for j in range(dim):
-                        buff.setAt(pydatatype(*comps[j*elemsize:(j+1)*elemsize]),i,j)
+            buff.setN(arr.shape[0])
+            if arr.shape[0]>0:
+                np.asarray(buff)[:arr.shape[0]]=arr.reshape((arr.shape[0],-1))
 
-                i+=1
-                line=data.readline()
+        if task:
+            task.setProgress(header[0])
 
         return buff,tuple(header)
     finally:
@@ -167,21 +140,49 @@ def readCheartBuffer(data, pydatatype, dim,numHeaders,isBinary=False,buff=None,b
             data.close()
 
 
-def writeCheartBuffer(outfile,header,data,addVal=None):
-    if isinstance(data,Vec3Matrix):
-        getRow=lambda n:tuple(data.getAt(n))
-    else:
-        getRow=lambda n:data.getRow(n)
+def getStreamFilename(data):
+    '''
+    Returns the absolute path of the file the stream `data' reads from directly, or None if `data' is an in-memory, 
+    compressed, or other stream which doesn't read plain file contents.
+    '''
+    raw=getattr(data,'buffer',data) # underlying binary stream of a text stream
+    raw=getattr(raw,'raw',raw) # underlying raw file of a buffered stream
+    name=getattr(raw,'name',None)
 
+    if isinstance(raw,io.FileIO) and isinstance(name,str) and os.path.isfile(name):
+        return os.path.abspath(name)
+
+    return None
+
+
+def writeCheartBuffer(outfile,header,data,addVal=None,isBinary=False):
+    '''
+    Write the matrix `data' with the list of ints `header' to `outfile', which is a filename or a writable stream. The 
+    value `addVal' is added to every value if given. Binary files store 32-bit ints for IndexMatrix and doubles for 
+    everything else, text files store each row of values on a line.
+    '''
+    arr=np.asarray(data) if data.n()>0 else np.zeros((0,data.m()))
     if addVal!=None:
-        getRow1=getRow
-        getRow=lambda n:[v+addVal for v in getRow1(n)]
+        arr=arr+addVal
+
+    doClose=False
+    if isinstance(outfile,str):
+        doClose=True
+        outfile=open(outfile,'wb' if isBinary else 'w')
 
-    with open(outfile,'w') as o:
-        o.write(' '.join(map(str,header))+'\n')
-        for n in range(data.n()):
-            line=getRow(n)
-            o.write(' '.join(map(str,line))+'\n')
+    try:
+        if isBinary:
+            dtype=np.int32 if isinstance(data,IndexMatrix) else np.float64
+            outfile.write(np.asarray(header,np.int32).tobytes())
+            outfile.write(arr.astype(dtype).tobytes())
+        else:
+            # astype(str) gives the same shortest representation of each value as str() but without a Python loop
+            lines=[' '.join(row) for row in arr.astype(str)]
+            outfile.write(' '.join(map(str,header))+'\n')
+            outfile.write('\n'.join(lines)+('\n' if lines else ''))
+    finally:
+        if doClose:
+            outfile.close()
 
 
 def guessTopologyType(tfile):
@@ -1074,3 +1075,96 @@ Usage: --cheartload=XFILE,TFILE,BASIS [--cheartfield=DFILE,DIM[,TFILE,BASIS]]
 
 addPlugin(CheartPlugin())
 
+
+
+### Unit tests
+
+class TestCheartPlugin(unittest.TestCase):
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+
+        self.nodearr=np.asarray([(0,0,0),(1.5,0,0),(0,-2.25,0),(0,0,1e-3)])
+        self.indarr=np.asarray([(0,1,2,3),(3,2,1,0)])
+
+        self.nodes=Vec3Matrix('nodes',self.nodearr.shape[0])
+        np.asarray(self.nodes)[:,:]=self.nodearr
+        self.inds=IndexMatrix('inds',ElemType._Tet1NL,self.indarr.shape[0],4)
+        np.asarray(self.inds)[:,:]=self.indarr
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testTextFile(self):
+        '''Test writing and reading text node and topology files.'''
+        xfile=os.path.join(self.tempdir,'test.X')
+        tfile=os.path.join(self.tempdir,'test.T')
+        writeCheartBuffer(xfile,[self.nodes.n(),3],self.nodes)
+        writeCheartBuffer(tfile,[self.inds.n(),self.nodes.n()],self.inds,1)
+
+        nodes,xheader=readXFile(xfile,'nodes')
+        inds,theader=readTFile(tfile,ElemType._Tet1NL,'inds')
+
+        self.assertEqual((self.nodes.n(),3),xheader)
+        self.assertEqual((self.inds.n(),self.nodes.n()),theader)
+        self.assertTrue(np.allclose(self.nodearr,np.asarray(nodes)))
+        self.assertTrue(np.array_equal(self.indarr+1,np.asarray(inds)))
+        self.assertEqual(os.path.abspath(xfile),nodes.meta(StdProps._filename))
+
+    def testBinaryFile(self):
+        '''Test writing and reading binary node and topology files.'''
+        xfile=os.path.join(self.tempdir,'test.Xb')
+        tfile=os.path.join(self.tempdir,'test.Tb')
+        writeCheartBuffer(xfile,[self.nodes.n(),3],self.nodes,isBinary=True)
+        writeCheartBuffer(tfile,[self.inds.n(),self.nodes.n()],self.inds,isBinary=True)
+
+        self.assertTrue(np.allclose(self.nodearr,np.asarray(readXFile(xfile,'nodes',True)[0])))
+        self.assertTrue(np.array_equal(self.indarr,np.asarray(readTFile(tfile,ElemType._Tet1NL,'inds',True)[0])))
+
+    def testStreams(self):
+        '''Test writing and reading text and binary in-memory streams.'''
+        text=io.StringIO()
+        writeCheartBuffer(text,[self.nodes.n(),3],self.nodes)
+        text.seek(0)
+        self.assertTrue(np.allclose(self.nodearr,np.asarray(readXFile(text,'nodes')[0])))
+
+        binary=io.BytesIO()
+        writeCheartBuffer(binary,[self.inds.n(),self.nodes.n()],self.inds,isBinary=True)
+        binary.seek(0)
+        self.assertTrue(np.array_equal(self.indarr,np.asarray(readTFile(binary,ElemType._Tet1NL,'inds',True)[0])))
+
+    def test2DNodes(self):
+        '''Test that 2D nodes are padded with a zero z component.'''
+        nodes,header=readXFile(io.StringIO('3 2\n0 0\n1.5 0\n0 -2\n'),'nodes')
+
+        self.assertEqual((3,2),header)
+        self.assertTrue(np.allclose([(0,0,0),(1.5,0,0),(0,-2,0)],np.asarray(nodes)))
+
+    def testGzip(self):
+        '''Test writing and reading gzip compressed text and binary files.'''
+        xfile=os.path.join(self.tempdir,'test.X.gz')
+        tfile=os.path.join(self.tempdir,'test.Tb.gz')
+
+        with gzip.open(xfile,'wt') as o:
+            writeCheartBuffer(o,[self.nodes.n(),3],self.nodes)
+
+        with gzip.open(tfile,'wb') as o:
+            writeCheartBuffer(o,[self.inds.n(),self.nodes.n()],self.inds,isBinary=True)
+
+        with gzip.open(xfile,'rt') as o:
+            self.assertTrue(np.allclose(self.nodearr,np.asarray(readXFile(o,'nodes')[0])))
+
+        with gzip.open(tfile,'rb') as o:
+            self.assertTrue(np.array_equal(self.indarr,np.asarray(readTFile(o,ElemType._Tet1NL,'inds',True)[0])))
+
+    def testReuseLargerBuffer(self):
+        '''Test that reading into a provided matrix larger than the file resizes it to the file's contents.'''
+        buff=Vec3Matrix('buff',10)
+        text=io.StringIO()
+        writeCheartBuffer(text,[self.nodes.n(),3],self.nodes)
+        text.seek(0)
+
+        nodes,_=readXFile(text,'nodes',buff=buff)
+
+        self.assertIs(buff,nodes)
+        self.assertEqual(self.nodes.n(),nodes.n())
+        self.assertTrue(np.allclose(self.nodearr,np.asarray(nodes)))
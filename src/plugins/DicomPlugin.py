@@ -33,10 +33,15 @@ import tempfile
 import shutil
 import glob
 import itertools
+import sqlite3
+import struct
+import zlib
 from collections import OrderedDict, namedtuple
 from random import randint
 import numpy as np
 
+from io import BytesIO
+
 try:
     from StringIO import StringIO
 except:
@@ -55,11 +60,19 @@ from pydicom.datadict import DicomDictionary
 from pydicom.tag import Tag
 from pydicom.dataset import Dataset,FileDataset
 
-from ui import Ui_SeriesProp, Ui_ChooseSeriesDialog, Ui_Dicom2DView
+try:
+    import imagecodecs # optional native codecs for JPEG, JPEG-LS, JPEG2000, and PackBits (RLE) data
+except ImportError:
+    imagecodecs=None
+
+from ui import QtCore, QtGui, Ui_SeriesProp, Ui_ChooseSeriesDialog, Ui_Dicom2DView
 
 
 eidolon.AssetType.append('dcm','Dicom Sources','Dicom Datasets (Directory References)') # adds the DICOM directory asset type to the asset panel
-digestFilename='dicomdataset.ini' # name of digest file
+digestFilename='dicomdataset.ini' # name of legacy digest file
+indexFilename='dicomdataset.sqlite' # name of directory index database file
+thumbnailSize=64 # maximal dimension of series thumbnail images
+previewSize=128 # maximal in-plane dimension of series preview volumes
 headerPrecision=4 # precision of float values in DICOM headers, values are only correct to this number plus one of significant figures
 keywordToTag={v[4]:Tag(k) for k,v in DicomDictionary.items()} # maps tag keywords to 2 part tag numbers
 
@@ -87,6 +100,19 @@ NonstandardTags=enum(
     ('USpixeldata',Tag(0x7fe0, 0x0010))
 )
 
+# compressed transfer syntax UIDs mapped to the name of the imagecodecs decode function for their frames
+CompressedSyntaxes={
+    '1.2.840.10008.1.2.5':'rle', # RLE Lossless, decoded by decodeRLEFrame()
+    '1.2.840.10008.1.2.4.50':'jpeg8_decode', # JPEG Baseline
+    '1.2.840.10008.1.2.4.51':'jpeg8_decode', # JPEG Extended
+    '1.2.840.10008.1.2.4.57':'ljpeg_decode', # JPEG Lossless
+    '1.2.840.10008.1.2.4.70':'ljpeg_decode', # JPEG Lossless SV1
+    '1.2.840.10008.1.2.4.80':'jpegls_decode', # JPEG-LS Lossless
+    '1.2.840.10008.1.2.4.81':'jpegls_decode', # JPEG-LS Near Lossless
+    '1.2.840.10008.1.2.4.90':'jpeg2k_decode', # JPEG2000 Lossless
+    '1.2.840.10008.1.2.4.91':'jpeg2k_decode', # JPEG2000
+}
+
 
 def roundHeaderVals(*vals):
     '''Yield each of `vals' rounded to `headerPrecision'.'''
@@ -94,6 +120,207 @@ def roundHeaderVals(*vals):
         yield round(v,headerPrecision)
 
 
+def decodePackBits(data,size):
+    '''Decode the PackBits encoded byte string `data' which expands to `size' bytes, returning a uint8 array.'''
+    if imagecodecs is not None:
+        return np.frombuffer(imagecodecs.packbits_decode(data),np.uint8)[:size]
+
+    data=bytes(data)
+    result=bytearray()
+    pos=0
+    datalen=len(data)
+
+    # copy each run with one slice operation, this loops over runs rather than bytes
+    while pos<datalen and len(result)<size:
+        header=data[pos]
+        pos+=1
+
+        if header<128: # literal run of header+1 bytes
+            result+=data[pos:pos+header+1]
+            pos+=header+1
+        elif header>128: # replicate run of the next byte repeated 257-header times
+            result+=data[pos:pos+1]*(257-header)
+            pos+=1
+
+    return np.frombuffer(bytes(result[:size]),np.uint8)
+
+
+def encodePackBits(data):
+    '''Encode the uint8 array `data' as a PackBits byte string with runs of 3 or more bytes replicated.'''
+    data=np.asarray(data,np.uint8).ravel()
+    result=bytearray()
+
+    if data.shape[0]==0:
+        return bytes(result)
+
+    # start indices and lengths of runs of equal values
+    starts=np.flatnonzero(np.concatenate([[True],data[1:]!=data[:-1]]))
+    lengths=np.diff(np.concatenate([starts,[data.shape[0]]]))
+    literal=None # start of the current literal sequence
+
+    def addLiteral(start,end):
+        for i in range(start,end,128):
+            chunk=data[i:min(end,i+128)]
+            result.append(chunk.shape[0]-1)
+            result.extend(chunk.tobytes())
+
+    for start,length in zip(starts.tolist(),lengths.tolist()):
+        if length<3:
+            literal=start if literal is None else literal
+        else:
+            if literal is not None:
+                addLiteral(literal,start)
+                literal=None
+
+            for i in range(0,length,128):
+                count=min(128,length-i)
+                if count<3:
+                    addLiteral(start+i,start+i+count)
+                else:
+                    result.append(257-count)
+                    result.append(int(data[start]))
+
+    if literal is not None:
+        addLiteral(literal,data.shape[0])
+
+    return bytes(result)
+
+
+def decodeRLEFrame(data,rows,cols,samples,bitsAlloc):
+    '''
+    Decode the DICOM RLE Lossless frame byte string `data' into an array of dimensions (rows,cols) or (rows,cols,samples)
+    for multi-sample images. Each segment stores one byte of one sample for every pixel, most significant byte first,
+    so the decoded segments are combined into unsigned big endian values of `bitsAlloc' bits.
+    '''
+    nbytes=bitsAlloc//8
+    numpixels=rows*cols
+    header=np.frombuffer(data[:64],np.dtype('<u4'))
+    numsegs=int(header[0])
+
+    if numsegs!=nbytes*samples:
+        raise ValueError('RLE frame has %i segments, expected %i'%(numsegs,nbytes*samples))
+
+    offsets=header[1:numsegs+1].tolist()+[len(data)]
+    planes=np.empty((samples,numpixels,nbytes),np.uint8)
+
+    for seg in range(numsegs):
+        segment=decodePackBits(data[offsets[seg]:offsets[seg+1]],numpixels)
+        planes[seg//nbytes,:segment.shape[0],seg%nbytes]=segment
+
+    result=planes.view('>u%i'%nbytes)[...,0] # each pixel's bytes are in big endian order
+    result=result.astype(result.dtype.newbyteorder('=')).reshape((samples,rows,cols))
+
+    return result[0] if samples==1 else result.transpose((1,2,0))
+
+
+def encodeRLEFrame(arr):
+    '''
+    Encode the unsigned or signed integer image `arr' of dimensions (rows,cols) or (rows,cols,samples) as a DICOM RLE
+    Lossless frame byte string, the inverse of decodeRLEFrame(). Each row of each byte segment is encoded separately.
+    '''
+    arr=np.asarray(arr)
+    planes=arr[...,np.newaxis] if arr.ndim==2 else arr
+    nbytes=arr.dtype.itemsize
+    # split each sample's values into big endian byte planes of dimensions (samples*nbytes,rows,cols)
+    planes=planes.astype(planes.dtype.newbyteorder('>')).view(np.uint8)
+    planes=planes.reshape(arr.shape[:2]+(-1,nbytes)).transpose((2,3,0,1)).reshape((-1,)+arr.shape[:2])
+
+    segments=[b''.join(encodePackBits(row) for row in plane) for plane in planes]
+    segments=[seg+b'\0'*(len(seg)%2) for seg in segments] # segments are padded to even length
+
+    header=np.zeros((16,),np.dtype('<u4'))
+    header[0]=len(segments)
+    header[1:len(segments)+1]=64+np.cumsum([0]+[len(seg) for seg in segments[:-1]])
+
+    return header.tobytes()+b''.join(segments)
+
+
+def readEncapsulatedItems(data):
+    '''
+    Returns the list of item values in the encapsulated pixel data byte string `data', the first of which is the basic
+    offset table and the rest the fragments of compressed frame data.
+    '''
+    items=[]
+    pos=0
+
+    while pos+8<=len(data):
+        group,elem,length=struct.unpack_from('<HHI',data,pos)
+        pos+=8
+
+        if (group,elem)!=(0xfffe,0xe000): # sequence delimiter or invalid tag
+            break
+
+        items.append(data[pos:pos+length])
+        pos+=length
+
+    return items
+
+
+def decodeCompressedFrames(dcm):
+    '''
+    Decode the encapsulated pixel data of Dicom object `dcm' if it's stored with one of the transfer syntaxes in 
+    CompressedSyntaxes, returning an array in the same layout as dcm.pixel_array, or None if the syntax or encapsulation
+    isn't handled or the needed codec is not available.
+    '''
+    meta=getattr(dcm,'file_meta',None)
+    tsuid=str(meta.get('TransferSyntaxUID','')) if meta is not None else ''
+    codec=CompressedSyntaxes.get(tsuid,None)
+
+    if codec is None or 'PixelData' not in dcm or (codec!='rle' and not hasattr(imagecodecs,codec)):
+        return None
+
+    rows=int(dcm.Rows)
+    cols=int(dcm.Columns)
+    samples=int(dcm.get('SamplesPerPixel',1) or 1)
+    bitsAlloc=int(dcm.get('BitsAllocated',16) or 16)
+    bitsStored=int(dcm.get('BitsStored',bitsAlloc) or bitsAlloc)
+    numframes=int(dcm.get('NumberOfFrames',1) or 1)
+    fragments=readEncapsulatedItems(dcm.PixelData)[1:] # first item is the basic offset table
+
+    if numframes==1:
+        frames=[b''.join(fragments)]
+    elif len(fragments)==numframes:
+        frames=fragments
+    else: # multiple fragments per frame, leave to pydicom
+        return None
+
+    if codec=='rle':
+        result=[decodeRLEFrame(f,rows,cols,samples,bitsAlloc) for f in frames]
+    else:
+        decode=getattr(imagecodecs,codec)
+        result=[np.asarray(decode(f)).reshape((rows,cols,samples) if samples>1 else (rows,cols)) for f in frames]
+
+    result=np.stack(result) if numframes>1 else result[0]
+
+    # codecs produce unsigned values, reinterpret signed data as two's complement values of `bitsStored' bits
+    if int(dcm.get('PixelRepresentation',0) or 0)==1 and result.dtype.kind=='u':
+        shift=result.dtype.itemsize*8-bitsStored
+        result=result.view(result.dtype.str.replace('u','i'))
+        if shift>0:
+            result=(result<<shift)>>shift
+
+    return result
+
+
+def readPixelArray(dcm):
+    '''
+    Returns the pixel array of Dicom object `dcm', or None if it has no pixel data or it can't be decoded. Compressed data
+    is decoded with decodeCompressedFrames() if possible, falling back to pydicom's own handlers otherwise.
+    '''
+    try:
+        result=decodeCompressedFrames(dcm)
+    except Exception:
+        result=None
+
+    if result is None:
+        try:
+            result=dcm.pixel_array
+        except Exception:
+            result=None
+
+    return result
+
+
 def readDicomMMap(fullpath,**kwargs):
     with open(fullpath,'r+b') as ff:
         mm=mmap.mmap(ff.fileno(),0)
@@ -181,49 +408,104 @@ def createDicomReadThread(rootpath,files,readPixels=True):
 
 
 @concurrent
-def createDicomDatasets(process,rootdir,files):
-    '''Reads the listed Dicom files from the given directory and returns DicomDataset objects containing collected info.'''
-    dds=DicomDataset(rootdir)
-
-    readthread,dcmqueue=createDicomReadThread(rootdir,files,False)
+def readDicomIndexEntries(process,rootdir,files):
+    '''
+    Reads the headers of the Dicom files in `rootdir' listed by relative file names in `files' and returns a list of
+    (filename,seriesID,seriesNum,desc,instanceUID,instanceNum) tuples. The values other than the filename are None for
+    files which aren't Dicom or can't be read, so that these are recorded in the index and not read again.
+    '''
+    result=[]
 
-    counter=0
-    while readthread.isAlive() or not dcmqueue.empty():
+    for i,f in enumerate(files):
         try:
-            f,ds=dcmqueue.get(True,0.01)
+            dcm=read_file(os.path.join(rootdir,f),stop_before_pixels=True)
+            result.append((
+                f,
+                str(dcm.SeriesInstanceUID),
+                int(dcm.get('SeriesNumber',0) or 0),
+                str(dcm.get('SeriesDescription','')).strip(),
+                str(dcm.get('SOPInstanceUID','')),
+                int(dcm.get('InstanceNumber',0) or 0)
+            ))
+        except: # reject non-Dicom files or files with errors
+            result.append((f,None,None,None,None,None))
 
-            series=dds.getSeries(ds.SeriesInstanceUID,True)
-            series.addFile(os.path.relpath(f,rootdir))
-            series.desc=series.desc or str(ds.get('SeriesDescription',series.desc)).strip()
-            series.seriesNum=series.seriesNum or int(ds.get('SeriesNumber',series.seriesNum))
+        process.setProgress(i+1)
 
-            counter+=1
-            process.setProgress(counter)
-        except:
-            pass
+    return result
 
-    return dds
+
+def createDicomPrefetchThread(rootdir,files,maxPrefetch=16):
+    '''
+    Reads the contents of the files in `rootdir' listed by relative file names in `files' ahead of their use, and returns
+    the reading thread object and the synchronized queue containing (relative-filename,file-bytes) pairs produced by the
+    thread in the order of `files'. The file bytes are None for files which couldn't be read. At most `maxPrefetch' files
+    are held in the queue at once, so file IO overlaps with decoding without reading the whole series into memory.
+    '''
+    dcmqueue=queue.Queue(maxPrefetch)
+
+    def readFiles():
+        for f in files:
+            try:
+                with open(os.path.join(rootdir,f),'rb') as o:
+                    dcmqueue.put((f,o.read()))
+            except IOError:
+                dcmqueue.put((f,None))
+
+    readthread=threading.Thread(target=readFiles)
+    readthread.daemon=True
+    readthread.start()
+
+    return readthread,dcmqueue
 
 
 @concurrent
 @timing
-def loadSharedImages(process,rootdir,files,crop=None):
-    '''Reads the image data from the listed files and returns a list of SharedImage objects storing this image data.'''
+def loadSharedImages(process,rootdir,files,crop=None,indexStart=0):
+    '''
+    Reads the image data from the listed files and returns a list of SharedImage objects storing this image data. Files
+    are read by a prefetching thread while pixel data is decoded and rescaled directly into shared image matrices, so
+    only the matrix handles and not the pixel data are copied back to the calling process.
+    '''
     result=[]
+    readthread,dcmqueue=createDicomPrefetchThread(rootdir,files)
+    # images which will be cropped are allocated locally since only the cropped copy needs to be shared
+    isShared=crop is None
 
-    for i in range(len(files)):
-        process.setProgress(i+1)
-        filename=os.path.join(rootdir,files[i])
-        dcm=DicomSharedImage(filename,i+process.startval,False)
+    try:
+        for i in range(len(files)):
+            process.setProgress(i+1)
+            f,data=dcmqueue.get()
+
+            if data is None:
+                continue
+
+            filename=os.path.join(rootdir,f)
+
+            try:
+                dcm=read_file(BytesIO(data))
+            except: # reject non-Dicom files or files with errors
+                continue
+
+            dcm=DicomSharedImage(filename,i+process.startval+indexStart,isShared,dcm=dcm)
+
+            # crop the image if a valid crop rectangle is given and the object has image data
+            if dcm.img is not None and crop!=None and (crop[0]>0 or crop[1]>0 or crop[2]<dcm.dimensions[0]-1 or crop[3]<dcm.dimensions[1]-1):
+                dcm=dcm.crop(*crop)
 
-        # crop the image if a valid crop rectangle is given and the object has image data
-        if dcm.img is not None and crop!=None and (crop[0]>0 or crop[1]>0 or crop[2]<dcm.dimensions[0]-1 or crop[3]<dcm.dimensions[1]-1):
-            dcm=dcm.crop(*crop)
+            # if the img member is None and this isn't a compressed image then it's non-image data so discard
+            if dcm.img is not None or dcm.isCompressed:
+                if dcm.img is not None and not dcm.img.isShared():
+                    dcm.setShared(True)
 
-        # if the img member is None and this isn't a compressed image then it's non-image data so discard
-        if dcm.img is not None or dcm.isCompressed:
-            dcm.setShared(True)
-            result.append(dcm)
+                result.append(dcm)
+    finally:
+        # consume what remains in the queue if an error occurred so the reading thread can exit
+        while readthread.is_alive() or not dcmqueue.empty():
+            try:
+                dcmqueue.get(True,0.01)
+            except queue.Empty:
+                pass
 
     return result
 
@@ -343,6 +625,68 @@ def isPhaseImage(image):
     return phasevalue1 in imagetype or phasevalue2 in imagetype
 
 
+def getRescaleValues(dcm,rescale=True):
+    '''Returns the (slope,intercept) rescale values of Dicom object `dcm', or (1.0,0.0) if `rescale' is False.'''
+    rslope=float(dcm.get(slopeTag,1) or 1)
+    rinter=float(dcm.get(interTag,0) or 0)
+    #rtype=dcm.get('RescaleType',None)
+
+    # TODO: proper rescaling?
+    if not rescale or rslope==0:
+        rslope=1.0
+        rinter=0.0
+
+    return rslope,rinter
+
+
+def downsampleImage(img,maxdim):
+    '''
+    Returns the pair (img[::scale,::scale],scale) for the smallest integer `scale' which reduces the first two dimensions
+    of `img' to at most `maxdim'.
+    '''
+    scale=max(1,int(np.ceil(max(img.shape[:2])/float(maxdim))))
+    return img[::scale,::scale],scale
+
+
+def readDicomPreviewImage(filename,maxdim):
+    '''
+    Reads the Dicom file `filename' and returns its rescaled image as a float32 array downsampled to at most `maxdim' in
+    each dimension paired with the downsampling scale, or (None,1) if the file has no readable pixel data.
+    '''
+    dcm=read_file(filename)
+    pixelarray=readPixelArray(dcm)
+
+    if pixelarray is None:
+        return None,1
+
+    if pixelarray.ndim==3: # sum channels as DicomSharedImage does
+        pixelarray=np.sum(pixelarray,axis=2)
+
+    img,scale=downsampleImage(pixelarray,maxdim)
+    rslope,rinter=getRescaleValues(dcm)
+
+    return img.astype(np.float32)*rslope+rinter,scale
+
+
+@concurrent
+def readSeriesPreviewImages(process,rootdir,files,maxdim):
+    '''
+    Reads the listed Dicom files from `rootdir' and returns the list of results from readDicomPreviewImage(), with
+    (None,1) for files which couldn't be read.
+    '''
+    result=[]
+
+    for i,f in enumerate(files):
+        try:
+            result.append(readDicomPreviewImage(os.path.join(rootdir,f),maxdim))
+        except:
+            result.append((None,1))
+
+        process.setProgress(i+1)
+
+    return result
+
+
 def DicomSharedImage(filename,index=-1,isShared=False,rescale=True,dcm=None,includeTags=False):
     '''
     This pseudo-constructor creates a SharedImage object from a DICOM file. If `dcm' is None then the file is read
@@ -371,10 +715,8 @@ def DicomSharedImage(filename,index=-1,isShared=False,rescale=True,dcm=None,incl
     
     si=SharedImage(filename,position,orientation,dimensions,spacing)
 
-    try:
-        validPixelArray=dcm.pixel_array is not None
-    except:
-        validPixelArray=False
+    pixelarray=readPixelArray(dcm)
+    validPixelArray=pixelarray is not None
 
     si.index=index
     # extract Dicom properties of interest
@@ -391,21 +733,20 @@ def DicomSharedImage(filename,index=-1,isShared=False,rescale=True,dcm=None,incl
     if validPixelArray:
         #wincenter=dcm.get('WindowCenter',None)
         #winwidth=dcm.get('WindowWidth',None)
-        rslope=float(dcm.get(slopeTag,1) or 1)
-        rinter=float(dcm.get(interTag,0) or 0)
-        #rtype=dcm.get('RescaleType',None)
-
-        # TODO: proper rescaling?
-        if not rescale or rslope==0: 
-            rslope=1.0
-            rinter=0.0
-            
-        pixelarray=dcm.pixel_array*rslope+rinter
-        if pixelarray.ndim==3: # TODO: handle actual multichannel images?
-            pixelarray=np.sum(pixelarray,axis=2)
+        rslope,rinter=getRescaleValues(dcm,rescale)
 
+        # pixelarray is in (row,column) index order already
         si.allocateImg(si.seriesID+str(si.index),isShared)
-        np.asarray(si.img)[:,:]=pixelarray # pixelarray is in (row,column) index order already
+        img=np.asarray(si.img)
+
+        if pixelarray.ndim==3: # TODO: handle actual multichannel images?
+            img[:,:]=np.sum(pixelarray*rslope+rinter,axis=2)
+        else:
+            # rescale the native pixel values straight into the image matrix without creating temporary arrays
+            np.multiply(pixelarray,rslope,out=img,casting='unsafe')
+            if rinter!=0:
+                img+=rinter
+
         si.setMinMaxValues(*eidolon.minmaxMatrixReal(si.img))
 
     return si
@@ -478,6 +819,23 @@ class ChooseSeriesDialog(QtWidgets.QDialog,Ui_ChooseSeriesDialog):
 
         self.mgr.callThreadSafe(fillList,self.seriesList,series or ['No Dicom Files Found'],curitem=curitem)
 
+        # set the thumbnail icons after the list is filled so that the series can be chosen before these are created
+        if series:
+            for i,s in enumerate(self.dds.series):
+                self.mgr.callThreadSafe(self._setThumbnail,i,self.plugin.getSeriesThumbnail(s))
+
+    def _setThumbnail(self,row,thumb):
+        item=self.seriesList.item(row)
+
+        if item is not None and thumb is not None and thumb.size>0:
+            minv=thumb.min()
+            maxv=thumb.max()
+            img=np.ascontiguousarray((thumb-minv)*(255.0/max(maxv-minv,eidolon.epsilon)),np.uint8)
+            qimg=QtGui.QImage(img.data,img.shape[1],img.shape[0],img.strides[0],QtGui.QImage.Format_Grayscale8)
+
+            item.setIcon(QtGui.QIcon(QtGui.QPixmap.fromImage(qimg)))
+            self.seriesList.setIconSize(QtCore.QSize(thumbnailSize,thumbnailSize))
+
     def accept(self):
         selected=[]
         for i in self.seriesList.selectedItems():
@@ -511,6 +869,7 @@ class TimeMultiSeriesDialog(QtWidgets.QDialog,BaseCamera2DWidget,Ui_Dicom2DView)
         self.imgwidth=0
         self.imgheight=0
         self.tex=None # Texture for the current image
+        self.previews={} # maps series IDs to (volume,scale) preview pairs from DicomPlugin.getSeriesPreview()
 
         # image data plane figure and material
         self.texmat=self.createMaterial('texmat')
@@ -557,6 +916,14 @@ class TimeMultiSeriesDialog(QtWidgets.QDialog,BaseCamera2DWidget,Ui_Dicom2DView)
         self.buttonBox.accepted.connect(self.createImage)
         self.buttonBox.rejected.connect(self.reject)
 
+        # load or create the series preview volumes, images are read from files until these are available
+        @taskroutine('Loading Series Previews')
+        def _loadPreviews(task=None):
+            for s in self.serieslist:
+                self.previews[s.seriesID]=self.plugin.getSeriesPreview(s,True,task)
+
+        self.mgr.runTasks(_loadPreviews())
+
     def _worldToImgXY(self,x,y):
         return vec3(x+self.imgwidth/2,self.imgheight/2-y)
 
@@ -621,8 +988,22 @@ class TimeMultiSeriesDialog(QtWidgets.QDialog,BaseCamera2DWidget,Ui_Dicom2DView)
     def _loadImage(self):
         seriesindex=self.seriesListWidget.currentRow()
         imgindex=self.imgNumBox.value()
+        series=self.serieslist[seriesindex]
+        preview=self.previews.get(series.seriesID,None)
 
-        return self.serieslist[seriesindex].loadSharedImage(imgindex)
+        # use the preview volume once the full image dimensions are known from the first image
+        if self.tex is not None and preview is not None:
+            volume,scale=preview
+            w,h=self.imgwidth,self.imgheight
+            img=np.repeat(np.repeat(volume[imgindex],scale,0),scale,1)[:h,:w]
+
+            if img.shape==(h,w):
+                simg=SharedImage(series.filenames[imgindex],vec3(),rotator(),(w,h))
+                simg.allocateImg('preview%i'%imgindex)
+                simg.setArrayImg(img)
+                return simg
+
+        return series.loadSharedImage(imgindex)
 
     def _selectImg(self,val=None):
         if val==None: # val is not None when the signal is from the slider, use the value in that case
@@ -675,7 +1056,12 @@ class TimeMultiSeriesDialog(QtWidgets.QDialog,BaseCamera2DWidget,Ui_Dicom2DView)
                 crop=(minx,miny,maxx,maxy)
 
                 for i,series in enumerate(self.serieslist):
-                    simgs=self.plugin.loadSeriesImages(series,selection,False,crop)
+                    loaded=[]
+                    def _batchLoaded(batch,desc=series.desc):
+                        loaded.extend(batch)
+                        task.setLabel('Loading Multiseries Image: %s %i/%i'%(desc,len(loaded),len(selection)))
+                        
+                    simgs=self.plugin.loadSeriesImages(series,selection,False,crop,_batchLoaded)
                     images+=simgs
                     tslist=set(s.timestep for s in simgs)
                     
@@ -763,8 +1149,13 @@ class DicomDataset(object):
     '''Represents all the loaded Dicom information for files found in a given root directory. Changing breaks .pickle files.'''
     def __init__(self,rootdir='.'):
         self.series=[]
+        self.seriesmap={} # maps series IDs to members of self.series
         self.rootdir=rootdir
 
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.seriesmap={s.seriesID:s for s in self.series}
+
     def getSeries(self,seriesID,createNew=False):
         '''
         Get the series with the given ID `seriesID'. If no such series is present, create a new series object if
@@ -772,10 +1163,11 @@ class DicomDataset(object):
         '''
         seriesID=str(seriesID)
 
-        s=first(s for s in self.series if s.seriesID==seriesID)
+        s=self.seriesmap.get(seriesID,None)
         if s is None and createNew:
             s=DicomSeries(self,seriesID)
             self.series.append(s)
+            self.seriesmap[seriesID]=s
 
         return s
 
@@ -824,6 +1216,7 @@ class DicomDataset(object):
         for sid in dsmap['series']:
             series=DicomSeries(self,sid,**dsmap[sid])
             self.series.append(series)
+            self.seriesmap[sid]=series
 
             # ensure the files referred to by the series still exist
             if any(not os.path.isfile(f) for f in series.enumFilePaths()):
@@ -846,6 +1239,202 @@ class DicomDataset(object):
         return 'Dataset %s #Images %i' %(self.rootdir,sum(len(s.filenames) for s in self.series))
     
 
+class DicomIndex(object):
+    '''
+    Persistent index of the files in a directory tree of Dicom files, stored as a SQLite database in the root directory.
+    This records the series and instance information of every Dicom file and the modification time and size of every
+    file, including non-Dicom ones so that these aren't read again, along with preview images for each series which are
+    discarded when the series' files change. The index is revalidated by comparing directory
+    modification times, so only directories which have had files added, removed, or renamed are listed again and only
+    the new or changed files in these are read. Files modified in place within an unchanged directory aren't detected.
+    If the database can't be created or written to (ie. read-only filesystem) an in-memory database is used instead.
+    '''
+
+    schema='''
+        CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime INTEGER);
+        CREATE TABLE IF NOT EXISTS series (seriesID TEXT PRIMARY KEY, seriesNum INTEGER, desc TEXT);
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY, dir TEXT, mtime INTEGER, size INTEGER,
+            seriesID TEXT, instanceUID TEXT, instanceNum INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS previews (
+            seriesID TEXT, kind TEXT, scale INTEGER, shape TEXT, data BLOB, PRIMARY KEY (seriesID,kind)
+        );
+        CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+        CREATE INDEX IF NOT EXISTS files_series ON files (seriesID);
+    '''
+
+    def __init__(self,rootdir,filename=None):
+        self.rootdir=os.path.abspath(rootdir)
+        self.filename=filename or os.path.join(self.rootdir,indexFilename)
+
+        try:
+            self.conn=self._connect(self.filename)
+        except sqlite3.OperationalError: # can't create or open the database file
+            self.conn=self._connect(':memory:')
+        except sqlite3.DatabaseError: # corrupt database file, replace it
+            try:
+                os.remove(self.filename)
+                self.conn=self._connect(self.filename)
+            except (OSError,sqlite3.Error):
+                self.conn=self._connect(':memory:')
+
+    def _connect(self,filename):
+        conn=sqlite3.connect(filename)
+        try:
+            # keep the journal in memory so that writing the index doesn't change the root directory's modification time
+            conn.execute('PRAGMA journal_mode=MEMORY')
+            conn.executescript(self.schema)
+            conn.commit()
+            return conn
+        except:
+            conn.close()
+            raise
+
+    def close(self):
+        self.conn.close()
+
+    def isIndexFile(self,relpath):
+        '''Returns True if `relpath' is the database file or a temporary file associated with it.'''
+        return os.path.join(self.rootdir,relpath).startswith(self.filename)
+
+    def scanDirectory(self):
+        '''
+        Compares the directory tree against the index and returns (changed,removed,dirs) where `changed' lists the
+        (relative path, mtime, size) triples of files which are new or have changed, `removed' lists the relative paths
+        of files no longer present, and `dirs' maps every relative directory path to its current modification time.
+        '''
+        storeddirs=dict(self.conn.execute('SELECT path,mtime FROM dirs'))
+        subdirs={}
+        changed=[]
+        removed=[]
+        dirs={}
+        stack=['']
+
+        for d in storeddirs:
+            if d:
+                subdirs.setdefault(os.path.dirname(d),[]).append(d)
+
+        while stack:
+            reldir=stack.pop()
+
+            try:
+                mtime=os.stat(os.path.join(self.rootdir,reldir)).st_mtime_ns
+            except OSError: # directory removed during the scan
+                continue
+
+            dirs[reldir]=mtime
+
+            # the directory's contents haven't changed so its subdirectories are those stored in the index
+            if storeddirs.get(reldir,None)==mtime:
+                stack+=subdirs.get(reldir,[])
+                continue
+
+            stored={p:(m,sz) for p,m,sz in self.conn.execute('SELECT path,mtime,size FROM files WHERE dir=?',(reldir,))}
+
+            for entry in os.scandir(os.path.join(self.rootdir,reldir)):
+                relpath=os.path.join(reldir,entry.name)
+
+                if entry.is_dir():
+                    stack.append(relpath)
+                elif entry.is_file() and not self.isIndexFile(relpath):
+                    st=entry.stat()
+                    if stored.pop(relpath,None)!=(st.st_mtime_ns,st.st_size):
+                        changed.append((relpath,st.st_mtime_ns,st.st_size))
+
+            removed+=list(stored)
+
+        return changed,removed,dirs
+
+    def update(self,changed,entries,removed,dirs):
+        '''
+        Update the index with the results of scanDirectory() and the list `entries' of tuples produced by calling
+        readDicomIndexEntries() with the files in `changed'.
+        '''
+        stats={f:(m,sz) for f,m,sz in changed}
+        files=[]
+
+        for f,sid,snum,desc,iuid,inum in entries:
+            files.append((f,os.path.dirname(f))+stats[f]+(sid,iuid,inum))
+
+        try:
+            self._updateTables(files,entries,removed,dirs)
+        except sqlite3.OperationalError: # can't write to the database file, copy it to memory and update that instead
+            conn=sqlite3.connect(':memory:')
+            conn.executescript('\n'.join(self.conn.iterdump()))
+            self.conn.close()
+            self.conn=conn
+            self._updateTables(files,entries,removed,dirs)
+
+    def _updateTables(self,files,entries,removed,dirs):
+        with self.conn:
+            # discard the previews of series which had files changed, added, or removed
+            stale='DELETE FROM previews WHERE seriesID IN (SELECT seriesID FROM files WHERE %s)'
+            self.conn.executemany(stale%'path=?',((f[0],) for f in files))
+            self.conn.executemany(stale%'path=?',((f,) for f in removed))
+            self.conn.executemany('DELETE FROM previews WHERE seriesID=?',((f[4],) for f in files))
+
+            self.conn.execute('DELETE FROM dirs')
+            self.conn.executemany('INSERT INTO dirs VALUES (?,?)',dirs.items())
+            self.conn.execute(stale%'dir NOT IN (SELECT path FROM dirs)')
+            self.conn.executemany('DELETE FROM files WHERE path=?',((f,) for f in removed))
+            self.conn.execute('DELETE FROM files WHERE dir NOT IN (SELECT path FROM dirs)')
+            self.conn.executemany('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?)',files)
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO series VALUES (?,?,?)',
+                (e[1:4] for e in entries if e[1] is not None)
+            )
+            self.conn.execute('DELETE FROM series WHERE seriesID NOT IN (SELECT seriesID FROM files WHERE seriesID IS NOT NULL)')
+
+    def getPreview(self,seriesID,kind):
+        '''
+        Returns the (array,scale) pair stored by storePreview() for series `seriesID' under the name `kind', or None if
+        there is no such stored preview.
+        '''
+        query='SELECT scale,shape,data FROM previews WHERE seriesID=? AND kind=?'
+        row=self.conn.execute(query,(str(seriesID),kind)).fetchone()
+
+        if row is None:
+            return None
+
+        scale,shape,data=row
+        shape=tuple(int(i) for i in shape.split(','))
+
+        return np.frombuffer(zlib.decompress(data),np.float32).reshape(shape),scale
+
+    def getPreviewSeries(self,kind):
+        '''Returns the set of series IDs which have a preview stored under the name `kind'.'''
+        return set(r[0] for r in self.conn.execute('SELECT seriesID FROM previews WHERE kind=?',(kind,)))
+
+    def storePreview(self,seriesID,kind,arr,scale):
+        '''Store the array `arr' as float32 values with its downsampling `scale' for series `seriesID' as `kind'.'''
+        arr=np.ascontiguousarray(arr,np.float32)
+        values=(str(seriesID),kind,scale,','.join(map(str,arr.shape)),sqlite3.Binary(zlib.compress(arr.tobytes())))
+
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO previews VALUES (?,?,?,?,?)',values)
+
+    def getSeriesFiles(self,seriesID):
+        '''Returns the (relative path, instance UID, instance number) tuples for the files of series `seriesID'.'''
+        query='SELECT path,instanceUID,instanceNum FROM files WHERE seriesID=? ORDER BY path'
+        return list(self.conn.execute(query,(str(seriesID),)))
+
+    def getDataset(self):
+        '''Returns a DicomDataset object containing the series and files stored in the index.'''
+        ds=DicomDataset(self.rootdir)
+
+        for sid,snum,desc in self.conn.execute('SELECT seriesID,seriesNum,desc FROM series ORDER BY rowid'):
+            series=ds.getSeries(sid,True)
+            series.seriesNum=snum
+            series.desc=desc
+
+        query='SELECT seriesID,path FROM files WHERE seriesID IS NOT NULL ORDER BY path'
+        for sid,path in self.conn.execute(query):
+            ds.seriesmap[sid].filenames.append(path) # paths are unique so addFile()'s membership check isn't needed
+
+        return ds
+
+
 class DicomPlugin(ImageScenePlugin):
     def __init__(self):
         ImageScenePlugin.__init__(self,'Dicom')
@@ -880,8 +1469,13 @@ class DicomPlugin(ImageScenePlugin):
             for s in dds.series:
                 yield s
 
-    def loadSeriesImages(self,series,selection,loadSequential=False,crop=None):
-        '''Load the actual image data from the files in `series' and store them as SharedImage objects in series.simgs.'''
+    def loadSeriesImages(self,series,selection,loadSequential=False,crop=None,batchCallback=None):
+        '''
+        Load the actual image data from the files in `series' and store them as SharedImage objects in series.simgs.
+        Files are decoded by loadSharedImages() split across processes, each reading ahead in a prefetching thread and
+        decoding into shared image matrices. If `batchCallback' is given the files are loaded in batches in series
+        order and it's called with the list of new images after each batch, this is meant for reporting progress only.
+        '''
         f=Future()
         assert selection==None or all(s<len(series.filenames) for s in selection)
 
@@ -902,23 +1496,33 @@ class DicomPlugin(ImageScenePlugin):
                     filenames=[series.filenames[i] for i in selection] if selection else series.filenames
                     # remove already-loaded images
                     filenames=[i for i in filenames if series.getSharedImage(i)==None]
+                    batchsize=max(len(filenames)//4,proccount*10) if batchCallback else len(filenames)
+                    batchsize=max(1,batchsize) # every image may already be loaded
 
-                    if len(filenames)>0:
-                        simgs=loadSharedImages(len(filenames),proccount,task,rootdir,filenames,crop,partitionArgs=(filenames,))
+                    for start in range(0,len(filenames),batchsize):
+                        batch=filenames[start:start+batchsize]
+                        simgs=loadSharedImages(len(batch),proccount,task,rootdir,batch,crop,start,partitionArgs=(batch,))
                         eidolon.checkResultMap(simgs)
-                        series.addSharedImages(eidolon.sumResultMap(simgs)) # add new images, there isn't necessarily any order to this list
+                        simgs=eidolon.sumResultMap(simgs)
+                        series.addSharedImages(simgs) # add new images, there isn't necessarily any order to this list
+
+                        if batchCallback:
+                            batchCallback(simgs)
 
                 f.setObject(series.simgs)
 
         return self.mgr.runTasks([loadSITask()],f,loadSequential)
 
-    def loadSeries(self,series,name=None,selection=None,loadSequential=False,isTimeDependent=None,crop=None):
-        '''Loads the Dicom files for the given series object or series ID string `series' into a SceneObject subtype.'''
+    def loadSeries(self,series,name=None,selection=None,loadSequential=False,isTimeDependent=None,crop=None,batchCallback=None):
+        '''
+        Loads the Dicom files for the given series object or series ID string `series' into a SceneObject subtype. If
+        `batchCallback' is given it's passed to loadSeriesImages() to report progress as each batch of images loads,
+        the scene object itself is only created once every image is loaded.
+        '''
 
         # look for the series of `series' is a string 
         if isinstance(series,str):
-            allseries=eidolon.listSum(dds.series for dds in self.dirobjs.values())
-            series1=first(s for s in allseries if s.seriesID==series)
+            series1=first(dds.getSeries(series) for dds in self.dirobjs.values() if dds.getSeries(series))
             assert series1!=None,'Cannot find series %r'%series
             series=series1
 
@@ -931,7 +1535,7 @@ class DicomPlugin(ImageScenePlugin):
         name=eidolon.uniqueStr(name or series.desc,[o.getName() for o in self.mgr.enumSceneObjects()]+self.loadedNames)
         self.loadedNames.append(name)
 
-        ff=self.loadSeriesImages(series,selection,loadSequential,crop)
+        ff=self.loadSeriesImages(series,selection,loadSequential,crop,batchCallback)
         self.mgr.checkFutureResult(ff)
 
         @taskroutine('Creating Scene Object')
@@ -965,49 +1569,130 @@ class DicomPlugin(ImageScenePlugin):
     @timing
     def loadDigestFile(self,dirpath,task):
         '''
-        Loads the directory digest ini file in 'dirpath' if it exists, or creates it otherwise. Returns the loaded
-        or created DicomDataset object.
+        Loads the directory index database in `dirpath' if it exists or creates it otherwise, updates it with the files
+        which have changed since it was last stored, and returns a DicomDataset object created from it.
         '''
         dirpath=os.path.abspath(dirpath)
-        dirfiles=list(eidolon.enumAllFiles(dirpath))
-        picklefile=os.path.join(dirpath,'dicomdataset.pickle')
-        digestfile=os.path.join(dirpath,digestFilename)
-        useDigestFile=False
-
-        # delete legacy pickle file
-        if os.path.isfile(picklefile):
-            os.remove(picklefile)
-
-        # if the digest file exists and is later than all the files in the directory, set useDigestFile to True
-        if os.path.isfile(digestfile):
-            digeststat=os.stat(digestfile)
-            useDigestFile=all(os.stat(f).st_mtime<=digeststat.st_mtime for f in dirfiles)
-
-        # if the digest file is present and later than the other files, try to load it
-        if useDigestFile:
+
+        # delete legacy pickle and digest files
+        for legacy in ('dicomdataset.pickle',digestFilename):
             try:
-                ds=DicomDataset(dirpath)
-                ds.loadDataset(digestfile)
-            except:
-                useDigestFile=False # digest file was bogus somehow, load the hard way
+                os.remove(os.path.join(dirpath,legacy))
+            except OSError:
+                pass
+
+        index=DicomIndex(dirpath)
+
+        try:
+            changed,removed,dirs=index.scanDirectory()
+            entries=[]
+
+            if changed:
+                filenames=[c[0] for c in changed]
+                proccount=eidolon.chooseProcCount(len(filenames),0,500)
+                result=readDicomIndexEntries(len(filenames),proccount,task,dirpath,filenames,partitionArgs=(filenames,))
+                eidolon.checkResultMap(result)
+                entries=eidolon.sumResultMap(result)
+
+            index.update(changed,entries,removed,dirs)
+            dds=index.getDataset()
+
+            # create the thumbnails of new or changed series from one file each while indexing, preview volumes need
+            # every file's pixel data so are left to getSeriesPreview() when a series is first viewed
+            stored=index.getPreviewSeries('thumbnail')
+            missing=[s for s in dds.series if s.seriesID not in stored and s.filenames]
+
+            if missing:
+                filenames=[s.filenames[len(s.filenames)//2] for s in missing]
+                proccount=eidolon.chooseProcCount(len(filenames),0,10)
+                result=readSeriesPreviewImages(len(filenames),proccount,task,dirpath,filenames,thumbnailSize,partitionArgs=(filenames,))
+                eidolon.checkResultMap(result)
+
+                for series,(thumb,scale) in zip(missing,eidolon.sumResultMap(result)):
+                    self._storeThumbnail(index,series,thumb,scale)
+
+            return dds
+        finally:
+            index.close()
+
+    def _storeThumbnail(self,index,series,thumb,scale):
+        '''
+        Store the thumbnail `thumb' of `series' in `index', or an empty array if it's None so that unreadable series
+        aren't read again. Failed writes are ignored since the thumbnail is only a convenience.
+        '''
+        try:
+            index.storePreview(series.seriesID,'thumbnail',thumb if thumb is not None else np.zeros((0,0)),scale)
+        except sqlite3.Error:
+            pass
+
+    def getSeriesThumbnail(self,series):
+        '''
+        Returns the thumbnail of the middle image of `series' as a float32 array at most `thumbnailSize' in each 
+        dimension. This is normally created by loadDigestFile() when the series is indexed and read from the directory
+        index, otherwise it's created and stored. Returns None if no image could be read.
+        '''
+        index=DicomIndex(series.parent.rootdir)
 
-        # if the digest file wasn't present or failed to load, create the dataset object by scanning the directory then try to save the digest
-        if not useDigestFile:
-            ds=DicomDataset(dirpath)
+        try:
+            stored=index.getPreview(series.seriesID,'thumbnail')
+
+            if stored is None:
+                thumb,scale=None,1
+                if series.filenames:
+                    try:
+                        filename=series.filenames[len(series.filenames)//2]
+                        thumb,scale=readDicomPreviewImage(os.path.join(series.parent.rootdir,filename),thumbnailSize)
+                    except Exception: # ignore unreadable files
+                        pass
+
+                self._storeThumbnail(index,series,thumb,scale)
+                stored=thumb,scale
+
+            thumb=stored[0]
+            return thumb if thumb is not None and thumb.size>0 else None
+        finally:
+            index.close()
+
+    def getSeriesPreview(self,series,create=True,task=None):
+        '''
+        Returns the low resolution preview volume of `series' as a (volume,scale) pair, where `volume' is a float32 array
+        of dimensions (images,rows,columns) with one image for each file in series.filenames downsampled by the integer
+        `scale'. The volume is read from the directory index, or if not present and `create' is True it's created from
+        the series files and stored, otherwise None is returned. Images for unreadable files are left as zeros.
+        '''
+        index=DicomIndex(series.parent.rootdir)
+
+        try:
+            stored=index.getPreview(series.seriesID,'preview')
+            if stored is not None and stored[0].shape[0]==len(series.filenames):
+                return stored
+
+            if not create or not series.filenames:
+                return None
 
-            proccount=eidolon.chooseProcCount(len(dirfiles),0,500)
-            ddsmap=createDicomDatasets(len(dirfiles),proccount,task,dirpath,dirfiles,partitionArgs=(dirfiles,))
+            filenames=series.filenames
+            proccount=eidolon.chooseProcCount(len(filenames),0,10)
+            result=readSeriesPreviewImages(len(filenames),proccount,task,series.parent.rootdir,filenames,previewSize,partitionArgs=(filenames,))
+            eidolon.checkResultMap(result)
+            images=eidolon.sumResultMap(result)
 
-            for dds in ddsmap.values():
-                ds.addDataset(dds)
+            img,scale=first((i,s) for i,s in images if i is not None) or (None,1)
+            if img is None:
+                return None
+
+            volume=np.zeros((len(images),)+img.shape,np.float32)
+            for i,(im,_) in enumerate(images):
+                if im is not None and im.shape==img.shape:
+                    volume[i]=im
 
-            # try to store the digest file but if it fails (ie. read-only filesystem) just continue since it's only an optimization
             try:
-                ds.storeDataset(digestfile)
-            except:
+                index.storePreview(series.seriesID,'preview',volume,scale)
+            except sqlite3.Error: # can't write the index, the preview is still usable this time
                 pass
 
-        return ds
+            return volume,scale
+        finally:
+            index.close()
 
     def loadDirDataset(self,dirpath,loadSequential=False):
         '''Loads the dataset directory as an asset and create the DicomDataset object keyed to `dirpath' in self.dirobjs.'''
@@ -1366,26 +2051,162 @@ class TestDicomPlugin(unittest.TestCase):
         self.assertIsNotNone(dcm)
     
     def testLoadDigest(self):
-        '''Test loading a digest file.'''
-        digestfile=os.path.join(self.dcmdir,digestFilename)
+        '''Test loading a directory index file.'''
+        indexfile=os.path.join(self.dcmdir,indexFilename)
         
         ds=self.plugin.loadDigestFile(self.dcmdir,None)
         
         self.assertIsNotNone(ds)
-        self.assertTrue(os.path.isfile(digestfile))
-        os.remove(digestfile)
+        self.assertTrue(os.path.isfile(indexfile))
+        os.remove(indexfile)
+        
+    def testIndexUpdate(self):
+        '''Test the directory index is updated when files are added and removed.'''
+        dcmdir=os.path.join(self.tempdir,'dcm')
+        shutil.copytree(self.dcmdir,dcmdir)
+        
+        ds=self.plugin.loadDigestFile(dcmdir,None)
+        numfiles=sum(len(s.filenames) for s in ds.series)
+        series=ds.series[0]
+        
+        os.remove(os.path.join(dcmdir,series.filenames[0]))
+        os.mkdir(os.path.join(dcmdir,'sub'))
+        shutil.copy(os.path.join(self.dcmdir,series.filenames[1]),os.path.join(dcmdir,'sub'))
+        
+        ds1=self.plugin.loadDigestFile(dcmdir,None)
+        
+        self.assertEqual(numfiles,sum(len(s.filenames) for s in ds1.series))
+        self.assertIn(os.path.join('sub',series.filenames[1]),ds1.getSeries(series.seriesID).filenames)
+        self.assertNotIn(series.filenames[0],ds1.getSeries(series.seriesID).filenames)
     
+    def testIndexPreviews(self):
+        '''Test thumbnails are stored when indexing, preview volumes when requested, and both are discarded on changes.'''
+        dcmdir=os.path.join(self.tempdir,'dcm')
+        shutil.copytree(self.dcmdir,dcmdir)
+        
+        ds=self.plugin.loadDigestFile(dcmdir,None)
+        series=ds.series[0]
+        index=DicomIndex(dcmdir)
+        
+        try:
+            self.assertEqual(set(s.seriesID for s in ds.series),index.getPreviewSeries('thumbnail'))
+            self.assertIsNone(index.getPreview(series.seriesID,'preview'))
+            
+            thumb,scale=index.getPreview(series.seriesID,'thumbnail')
+            middle=os.path.join(dcmdir,series.filenames[len(series.filenames)//2])
+            self.assertLessEqual(max(thumb.shape),thumbnailSize)
+            self.assertTrue(np.allclose(readDicomPreviewImage(middle,thumbnailSize)[0],thumb))
+            self.assertTrue(np.allclose(thumb,self.plugin.getSeriesThumbnail(series)))
+            
+            volume,scale=self.plugin.getSeriesPreview(series)
+            self.assertEqual(len(series.filenames),volume.shape[0])
+            self.assertLessEqual(max(volume.shape[1:]),previewSize)
+            
+            storedvol,storedscale=index.getPreview(series.seriesID,'preview')
+            self.assertEqual(scale,storedscale)
+            self.assertTrue(np.array_equal(volume,storedvol))
+        finally:
+            index.close()
+            
+        os.remove(os.path.join(dcmdir,series.filenames[0]))
+        self.plugin.loadDigestFile(dcmdir,None)
+        index=DicomIndex(dcmdir)
+        
+        try:
+            self.assertIsNone(index.getPreview(series.seriesID,'preview'))
+            self.assertIsNotNone(index.getPreview(series.seriesID,'thumbnail')) # recreated when reindexing
+        finally:
+            index.close()
+        
+    def testLoadSeriesTwice(self):
+        '''Test loading a series twice, the second time every image is already loaded and no batches are loaded.'''
+        dcmdir=os.path.join(self.tempdir,'dcm')
+        shutil.copytree(self.dcmdir,dcmdir)
+        
+        series=self.plugin.loadDigestFile(dcmdir,None).series[0]
+        batches=[]
+        
+        obj1=Future.get(self.plugin.loadSeries(series,batchCallback=batches.append),None)
+        
+        self.assertGreater(len(batches),0)
+        self.assertEqual(len(series.filenames),sum(map(len,batches)))
+        self.assertTrue(all(series.getSharedImage(f) is not None for f in series.filenames))
+        
+        del batches[:]
+        obj2=Future.get(self.plugin.loadSeries(series,batchCallback=batches.append),None)
+        
+        self.assertEqual([],batches)
+        self.assertEqual(len(series.filenames),len(obj1.images))
+        self.assertEqual(len(obj1.images),len(obj2.images))
+        
+    def createCompressedDataset(self,arr,tsuid,frame,bitsStored=None):
+        '''Returns a Dataset storing the compressed `frame' of image `arr' as encapsulated data with syntax `tsuid'.'''
+        ds=Dataset()
+        ds.file_meta=Dataset()
+        ds.file_meta.TransferSyntaxUID=tsuid
+        ds.Rows=arr.shape[0]
+        ds.Columns=arr.shape[1]
+        ds.SamplesPerPixel=arr.shape[2] if arr.ndim==3 else 1
+        ds.BitsAllocated=arr.dtype.itemsize*8
+        ds.BitsStored=bitsStored or ds.BitsAllocated
+        ds.PixelRepresentation=1 if arr.dtype.kind=='i' else 0
+        
+        item=lambda data:struct.pack('<HHI',0xFFFE,0xE000,len(data))+data
+        ds.add_new(0x7fe00010,'OB',item(b'')+item(frame+b'\0'*(len(frame)%2)))
+        
+        return ds
+        
+    def testRLEDecode(self):
+        '''Test that RLE frames decode to their source images for 8 and 16 bit, signed, and multi-sample images.'''
+        rand=np.random.RandomState(42)
+        images=[
+            rand.randint(0,256,(17,23)).astype(np.uint8),
+            rand.randint(0,65536,(17,23)).astype(np.uint16),
+            rand.randint(-32768,32768,(17,23)).astype(np.int16),
+            rand.randint(0,256,(17,23,3)).astype(np.uint8),
+        ]
+        images[1][3:9]=1234 # replicate runs as well as literals
+        
+        for arr in images:
+            samples=arr.shape[2] if arr.ndim==3 else 1
+            frame=encodeRLEFrame(arr)
+            decoded=decodeRLEFrame(frame,arr.shape[0],arr.shape[1],samples,arr.dtype.itemsize*8)
+            
+            self.assertEqual(arr.shape,decoded.shape)
+            self.assertTrue(np.array_equal(arr.view(decoded.dtype),decoded))
+            self.assertTrue(np.array_equal(arr,readPixelArray(self.createCompressedDataset(arr,'1.2.840.10008.1.2.5',frame))))
+            
+    def testRLEDecodeSignExtend(self):
+        '''Test that signed RLE images with fewer bits stored than allocated are sign extended.'''
+        arr=np.random.RandomState(42).randint(-2048,2048,(17,23)).astype(np.int16)
+        frame=encodeRLEFrame(arr&0xfff) # only the stored 12 bits are kept
+        ds=self.createCompressedDataset(arr,'1.2.840.10008.1.2.5',frame,12)
+        
+        self.assertTrue(np.array_equal(arr,readPixelArray(ds)))
+        
+    def testJPEGLSDecode(self):
+        '''Test that JPEG-LS lossless frames decode to their source images.'''
+        if imagecodecs is None or not hasattr(imagecodecs,'jpegls_encode'):
+            self.skipTest('imagecodecs with JPEG-LS support is not installed')
+            
+        rand=np.random.RandomState(42)
+        for arr in (rand.randint(0,256,(17,23)).astype(np.uint8),rand.randint(0,4096,(17,23)).astype(np.uint16)):
+            frame=bytes(imagecodecs.jpegls_encode(arr))
+            ds=self.createCompressedDataset(arr,'1.2.840.10008.1.2.4.80',frame)
+            
+            self.assertTrue(np.array_equal(arr,readPixelArray(ds)))
+        
     def testLoadDir(self):
         '''Test loading a directory containing Dicom files.'''
-        digestfile=os.path.join(self.dcmdir,digestFilename)
+        indexfile=os.path.join(self.dcmdir,indexFilename)
         
         f=self.plugin.loadDirDataset(self.dcmdir)
         result=Future.get(f)
         
         self.assertIsNotNone(result)
         assert self.dcmdir in self.plugin.dirobjs, '%r not in %r'%(self.dcmdir,self.plugin.dirobjs)
-        self.assertTrue(os.path.isfile(digestfile))
-        os.remove(digestfile)
+        self.assertTrue(os.path.isfile(indexfile))
+        os.remove(indexfile)
         
     def testSaveLoadPlane(self):
         self.plugin.saveObject(self.plane,self.tempdir)
@@ -18,6 +18,11 @@
 
 
 import os,glob
+import unittest
+import tempfile
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 from eidolon import (
     ImageScenePlugin, ImageSceneObject, vec3, rotator,
     sortFilenameList, uniqueStr, splitPathExt, fillList, listSum, taskroutine, taskmethod, loadImageStack
@@ -27,8 +32,9 @@ import eidolon
 from ui import QtWidgets, Ui_OpenImgStackDialog
 
 try:
-    from imageio import imwrite
+    from imageio import imwrite, imread
 except ImportError:
+    imread=None # images are decoded by the renderer one at a time
     try:
         from scipy.misc import imsave as imwrite
     except ImportError:
@@ -36,6 +42,37 @@ except ImportError:
         warnings.warn('imageio not found, ImageStackPlugin will be unable to save')
     
 
+class ArrayImage(object):
+    '''Wraps a decoded image array with the getWidth(), getHeight(), and fillRealMatrix() methods of renderer images.'''
+    def __init__(self,arr):
+        self.arr=arr
+
+    def getWidth(self):
+        return self.arr.shape[1]
+
+    def getHeight(self):
+        return self.arr.shape[0]
+
+    def fillRealMatrix(self,mat):
+        np.asarray(mat)[:,:]=self.arr
+
+
+def decodeImageFile(filename):
+    '''
+    Decode the image file `filename' with imageio and return an ArrayImage with the values the renderer's loader gives:
+    greyscale images keep their stored values while colour images are the mean of the RGB channels scaled to [0,1].
+    Unlike the renderer's loader this is thread-safe and the GIL is released while decoding.
+    '''
+    arr=np.asarray(imread(filename))
+
+    if arr.ndim==3: # colour or greyscale with alpha, channels are normalized like renderer colour values
+        scale=float(np.iinfo(arr.dtype).max) if arr.dtype.kind in 'ui' else 1.0
+        arr=(arr[...,:3].mean(axis=2) if arr.shape[2]>=3 else arr[...,0])/scale
+
+    return ArrayImage(arr)
+
+
+
 class ChooseImgStackDialog(QtWidgets.QDialog,Ui_OpenImgStackDialog):
     def __init__(self, plugin,parent=None):
         QtWidgets.QDialog.__init__(self,parent)
@@ -90,36 +127,59 @@ class ImageStackPlugin(ImageScenePlugin):
     
     @taskmethod('Saving Image Files')
     def saveObject(self,obj,path,overwrite=False,setFilenames=False,task=None,**kwargs):
+        '''
+        Save each image of `obj' to a separate file in directory `path' named from the object, slice index, and timestep.
+        The keyword argument `format' chooses the file format (default "png"), and images are rescaled and encoded in
+        parallel by `numThreads' threads (default CPU count). No files are written if any would be overwritten and
+        `overwrite' is False.
+        '''
         name=eidolon.getValidFilename(obj.getName())
         formatname=kwargs.get('format','png')
+        numthreads=kwargs.get('numThreads',None) or eidolon.cpu_count()
         
         with eidolon.processImageNp(obj) as o:
             depth,time=o.shape[2:]
+            indices=list(eidolon.trange(time,depth))
+            filenames=[os.path.join(path,'%s_%.4i_%.4i.%s'%(name,d,t,formatname)) for t,d in indices]
+            
+            if not overwrite:
+                existing=list(filter(os.path.exists,filenames))
+                if existing:
+                    raise IOError('File already exists: %r'%existing[0])
+            
+            def _writeImage(t,d,filename):
+                imwrite(filename,eidolon.rescaleArray(o[:,:,d,t].T,0,255),formatname)
             
             if task:
                 task.setMaxProgress(depth*time)
                 
-            for t,d in eidolon.trange(time,depth):
-                im=eidolon.rescaleArray(o[:,:,d,t].T,0,255)
-                
-                filename=os.path.join(path,'%s_%.4i_%.4i.%s'%(name,d,t,formatname))
+            with ThreadPoolExecutor(numthreads) as pool:
+                writes=[pool.submit(_writeImage,t,d,f) for (t,d),f in zip(indices,filenames)]
                 
-                if not overwrite and os.path.exists(filename):
-                    raise IOError('File already exists: %r'%filename)
+                for count,write in enumerate(as_completed(writes)):
+                    write.result()
                     
-                imwrite(filename,im,formatname)
-                
-                if task:
-                    task.setProgress(d+t*depth)
+                    if task:
+                        task.setProgress(count+1)
 
-    def loadImageStackObject(self,name,filenames,pos=vec3(),rot=rotator(),spacing=(1.0,1.0),imgsep=1.0,sortIndex=None,regex=None,reverse=False,task=None):
+    def loadImageStackObject(self,name,filenames,pos=vec3(),rot=rotator(),spacing=(1.0,1.0),imgsep=1.0,sortIndex=None,regex=None,reverse=False,numThreads=None,task=None):
         '''
         Loads a stack of images (or a sequence of stacks), ordered bottom up, into a ImageSceneObject. If
         `sortIndex' is not None, this is the sorting index in the file names used to sort the stack. The start
         position `pos' is intepreted as the top left position of the bottom-most image. If `filenames' is a list
         of filenames only, the series is not timed, however if it's a list of lists of filenames then each sublist
-        is (optionally) sorted and then loaded into a time series object.
+        is (optionally) sorted and then loaded into a time series object. If imageio is present images are decoded
+        in parallel by `numThreads' threads (default CPU count), all timesteps sharing the one pool, otherwise they're
+        decoded one at a time by the renderer. Without imageio stacks cannot be loaded headless since there's no renderer.
         '''
+        if imread is not None:
+            loadfunc=decodeImageFile
+            numThreads=numThreads or eidolon.cpu_count()
+        elif self.mgr.scene is None:
+            raise IOError('Cannot load image stack without imageio or a renderer')
+        else:
+            loadfunc=self.mgr.scene.loadImageFile
+            numThreads=1 # the renderer's loader holds the GIL and isn't known to be thread-safe
 
         isTimed=eidolon.isIterable(filenames[0]) and not isinstance(filenames[0],str)
 
@@ -132,15 +192,15 @@ class ImageStackPlugin(ImageScenePlugin):
                     f.reverse()
 
             positions=[pos+(rot*vec3(0,0,imgsep*i)) for i in range(len(filenames[0]))]
+            timesteps={f:i for i,fn in enumerate(filenames) for f in fn}
 
-            imagesteps=[loadImageStack(fn,self.mgr.scene.loadImageFile,positions,rot,spacing,task) for fn in filenames]
-
-            for i,imgs in enumerate(imagesteps):
-                for img in imgs:
-                    img.timestep=i
-
-            images=listSum(imagesteps)
+            # load every timestep's images with one pool, each image is then assigned the timestep of its file
             filenames=listSum(filenames)
+            positions=positions*(len(filenames)//len(positions))
+            images=loadImageStack(filenames,loadfunc,positions,rot,spacing,task,numThreads)
+
+            for img in images:
+                img.timestep=timesteps[img.filename]
         else:
             if sortIndex!=None:
                 filenames=sortFilenameList(filenames,sortIndex,regex)
@@ -150,7 +210,7 @@ class ImageStackPlugin(ImageScenePlugin):
 
             positions=[pos+(rot*vec3(0,0,imgsep*i)) for i in range(len(filenames))]
 
-            images=loadImageStack(filenames,self.mgr.scene.loadImageFile,positions,rot,spacing,task)
+            images=loadImageStack(filenames,loadfunc,positions,rot,spacing,task,numThreads)
 
         return self.createSceneObject(name,images,filenames,isTimed)
             
@@ -181,3 +241,63 @@ class ImageStackPlugin(ImageScenePlugin):
         
         
 eidolon.addPlugin(ImageStackPlugin())
+
+
+### Unit tests
+
+@unittest.skipIf(imread is None,'imageio not present')
+class TestImageStackPlugin(unittest.TestCase):
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        self.plugin=eidolon.getSceneMgr().getPlugin('ImgStack')
+        self.greyfiles=[]
+        self.colourfiles=[]
+
+        rand=np.random.RandomState(1234)
+        for i in range(6):
+            self.greyfiles.append(os.path.join(self.tempdir,'grey%.2i.png'%i))
+            imwrite(self.greyfiles[-1],rand.randint(0,256,(13,17)).astype(np.uint8))
+
+            self.colourfiles.append(os.path.join(self.tempdir,'colour%.2i.png'%i))
+            imwrite(self.colourfiles[-1],rand.randint(0,256,(13,17,3)).astype(np.uint8))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def loadSequential(self,filenames):
+        '''Load `filenames' one at a time with the renderer's decoder.'''
+        positions=[vec3(0,0,i) for i in range(len(filenames))]
+        return loadImageStack(filenames,self.plugin.mgr.scene.loadImageFile,positions,numthreads=1)
+
+    def checkImages(self,images1,images2):
+        self.assertEqual(len(images1),len(images2))
+
+        for img1,img2 in zip(images1,images2):
+            self.assertEqual(img1.filename,img2.filename)
+            self.assertEqual(img1.position,img2.position)
+            self.assertTrue(np.allclose(np.asarray(img1.img),np.asarray(img2.img)))
+            self.assertAlmostEqual(img1.imgmax,img2.imgmax)
+
+    def testDecodeMatchesRenderer(self):
+        '''Test images decoded with imageio have the same values as those decoded by the renderer.'''
+        for filename in self.greyfiles+self.colourfiles:
+            img=self.plugin.mgr.scene.loadImageFile(filename)
+            mat=eidolon.RealMatrix('mat',img.getHeight(),img.getWidth())
+            img.fillRealMatrix(mat)
+
+            self.assertTrue(np.allclose(np.asarray(mat),decodeImageFile(filename).arr,atol=1e-5),filename)
+
+    def testParallelMatchesSequential(self):
+        '''Test a stack decoded by multiple threads matches one decoded sequentially by the renderer.'''
+        for filenames in (self.greyfiles,self.colourfiles):
+            obj=self.plugin.loadImageStackObject('stack',list(filenames),numThreads=4)
+            self.checkImages(self.loadSequential(filenames),obj.images)
+
+    def testParallelTimed(self):
+        '''Test a timed stack decoded by multiple threads has the right images and timesteps.'''
+        filenames=[self.greyfiles[:3],self.greyfiles[3:]]
+        obj=self.plugin.loadImageStackObject('stack',[list(f) for f in filenames],numThreads=4)
+        images=self.loadSequential(self.greyfiles[:3])+self.loadSequential(self.greyfiles[3:])
+
+        self.checkImages(images,obj.images)
+        self.assertEqual([0,0,0,1,1,1],[img.timestep for img in obj.images])
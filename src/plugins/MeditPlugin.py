@@ -18,9 +18,219 @@
 
 
 import os
+import itertools
+import unittest
+import tempfile
+import shutil
+import numpy as np
 import eidolon
 from eidolon import MeshScenePlugin, MeshSceneObject, StdProps, taskmethod
 
+
+MeditSections=eidolon.enum(
+    ('vertices','',4,0,[]),
+    ('edges','Line1NL',5,2,[0,1]),
+    ('triangles','Tri1NL',6,3,[0,1,2]),
+    ('quadrilaterals','Quad1NL',7,4,[0,1,3,2]),
+    ('tetrahedra','Tet1NL',8,4,[0,1,2,3]),
+    ('hexahedra','Hex1NL',10,8,[0,1,3,2,4,5,7,6]),
+    doc='Medit sections as (element type, binary keyword code, number of indices, ordering of indices into Eidolon order)'
+)
+
+# binary keyword codes for sections which aren't read as data
+MeditDimensionCode=3
+MeditEndCode=54
+
+chunkLines=1<<18 # number of lines to parse or format at a time when reading or writing text files
+
+
+def readTextBlock(o,numlines,width=None):
+    '''
+    Read `numlines' lines of numbers from the text file object `o' and return them as a float array with one row per
+    line. The lines are parsed in chunks with one numeric conversion each. The array has `width' columns if given,
+    otherwise the width of the first line's number of values.
+    '''
+    result=None
+
+    for start in range(0,numlines,chunkLines):
+        count=min(chunkLines,numlines-start)
+        vals=np.fromstring(''.join(itertools.islice(o,count)),dtype=float,sep=' ')
+
+        if result is None:
+            width=width or vals.shape[0]//count
+            result=np.empty((numlines,width),float)
+
+        result[start:start+count]=vals.reshape((count,width))
+
+    return result if result is not None else np.zeros((0,width or 1))
+
+
+def readMeditText(filename):
+    '''
+    Read the text Medit mesh file `filename', returning the dimension, an array of vertex coordinates and references,
+    and a dictionary mapping section names from MeditSections to arrays of 1-based indices and references.
+    '''
+    dim=3
+    vertices=None
+    sections={}
+
+    with open(filename) as o:
+        line=o.readline()
+        while line:
+            tokens=line.split()
+            keyword=tokens[0].lower() if tokens else ''
+
+            if not keyword or keyword[0]=='#': # blank or comment line
+                pass
+            elif keyword=='end':
+                break
+            elif keyword in ('meshversionformatted','dimension'): # header values may be on the same or next line
+                value=int(tokens[1] if len(tokens)>1 else o.readline())
+                if keyword=='dimension':
+                    dim=value
+                    if not 1<=dim<=3:
+                        raise IOError('Bad dimension value %r'%dim)
+            else:
+                numlines=int(tokens[1] if len(tokens)>1 else o.readline())
+
+                if keyword=='vertices':
+                    vertices=readTextBlock(o,numlines,dim+1)
+                elif keyword in MeditSections:
+                    sections[keyword]=readTextBlock(o,numlines,MeditSections[keyword][2]+1)
+                else:
+                    for _ in itertools.islice(o,numlines): # skip unknown sections
+                        pass
+
+            line=o.readline()
+
+    return dim,vertices,sections
+
+
+def readMeditBinary(filename):
+    '''
+    Read the binary Medit mesh file `filename', returning the same values as readMeditText(). Each section is read
+    with one call to np.fromfile using a structured type for the section's record layout.
+    '''
+    dim=3
+    vertices=None
+    sections={}
+    codes={code:name for name,_,code,_,_ in MeditSections}
+
+    with open(filename,'rb') as o:
+        code,version=np.fromfile(o,'<i4',2)
+
+        if code==1:
+            endian='<'
+        elif code==1<<24:
+            endian='>'
+            version=version.byteswap()
+        else:
+            raise IOError('Bad endianness code in binary Medit file %r'%filename)
+
+        if not 1<=version<=4:
+            raise IOError('Unsupported binary Medit file version %r'%version)
+
+        realtype=np.dtype(endian+('f4' if version==1 else 'f8'))
+        inttype=np.dtype(endian+('i4' if version<4 else 'i8'))
+        postype=np.dtype(endian+('i4' if version<3 else 'i8'))
+
+        while True:
+            keyword=np.fromfile(o,endian+'i4',1)
+            if keyword.shape[0]==0 or keyword[0]==MeditEndCode:
+                break
+
+            keyword=int(keyword[0])
+            nextpos=int(np.fromfile(o,postype,1)[0])
+
+            if keyword==MeditDimensionCode:
+                dim=int(np.fromfile(o,endian+'i4',1)[0])
+            elif keyword in codes:
+                name=codes[keyword]
+                numlines=int(np.fromfile(o,inttype,1)[0])
+
+                if name=='vertices':
+                    rec=np.fromfile(o,np.dtype([('c',realtype,(dim,)),('r',inttype)]),numlines)
+                else:
+                    rec=np.fromfile(o,np.dtype([('c',inttype,(MeditSections[name][2],)),('r',inttype)]),numlines)
+
+                block=np.empty((numlines,rec['c'].shape[1]+1))
+                block[:,:-1]=rec['c']
+                block[:,-1]=rec['r']
+
+                if name=='vertices':
+                    vertices=block
+                else:
+                    sections[name]=block
+
+            if nextpos==0:
+                break
+
+            o.seek(nextpos)
+
+    return dim,vertices,sections
+
+
+def writeMeditMesh(filename,nodes,sections,noderefs=None,isBinary=None):
+    '''
+    Write the mesh defined by `nodes' (Nx3 array) and `sections' (dictionary mapping MeditSections names to pairs of
+    0-based Eidolon-ordered index arrays and reference arrays or None) to the Medit mesh file `filename'. The file is
+    binary if `isBinary' is True or is None and `filename' ends with .meshb, in which case it's written in version 3
+    (double precision reals, 32-bit integers, 64-bit positions). Reference values default to 0.
+    '''
+    if isBinary is None:
+        isBinary=eidolon.hasExtension(filename,'meshb')
+
+    numnodes=nodes.shape[0]
+    noderefs=np.zeros((numnodes,)) if noderefs is None else noderefs
+    blocks=[('vertices',np.asarray(nodes,float),noderefs)]
+
+    for name,_,_,_,_ in MeditSections:
+        if name!='vertices' and name in sections:
+            inds,refs=sections[name]
+            ordering=np.argsort(MeditSections[name][3]) # inverse of the Medit to Eidolon ordering
+            refs=np.zeros((inds.shape[0],)) if refs is None else refs
+            blocks.append((name,inds[:,ordering]+1,refs))
+
+    if not isBinary:
+        with open(filename,'w') as o:
+            o.write('MeshVersionFormatted 1\nDimension 3\n')
+
+            for name,block,refs in blocks:
+                width=block.shape[1]
+                fmt=('%.17g '*width if name=='vertices' else '%d '*width)+'%d\n'
+                o.write('\n%s\n%i\n'%(name.capitalize(),block.shape[0]))
+
+                for start in range(0,block.shape[0],chunkLines):
+                    chunk=np.column_stack((block[start:start+chunkLines],refs[start:start+chunkLines])).astype(float)
+                    o.write((fmt*chunk.shape[0])%tuple(chunk.ravel().tolist()))
+
+            o.write('\nEnd\n')
+    else:
+        with open(filename,'wb') as o:
+            o.write(np.asarray([1,3],'<i4').tobytes())
+            o.write(np.asarray([MeditDimensionCode],'<i4').tobytes())
+            o.write(np.asarray([o.tell()+12],'<i8').tobytes())
+            o.write(np.asarray([3],'<i4').tobytes())
+
+            for name,block,refs in blocks:
+                width=block.shape[1]
+                dtype=np.dtype([('c','<f8' if name=='vertices' else '<i4',(width,)),('r','<i4')])
+                nextpos=o.tell()+16+block.shape[0]*dtype.itemsize
+
+                o.write(np.asarray([MeditSections[name][1]],'<i4').tobytes())
+                o.write(np.asarray([nextpos],'<i8').tobytes())
+                o.write(np.asarray([block.shape[0]],'<i4').tobytes())
+
+                for start in range(0,block.shape[0],chunkLines):
+                    chunk=np.empty((min(chunkLines,block.shape[0]-start),),dtype)
+                    chunk['c']=block[start:start+chunk.shape[0]]
+                    chunk['r']=refs[start:start+chunk.shape[0]]
+                    o.write(chunk.tobytes())
+
+            o.write(np.asarray([MeditEndCode],'<i4').tobytes())
+            o.write(np.asarray([0],'<i8').tobytes())
+
+
 class MeditPlugin(MeshScenePlugin):
     def __init__(self):
         MeshScenePlugin.__init__(self,'Medit')
@@ -32,6 +242,7 @@ class MeditPlugin(MeshScenePlugin):
         if win:
             win.addMenuItem('Import','MeditLoad'+str(plugid),'&Medit .mesh File',self._openFileDialog)
             win.addMenuItem('Import','MeditSol'+str(plugid),'&Medit .bb File',self._openSolutionDialog)
+            win.addMenuItem('Export','MeditSave'+str(plugid),'&Medit .mesh File',self._saveFileDialog)
             
         meditload=mgr.conf.get('args','--medit').split(',')
         
@@ -46,7 +257,7 @@ class MeditPlugin(MeshScenePlugin):
         return '\nUsage: --medit=mesh-file-path[,solution-file-path]'
     
     def acceptFile(self,filename):
-        return eidolon.hasExtension(filename,'mesh',)
+        return eidolon.hasExtension(filename,'mesh','meshb')
 
     def getObjFiles(self,obj):
         filenames=[obj.kwargs['filename']]
@@ -62,81 +273,47 @@ class MeditPlugin(MeshScenePlugin):
         eidolon.copyfileSafe(obj.kwargs['filename'],filename,overwrite)
         obj.kwargs['filename']=filename
 
-    def _openFileDialog(self):
-        filename=self.mgr.win.chooseFileDialog('Choose Medit filename',filterstr='Medit Mesh File (*.mesh)')
-        if filename!='':
-            self.mgr.addFuncTask(lambda:self.mgr.addSceneObject(self.loadObject(filename)),'Importing Medit file')
-            
-    def _openSolutionDialog(self):
-        obj=self.win.getSelectedObject()
-        
-        if not obj or not isinstance(obj,MeshSceneObject):
-            self.mgr.showMsg('A mesh object must be selected before data fields can be loaded for it.','No scene object')
-        else:
-            filename=self.mgr.win.chooseFileDialog('Choose Medit filename',filterstr='Medit Solution File (*.bb)')
-            if filename!='':
-                self.loadSolution(filename,obj)
-            
     @taskmethod('Loading Medit File')
     def loadObject(self,filename,name=None,task=None,**kwargs):
-        widths={'triangles':3,'quadrilaterals':4,'tetrahedra':4,'hexahedra':8,'edges':2}
-        types={'triangles':'Tri1NL','quadrilaterals':'Quad1NL','tetrahedra':'Tet1NL', 'hexahedra':'Hex1NL','edges':'Line1NL'}
-        orderings={'triangles':[0,1,2],'quadrilaterals':[0,1,3,2],'tetrahedra':[0,1,2,3], 'hexahedra':[0,1,3,2,4,5,7,6],'edges':[0,1]}
-        
         name=self.mgr.getUniqueObjName(name or eidolon.splitPathExt(filename)[1])
-        nodes=None
         indices=[]
         fields=[]
-        
-        with open(filename) as o:
-            header=[o.readline().strip(),o.readline().strip()]
-            assert header[0]=='MeshVersionFormatted 1'
-            assert header[1].split()[0]=='Dimension'
-            
-            if header[1]=='Dimension':
-                header+=[o.readline().strip()]
-                
-                assert header[1]=='Dimension'
-                assert 1<=int(header[2])<=3
-            else:
-                assert 1<=int(header[1].split()[1])<=3
-                
-            section=o.readline().strip().lower()
-            while section and section!='end':
-                numlines=int(o.readline())
-                if section=='vertices': # special case for vertices
-                    nodes=eidolon.Vec3Matrix('nodes',numlines)
-                    vertexrefs=eidolon.RealMatrix('vertexrefs',numlines)
-                    vertexrefs.meta(StdProps._nodedata,'True')
-                    fields.append(vertexrefs)
-                    
-                    for n in range(numlines):
-                        line=list(map(float,o.readline().split()))
-                        nodes.setAt(eidolon.vec3(*line[:-1]),n)
-                        vertexrefs.setAt(line[-1],n)
-                else: # read the index sets
-                    stype=types[section]
-                    inds=eidolon.IndexMatrix(section,stype,numlines,widths[section])
-                    inds.meta(StdProps._isspatial,'True')
-                    
-                    refs=eidolon.RealMatrix(section+'refs',numlines)
-                    refs.meta(StdProps._spatial,section)
-                    refs.meta(StdProps._topology,section)
-                    
-                    for n in range(numlines):
-                        line=list(map(int,o.readline().split()))
-                        #inds.setRow(n,*line[:-1])
-                        inds.setRow(n,*[line[i] for i in orderings[section]])
-                        refs.setAt(float(line[-1]),n)
-                        
-                    inds.sub(1)
-                    indices.append(inds)
-                    fields.append(refs)
-                    
-                section=o.readline().strip().lower()
-            
+
+        if eidolon.hasExtension(filename,'meshb'):
+            dim,vertices,sections=readMeditBinary(filename)
+        else:
+            dim,vertices,sections=readMeditText(filename)
+
+        if vertices is None:
+            raise IOError('No vertices found in Medit file %r'%filename)
+
+        numnodes=vertices.shape[0]
+        nodes=eidolon.Vec3Matrix('nodes',numnodes)
+        np.asarray(nodes)[:,:dim]=vertices[:,:dim]
+
+        vertexrefs=eidolon.RealMatrix('vertexrefs',numnodes)
+        vertexrefs.meta(StdProps._nodedata,'True')
+        np.asarray(vertexrefs)[:,0]=vertices[:,-1]
+        fields.append(vertexrefs)
+
+        for section,block in sections.items():
+            stype,_,width,ordering=MeditSections[section]
+            numlines=block.shape[0]
+
+            inds=eidolon.IndexMatrix(section,stype,numlines,width)
+            inds.meta(StdProps._isspatial,'True')
+            np.asarray(inds)[:,:]=block[:,ordering]-1 # reorder columns into Eidolon order and convert to 0-based
+
+            refs=eidolon.RealMatrix(section+'refs',numlines)
+            refs.meta(StdProps._spatial,section)
+            refs.meta(StdProps._topology,section)
+            np.asarray(refs)[:,0]=block[:,-1]
+
+            indices.append(inds)
+            fields.append(refs)
+
         return MeshSceneObject(name,eidolon.PyDataSet('meditDS',nodes,indices,fields),self,filename=filename)
-        
+
     @taskmethod('Loading Medit Solution File')
     def loadSolution(self,filename,obj,name=None,task=None):
         with open(filename) as o:
@@ -144,21 +321,100 @@ class MeditPlugin(MeshScenePlugin):
             dds=obj.datasets
             dim,width,numvals,stype=map(int,o.readline().split())
             numlines=int(numvals/width)
-            
+
             firstspatial=eidolon.first(filter(eidolon.isSpatialIndex,dds[0].indices.values())) # get the first spatial index
-            
+
             sol=eidolon.RealMatrix(name or eidolon.splitPathExt(filename)[1],numlines,width)
             sol.meta(StdProps._topology,firstspatial.getName())
             sol.meta(StdProps._spatial,firstspatial.getName())
             sol.meta(StdProps._filename,filename)
-            
-            for n in range(numlines):
-                sol.setRow(n,*map(float,o.readline().split()))
-                
+
+            np.asarray(sol)[:,:]=readTextBlock(o,numlines,width)
+
             for ds in dds:
                 ds.setDataField(sol)
-                
+
             return sol
+
+    @taskmethod('Saving Medit File')
+    def saveObject(self,obj,path,overwrite=False,setFilenames=False,task=None,**kwargs):
+        '''
+        Save the mesh of the first timestep of `obj' to the Medit file `path', which is binary if it ends with .meshb
+        or the keyword argument `isBinary' is True. Spatial index sets are written to the section for their element
+        type, index sets of the same type are concatenated, and reference values are taken from fields named after the
+        index set with "refs" appended (or "vertexrefs" for vertices) if present.
+        '''
+        if not isinstance(obj,MeshSceneObject):
+            raise ValueError('Can only save mesh objects')
+
+        isBinary=kwargs.get('isBinary',eidolon.hasExtension(path,'meshb'))
+
+        if os.path.isdir(path):
+            path=os.path.join(path,eidolon.getValidFilename(obj.getName()))
+
+        if not eidolon.hasExtension(path,'mesh','meshb'):
+            path+='.meshb' if isBinary else '.mesh'
+
+        if not overwrite and os.path.exists(path):
+            raise IOError('Cannot overwrite file %r'%path)
+
+        ds=obj.datasets[0]
+        sections={}
+        typesections={stype:name for name,stype,_,_,_ in MeditSections}
+
+        def _getRefs(name):
+            refs=ds.getDataField(name)
+            return np.asarray(refs)[:,0] if refs is not None else None
+
+        for ind in ds.enumIndexSets():
+            section=typesections.get(ind.getType(),None)
+
+            if section and eidolon.isSpatialIndex(ind):
+                inds=np.asarray(ind)
+                refs=_getRefs(ind.getName()+'refs')
+                if refs is None or refs.shape[0]!=inds.shape[0]:
+                    refs=np.zeros((inds.shape[0],))
+
+                if section in sections: # concatenate index sets of the same type
+                    inds=np.vstack((sections[section][0],inds))
+                    refs=np.concatenate((sections[section][1],refs))
+
+                sections[section]=(inds,refs)
+
+        writeMeditMesh(path,np.asarray(ds.getNodes()),sections,_getRefs('vertexrefs'),isBinary)
+
+        if setFilenames:
+            obj.plugin=self
+            obj.kwargs['filename']=path
+
+        return path
+
+    def _openFileDialog(self):
+        filename=self.mgr.win.chooseFileDialog('Choose Medit filename',filterstr='Medit Mesh File (*.mesh *.meshb)')
+        if filename!='':
+            self.mgr.addFuncTask(lambda:self.mgr.addSceneObject(self.loadObject(filename)),'Importing Medit file')
+
+    def _saveFileDialog(self):
+        obj=self.win.getSelectedObject()
+        if isinstance(obj,eidolon.SceneObjectRepr):
+            obj=obj.parent
+
+        if not isinstance(obj,MeshSceneObject):
+            self.mgr.showMsg('Error: Must select mesh data object to export','Medit Export')
+        else:
+            filename=self.mgr.win.chooseFileDialog('Choose Medit filename',filterstr='Medit Mesh File (*.mesh *.meshb)',isOpen=False)
+            if filename!='':
+                self.mgr.checkFutureResult(self.saveObject(obj,filename))
+
+    def _openSolutionDialog(self):
+        obj=self.win.getSelectedObject()
+        
+        if not obj or not isinstance(obj,MeshSceneObject):
+            self.mgr.showMsg('A mesh object must be selected before data fields can be loaded for it.','No scene object')
+        else:
+            filename=self.mgr.win.chooseFileDialog('Choose Medit filename',filterstr='Medit Solution File (*.bb)')
+            if filename!='':
+                self.loadSolution(filename,obj)
             
     def getScriptCode(self,obj,**kwargs):
         if isinstance(obj,MeshSceneObject):
@@ -186,4 +442,135 @@ class MeditPlugin(MeshScenePlugin):
             return MeshScenePlugin.getScriptCode(self,obj,**kwargs)     
             
         
-eidolon.addPlugin(MeditPlugin())
\ No newline at end of file
+eidolon.addPlugin(MeditPlugin())
+
+
+### Unit tests
+
+class TestMeditPlugin(unittest.TestCase):
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        self.plugin=eidolon.getSceneMgr().getPlugin('Medit')
+
+        # two hexes sharing a face, with the boundary quads of one end and a tet
+        self.nodes=np.asarray([(x,y,z) for z in (0,1) for y in (0,1) for x in (0,1,2)],float)+0.125
+        self.hexes=np.asarray([[0,1,3,4,6,7,9,10],[1,2,4,5,7,8,10,11]])
+        self.quads=np.asarray([[0,3,6,9]])
+        self.tets=np.asarray([[0,1,3,6]])
+        self.noderefs=np.arange(self.nodes.shape[0])
+        self.sections={
+            'hexahedra':(self.hexes,np.asarray([1,2])),
+            'quadrilaterals':(self.quads,None),
+            'tetrahedra':(self.tets,np.asarray([7])),
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def checkRead(self,dim,vertices,sections):
+        '''Check the result of readMeditText() or readMeditBinary() matches the test mesh.'''
+        self.assertEqual(3,dim)
+        self.assertTrue(np.allclose(self.nodes,vertices[:,:3]))
+        self.assertTrue(np.array_equal(self.noderefs,vertices[:,3]))
+        self.assertEqual(sorted(self.sections),sorted(sections))
+
+        for name,(inds,refs) in self.sections.items():
+            block=sections[name]
+            refs=np.zeros((inds.shape[0],)) if refs is None else refs
+
+            self.assertTrue(np.array_equal(inds,block[:,MeditSections[name][3]]-1)) # stored 1-based in Medit order
+            self.assertTrue(np.array_equal(refs,block[:,-1]))
+
+    def testWriteReadText(self):
+        '''Test writing and reading a text .mesh file.'''
+        filename=os.path.join(self.tempdir,'test.mesh')
+        writeMeditMesh(filename,self.nodes,self.sections,self.noderefs)
+
+        self.checkRead(*readMeditText(filename))
+
+    def testWriteReadTextChunked(self):
+        '''Test writing and reading a text .mesh file with sections longer than the chunk size.'''
+        global chunkLines
+        oldlines=chunkLines
+        filename=os.path.join(self.tempdir,'test.mesh')
+
+        try:
+            chunkLines=5
+            writeMeditMesh(filename,self.nodes,self.sections,self.noderefs)
+            self.checkRead(*readMeditText(filename))
+        finally:
+            chunkLines=oldlines
+
+    def testReadTextFormatting(self):
+        '''Test reading a text file with comments, values on the next line, and unknown sections.'''
+        filename=os.path.join(self.tempdir,'test.mesh')
+        with open(filename,'w') as o:
+            o.write('MeshVersionFormatted\n1\n# comment\nDimension\n3\n\nVertices\n3\n')
+            o.write('0 0 0 1\n1 0 0 2\n0 1 0 3\n')
+            o.write('Corners 2\n1\n2\n')
+            o.write('Triangles 1\n1 2 3 4\nEnd\n')
+
+        dim,vertices,sections=readMeditText(filename)
+
+        self.assertEqual(3,dim)
+        self.assertTrue(np.array_equal([[0,0,0,1],[1,0,0,2],[0,1,0,3]],vertices))
+        self.assertEqual(['triangles'],list(sections))
+        self.assertTrue(np.array_equal([[1,2,3,4]],sections['triangles']))
+
+    def testWriteReadBinary(self):
+        '''Test writing and reading a binary .meshb file.'''
+        filename=os.path.join(self.tempdir,'test.meshb')
+        writeMeditMesh(filename,self.nodes,self.sections,self.noderefs)
+
+        self.checkRead(*readMeditBinary(filename))
+
+    def testReadBinaryBigEndian(self):
+        '''Test reading a big-endian version 2 binary file, which has 32-bit positions.'''
+        filename=os.path.join(self.tempdir,'test.meshb')
+        vertices=np.asarray([(0,0,0,1),(1,0,0,2),(0,1,0,3)],float)
+        vrec=np.empty((3,),np.dtype([('c','>f8',(3,)),('r','>i4')]))
+        vrec['c']=vertices[:,:3]
+        vrec['r']=vertices[:,3]
+        tris=np.asarray([[1,2,3,5]],'>i4')
+
+        with open(filename,'wb') as o:
+            o.write(np.asarray([1,2],'>i4').tobytes())
+            o.write(np.asarray([MeditDimensionCode,20,3],'>i4').tobytes())
+            o.write(np.asarray([MeditSections.vertices[1],32+vrec.nbytes,3],'>i4').tobytes()+vrec.tobytes())
+            o.write(np.asarray([MeditSections.triangles[1],0,1],'>i4').tobytes()+tris.tobytes())
+
+        dim,readverts,sections=readMeditBinary(filename)
+
+        self.assertEqual(3,dim)
+        self.assertTrue(np.array_equal(vertices,readverts))
+        self.assertTrue(np.array_equal(tris,sections['triangles']))
+
+    def testReadBinaryBadVersion(self):
+        '''Test that unknown endianness codes and versions are rejected.'''
+        filename=os.path.join(self.tempdir,'test.meshb')
+
+        for header in ([2,3],[1,5]):
+            with open(filename,'wb') as o:
+                o.write(np.asarray(header,'<i4').tobytes())
+
+            with self.assertRaises(IOError):
+                readMeditBinary(filename)
+
+    def testSaveLoadObject(self):
+        '''Test saving and loading a mesh object as text and binary files, including reference fields.'''
+        filename=os.path.join(self.tempdir,'test.mesh')
+        writeMeditMesh(filename,self.nodes,self.sections,self.noderefs)
+        obj=eidolon.Future.get(self.plugin.loadObject(filename))
+
+        for ext in ('.mesh','.meshb'):
+            path=eidolon.Future.get(self.plugin.saveObject(obj,os.path.join(self.tempdir,'saved'+ext)))
+            obj1=eidolon.Future.get(self.plugin.loadObject(path))
+            ds=obj1.datasets[0]
+
+            self.assertTrue(np.allclose(self.nodes,np.asarray(ds.getNodes())))
+            self.assertTrue(np.array_equal(self.noderefs,np.asarray(ds.getDataField('vertexrefs'))[:,0]))
+
+            for name,(inds,refs) in self.sections.items():
+                refs=np.zeros((inds.shape[0],)) if refs is None else refs
+                self.assertTrue(np.array_equal(inds,np.asarray(ds.getIndexSet(name))))
+                self.assertTrue(np.array_equal(refs,np.asarray(ds.getDataField(name+'refs'))[:,0]))
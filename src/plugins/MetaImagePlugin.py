@@ -19,6 +19,9 @@
 
 from eidolon import *
 import zlib
+import unittest
+import tempfile
+import shutil
 
 
 MetaImageTypes=enum(
@@ -35,6 +38,85 @@ MetaImageTypes=enum(
     desc='Maps the MetaImage pixel type to the equivalent Numpy datatype'
 )
 
+chunkSize=1<<24 # number of bytes to decompress at a time when streaming compressed data
+
+
+def readMetaImageHeader(filename):
+    '''
+    Reads the header of MetaImage file `filename' and returns the dictionary of header values and the byte offset of
+    the first byte following the header. The header ends with the ElementDataFile line, so for .mha files this is the
+    offset of the image data.
+    '''
+    hdr={}
+
+    with open(filename,'rb') as o:
+        for line in o:
+            line=line.decode('ascii','replace').strip()
+            if not line:
+                continue
+
+            k,v=line.split('=',1)
+            hdr[k.strip()]=v.strip()
+
+            if k.strip()=='ElementDataFile':
+                break
+
+        return hdr,o.tell()
+
+
+def readMetaImageData(datfile,offset,dimsize,dtype,hdr,task=None):
+    '''
+    Returns the array of dimensions `dimsize' and type `dtype' stored in `datfile' starting at byte `offset', with
+    the first axis varying fastest. Uncompressed data is memory mapped so that it's only read when accessed, while
+    compressed data (CompressedData is True in `hdr') is decompressed into the array in chunks as it is read.
+    '''
+    count=int(np.prod(dimsize))
+    nbytes=count*dtype.itemsize
+
+    if hdr.get('CompressedData','').lower()!='true':
+        headersize=int(hdr.get('HeaderSize',0))
+        if headersize==-1: # data is at the end of the file
+            offset=os.path.getsize(datfile)-nbytes
+        else:
+            offset+=headersize
+
+        return np.memmap(datfile,dtype,'r',offset,tuple(dimsize),'F')
+
+    comsize=int(hdr.get('CompressedDataSize',0)) or os.path.getsize(datfile)-offset
+    assert comsize<=os.path.getsize(datfile)-offset,'File is smaller than specified compressed data length (%i)'%comsize
+
+    dat=np.empty((count,),dtype)
+    buff=memoryview(dat.view(np.uint8))
+    decomp=zlib.decompressobj()
+    pos=0
+
+    if task:
+        task.setMaxProgress(comsize)
+
+    # decompress chunks of the file into the array a chunk at a time so neither the compressed or uncompressed data is copied
+    with open(datfile,'rb') as o:
+        o.seek(offset)
+
+        while pos<nbytes:
+            data=decomp.unconsumed_tail # left over input from the last chunk if it decompressed to more than chunkSize
+            if not data:
+                data=o.read(min(chunkSize,offset+comsize-o.tell()))
+                if not data:
+                    break
+
+            chunk=decomp.decompress(data,min(chunkSize,nbytes-pos))
+            buff[pos:pos+len(chunk)]=chunk
+            pos+=len(chunk)
+
+            if task:
+                task.setProgress(o.tell()-offset)
+
+    if pos!=nbytes:
+        raise IOError('Decompressed data is %i bytes, expected %i'%(pos,nbytes))
+
+    return dat.reshape(dimsize,order='F')
+
+
 class MetaImagePlugin(ImageScenePlugin):
     # this defines the header ordering which appears to be sacred to some software
     HeaderNames=(
@@ -117,10 +199,6 @@ class MetaImagePlugin(ImageScenePlugin):
         a raw file which is then read. If `name' is None then a name for the returned ImageSceneObject is chosen from
         `filename', otherwise `name' is used.
         '''
-        def _isBinaryLine(line):
-            '''A line is binary data if it contains successive null characters or any character >=127 (not ASCII).'''
-            return '\00\00' in line or any(ord(l)>=127 for l in line)
-
         f=Future()
 
         @taskroutine('Loading MetaImage File')
@@ -129,19 +207,7 @@ class MetaImagePlugin(ImageScenePlugin):
                 filename=Future.get(filename)
                 basename=name or os.path.basename(filename).split('.')[0]
                 name=uniqueStr(basename,[o.getName() for o in self.mgr.enumSceneObjects()]) # choose object name based on file name
-                hdr={}
-                raw=''
-
-                # read each line of data, lines that don't have 2 nulls are header, all others data
-                with open(filename,'rb') as o:
-                    line=o.readline()
-                    while line!='' and not _isBinaryLine(line): # lines that don't have 2 nulls are header lines
-                        k,v=line.split('=')
-                        hdr[k.strip()]=v.strip()
-                        line=o.readline()
-
-                    if line!='': # store the rest as the data components
-                        raw=line+o.read()
+                hdr,dataoffset=readMetaImageHeader(filename)
 
                 elemtype=hdr['ElementType']
                 dim=int(hdr['NDims']) # 3 for static image, 4 for time-dependent
@@ -160,7 +226,7 @@ class MetaImagePlugin(ImageScenePlugin):
                 assert len(dimsize)==dim,'%i!=%i'%(len(dimsize),dim)
                 assert len(espacing)==dim,'%i!=%i'%(len(espacing),dim)
                 assert len(trans) in (9,16),'%i!=9 or 16'%len(trans)
-                assert datfile=='LOCAL' or raw==''
+                assert datfile=='LOCAL' or os.path.getsize(filename)==dataoffset, 'Data found in header with separate data file %r'%datfile
 
                 if len(trans)==16:
                     a,b,c,_,d,e,g,_,c1,c2,c3,_=trans[:12]
@@ -180,19 +246,18 @@ class MetaImagePlugin(ImageScenePlugin):
                     datfile=filename
                 else:
                     datfile=os.path.join(os.path.split(filename)[0],datfile)
-                    with open(datfile,'rb') as o:
-                        raw=o.read()
-
-                # decompress image data
-                if raw and hdr.get('CompressedData','').lower()=='true':
-                    comsize=int(hdr.get('CompressedDataSize',0))
-                    assert comsize in (0,len(raw)),'Raw data length (%i) does not match specified length (%i)'%(len(raw),comsize)
-                    raw=zlib.decompress(raw)
+                    dataoffset=0
 
                 hdr['datfile']=datfile
                 hdr['filename']=filename
 
-                dat=np.ndarray(dimsize,dtype=np.dtype(MetaImageTypes[elemtype]),buffer=raw,order='F')
+                # the array is memory mapped or decompressed into memory, either way the data isn't copied here
+                dtype=np.dtype(MetaImageTypes[elemtype])
+                if dtype.itemsize>1:
+                    isMSB=hdr.get('BinaryDataByteOrderMSB',hdr.get('ElementByteOrderMSB','False')).lower()=='true'
+                    dtype=dtype.newbyteorder('>' if isMSB else '<')
+
+                dat=readMetaImageData(datfile,dataoffset,dimsize,dtype,hdr,task)
                 #dat=eidolon.transposeRowsColsNP(dat) # transpose from row-column to column-row
 
                 obj=self.createObjectFromArray(name,dat,interval,toffset,position,rot,spacing,task=task)
@@ -213,7 +278,9 @@ class MetaImagePlugin(ImageScenePlugin):
         in `path'+".raw". However, if either extension is given in `path', these are used to determine whether
         to write to one file or two if `isOneFile' isn't present. If a MetaImage type is supplied in the keyword argument
         `datatype' then the image data will be stored in that format, otherwise MET_SHORT is used. Any other keyword
-        arguments are added to the end of the header, or override those values named in `HeaderNames'.
+        arguments are added to the end of the header, or override those values named in `HeaderNames'. The image data is
+        converted and written a slice at a time so that the whole 4D array is never created. The result is the header
+        dictionary and the path of the header file.
         '''
         f=Future()
 
@@ -236,16 +303,20 @@ class MetaImagePlugin(ImageScenePlugin):
 
                 datatype=kwargs.pop('datatype',MetaImageTypes._MET_SHORT) # choose output datatype, MET_SHORT is default
 
-                # convert the image into a 2D/3D/4D matrix and pull out the header information
-                mat=self.getImageObjectArray(obj,MetaImageTypes[datatype])
-                dat=mat['array']
-                pos=obj.getTransform()*vec3.Z() # choose the top corner as the origin instead of mat['pos'] for compatibility with other programs
-                spacing=[i or 1 for i in mat['spacing']] # all values of spacing must be non-zero
-                rot=mat['rot']
-                toffset=mat['toffset']
-                interval=mat['interval']
-                cols,rows,depth,numsteps=dat.shape
+                # pull out the header information, the image data is read a slice at a time when written
+                info=self.getImageObjectInfo(obj)
+                dtype=np.dtype(MetaImageTypes[datatype]).newbyteorder('<')
+                pos=obj.getTransform()*vec3.Z() # choose the top corner as the origin instead of info['pos'] for compatibility with other programs
+                spacing=[i or 1 for i in info['spacing']] # all values of spacing must be non-zero
+                rot=info['rot']
+                toffset=info['toffset']
+                interval=info['interval']
+                cols,rows,depth,numsteps=info['shape']
                 dims=4 if obj.isTimeDependent else 3
+                stacks=obj.getVolumeStacks()
+
+                if dims==3:
+                    numsteps=1
 
                 xdir=rot*vec3.X()
                 ydir=rot*-vec3.Y()
@@ -275,10 +346,19 @@ class MetaImagePlugin(ImageScenePlugin):
                 hdrnames=list(self.HeaderNames)+[k for k in kwargs if k not in self.HeaderNames]
                 hdr.update(kwargs)
                 
-                #dat=np.transpose(dat,(1,0,2,3)[:len(dat.shape)]) # transpose rows and columns
-                
-                dat=dat[:,:,::-1,...] # since the top corner is the origin, invert the Z axis in the matrix
-                dat=np.squeeze(dat)
+                def _getSlice(t,z):
+                    '''
+                    Returns XY slice `z' at timestep `t' whose C-order bytes are the slice in Fortran order. Since the
+                    top corner is the origin the Z axis is inverted, so slices are taken from the top of the stack.
+                    '''
+                    img=np.asarray(obj.images[stacks[t][depth-z-1]].img)
+                    assert img.shape==(rows,cols)
+                    return img.astype(dtype)
+
+                def _writeData(o):
+                    '''Write each XY slice in Fortran order, Z varying faster than T, equivalent to writing the whole array.'''
+                    for t,z in trange(numsteps,depth):
+                        o.write(_getSlice(t,z).tobytes())
 
                 with open(path,'wb') as o:
                     for k in hdrnames:
@@ -287,16 +367,16 @@ class MetaImagePlugin(ImageScenePlugin):
                             sv=str(v)
                         else:
                             sv=' '.join(map(str,hdr[k]))
-                        o.write('%s = %s\n'%(k,sv))
+                        o.write(('%s = %s\n'%(k,sv)).encode('ascii'))
 
                     if isOneFile:
-                        o.write(dat.tostring(order='F'))
+                        _writeData(o)
 
                 if not isOneFile:
                     with open(datfile,'wb') as o:
-                        o.write(dat.tostring(order='F'))
+                        _writeData(o)
 
-                f.setObject((hdr,dat))
+                f.setObject((hdr,path))
 
         return self.mgr.runTasks([_saveFile(path,obj,kwargs)],f)
 
@@ -353,4 +433,101 @@ class MetaImagePlugin(ImageScenePlugin):
         return setStrIndent(script % args).strip()+'\n'
 
 
-addPlugin(MetaImagePlugin())
\ No newline at end of file
+addPlugin(MetaImagePlugin())
+
+
+### Unit tests
+
+class TestMetaImagePlugin(unittest.TestCase):
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        self.plugin=getSceneMgr().getPlugin('MetaImg')
+
+        self.volarr=np.fromfunction(lambda x,y,z,t:(x+1)*1000+(y+1)*100+(z+1)*10+t+1,(11,13,7,3))
+        self.vpos=vec3(-10,20,-15)
+        self.vrot=rotator(0.1,-0.2,0.13)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def createVolume(self,volarr):
+        return self.plugin.createObjectFromArray('TestVolume',volarr,pos=self.vpos,rot=self.vrot,spacing=vec3(1,1.5,2))
+
+    def checkLoad(self,filename,volarr):
+        '''Load `filename' and check its data matches `volarr'.'''
+        obj=Future.get(self.plugin.loadObject(filename))
+
+        with processImageNp(obj) as arr:
+            self.assertEqual(volarr.shape,arr.shape)
+            self.assertTrue(np.allclose(volarr,arr))
+
+    def saveCompressed(self,filename,compfilename,truncate=0):
+        '''
+        Save the single file `filename' as `compfilename' with its data zlib compressed, leaving off `truncate' bytes of
+        the compressed data. Returns the header and the uncompressed data array.
+        '''
+        hdr,offset=readMetaImageHeader(filename)
+
+        with open(filename,'rb') as o:
+            o.seek(offset)
+            data=zlib.compress(o.read())
+
+        data=data[:len(data)-truncate]
+        hdr['CompressedData']='True'
+        hdr['CompressedDataSize']=len(data)
+
+        with open(compfilename,'wb') as o:
+            for k in self.plugin.HeaderNames+('CompressedDataSize',):
+                if k in hdr and k!='ElementDataFile':
+                    o.write(('%s = %s\n'%(k,hdr[k])).encode('ascii'))
+
+            o.write(b'ElementDataFile = LOCAL\n')
+            o.write(data)
+
+        return hdr
+
+    def testSaveLoadOneFile(self):
+        '''Test saving and loading a single .mha file whose data is memory mapped when read.'''
+        volarr=self.volarr[...,:1]
+        hdr,filename=Future.get(self.plugin.saveObject(self.createVolume(volarr),os.path.join(self.tempdir,'vol.mha'),datatype='MET_FLOAT'))
+
+        hdr,offset=readMetaImageHeader(filename)
+        dat=readMetaImageData(filename,offset,[11,13,7],np.dtype('<f4'),hdr)
+
+        self.assertIsInstance(dat,np.memmap)
+        self.assertTrue(np.allclose(volarr[:,:,::-1,0],dat)) # stored with the top corner as the origin
+        self.checkLoad(filename,volarr)
+
+    def testSaveLoadSeparate(self):
+        '''Test saving and loading a time-dependent header and raw file pair.'''
+        hdr,filename=Future.get(self.plugin.saveObject(self.createVolume(self.volarr),os.path.join(self.tempdir,'vol'),isOneFile=False))
+
+        self.assertTrue(filename.endswith('.mhd'))
+        self.assertTrue(os.path.isfile(os.path.join(self.tempdir,'vol.raw')))
+        self.assertEqual(self.volarr.size*2,os.path.getsize(os.path.join(self.tempdir,'vol.raw'))) # MET_SHORT by default
+        self.checkLoad(filename,self.volarr)
+
+    def testLoadCompressed(self):
+        '''Test loading zlib compressed data, including decompressing in chunks smaller than the data.'''
+        global chunkSize
+        oldsize=chunkSize
+        _,filename=Future.get(self.plugin.saveObject(self.createVolume(self.volarr),os.path.join(self.tempdir,'vol.mha')))
+        compfilename=os.path.join(self.tempdir,'comp.mha')
+        self.saveCompressed(filename,compfilename)
+
+        try:
+            for size in (oldsize,100):
+                chunkSize=size
+                self.checkLoad(compfilename,self.volarr)
+        finally:
+            chunkSize=oldsize
+
+    def testLoadCompressedTruncated(self):
+        '''Test that loading truncated compressed data raises an error.'''
+        _,filename=Future.get(self.plugin.saveObject(self.createVolume(self.volarr),os.path.join(self.tempdir,'vol.mha')))
+        compfilename=os.path.join(self.tempdir,'comp.mha')
+        hdr=self.saveCompressed(filename,compfilename,100)
+        _,offset=readMetaImageHeader(compfilename)
+
+        with self.assertRaises(IOError):
+            readMetaImageData(compfilename,offset,list(self.volarr.shape),np.dtype('<i2'),hdr)
@@ -17,14 +17,229 @@
 # with this program (LICENSE.txt).  If not, see <http://www.gnu.org/licenses/>
 
 
+import re
+import gzip
+import bz2
+import math
+import unittest
+import tempfile
+import shutil
+from multiprocessing import cpu_count
+from concurrent.futures import ThreadPoolExecutor
+
 from eidolon import *
 
-addLibraryFile('pynrrd-0.2.4-py2.py3-none-any')
 
-import nrrd
+HeaderNames=enum(
+    'dimension','sizes','type','encoding','endian','data file','line skip','byte skip','spacings','axis mins','units',
+    'kinds','space','space dimension','space directions','space origin','space units'
+)
+
+# maps NRRD type names to Numpy datatypes
+NRRDTypes={
+    'signed char':'i1','int8':'i1','int8_t':'i1',
+    'uchar':'u1','unsigned char':'u1','uint8':'u1','uint8_t':'u1',
+    'short':'i2','short int':'i2','signed short':'i2','signed short int':'i2','int16':'i2','int16_t':'i2',
+    'ushort':'u2','unsigned short':'u2','unsigned short int':'u2','uint16':'u2','uint16_t':'u2',
+    'int':'i4','signed int':'i4','int32':'i4','int32_t':'i4',
+    'uint':'u4','unsigned int':'u4','uint32':'u4','uint32_t':'u4',
+    'longlong':'i8','long long':'i8','long long int':'i8','signed long long':'i8','signed long long int':'i8',
+    'int64':'i8','int64_t':'i8',
+    'ulonglong':'u8','unsigned long long':'u8','unsigned long long int':'u8','uint64':'u8','uint64_t':'u8',
+    'float':'f4','double':'f8'
+}
+
+# maps Numpy datatypes to the NRRD type names used when writing
+NRRDTypeNames={
+    'i1':'int8','u1':'uint8','i2':'int16','u2':'uint16','i4':'int32','u4':'uint32','i8':'int64','u8':'uint64',
+    'f4':'float','f8':'double'
+}
+
+intFields=(HeaderNames.dimension,HeaderNames.space_dimension,HeaderNames.line_skip,HeaderNames.byte_skip)
+intListFields=(HeaderNames.sizes,)
+floatListFields=(HeaderNames.spacings,HeaderNames.axis_mins,'axis maxs','thicknesses')
+strListFields=(HeaderNames.kinds,HeaderNames.units,HeaderNames.space_units,'labels','centers','centerings')
+
+vectorRegex=re.compile(r'\(([^)]*)\)|none')
+quotedRegex=re.compile(r'"([^"]*)"|(\S+)')
+
+chunkSize=1<<24 # number of bytes to decompress at a time when streaming compressed data
+
+
+def parseVector(value):
+    '''Returns the list of floats in the NRRD vector string `value' of the form "(x,y,z)".'''
+    return [float(v) for v in vectorRegex.match(value.strip()).group(1).split(',')]
+
+
+def parseHeaderValue(key,value):
+    '''Converts the string `value' of NRRD field `key' into its Python value, unknown fields are left as strings.'''
+    if key in intFields:
+        return int(value)
+    elif key in intListFields:
+        return list(map(int,value.split()))
+    elif key in floatListFields:
+        return list(map(float,value.split()))
+    elif key in strListFields:
+        return [q or u for q,u in quotedRegex.findall(value)]
+    elif key==HeaderNames.space_origin:
+        return parseVector(value)
+    elif key==HeaderNames.space_directions:
+        return [parseVector(m.group(0)) if m.group(1) is not None else None for m in vectorRegex.finditer(value)]
+    else:
+        return value.strip()
+
+
+def formatHeaderValue(key,value):
+    '''Converts the Python value `value' of NRRD field `key' into its header string form.'''
+    formatVec=lambda v:'none' if v is None else '(%s)'%','.join(map(repr,map(float,v)))
+
+    if key==HeaderNames.space_origin:
+        return formatVec(value)
+    elif key==HeaderNames.space_directions:
+        return ' '.join(map(formatVec,value))
+    elif isinstance(value,str) or not isIterable(value):
+        return str(value)
+    else:
+        return ' '.join(map(str,value))
+
+
+def readNRRDHeader(filename):
+    '''
+    Reads the header of NRRD file `filename' and returns the header dictionary and the byte offset of the data that
+    follows it. The dictionary maps field names to values, and key/value pairs (key:=value) are stored the same way.
+    '''
+    hdr={}
+
+    with open(filename,'rb') as o:
+        magic=o.readline().decode('ascii','replace').strip()
+        if not magic.startswith('NRRD'):
+            raise IOError('File %r is not a NRRD file'%filename)
+
+        for line in o:
+            line=line.decode('ascii','replace').strip()
+
+            if not line: # blank line ends the header
+                break
+            elif line[0]=='#': # comment
+                continue
+            elif ':=' in line:
+                key,value=line.split(':=',1)
+                hdr[key]=value
+            else:
+                key,value=line.split(':',1)
+                hdr[key.strip()]=parseHeaderValue(key.strip(),value.strip())
+
+        return hdr,o.tell()
+
+
+def getNRRDDatatype(hdr):
+    '''Returns the Numpy datatype of the data described by `hdr' including byte order.'''
+    dtype=np.dtype(NRRDTypes[hdr[HeaderNames.type]])
+
+    if dtype.itemsize>1:
+        dtype=dtype.newbyteorder('>' if hdr.get(HeaderNames.endian,'little')=='big' else '<')
+
+    return dtype
+
+
+def readNRRDData(filename,hdr,offset,task=None):
+    '''
+    Returns the array of the data described by header `hdr' loaded from `filename' or its detached data file, with the
+    first axis varying fastest as stored. Data starts at byte `offset' for attached data. Raw data is memory mapped so
+    that it's only read when accessed. Compressed data is decompressed a chunk at a time into a temporary file which is
+    then memory mapped, so neither the compressed nor the uncompressed data is held in memory as a whole.
+    '''
+    dtype=getNRRDDatatype(hdr)
+    sizes=hdr[HeaderNames.sizes]
+    count=int(np.prod(sizes))
+    encoding=hdr.get(HeaderNames.encoding,'raw').lower()
+    datafile=hdr.get(HeaderNames.data_file,None)
+    lineskip=hdr.get(HeaderNames.line_skip,0)
+    byteskip=hdr.get(HeaderNames.byte_skip,0)
+
+    if datafile:
+        if datafile=='LIST' or len(datafile.split())>1:
+            raise IOError('Multiple detached data files are not supported')
+
+        filename=os.path.join(os.path.dirname(filename),datafile)
+        offset=0
+
+    with open(filename,'rb') as o:
+        o.seek(offset)
+        for _ in range(lineskip):
+            o.readline()
 
+        offset=o.tell()
+
+        if encoding=='raw':
+            if byteskip==-1: # data is at the end of the file
+                offset=os.path.getsize(filename)-count*dtype.itemsize
+            else:
+                offset+=byteskip
+
+            return np.memmap(filename,dtype,'r',offset,tuple(sizes),'F')
+        elif encoding in ('txt','text','ascii'):
+            text=o.read().decode('ascii')
+            return np.fromstring(text,dtype=dtype,sep=' ')[:count].reshape(sizes,order='F')
+        elif encoding in ('gz','gzip','bz2','bzip2'):
+            stream=gzip.GzipFile(fileobj=o) if encoding in ('gz','gzip') else bz2.BZ2File(o)
+            stream.read(max(0,byteskip))
+
+            nbytes=count*dtype.itemsize
+            pos=0
+
+            if task:
+                task.setMaxProgress(nbytes)
+
+            # the temporary file is deleted once closed and the map created from it is released
+            with tempfile.TemporaryFile() as tmp:
+                while pos<nbytes:
+                    chunk=stream.read(min(chunkSize,nbytes-pos))
+                    if not chunk:
+                        raise IOError('Compressed data is %i bytes, expected %i'%(pos,nbytes))
+
+                    tmp.write(chunk)
+                    pos+=len(chunk)
+                    if task:
+                        task.setProgress(pos)
+
+                tmp.flush()
+                return np.memmap(tmp,dtype,'r',0,tuple(sizes),'F')
+        else:
+            raise IOError('Unsupported NRRD encoding %r'%encoding)
+
+
+def writeNRRDFile(filename,hdr,getSlab,numslabs,compresslevel=6,numthreads=None,datafile=None):
+    '''
+    Writes the NRRD header dictionary `hdr' and image data to `filename', or to the detached file `datafile' if given.
+    The data is never held in memory as a whole, instead getSlab(i) must return the i'th of `numslabs' slabs along the
+    last axis as an array whose C-order bytes are the slab's data with the first axis varying fastest, in the datatype
+    and byte order the header states. For gzip encoding slabs are compressed as separate gzip members in parallel using
+    `numthreads' threads, decoders read concatenated members as one stream. Only a bounded number of slabs are held at
+    once for either encoding.
+    '''
+    isCompressed=hdr.get(HeaderNames.encoding,'raw') in ('gz','gzip')
+    numthreads=numthreads or max(1,cpu_count())
+
+    def _getBytes(i):
+        data=np.ascontiguousarray(getSlab(i)).tobytes()
+        return gzip.compress(data,compresslevel) if isCompressed else data
+
+    with open(filename,'wb') as o:
+        o.write(b'NRRD0004\n')
+        o.write(b'# Complete NRRD file format specification at:\n')
+        o.write(b'# http://teem.sourceforge.net/nrrd/format.html\n')
+
+        for k,v in hdr.items():
+            o.write(('%s: %s\n'%(k,formatHeaderValue(k,v))).encode('ascii'))
+
+        o.write(b'\n')
+
+    with open(datafile or filename,'ab' if datafile is None else 'wb') as o:
+        with ThreadPoolExecutor(numthreads) as pool:
+            for data in boundedMap(pool,_getBytes,range(numslabs),numthreads*2):
+                o.write(data)
 
-HeaderNames=enum('dimension','spacings','units','kinds','space origin','space','space directions','space origin','space units','space dimension')
 
 class NRRDPlugin(ImageScenePlugin):             
     def __init__(self):
@@ -91,40 +306,60 @@ class NRRDPlugin(ImageScenePlugin):
                 basename=name or splitPathExt(filename)[1]
                 name=uniqueStr(basename,[o.getName() for o in self.mgr.enumSceneObjects()]) # choose object name based on file name
                 
-                dat,hdr=nrrd.read(filename)             
-                
-                space=hdr.get(HeaderNames.space,0)
-                spacedim=hdr.get(HeaderNames.space_dimension,0)
+                hdr,offset=readNRRDHeader(filename)
+                dat=readNRRDData(filename,hdr,offset,task)
+
                 dimension=hdr.get(HeaderNames.dimension,1)
-                spacedir=hdr.get(HeaderNames.space_directions,[[1,0,0],[0,1,0],[0,0,1],'none'])
+                spacedir=hdr.get(HeaderNames.space_directions,None)
                 position=vec3(*hdr.get(HeaderNames.space_origin,[0,0,0]))
-                spacings=hdr.get(HeaderNames.spacings,[1]*dimension)
-                
-                assert dimension in (2,3,4), 'Can only understand NRRD images representing 2D images, 3D volumes, or 4D volumes'    
-                
-                movetimeaxis=spacedim==3 or space in ("right-anterior-superior", "RAS","left-anterior-superior","LAS","left-posterior-superior","LPS","scanner-xyz")        
-                
-                # calculate a rotation from the dimension vectors
-                spacedir1=vec3(*spacedir[1 if movetimeaxis else 0])             
-                spacedir2=vec3(*spacedir[2 if movetimeaxis else 1])
-                rot=rotator(spacedir1,spacedir2,vec3(1,0,0),vec3(0,1,0))
-                
-                if movetimeaxis:
-                    dat=np.rollaxis(dat,0,len(dat.shape)) # move the time axis to the end
-                    spacing=vec3(*spacings[1:4])
+                spacings=hdr.get(HeaderNames.spacings,[float('nan')]*dimension)
+                axismins=hdr.get(HeaderNames.axis_mins,[float('nan')]*dimension)
+
+                assert dimension in (2,3,4), 'Can only understand NRRD images representing 2D images, 3D volumes, or 4D volumes'
+
+                # the time axis is the non-spatial axis with no space direction, or the last axis if there's no directions
+                if spacedir:
+                    timeaxis=first(i for i,d in enumerate(spacedir) if d is None)
+                    spatial=[vec3(*d) for d in spacedir if d is not None]
                 else:
-                    spacing=vec3(*spacings[:3])
-                    
-                if dimension==4 and len(spacings)==dimension:
-                    interval=spacings[0 if movetimeaxis else 3] # if there's as many space values as dimensions, is the first or last the time interval?
+                    timeaxis=None
+                    spatial=[]
+
+                if dimension==4 and timeaxis is None:
+                    timeaxis=3
+
+                if timeaxis is not None and timeaxis!=len(dat.shape)-1:
+                    dat=np.rollaxis(dat,timeaxis,len(dat.shape)) # move the time axis to the end
+
+                if len(spatial)>=2:
+                    # calculate a rotation and spacing from the dimension vectors
+                    rot=rotator(spatial[0].norm(),spatial[1].norm(),vec3(1,0,0),vec3(0,1,0))
+                    spacing=vec3(*[d.len() for d in spatial]+[1]*(3-len(spatial)))
+
+                    # A rotator can't represent a left-handed set of axes, so if the stack direction is opposite
+                    # the cross product of the row and column directions the Z spacing is negated instead, which
+                    # generateImageStack() accepts by placing slices along -Z. This keeps every slice in the
+                    # position the file states, saving then writes the same slices with a positive spacing along the
+                    # Z axis of the object's transform, an equivalent header rather than the identical one.
+                    if len(spatial)==3 and spatial[2].dot(rot*vec3(0,0,1))<0:
+                        spacing*=vec3(1,1,-1)
                 else:
-                    interval=1
-                    
+                    rot=rotator()
+                    spatialspacings=[s for i,s in enumerate(spacings) if i!=timeaxis]
+                    spacing=vec3(*[1 if math.isnan(s) else s for s in spatialspacings[:3]]+[1]*(3-len(spatialspacings[:3])))
+
+                interval=1
+                if timeaxis is not None and timeaxis<len(spacings) and not math.isnan(spacings[timeaxis]):
+                    interval=spacings[timeaxis]
+
+                if timeaxis is not None and timeaxis<len(axismins) and not math.isnan(axismins[timeaxis]):
+                    toffset+=axismins[timeaxis]
+
                 position-=rot*(spacing*0.5) # move position from center to top-left corner of image
-                
+
                 if setinterval!=None:
                     interval=setinterval
-                
+
                 obj=self.createObjectFromArray(name,dat,interval,toffset,setpos or position,setrot or rot,setspacing or spacing,task=task)
                 obj.source=hdr
                 hdr['filename']=filename
@@ -132,18 +367,86 @@ class NRRDPlugin(ImageScenePlugin):
         
         return self.mgr.runTasks([_loadFile(filename,name,setpos,setrot,settrans,toffset,setinterval)],f)
     
-#   def saveObject(self,obj,path,overwrite=False,setFilenames=False,**kwargs):
-#       '''
-#       '''
-#       f=Future()
-#
-#       @taskroutine('Saving NRRD File')
-#       def _saveFile(obj,path,kwargs,task):
-#           with f:
-#               pass
-#       
-#       return self.mgr.runTasks([_saveFile(obj,path,kwargs)],f)
-        
+    def saveObject(self,obj,path,overwrite=False,setFilenames=False,**kwargs):
+        '''
+        Saves the ImageSceneObject `obj' to the NRRD file `path', adding the .nrrd extension if not present or .nhdr if
+        the keyword argument `detached' is True, in which case the data is written to a separate .raw file (.raw.gz if
+        compressed). The keyword argument `datatype' states the Numpy type to store data as (default float32), and
+        `encoding' may be "raw" (default) or "gzip". Compression is done in parallel with `numthreads' threads (default
+        number of CPUs) using the zlib level `compresslevel' (default 6). Time-dependent images are stored with the
+        time axis first with kind "list", its spacing is the time interval and its axis minimum is the time offset.
+        '''
+        f=Future()
+
+        @taskroutine('Saving NRRD File')
+        def _saveFile(obj,path,kwargs,task):
+            with f:
+                detached=kwargs.get('detached',False)
+                encoding=kwargs.get('encoding','raw')
+                datatype=np.dtype(kwargs.get('datatype',np.float32)).newbyteorder('<')
+
+                if splitPathExt(path)[2].lower() not in ('.nrrd','.nhdr'):
+                    path+='.nhdr' if detached else '.nrrd'
+
+                if not overwrite and os.path.exists(path):
+                    raise IOError('File already exists: %r'%path)
+
+                info=self.getImageObjectInfo(obj)
+                rot=info['rot']
+                spacing=info['spacing']
+                cols,rows,depth,numsteps=info['shape']
+                isTimeDependent=obj.isTimeDependent and numsteps>1
+                stacks=obj.getVolumeStacks()
+
+                # axis direction vectors, origin is the center of the first voxel
+                dirs=[list(rot*(v*s)) for v,s in zip((vec3.X(),vec3.Y(),vec3.Z()),spacing)]
+                origin=info['pos']+rot*(spacing*0.5)
+
+                hdr={
+                    HeaderNames.type:NRRDTypeNames[datatype.str[1:]],
+                    HeaderNames.dimension:4 if isTimeDependent else 3,
+                    HeaderNames.space_dimension:3,
+                    HeaderNames.sizes:[cols,rows,depth],
+                    HeaderNames.space_directions:dirs,
+                    HeaderNames.kinds:['domain']*3,
+                    HeaderNames.endian:'little',
+                    HeaderNames.encoding:encoding,
+                    HeaderNames.space_origin:list(origin)
+                }
+
+                if isTimeDependent:
+                    nan=float('nan')
+                    hdr[HeaderNames.sizes]=[numsteps]+hdr[HeaderNames.sizes]
+                    hdr[HeaderNames.space_directions]=[None]+dirs
+                    hdr[HeaderNames.kinds]=['list']+hdr[HeaderNames.kinds]
+                    hdr[HeaderNames.spacings]=[info['interval'],nan,nan,nan]
+                    hdr[HeaderNames.axis_mins]=[info['toffset'],nan,nan,nan]
+
+                def _getSlab(d):
+                    '''
+                    Returns slice `d' of every timestep, or of the first only if not time-dependent. Images are stored
+                    (rows,cols) so in C-order the columns vary fastest, followed by time when stacked on the last axis.
+                    '''
+                    steps=range(numsteps if isTimeDependent else 1)
+                    slab=np.stack([np.asarray(obj.images[stacks[t][d]].img) for t in steps],axis=-1)
+                    assert slab.shape[:2]==(rows,cols)
+                    return slab.astype(datatype)
+
+                datafile=None
+                if detached:
+                    datafile=os.path.splitext(path)[0]+('.raw.gz' if encoding in ('gz','gzip') else '.raw')
+                    hdr[HeaderNames.data_file]=os.path.basename(datafile)
+
+                writeNRRDFile(path,hdr,_getSlab,depth,kwargs.get('compresslevel',6),kwargs.get('numthreads',None),datafile)
+
+                if setFilenames:
+                    hdr['filename']=path
+                    obj.source=hdr
+
+                f.setObject(path)
+
+        return self.mgr.runTasks([_saveFile(obj,path,kwargs)],f)
+
     def _openFileDialog(self):
         filename=self.mgr.win.chooseFileDialog('Choose NRRD filename',filterstr='NRRD Files (*.nrrd  *.nhdr)')
         if filename!='':
@@ -200,4 +503,120 @@ class NRRDPlugin(ImageScenePlugin):
 #       return setStrIndent(script % args).strip()+'\n'
 
                 
-addPlugin(NRRDPlugin())
\ No newline at end of file
+addPlugin(NRRDPlugin())
+
+### Unit tests
+
+class TestNRRDPlugin(unittest.TestCase):
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        self.plugin=getSceneMgr().getPlugin('NRRD')
+
+        self.volarr=np.fromfunction(lambda x,y,z,t:(x+1)*1000+(y+1)*100+(z+1)*10+t+1,(11,13,7,3))
+        self.vpos=vec3(-10,20,-15)
+        self.vrot=rotator(0.1,-0.2,0.13)
+        self.vspacing=vec3(1,1.5,2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def saveLoad(self,volarr,**kwargs):
+        '''Save an image object of `volarr' with the arguments `kwargs', load it again, and compare the two.'''
+        vol=self.plugin.createObjectFromArray('TestVolume',volarr,pos=self.vpos,rot=self.vrot,spacing=self.vspacing)
+        filename=Future.get(self.plugin.saveObject(vol,os.path.join(self.tempdir,'vol'),**kwargs))
+        obj=Future.get(self.plugin.loadObject(filename))
+        trans=obj.getVolumeTransform()
+
+        self.assertTrue(os.path.isfile(filename))
+        self.assertEqual(vol.getArrayDims(),obj.getArrayDims())
+        self.assertTrue(np.allclose(list(vol.getVolumeTransform().getTranslation()),list(trans.getTranslation()),atol=1e-4))
+
+        with processImageNp(obj) as arr:
+            self.assertEqual(volarr.shape,arr.shape)
+            self.assertTrue(np.allclose(volarr,arr))
+
+        return filename
+
+    def testSaveLoadRaw(self):
+        '''Test saving and loading a time-dependent raw volume.'''
+        self.saveLoad(self.volarr)
+
+    def testSaveLoadRawStatic(self):
+        '''Test saving and loading a raw volume with a single timestep.'''
+        self.saveLoad(self.volarr[...,:1])
+
+    def testSaveLoadGzip(self):
+        '''Test saving and loading a time-dependent gzip volume, which is stored as multiple gzip members.'''
+        filename=self.saveLoad(self.volarr,encoding='gzip',numthreads=3)
+
+        hdr,_=readNRRDHeader(filename)
+        self.assertEqual('gzip',hdr[HeaderNames.encoding])
+
+    def testSaveLoadGzipStatic(self):
+        '''Test saving and loading a gzip volume with a single timestep.'''
+        self.saveLoad(self.volarr[...,:1],encoding='gzip')
+
+    def testSaveLoadDetachedRaw(self):
+        '''Test saving and loading a volume with a detached raw data file.'''
+        filename=self.saveLoad(self.volarr,detached=True)
+
+        self.assertTrue(filename.endswith('.nhdr'))
+        self.assertTrue(os.path.isfile(os.path.splitext(filename)[0]+'.raw'))
+
+    def testSaveLoadDetachedGzip(self):
+        '''Test saving and loading a volume with a detached gzip data file.'''
+        filename=self.saveLoad(self.volarr,detached=True,encoding='gzip')
+
+        self.assertTrue(os.path.isfile(os.path.splitext(filename)[0]+'.raw.gz'))
+
+    def testLoadGzipTruncated(self):
+        '''Test that loading gzip data shorter than the header states raises an error.'''
+        hdr={
+            HeaderNames.type:'float',
+            HeaderNames.dimension:3,
+            HeaderNames.sizes:[4,4,4],
+            HeaderNames.endian:'little',
+            HeaderNames.encoding:'gzip'
+        }
+        filename=os.path.join(self.tempdir,'short.nrrd')
+        writeNRRDFile(filename,hdr,lambda i:np.zeros((4,4),np.float32),3) # one slab missing
+
+        with self.assertRaises(IOError):
+            readNRRDData(filename,*readNRRDHeader(filename))
+
+    def getSliceValues(self,obj):
+        '''Returns a dict mapping the Z position of each image of `obj' to the image's mean value.'''
+        return {round(img.position.z(),4):np.asarray(img.img).mean() for img in obj.images}
+
+    def testLoadReversedStack(self):
+        '''Test loading a stack whose direction is opposite the row and column cross product, and saving it again.'''
+        depth=5
+        dat=np.repeat(np.arange(depth,dtype=np.float32),16).reshape((depth,4,4)) # slice i has value i
+        hdr={
+            HeaderNames.type:'float',
+            HeaderNames.dimension:3,
+            HeaderNames.space_dimension:3,
+            HeaderNames.sizes:[4,4,depth],
+            HeaderNames.space_directions:[[1,0,0],[0,1,0],[0,0,-2]],
+            HeaderNames.kinds:['domain']*3,
+            HeaderNames.endian:'little',
+            HeaderNames.encoding:'raw',
+            HeaderNames.space_origin:[0,0,0]
+        }
+        filename=os.path.join(self.tempdir,'reversed.nrrd')
+        writeNRRDFile(filename,hdr,lambda i:dat[i],depth)
+
+        obj=Future.get(self.plugin.loadObject(filename))
+        slices=self.getSliceValues(obj)
+
+        # slices are placed along -Z from the origin in file order
+        self.assertEqual(depth,len(slices))
+        for i,z in enumerate(sorted(slices,reverse=True)):
+            self.assertAlmostEqual(-2*i,z-max(slices),4)
+            self.assertEqual(i,slices[z])
+
+        # saving produces the same slices at the same positions
+        savename=Future.get(self.plugin.saveObject(obj,os.path.join(self.tempdir,'saved.nrrd')))
+        obj1=Future.get(self.plugin.loadObject(savename))
+
+        self.assertEqual(slices,self.getSliceValues(obj1))
@@ -26,12 +26,14 @@ import nibabel
 from nibabel.nifti1 import unit_codes, xform_codes,data_type_codes
 import os
 import gzip
+import struct
 import math
 import unittest
 import tempfile
 import shutil
 import glob
 import contextlib
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
 
@@ -47,6 +49,130 @@ def processNifti(infile,outfile=None):
         nibabel.save(outim,outfile)
     
 
+def writeNiftiFile(filename,hdr,getSlice,compresslevel=6,numthreads=None,slabsize=16*1024*1024):
+    '''
+    Write the single-file Nifti1Header `hdr' and image data to `filename', compressing with gzip if the name ends with
+    .gz. The image data is never held in memory as a whole, instead getSlice(i) must return the i'th 2D slice of the
+    data, the slices of dimensions 3 and up being numbered in Fortran order, as an array of the header's dimensions 1
+    and 2 and the header's data type. Slices are fetched in parallel using `numthreads' threads. Uncompressed files
+    are written through a memory map, compressed files are written as concatenated gzip members of `slabsize' bytes
+    of slice data compressed in parallel, which standard gzip readers treat as a single stream.
+    '''
+    shape=hdr.get_data_shape()
+    dtype=hdr.get_data_dtype()
+    offset=int(hdr['vox_offset'])
+    numslices=int(np.prod(shape[2:]))
+    numthreads=numthreads or max(1,eidolon.cpu_count())
+    window=numthreads*2
+
+    hbytes=hdr.binaryblock+b'\0'*(offset-len(hdr.binaryblock)) # no extensions, pad to the data offset
+
+    with ThreadPoolExecutor(numthreads) as pool:
+        if filename.endswith('.gz'):
+            slicebytes=shape[0]*shape[1]*dtype.itemsize
+            perslab=max(1,slabsize//max(1,slicebytes))
+            slabs=(range(i,min(numslices,i+perslab)) for i in range(0,numslices,perslab))
+            compress=lambda slab:gzip.compress(b''.join(getSlice(i).tobytes(order='F') for i in slab),compresslevel)
+
+            with open(filename,'wb') as o:
+                o.write(gzip.compress(hbytes,compresslevel))
+                for member in eidolon.boundedMap(pool,compress,slabs,window):
+                    o.write(member)
+        else:
+            with open(filename,'wb') as o:
+                o.write(hbytes)
+                o.truncate(offset+numslices*shape[0]*shape[1]*dtype.itemsize)
+
+            dat=np.memmap(filename,dtype,'r+',offset,(shape[0],shape[1],numslices),'F')
+
+            def _setSlice(i):
+                dat[:,:,i]=getSlice(i)
+
+            for _ in eidolon.boundedMap(pool,_setSlice,range(numslices),window):
+                pass
+
+            dat.flush()
+            del dat
+
+
+# decompressed data sidecar file header: magic, source size, source mtime, source gzip trailer, data offset
+sidecarMagic=b'EIDNIIGZ'
+sidecarFormat='<8sQQ8sQ'
+sidecarExt='.cache'
+
+
+def getSourceIdentity(filename):
+    '''
+    Returns the size, modification time in ns, and the 8 byte gzip trailer (CRC32 and length of the uncompressed data)
+    of gzip file `filename'. A sidecar file created for `filename' is valid only while these values remain the same.
+    '''
+    st=os.stat(filename)
+    with open(filename,'rb') as o:
+        o.seek(-8,os.SEEK_END)
+        trailer=o.read(8)
+
+    return st.st_size,st.st_mtime_ns,trailer
+
+
+def getSidecarDataOffset(filename,sidecar):
+    '''Returns the offset of the data in `sidecar' if it's a valid sidecar file for `filename', None otherwise.'''
+    try:
+        with open(sidecar,'rb') as o:
+            magic,size,mtime,trailer,offset=struct.unpack(sidecarFormat,o.read(struct.calcsize(sidecarFormat)))
+    except (IOError,OSError,struct.error):
+        return None
+
+    if magic!=sidecarMagic or (size,mtime,trailer)!=getSourceIdentity(filename):
+        return None
+
+    return offset
+
+
+def readGzipSlices(filename,offset,sliceshape,dtype,numslices,sidecar=None):
+    '''
+    Yields `numslices' 2D arrays of shape `sliceshape' and type `dtype' stored in Fortran order in gzip file `filename'
+    starting `offset' bytes into the uncompressed data. Data is decompressed one slice at a time into a reused buffer
+    so each yielded array is only valid until the next is requested. If `sidecar' is given, the uncompressed data is
+    also written to this file with a header identifying `filename' so that later reads can memory-map it instead.
+    '''
+    dtype=np.dtype(dtype)
+    buf=bytearray(int(np.prod(sliceshape))*dtype.itemsize)
+    view=memoryview(buf)
+    out=None
+
+    if sidecar:
+        hsize=struct.calcsize(sidecarFormat)
+        dataoffset=hsize+(-hsize)%64
+        out=open(sidecar+'.tmp','wb')
+        out.write(struct.pack(sidecarFormat,sidecarMagic,*(getSourceIdentity(filename)+(dataoffset,))))
+        out.write(b'\0'*(dataoffset-hsize))
+
+    try:
+        with gzip.open(filename,'rb') as o:
+            o.seek(offset)
+
+            for _ in range(numslices):
+                pos=0
+                while pos<len(buf):
+                    count=o.readinto(view[pos:])
+                    if not count:
+                        raise IOError('Unexpected end of data in %r'%filename)
+                    pos+=count
+
+                if out:
+                    out.write(buf)
+
+                yield np.frombuffer(buf,dtype).reshape(sliceshape,order='F')
+
+        if out:
+            out.close()
+            os.replace(sidecar+'.tmp',sidecar)
+    finally:
+        if out and not out.closed:
+            out.close()
+            os.remove(sidecar+'.tmp')
+
+
 class NiftiPlugin(ImageScenePlugin):
     def __init__(self):
         ImageScenePlugin.__init__(self,'Nifti')
@@ -122,6 +248,13 @@ class NiftiPlugin(ImageScenePlugin):
         return self.loadObject(filename,name,imgObj)
 
     def loadObject(self,filename,name=None,imgObj=None,**kwargs):
+        '''
+        Load the NIfTI or Analyze file `filename' as an image object named `name' or a name derived from the filename.
+        Uncompressed files are memory-mapped, gzipped NIfTI files are decompressed a slice at a time straight into the
+        object's images. If the keyword argument `sidecar' is True the decompressed data is also stored in the file
+        `filename'+".cache", which is memory-mapped instead of decompressing on later loads as long as `filename'
+        has the same size, modification time, and gzip trailer as when the sidecar was written.
+        '''
         f=Future()
 
         @taskroutine('Loading NIfTI File')
@@ -188,27 +321,45 @@ class NiftiPlugin(ImageScenePlugin):
 
                 dobj=img.dataobj
                 datshape=tuple(d or 1 for d in dobj.shape) # dimensions are sometimes given as 0 for some reason?
-                
+                sidecarfile=filename+sidecarExt
+                sidecaroffset=getSidecarDataOffset(filename,sidecarfile) if filename.endswith('.gz') else None
+
                 # reading file data directly is expected to be faster than using nibabel, specifically by using memmap
-                if filename.endswith('.gz'):
-                    dat=img.get_data()
-                    #dat=np.asanyarray(dobj) # same as the above
-                    
-#                    with gzip.open(filename) as o: # TODO: not sure if this is any faster than the above
-#                        o.seek(dobj.offset) # seek beyond the header
-#                        dat=np.frombuffer(o.read(),dobj.dtype).reshape(datshape,order=dobj.order)
+                if filename.endswith('.gz') and sidecaroffset is None:
+                    # decompress a slice at a time straight into the image matrices, storing the data in a sidecar file if requested
+                    fullshape=datshape+(1,1)
+                    rows,cols,depth=fullshape[:3]
+                    numsteps=int(np.prod(fullshape[3:]))
+                    sidecar=sidecarfile if kwargs.get('sidecar',False) else None
+
+                    obj=self.createImageStackObject(name,cols,rows,depth,numsteps,position,rot,spacing)
+
+                    if task:
+                        task.setMaxProgress(depth*numsteps)
+
+                    for i,dat in enumerate(readGzipSlices(filename,dobj.offset,(rows,cols),dobj.dtype,depth*numsteps,sidecar)):
+                        t,d=divmod(i,depth)
+                        im=obj.images[d+t*depth]
+                        np.asarray(im.img)[:,:]=dat # slice is already in row-column order
+                        im.setMinMaxValues(*eidolon.minmaxMatrixReal(im.img))
+                        im.timestep=im.timestep*interval+toffset
+
+                        if task:
+                            task.setProgress(i+1)
                 else:
-                    # mmap the image data below the header in the file
-                    dat=np.memmap(dobj.file_like,dobj.dtype,'r',dobj.offset,datshape,dobj.order)
+                    if sidecaroffset is not None: # mmap the decompressed data stored previously in the sidecar file
+                        dat=np.memmap(sidecarfile,dobj.dtype,'r',sidecaroffset,datshape,dobj.order)
+                    else: # mmap the image data below the header in the file
+                        dat=np.memmap(dobj.file_like,dobj.dtype,'r',dobj.offset,datshape,dobj.order)
 
-                dat=eidolon.transposeRowsColsNP(dat) # transpose from row-column to column-row
+                    dat=eidolon.transposeRowsColsNP(dat) # transpose from row-column to column-row
+
+                    obj=self.createObjectFromArray(name,dat,interval,toffset,position,rot,spacing,task=task)
 
-                obj=self.createObjectFromArray(name,dat,interval,toffset,position,rot,spacing,task=task)
                 obj.source=hdr
 
-                # apply slope since this isn't done automatically when using memmap/gzip
-                if not filename.endswith('.gz'):
-                    eidolon.applySlopeIntercept(obj,*img.header.get_slope_inter())
+                # apply slope since this isn't done automatically when using memmap or reading slices
+                eidolon.applySlopeIntercept(obj,*img.header.get_slope_inter())
 
                 f.setObject(obj)
 
@@ -245,6 +396,13 @@ class NiftiPlugin(ImageScenePlugin):
         return self.saveObject(obj,filename,kwargs.get('overwrite',False),setObjArgs,**kwargs)
 
     def saveObject(self,obj,path,overwrite=False,setFilenames=False,**kwargs):
+        '''
+        Save the ImageSceneObject `obj' to the NIfTI file `path', adding the .nii extension if it doesn't end with .nii
+        or .nii.gz. The keyword argument `datatype' states the Numpy type to store data as (default is the source's
+        datatype or float32), gzip compression uses `numthreads' threads (default number of CPUs) and the zlib level
+        `compresslevel' (default 6), and any other keyword arguments are NIfTI header values. The returned Future
+        contains the path of the written file.
+        '''
         f=Future()
 
         @taskroutine('Saving Nifti File')
@@ -268,20 +426,27 @@ class NiftiPlugin(ImageScenePlugin):
                 else:
                     datatype=np.float32
 
-                mat=self.getImageObjectArray(obj,datatype)
-                dat=mat['array']
-                pos=mat['pos']
-                spacex,spacey,spacez=mat['spacing']
-                rot=rotator(vec3(0,0,1),math.pi)*mat['rot']*rotator(vec3(0,0,1),-halfpi)
-                toffset=mat['toffset']
-                interval=mat['interval']
+                compresslevel=kwargs.pop('compresslevel',6)
+                numthreads=kwargs.pop('numthreads',None)
+
+                info=self.getImageObjectInfo(obj)
+                pos=info['pos']
+                spacex,spacey,spacez=info['spacing']
+                rot=rotator(vec3(0,0,1),math.pi)*info['rot']*rotator(vec3(0,0,1),-halfpi)
+                toffset=info['toffset']
+                interval=info['interval']
+                cols,rows,depth,numsteps=info['shape']
 
                 affine=np.array(rot.toMatrix())
                 affine[:,3]=-pos.x(),-pos.y(),pos.z(),1.0
 
-                dat=eidolon.transposeRowsColsNP(dat) # transpose from row-column to column-row
-
-                imgobj=nibabel.nifti1.Nifti1Image(dat,affine)
+                # data is stored transposed from column-row to row-column, so the first dimension is the image rows
+                imghdr=nibabel.Nifti1Header()
+                imghdr.set_data_shape((rows,cols,depth,numsteps))
+                imghdr.set_data_dtype(datatype)
+                imghdr.set_qform(affine,'aligned')
+                imghdr.set_sform(affine,'scanner')
+                imghdr['vox_offset']=352
 
                 # header info: http://nifti.nimh.nih.gov/pub/dist/src/niftilib/nifti1.h
                 hdr={
@@ -297,10 +462,20 @@ class NiftiPlugin(ImageScenePlugin):
                 hdr.update(kwargs)
 
                 for k,v in hdr.items():
-                    if k in imgobj.header:
-                        imgobj.header[k]=v
+                    if k in imghdr:
+                        imghdr[k]=v
+
+                # read each slice straight from the image matrices, these are already in row-column order
+                stacks=obj.getVolumeStacks()
+                dtype=imghdr.get_data_dtype()
+
+                def _getSlice(i):
+                    t,d=divmod(i,depth)
+                    img=np.asarray(obj.images[stacks[t][d]].img)
+                    assert img.shape==(rows,cols)
+                    return img.astype(dtype)
 
-                nibabel.save(imgobj,path)
+                writeNiftiFile(path,imghdr,_getSlice,compresslevel,numthreads)
 
                 if setFilenames:
                     obj.plugin.removeObject(obj)
@@ -310,7 +485,7 @@ class NiftiPlugin(ImageScenePlugin):
                 elif isinstance(obj.source,dict) and 'filename' in obj.source:
                     obj.source['filename']=path
 
-                f.setObject(imgobj)
+                f.setObject(path)
 
         return self.mgr.runTasks([_saveFile(path,obj,kwargs)],f)
 
@@ -413,4 +588,20 @@ class TestNiftiPlugin(unittest.TestCase):
             
             diff=np.sum(np.abs(self.volarr-arr1))
             self.assertAlmostEqual(diff,0,4,'%r is too large'%(diff,))
-            
\ No newline at end of file
+                        
+    def testSaveLoadVolumeGzip(self):
+        '''Test saving and loading a compressed volume image, loading a second time from the sidecar file.'''
+        filename=os.path.join(self.tempdir,'vol.nii.gz')
+        self.plugin.saveObject(self.vol,filename)
+        
+        obj1=self.plugin.loadObject(filename,sidecar=True)
+        self.assertTrue(os.path.isfile(filename+sidecarExt))
+        
+        obj2=self.plugin.loadObject(filename)
+        
+        for obj in (obj1,obj2):
+            self.assertEqual(self.vol.getArrayDims(),obj.getArrayDims())
+            
+            with eidolon.processImageNp(obj) as arr:
+                diff=np.sum(np.abs(self.volarr-arr))
+                self.assertAlmostEqual(diff,0,4,'%r is too large'%(diff,))
@@ -20,11 +20,14 @@
 from eidolon import vec3,rotator,ImageSceneObject,enum,ImageScenePlugin,ReprType,taskroutine,renameFile,SceneObject,printFlush
 from eidolon import ensureExt,splitPathExt,Future,SharedImage,avgspan,ImageSceneObjectRepr,first,setStrIndent, addPlugin
 
+import eidolon
 import numpy as np
 
 import os
 import shutil
 import math
+import unittest
+import tempfile
 
 genInfoFields=enum(
     ('patientname','Patient name',str,0),
@@ -122,9 +125,20 @@ SliceOrientations=enum(
 )
 
 
-def parseParFile(filename):
+# maps each image info field position to its first column in the image info table
+imgInfoColumns=dict(zip(
+    [f[-1] for f in imgInfoFields],
+    np.cumsum([0]+[f[-2] for f in imgInfoFields])
+))
+
+
+def parseParFileTable(filename):
+    '''
+    Parse the Par file `filename' returning the general info dictionary and the image info lines as a 2D float array
+    with one row per image. Columns are located with getInfoColumn() and are converted to float so that a column that's
+    supposed to be int but is given as float will convert correctly.
+    '''
     geninfo={}
-    imginfo=[]
     numinfocols=sum(f[-2] for f in imgInfoFields)
 
     with open(filename) as o:
@@ -142,21 +156,55 @@ def parseParFile(filename):
 
         geninfo[i]=value
 
-    # parse the image info lines, this assumes the columns are always in the same order and does not check names as specified
-    for line in lines:
-        vals=list(map(float,line.split())) # convert to float now so that a column that's supposed to be int but is given as float will convert correctly
-        assert len(vals)==numinfocols
-        imgdef=[]
+    # parse the image info lines in one go, this assumes the columns are always in the same order and does not check names
+    table=np.array(' '.join(lines).split(),dtype=float)
+    assert table.shape[0]%numinfocols==0 and all(len(l.split())==numinfocols for l in lines)
+
+    return geninfo,table.reshape((-1,numinfocols))
+
+
+def getInfoColumn(table,field,vtype=None):
+    '''
+    Returns the column(s) of image info table `table' for the imgInfoFields member `field', converted to the field's
+    type or `vtype' if given. Fields with multiple values produce a 2D array with one column per value.
+    '''
+    start=imgInfoColumns[field[-1]]
+    dim=field[-2]
+    col=table[:,start] if dim==1 else table[:,start:start+dim]
+    return col.astype(vtype or field[-3])
 
-        for _,_,vtype,dim,_ in imgInfoFields:
-            if dim==1:
-                imgdef.append(vtype(vals.pop(0)))
-            else:
-                imgdef.append(tuple(vtype(vals.pop(0)) for i in range(dim)))
 
-        imginfo.append(imgdef)
+def getImageInfoList(table):
+    '''Convert the image info table `table' into a list of per-image lists of values as they're stored in imgInfoFields.'''
+    columns=[]
+    for field in imgInfoFields:
+        col=getInfoColumn(table,field).tolist()
+        columns.append(col if field[-2]==1 else list(map(tuple,col)))
 
-    return geninfo,imginfo
+    return list(map(list,zip(*columns)))
+
+
+def parseParFile(filename):
+    geninfo,table=parseParFileTable(filename)
+    return geninfo,getImageInfoList(table)
+
+
+def getRescaleValues(table,scalemethod='DV'):
+    '''
+    Returns the per-image (slope,intercept) arrays which convert stored pixel values (PV) for the images in info table
+    `table' to values for the given scale method: displayed values (DV) are PV*RS+RI while floating point values (FP)
+    are DV/(RS*SS), any other method leaves values unchanged.
+    '''
+    rs=getInfoColumn(table,imgInfoFields.rescalesl)
+    ri=getInfoColumn(table,imgInfoFields.rescalein)
+    ss=getInfoColumn(table,imgInfoFields.scalesl)
+
+    if scalemethod in ('dv','DV'):
+        return rs,ri
+    elif scalemethod in ('fp','FP'):
+        return 1.0/ss,ri/(rs*ss)
+    else:
+        return np.ones_like(rs),np.zeros_like(ri)
 
 
 def getTransformFromInfo(offcenter,angulation,sliceorient,spacing,dimensions):
@@ -272,6 +320,11 @@ class ParRecPlugin(ImageScenePlugin):
         obj.source['filename']=renameFile(oldpath,obj.getName(),overwriteFile=overwrite)
 
     def loadObject(self,filename,name=None,scalemethod='DV',**kwargs):
+        '''
+        Loads the Par file `filename' and its Rec file, returning a list of ImageSceneObjects, one for each combination
+        of image type and dynamic number. The `scalemethod' value chooses how stored pixel values are rescaled: "DV"
+        for displayed values, "FP" for floating point values, or "PV" to keep the stored values.
+        '''
         f=Future()
         @taskroutine('Loading ParRec Files')
         def _loadFile(filename,name,position=None,rot=None,toffset=None,interval=None,task=None):
@@ -287,85 +340,84 @@ class ParRecPlugin(ImageScenePlugin):
                 else:
                     raise IOError("Cannot find rec file '%s.rec'"%recfile)
 
-                geninfo,imginfo=parseParFile(filename) # read par file
-                rec=np.fromfile(recfile,np.uint8) # read rec file
-
-#               numorients=geninfo[genInfoFields.maxgrad[2]][0]
-#               numslices=geninfo[genInfoFields.maxloc[2]][0]
-#               numsteps=geninfo[genInfoFields.maxphase[2]][0]
-
-#               slicenum=imgInfoFields.slicenum[-1]
-#               trigger=imgInfoFields.trigger[-1]
-
-#               numslices=len(set(i[slicenum] for i in imginfo))
-#               # count the number of times the slice number decreases one slice to the next, this indicates how many times the slice index loops back
-#               numorients=1+sum(1 if imginfo[i][slicenum]>imginfo[i+1][slicenum] else 0 for i in range(len(imginfo)-1))
-#               # count the number of times the trigger time decreases one slice to the next, this indicates when the images transition between volumes
-#               numvols=1+sum(1 if imginfo[i][trigger]>imginfo[i+1][trigger] else 0 for i in range(len(imginfo)-1))/(numorients*numslices)
-
-#               if len(imginfo)!=(numvols*numorients*numslices*numsteps):
-#                   raise IOError,'Mismatch between stated orient, slice, and step numbers and number of images (%r != %r*%r*%r*%r)'%(len(imginfo),numorients,numslices,numsteps,numvols)
-
-#               orientsize=len(imginfo)/numorients
-                datasize=0
+                geninfo,table=parseParFileTable(filename) # read par file
+                imginfo=getImageInfoList(table)
                 objs=[]
-                rpos=0
-                typemap={} # maps type ID to dict mapping dynamic ID to SharedImage lists
-
-                for imgi in imginfo: # sum up the sizes of each image to compare against the actual size of the rec file
-                    w,h=imgi[imgInfoFields.reconres[-1]]
-                    pixelsize=imgi[imgInfoFields.imgpix[-1]]/8 # convert from bits to bytes
-                    datasize+=w*h*pixelsize
-
-                if rec.shape[0]!=datasize:
-                    raise IOError('Rec file incorrect size, should be %i but is %i'%(datasize,rec.shape[0]))
-
-                for imgi in imginfo:
-                    dynamic=imgi[imgInfoFields.dynnum[-1]]
-                    itype=imgi[imgInfoFields.imgtypemr[-1]]
-                    dims=imgi[imgInfoFields.reconres[-1]]
-                    trigger=imgi[imgInfoFields.trigger[-1]]
-                    orientation=imgi[imgInfoFields.sliceori[-1]]
-                    spacing=imgi[imgInfoFields.pixspace[-1]]
-                    offcenter=imgi[imgInfoFields.imgoff[-1]]
-                    angulation=imgi[imgInfoFields.imgang[-1]]
-                    pixelsize=imgi[imgInfoFields.imgpix[-1]]
-                    reslope=imgi[imgInfoFields.rescalesl[-1]]
-                    intercept=imgi[imgInfoFields.rescalein[-1]]
-
-                    if itype not in typemap:
-                        typemap[itype]=dict()
-
-                    if dynamic not in typemap[itype]:
-                        typemap[itype][dynamic]=[]
-
-                    images=typemap[itype][dynamic]
-
-                    dtype=np.dtype('uint'+str(pixelsize))
-
-                    pos,rot=getTransformFromInfo(offcenter,angulation,orientation,vec3(*spacing),vec3(*dims))
-
-                    imgsize=dims[0]*dims[1]*dtype.itemsize
-                    arr=rec[rpos:rpos+imgsize].view(dtype).reshape(dims)
-                    rpos+=imgsize
-
-                    if scalemethod in ('dv','DV'):
-                        arr=(arr.astype(float)*reslope)+intercept # DV scaling method
-
-                    simg=SharedImage(recfile,pos,rot,dims,spacing,trigger)
-                    simg.allocateImg('%s_t%i_d%i_img%i'%(name,itype,dynamic,len(images)))
-                    #simg.setArrayImg(arr)
-                    simg.setMinMaxValues(arr.min(),arr.max())
-                    np.asarray(simg.img)[:,:]=arr
-
-                    images.append(simg)
-
-                for itype in typemap:
-                    for dynamic,images in typemap[itype].items():
-                        vname='%s_t%i_d%i'%(name,itype,dynamic)
-                        source={'geninfo':geninfo,'imginfo':imginfo,'filename':filename,'scalemethod':scalemethod,'loadorder':len(objs)}
-                        obj=ImageSceneObject(vname,source,images,self)
-                        objs.append(obj)
+                numimgs=table.shape[0]
+
+                dims=getInfoColumn(table,imgInfoFields.reconres)
+                pixelsizes=getInfoColumn(table,imgInfoFields.imgpix)//8 # convert from bits to bytes
+                imgsizes=dims[:,0]*dims[:,1]*pixelsizes
+                offsets=np.cumsum(imgsizes)-imgsizes # images are stored in the rec file in the order they're listed
+                datasize=imgsizes.sum()
+
+                if os.path.getsize(recfile)!=datasize:
+                    raise IOError('Rec file incorrect size, should be %i but is %i'%(datasize,os.path.getsize(recfile)))
+
+                itypes=getInfoColumn(table,imgInfoFields.imgtypemr)
+                dynamics=getInfoColumn(table,imgInfoFields.dynnum)
+                triggers=getInfoColumn(table,imgInfoFields.trigger)
+                slicenums=getInfoColumn(table,imgInfoFields.slicenum)
+                spacings=getInfoColumn(table,imgInfoFields.pixspace)
+                slopes,intercepts=getRescaleValues(table,scalemethod)
+
+                # if all images are the same size and type map the rec file as one stack, otherwise map individual images,
+                # dimensions are (columns,rows) but the pixels of each image are stored row by row as the matrices are
+                isUniform=(dims==dims[0]).all() and (pixelsizes==pixelsizes[0]).all()
+                if isUniform:
+                    dtype=np.dtype('<u%i'%pixelsizes[0])
+                    stack=np.memmap(recfile,dtype,'r',0,(numimgs,dims[0,1],dims[0,0]))
+                    getImage=lambda i:stack[i]
+                else:
+                    rec=np.memmap(recfile,np.uint8,'r')
+                    getImage=lambda i:rec[offsets[i]:offsets[i]+imgsizes[i]].view('<u%i'%pixelsizes[i]).reshape(tuple(dims[i][::-1]))
+
+                # calculate transforms for each distinct slice geometry only, these are shared between timesteps
+                geomcols=[imgInfoFields.imgoff,imgInfoFields.imgang,imgInfoFields.sliceori,imgInfoFields.pixspace,imgInfoFields.reconres]
+                geoms=np.column_stack([getInfoColumn(table,c,float) for c in geomcols])
+                uniquegeoms,geominds=np.unique(geoms,axis=0,return_inverse=True)
+                transforms=[getTransformFromInfo(g[0:3],g[3:6],int(g[6]),vec3(*g[7:9]),vec3(*g[9:11])) for g in uniquegeoms]
+
+                # order images by type then dynamic in order of first appearance, then by trigger time and slice number
+                _,typefirst,typeinds=np.unique(itypes,return_index=True,return_inverse=True)
+                _,groupfirst,groupinds=np.unique(np.column_stack((itypes,dynamics)),axis=0,return_index=True,return_inverse=True)
+                typeorder=typefirst[typeinds.ravel()]
+                grouporder=groupfirst[groupinds.ravel()]
+                order=np.lexsort((np.arange(numimgs),slicenums,triggers,grouporder,typeorder))
+                groupstarts=np.flatnonzero(np.diff(grouporder[order]))+1
+
+                if task:
+                    task.setMaxProgress(numimgs)
+
+                numloaded=0
+                for count,group in enumerate(np.split(order,groupstarts)):
+                    itype=itypes[group[0]]
+                    dynamic=dynamics[group[0]]
+                    vname='%s_t%i_d%i'%(name,itype,dynamic)
+                    images=[]
+
+                    for i in group:
+                        pos,rot=transforms[geominds.ravel()[i]]
+                        arr=getImage(i)
+
+                        simg=SharedImage(recfile,pos,rot,tuple(dims[i]),tuple(spacings[i]),float(triggers[i]))
+                        simg.allocateImg('%s_img%i'%(vname,len(images)))
+
+                        # rescale directly into the image matrix, this reads the image from the rec file only once
+                        img=np.asarray(simg.img)
+                        np.multiply(arr,slopes[i],out=img,casting='unsafe')
+                        img+=intercepts[i]
+                        simg.setMinMaxValues(float(img.min()),float(img.max())) # taken from the matrix not the rec file
+
+                        images.append(simg)
+                        numloaded+=1
+
+                        if task:
+                            task.setProgress(numloaded)
+
+                    source={'geninfo':geninfo,'imginfo':imginfo,'filename':filename,'scalemethod':scalemethod,'loadorder':count}
+                    obj=ImageSceneObject(vname,source,images,self)
+                    objs.append(obj)
 
 #               for numo in range(numorients):
 #                   orientimgs=imginfo[numo*orientsize:(numo+1)*orientsize]
@@ -405,8 +457,6 @@ class ParRecPlugin(ImageScenePlugin):
 #                       obj=ImageSceneObject(vname,{'geninfo':geninfo,'imginfo':imginfo,'filename':filename},images,self)
 #                       objs.append(obj)
 
-                assert rpos==rec.shape[0],'%i != %i'%(rpos,rec.shape[0])
-
                 f.setObject(objs)
 
         return self.mgr.runTasks([_loadFile(filename,name)],f)
@@ -457,3 +507,137 @@ class ParRecPlugin(ImageScenePlugin):
         return setStrIndent(script % args).strip()+'\n'
 
 addPlugin(ParRecPlugin())
+
+
+### Unit tests
+
+class TestParRecPlugin(unittest.TestCase):
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        self.plugin=eidolon.getSceneMgr().getPlugin('ParRec')
+        self.parfile=os.path.join(self.tempdir,'test.par')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def createImageInfo(self,slicenum,dynamic,itype,dims=(4,5),pixelsize=16,slope=2.0,intercept=-3.0,scale=0.5,trigger=0):
+        '''Returns a dictionary of image info values for every field in imgInfoFields, using defaults not given here.'''
+        info={f[-1]:(1,)*f[-2] if f[-2]>1 else 0 for f in imgInfoFields}
+        info.update({
+            imgInfoFields.slicenum[-1]:slicenum,
+            imgInfoFields.dynnum[-1]:dynamic,
+            imgInfoFields.imgtypemr[-1]:itype,
+            imgInfoFields.imgpix[-1]:pixelsize,
+            imgInfoFields.reconres[-1]:dims,
+            imgInfoFields.rescalein[-1]:intercept,
+            imgInfoFields.rescalesl[-1]:slope,
+            imgInfoFields.scalesl[-1]:scale,
+            imgInfoFields.imgoff[-1]:(0,0,slicenum*2.0),
+            imgInfoFields.sliceori[-1]:1, # transverse
+            imgInfoFields.pixspace[-1]:(1.5,1.5),
+            imgInfoFields.trigger[-1]:trigger
+        })
+        return info
+
+    def writeParRec(self,infos):
+        '''Write the par file with the image info dictionaries `infos' and a rec file with pixel i of each image set to i.'''
+        with open(self.parfile,'w') as o:
+            o.write('# test par file\n')
+            for name,_,vtype,_ in genInfoFields:
+                o.write('.    %s    :   %s\n'%(name,'test' if vtype==str else '1'))
+
+            o.write('#\n')
+            for info in infos:
+                vals=[]
+                for field in imgInfoFields:
+                    val=info[field[-1]]
+                    vals+=map(str,val if field[-2]>1 else [val])
+
+                o.write(' '.join(vals)+'\n')
+
+        with open(os.path.splitext(self.parfile)[0]+'.rec','wb') as o:
+            for info in infos:
+                w,h=info[imgInfoFields.reconres[-1]]
+                o.write(np.arange(w*h,dtype='<u%i'%(info[imgInfoFields.imgpix[-1]]//8)).tobytes())
+
+    def testParseTable(self):
+        '''Test the parsed table and image info lists have a row per image with values in the right columns.'''
+        infos=[self.createImageInfo(s,d,0,slope=s+1.5) for d in (1,2) for s in (1,2,3)]
+        self.writeParRec(infos)
+
+        geninfo,table=parseParFileTable(self.parfile)
+        _,imginfo=parseParFile(self.parfile)
+
+        self.assertEqual(len(genInfoFields),len(geninfo))
+        self.assertEqual('test',geninfo[genInfoFields.patientname[-1]])
+        self.assertEqual((len(infos),sum(f[-2] for f in imgInfoFields)),table.shape)
+        self.assertEqual(len(infos),len(imginfo))
+
+        self.assertEqual([1,2,3,1,2,3],getInfoColumn(table,imgInfoFields.slicenum).tolist())
+        self.assertEqual([[4,5]]*len(infos),getInfoColumn(table,imgInfoFields.reconres).tolist())
+        self.assertTrue(np.allclose([2.5,3.5,4.5]*2,getInfoColumn(table,imgInfoFields.rescalesl)))
+
+        for info,row in zip(infos,imginfo):
+            for field in imgInfoFields:
+                val=info[field[-1]]
+                self.assertEqual(tuple(map(field[-3],val)) if field[-2]>1 else field[-3](val),row[field[-1]])
+
+    def testParseTableBadLine(self):
+        '''Test that an image info line with the wrong number of values is rejected.'''
+        self.writeParRec([self.createImageInfo(1,1,0)])
+
+        with open(self.parfile,'a') as o:
+            o.write('1 2 3\n')
+
+        with self.assertRaises(AssertionError):
+            parseParFileTable(self.parfile)
+
+    def testRescaleValues(self):
+        '''Test the slopes and intercepts of the DV, FP, and PV scale methods.'''
+        self.writeParRec([self.createImageInfo(1,1,0),self.createImageInfo(2,1,0,slope=4.0,intercept=1.0,scale=0.25)])
+        _,table=parseParFileTable(self.parfile)
+        pv=np.asarray([10.0,20.0])
+
+        slopes,intercepts=getRescaleValues(table,'DV')
+        self.assertTrue(np.allclose([17,81],pv*slopes+intercepts))
+
+        slopes,intercepts=getRescaleValues(table,'FP')
+        self.assertTrue(np.allclose([17/(2*0.5),81/(4*0.25)],pv*slopes+intercepts))
+
+        slopes,intercepts=getRescaleValues(table,'PV')
+        self.assertTrue(np.allclose(pv,pv*slopes+intercepts))
+
+    def testLoadGroups(self):
+        '''Test loading images into one object per image type and dynamic with rescaled values and min/max values.'''
+        infos=[self.createImageInfo(s,d,t) for t in (0,3) for d in (1,2) for s in (1,2)]
+        self.writeParRec(infos)
+
+        objs=eidolon.Future.get(self.plugin.loadObject(self.parfile))
+
+        self.assertEqual(['test_t0_d1','test_t0_d2','test_t3_d1','test_t3_d2'],[o.getName() for o in objs])
+
+        for obj in objs:
+            self.assertEqual(2,len(obj.images))
+            for img in obj.images:
+                expected=np.arange(20).reshape((5,4))*2.0-3.0 # 4 columns and 5 rows
+                self.assertTrue(np.allclose(expected,np.asarray(img.img)))
+                self.assertEqual((-3.0,35.0),(img.imgmin,img.imgmax))
+
+    def testLoadMixedSizes(self):
+        '''Test loading images of different sizes and pixel types which are read individually from the rec file.'''
+        self.writeParRec([self.createImageInfo(1,1,0),self.createImageInfo(2,1,0,dims=(3,2),pixelsize=8,slope=1.0,intercept=0)])
+
+        obj=eidolon.Future.get(self.plugin.loadObject(self.parfile))[0]
+
+        self.assertTrue(np.allclose(np.arange(20).reshape((5,4))*2.0-3.0,np.asarray(obj.images[0].img)))
+        self.assertTrue(np.allclose(np.arange(6).reshape((2,3)),np.asarray(obj.images[1].img)))
+
+    def testLoadWrongRecSize(self):
+        '''Test that a rec file whose size doesn't match the par file is rejected.'''
+        self.writeParRec([self.createImageInfo(1,1,0)])
+
+        with open(os.path.splitext(self.parfile)[0]+'.rec','ab') as o:
+            o.write(b'\0')
+
+        with self.assertRaises(IOError):
+            eidolon.Future.get(self.plugin.loadObject(self.parfile))
@@ -18,12 +18,135 @@
 
 
 from eidolon import *
-from struct import unpack,calcsize
+import os
+import re
+import unittest
+import tempfile
+import shutil
+import numpy as np
 
 HEADER_SIZE=80
 
 keywords=enum('solid','facet normal','outer loop','vertex','endloop','endfacet','endsolid')
 
+# record layout of a binary STL triangle: normal, 3 vertices, attribute byte count
+triangleDtype=np.dtype([('normal','<f4',(3,)),('vertices','<f4',(3,3)),('attr','<u2')])
+
+floatregex=r'([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)'
+normalRegex=re.compile((r'facet\s+normal'+r'\s+%s'*3)%((floatregex,)*3),re.I)
+vertexRegex=re.compile((r'vertex'+r'\s+%s'*3)%((floatregex,)*3),re.I)
+
+
+def isBinarySTL(filename):
+    '''
+    Returns True if `filename' is a binary STL file. The file size is checked against the triangle count in the header
+    since binary files may also start with "solid".
+    '''
+    size=os.path.getsize(filename)
+    if size<HEADER_SIZE+4:
+        return False
+        
+    with open(filename,'rb') as o:
+        o.seek(HEADER_SIZE)
+        numtris=int(np.frombuffer(o.read(4),'<u4')[0])
+        
+    return size==HEADER_SIZE+4+numtris*triangleDtype.itemsize
+
+
+def readSTLFile(filename):
+    '''
+    Read the ASCII or binary STL file `filename', returning the header string, a (N,3,3) array of the vertices of each
+    of the N triangles, and the (N,3) array of their normals.
+    '''
+    if isBinarySTL(filename):
+        with open(filename,'rb') as o:
+            header=o.read(HEADER_SIZE).rstrip(b'\0 ').decode('latin-1')
+            numtris=int(np.frombuffer(o.read(4),'<u4')[0])
+            tris=np.frombuffer(o.read(numtris*triangleDtype.itemsize),triangleDtype)
+            
+        return header,tris['vertices'].astype(np.float64),tris['normal'].astype(np.float64)
+    
+    with open(filename) as o:
+        text=o.read()
+        
+    header=text.split('\n',1)[0].strip()
+    normals=np.asarray(normalRegex.findall(text),np.float64).reshape((-1,3))
+    vertices=np.asarray(vertexRegex.findall(text),np.float64).reshape((-1,3,3))
+    
+    if vertices.shape[0]!=normals.shape[0]:
+        raise IOError('Found %i facets but %i triangles in %r'%(normals.shape[0],vertices.shape[0],filename))
+    
+    return header,vertices,normals
+
+
+def _mixBits(vals):
+    '''Returns the splitmix64 finalizer of the uint64 array `vals', so that every input bit affects every output bit.'''
+    vals=(vals^(vals>>np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+    vals=(vals^(vals>>np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+    return vals^(vals>>np.uint64(31))
+
+
+def weldVertices(vertices):
+    '''
+    Weld the coincident vertices of the (N,3,3) triangle vertex array `vertices', returning the (M,3) array of unique 
+    vertices in order of first appearance and the (N,3) array of indices into it for each triangle. Only vertices with
+    identical coordinates are merged.
+    '''
+    verts=np.ascontiguousarray(vertices.reshape((-1,3))+0.0) # adding 0 converts -0.0 to 0.0 so these compare equal
+    
+    # hash the bits of each vertex into one integer and group vertices by hash value
+    bits=verts.view(np.uint64)
+    hashes=_mixBits(_mixBits(_mixBits(bits[:,0])^bits[:,1])^bits[:,2])
+    _,firstinds,inverse=np.unique(hashes,return_index=True,return_inverse=True)
+    
+    # if hashes collide compare whole rows instead, this is correct but much slower
+    if not np.array_equal(verts[firstinds][inverse.ravel()],verts):
+        rows=verts.view(np.dtype((np.void,verts.dtype.itemsize*3))).ravel()
+        _,firstinds,inverse=np.unique(rows,return_index=True,return_inverse=True)
+    
+    # renumber unique vertices by first appearance so that node order follows the file
+    order=np.argsort(firstinds)
+    renumber=np.empty_like(order)
+    renumber[order]=np.arange(order.shape[0])
+    
+    return verts[firstinds[order]],renumber[inverse.ravel()].reshape((-1,3))
+
+
+def writeBinarySTL(filename,nodes,inds,header=''):
+    '''
+    Write the triangle mesh defined by the (M,3) array `nodes' and the (N,3) index array `inds' to the binary STL file
+    `filename', with `header' stored in the 80 byte header. Triangle normals are computed from the vertices. Flat node
+    and index arrays are accepted as lists of 3-tuples, any other shape raises ValueError.
+    '''
+    nodes=np.asarray(nodes,np.float64)
+    inds=np.asarray(inds)
+    
+    if nodes.size%3!=0 or (nodes.ndim>1 and nodes.shape[-1]!=3) or nodes.ndim>2:
+        raise ValueError('Nodes must be a (M,3) or flat array, got shape %r'%(nodes.shape,))
+    if inds.size%3!=0 or (inds.ndim>1 and inds.shape[-1] not in (1,3)) or inds.ndim>2:
+        raise ValueError('Indices must be a (N,3) or single column array, got shape %r'%(inds.shape,))
+    
+    nodes=nodes.reshape((-1,3))
+    inds=inds.reshape((-1,3))
+    
+    if inds.size>0 and (inds.min()<0 or inds.max()>=nodes.shape[0]):
+        raise ValueError('Indices must be in the range [0,%i)'%nodes.shape[0])
+    
+    vertices=nodes[inds]
+    normals=np.cross(vertices[:,1]-vertices[:,0],vertices[:,2]-vertices[:,0])
+    lengths=np.linalg.norm(normals,axis=1)
+    normals/=np.where(lengths>0,lengths,1)[:,np.newaxis]
+    
+    tris=np.zeros((vertices.shape[0],),triangleDtype)
+    tris['normal']=normals
+    tris['vertices']=vertices
+    
+    with open(filename,'wb') as o:
+        o.write(header.encode('latin-1','replace')[:HEADER_SIZE].ljust(HEADER_SIZE,b' '))
+        o.write(np.asarray([tris.shape[0]],'<u4').tobytes())
+        o.write(tris.tobytes())
+        
+
 class STLPlugin(MeshScenePlugin):
     def __init__(self):
         ScenePlugin.__init__(self,'STL')
@@ -59,64 +182,78 @@ class STLPlugin(MeshScenePlugin):
         if filename!='':
             self.mgr.addFuncTask(lambda:self.mgr.addSceneObject(self.loadObject(filename)),'Importing STL file')
 
-    def loadObject(self,filename,name=None,**kwargs):
-        def _readvertex(o,nodes):
-            v=o.readline().lower().split()
-            assert v[0]==keywords.vertex
-            nodes.append(vec3(*map(float,v[1:])))
-            
-        def _assertline(o,keyword):
-            line=o.readline().lower().strip()
-            assert line==keyword,'%r != %r'%(line,keyword)
-            
+    def loadObject(self,filename,name=None,weld=True,**kwargs):
+        '''
+        Load the STL file `filename' as a triangle mesh object. If `weld' is True coincident vertices are merged so 
+        that triangles share nodes, otherwise each triangle has its own 3 nodes as stored in the file.
+        '''
         f=Future()
         @taskroutine('Loading STL File')
-        def _loadFile(filename,name,task):
+        def _loadFile(filename,name,weld,task):
             with f:
                 name=self.mgr.getUniqueObjName(name or splitPathExt(filename)[1])
-                nodes=Vec3Matrix('nodes',0,1)
-                normals=RealMatrix('normals',0,3)
+                header,vertices,trinormals=readSTLFile(filename)
+                
+                if weld:
+                    nodearr,indarr=weldVertices(vertices)
+                else:
+                    nodearr=vertices.reshape((-1,3))
+                    indarr=np.arange(nodearr.shape[0]).reshape((-1,3))
+                
+                nodes=Vec3Matrix('nodes',nodearr.shape[0])
+                normals=RealMatrix('normals',trinormals.shape[0],3)
                 normals.meta(StdProps._topology,'triangles')
                 normals.meta(StdProps._spatial,'triangles')
-                indices=IndexMatrix('triangles',ElemType._Tri1NL,0,3)
+                indices=IndexMatrix('triangles',ElemType._Tri1NL,indarr.shape[0],3)
                 indices.meta(StdProps._isspatial,'True')
                 
-                with open(filename,'rb') as o:
-                    headcheck=o.read(len(keywords.solid)).lower()
-                    if headcheck==keywords.solid: # ascii file
-                        name=o.readline().strip()
-                        header='%s %s'%(keywords.solid,name)
-                        line=o.readline().lower()
-                        while line and not line.startswith(keywords.endsolid):
-                            assert ('%s %s'%tuple(line.split()[:2]))==keywords.facet_normal
-                            normal=list(map(float,line.split()[2:]))
-                            normals.append(*normal)
-                            _assertline(o,keywords.outer_loop)
-                            _readvertex(o,nodes)
-                            _readvertex(o,nodes)
-                            _readvertex(o,nodes)
-                            _assertline(o,keywords.endloop)
-                            _assertline(o,keywords.endfacet)
-                            line=o.readline().lower()
-                    else:
-                        header=headcheck+o.read(HEADER_SIZE-len(keywords.solid))
-                        numtris=unpack('I',o.read(calcsize('I')))[0]
-                        triformat='fff fff fff fff H'
-                        trisize=calcsize(triformat)
-                        
-                        for i in range(numtris):
-                            triangle=unpack(triformat,o.read(trisize))
-                            normals.append(*triangle[0:3])
-                            nodes.append(vec3(*triangle[3:6]))
-                            nodes.append(vec3(*triangle[6:9]))
-                            nodes.append(vec3(*triangle[9:12]))
-                            
-                for i in range(0,len(nodes),3):
-                    indices.append(i,i+1,i+2)
+                if nodearr.shape[0]>0:
+                    np.asarray(nodes)[:,:]=nodearr
+                    np.asarray(normals)[:,:]=trinormals
+                    np.asarray(indices)[:,:]=indarr
                     
                 f.setObject(MeshSceneObject(name,PyDataSet('STLDS',nodes,[indices],[normals]),self,filename=filename,header=header))
             
-        return self.mgr.runTasks(_loadFile(filename,name),f)
+        return self.mgr.runTasks(_loadFile(filename,name,weld),f)
+    
+    def saveObject(self,obj,path,overwrite=False,setFilenames=False,**kwargs):
+        '''
+        Save the triangle topologies of `obj' to binary STL file(s) at `path', one file per timestep. Normals are 
+        computed from the triangles and the header is taken from keyword argument "header" or the object's name. 
+        '''
+        if not isinstance(obj,MeshSceneObject):
+            raise ValueError('Can only save MeshSceneObject instances as STL')
+            
+        f=Future()
+        @taskroutine('Saving STL File')
+        def _saveFile(obj,path,overwrite,setFilenames,header,task):
+            with f:
+                dds=obj.datasets
+                prefix=os.path.join(path,obj.getName()) if os.path.isdir(path) else os.path.splitext(path)[0]
+                
+                if len(dds)==1:
+                    filenames=[prefix+'.stl']
+                else:
+                    filenames=['%s_%.4i.stl'%(prefix,i) for i in range(len(dds))]
+                    
+                if not overwrite and any(os.path.exists(fn) for fn in filenames):
+                    raise IOError('Not overwriting existing STL file(s) for %r'%obj.getName())
+                
+                for fn,ds in zip(filenames,dds):
+                    tris=[np.asarray(i) for i in ds.enumIndexSets() if i.getType()==ElemType._Tri1NL and i.n()>0]
+                    if not tris:
+                        raise ValueError('Dataset %r has no triangle topology to save as STL'%ds.getName())
+                    
+                    writeBinarySTL(fn,np.asarray(ds.getNodes()),np.concatenate(tris),header)
+                    
+                if setFilenames and len(filenames)==1:
+                    obj.plugin=self
+                    obj.kwargs={'filename':filenames[0],'header':header}
+                    
+                f.setObject(filenames)
+                
+        header=kwargs.get('header',obj.kwargs.get('header',obj.getName()))
+        return self.mgr.runTasks(_saveFile(obj,path,overwrite,setFilenames,header),f)
 
     def getScriptCode(self,obj,**kwargs):
         if isinstance(obj,MeshSceneObject):
@@ -137,4 +274,76 @@ class STLPlugin(MeshScenePlugin):
             return MeshScenePlugin.getScriptCode(self,obj,**kwargs)     
             
         
-addPlugin(STLPlugin())
\ No newline at end of file
+addPlugin(STLPlugin())
+
+### Unit tests
+
+class TestSTLPlugin(unittest.TestCase):
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        self.plugin=getSceneMgr().getPlugin('STL')
+
+        # a unit square of two triangles, nodes are numbered in order of first appearance like welded files
+        self.nodearr=np.asarray([(0,0,0),(1,0,0),(0,1,0),(1,1,0)],np.float64)
+        self.indarr=np.asarray([(0,1,2),(2,1,3)])
+
+        nodes=Vec3Matrix('nodes',self.nodearr.shape[0])
+        np.asarray(nodes)[:,:]=self.nodearr
+        inds=IndexMatrix('tris',ElemType._Tri1NL,self.indarr.shape[0],3)
+        np.asarray(inds)[:,:]=self.indarr
+
+        self.obj=MeshSceneObject('square',PyDataSet('squareds',nodes,[inds]),self.plugin)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def checkObject(self,obj,header):
+        ds=obj.datasets[0]
+        self.assertEqual(header,obj.kwargs['header'])
+        self.assertTrue(np.allclose(self.nodearr,np.asarray(ds.getNodes())))
+        self.assertTrue(np.array_equal(self.indarr,np.asarray(ds.getIndexSet('triangles'))))
+        self.assertTrue(np.allclose(np.asarray(ds.getDataField('normals')),[(0,0,1),(0,0,1)]))
+
+    def testSaveLoadBinary(self):
+        '''Test saving and loading a binary STL file.'''
+        filenames=Future.get(self.plugin.saveObject(self.obj,self.tempdir,header='test header'))
+        self.assertEqual(1,len(filenames))
+        self.assertTrue(isBinarySTL(filenames[0]))
+
+        self.checkObject(Future.get(self.plugin.loadObject(filenames[0])),'test header')
+
+    def testLoadASCII(self):
+        '''Test loading an ASCII STL file with and without welding.'''
+        filename=os.path.join(self.tempdir,'square.stl')
+        with open(filename,'w') as o:
+            o.write('solid square\n')
+            for tri in self.indarr:
+                o.write('facet normal 0 0 1\n outer loop\n')
+                for n in tri:
+                    o.write('  vertex %f %f %f\n'%tuple(self.nodearr[n]))
+                o.write(' endloop\nendfacet\n')
+            o.write('endsolid square\n')
+
+        self.assertFalse(isBinarySTL(filename))
+        self.checkObject(Future.get(self.plugin.loadObject(filename)),'solid square')
+
+        unwelded=Future.get(self.plugin.loadObject(filename,weld=False)).datasets[0]
+        self.assertEqual(6,unwelded.getNodes().n())
+        self.assertTrue(np.allclose(self.nodearr[self.indarr.ravel()],np.asarray(unwelded.getNodes())))
+
+    def testWriteShapes(self):
+        '''Test writing flat node and index arrays, and that other shapes are rejected.'''
+        filename=os.path.join(self.tempdir,'flat.stl')
+        writeBinarySTL(filename,self.nodearr.ravel(),self.indarr.reshape((-1,1)))
+
+        _,vertices,normals=readSTLFile(filename)
+        self.assertTrue(np.allclose(self.nodearr[self.indarr],vertices))
+
+        with self.assertRaises(ValueError):
+            writeBinarySTL(filename,self.nodearr[:,:2],self.indarr)
+
+        with self.assertRaises(ValueError):
+            writeBinarySTL(filename,self.nodearr,self.indarr[:,:2])
+
+        with self.assertRaises(ValueError):
+            writeBinarySTL(filename,self.nodearr,self.indarr+2)
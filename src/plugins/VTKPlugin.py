@@ -17,15 +17,27 @@
 # with this program (LICENSE.txt).  If not, see <http://www.gnu.org/licenses/>
 
 import os
-import xml.etree.cElementTree as ET
+import re
 import base64
 import contextlib
-import warnings
+import hashlib
+import zlib
+import lzma
+import sys
+import unittest
+import tempfile
+import shutil
+from io import BytesIO
 
 try:
-    from StringIO import StringIO
-except:
-    from io import StringIO
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+try: # lz4 is only needed for LZ4 compressed XML files
+    import lz4.block as lz4block
+except ImportError:
+    lz4block=None
 
 import numpy as np
 
@@ -35,23 +47,14 @@ from eidolon import (
     taskroutine,PyDataSet, uniqueStr, copyfileSafe
 )
 
-eidolon.addLibraryFile('pyparsing-2.2.0-py2.py3-none-any')
-
-from pyparsing import ParserElement,Word, Suppress, Regex, OneOrMore, ZeroOrMore, alphas, alphanums, CharsNotIn, lineEnd, Optional, Keyword
 
-try: # try to use pandas for loading text arrays
-    from pandas import read_csv
-    
-    def readTextArray(text,dtype):
-        buf=StringIO(text.replace(' ','\n'))
-        nn=read_csv(buf,sep='\n',names=['c1'],engine='c',dtype=dtype)
-        return np.asarray(nn).flatten()
-except ImportError: # no pandas, use np.loadtxt
-    warnings.warn('Pandas not found, VTK XML load will be slow.')
+def readTextArray(text,dtype):
+    '''Parse the whitespace-separated values in `text' as an array of type `dtype'.'''
+    if not text or not text.strip():
+        return np.zeros((0,),dtype)
     
-    def readTextArray(text,dtype):
-        buf=StringIO(text.replace(' ','\n'))
-        return np.loadtxt(buf,dtype).flatten()
+    textdtype=np.float64 if np.dtype(dtype).kind=='f' else np.int64
+    return np.fromstring(text,dtype=textdtype,sep=' ').astype(dtype)
 
 
 VTKProps=enum('header','desc','version','datasettype','griddims','attrtype','polyinds',desc='Metadata property names for storing VTK info in DataSet objects')
@@ -70,97 +73,811 @@ CellTypes=enum(
 )
 
 
-matrixCounter=0 # simple way of ensuring matrix name uniqueness
+# maps legacy VTK type names to numpy types, binary data in legacy files is always big endian
+LegacyDataTypes={
+    'unsigned_char':np.uint8,'char':np.int8,'unsigned_short':np.uint16,'short':np.int16,
+    'unsigned_int':np.uint32,'int':np.int32,'unsigned_long':np.uint64,'long':np.int64,
+    'float':np.float32,'double':np.float64,'vtkidtype':np.int32,
+    'vtktypeint8':np.int8,'vtktypeuint8':np.uint8,'vtktypeint16':np.int16,'vtktypeuint16':np.uint16,
+    'vtktypeint32':np.int32,'vtktypeuint32':np.uint32,'vtktypeint64':np.int64,'vtktypeuint64':np.uint64,
+    'vtktypefloat32':np.float32,'vtktypefloat64':np.float64
+}
+
+# matches the first line in a text block which starts a new section rather than continuing a list of numbers
+sectionRegex=re.compile(br'^[ \t]*(?!(?:nan|NaN|NAN|inf|Inf|INF)\b)[A-Za-z_]',re.M)
+
+
+class LegacyVTKReader(object):
+    '''
+    Streaming reader for legacy .vtk files in ASCII or BINARY format. Section header lines are read individually while 
+    the numeric blocks following them are parsed in bulk chunks straight into arrays, so the file is never held in 
+    memory as text. The result of read() is a list [version,desc,dataset,attrs...] where `dataset' is a tuple starting
+    with the dataset type name followed by its components, and each of `attrs' is a tuple starting with POINT_DATA or
+    CELL_DATA, the value count, then a tuple for each attribute section. Nodes are returned as Vec3Matrix objects, cell
+    lists and types as IndexMatrix objects, and attribute data as RealMatrix objects with the section's width as the 
+    column count. Cell lists are kept in the flat legacy format [count, index...] for each cell.
+    '''
     
+    chunksize=1<<22 # number of bytes to read from the stream at a time
     
-def toMatrix(mtype):
-    def _split(s=None,l=None,t=None):
-        if t==None or len(t)==0:
-            return None
-            
-        global matrixCounter
-        matrixCounter+=1
-        
-        if mtype: # if there's a matrix type, convert each element of t accordingly
-            tokens=t[0].strip().split()
-            if mtype==vec3:
-                mat=[vec3(float(a),float(b),float(c)) for a,b,c in eidolon.group(tokens,3)]
+    def __init__(self,stream):
+        self.stream=stream
+        self.buf=b''
+        self.eof=False
+        self.isBinary=False
+        self.version=None
+        
+    def _fill(self,minsize):
+        '''Read from the stream until the buffer has at least `minsize' bytes or the stream is exhausted.'''
+        while len(self.buf)<minsize and not self.eof:
+            data=self.stream.read(max(self.chunksize,minsize-len(self.buf)))
+            if data:
+                self.buf+=data
+            else:
+                self.eof=True
+                
+    def readLine(self,skipEmpty=True):
+        '''Returns the next stripped line, skipping empty lines if `skipEmpty' is True, or None at the end of file.'''
+        while True:
+            pos=self.buf.find(b'\n')
+            while pos==-1 and not self.eof:
+                start=len(self.buf)
+                self._fill(start+1)
+                pos=self.buf.find(b'\n',start)
+                
+            if pos==-1: # last line with no newline
+                if not self.buf:
+                    return None
+                pos=len(self.buf)
+                
+            line=self.buf[:pos].strip().decode('utf-8','replace')
+            self.buf=self.buf[pos+1:]
+            
+            if line or not skipEmpty:
+                return line
+            
+    def peekKeyword(self,keyword):
+        '''Returns True if the next non-empty line starts with the string `keyword'.'''
+        self._fill(len(keyword)+1024)
+        return re.match(br'\s*'+keyword.encode(),self.buf) is not None
+            
+    def readArray(self,count,dtype):
+        '''Read `count' values of type `dtype', either as big endian binary or as whitespace-separated text.'''
+        dtype=np.dtype(dtype)
+        
+        if self.isBinary:
+            nbytes=count*dtype.itemsize
+            self._fill(nbytes)
+            if len(self.buf)<nbytes:
+                raise ValueError('Unexpected end of file reading %i values'%count)
+            
+            result=np.frombuffer(memoryview(self.buf)[:nbytes],dtype.newbyteorder('>')).astype(dtype)
+            self.buf=self.buf[nbytes:]
+            return result
+        
+        result=np.empty((count,),dtype)
+        textdtype=np.float64 if dtype.kind=='f' else np.int64
+        pos=0
+        
+        while pos<count:
+            self._fill(self.chunksize)
+            buf=self.buf
+            match=sectionRegex.search(buf)
+            
+            # parse up to the next section or the last whitespace in the buffer so that no number is split
+            if match:
+                end=match.start()
+            elif self.eof:
+                end=len(buf)
             else:
-                mat=list(map(mtype,tokens))
-        else: # otherwise assume the elements in t are converted already and just make a list of these
-            mat=list(t)
+                end=max(buf.rfind(b' '),buf.rfind(b'\n'),buf.rfind(b'\t'))+1
+                
+            block=buf[:end]
+            self.buf=buf[end:]
+            
+            if block.strip():
+                vals=np.fromstring(block,dtype=textdtype,sep=' ')
+                if pos+vals.shape[0]>count:
+                    raise ValueError('Expected %i values but found more'%count)
+                
+                result[pos:pos+vals.shape[0]]=vals
+                pos+=vals.shape[0]
+            elif match or self.eof: # reached the next section or the end of file before reading everything
+                raise ValueError('Expected %i values but found %i'%(count,pos))
+            else: # buffer contains no whitespace, extend it so that the next number can be read whole
+                self._fill(len(self.buf)+self.chunksize)
+            
+        return result
+    
+    def readMatrix(self,name,count,width,dtype):
+        '''Read `count'*`width' values of type `dtype' into a RealMatrix of dimensions (`count',`width').'''
+        arr=self.readArray(count*width,dtype)
+        mat=eidolon.RealMatrix(name,count,width)
+        if count>0:
+            np.asarray(mat)[:,:]=arr.reshape((count,width))
+            
+        return mat
+    
+    def readNodes(self,count,dtype):
+        '''Read `count' vectors of type `dtype' into a Vec3Matrix.'''
+        arr=self.readArray(count*3,dtype)
+        nodes=eidolon.Vec3Matrix('nodes',count)
+        if count>0:
+            np.asarray(nodes)[:,:]=arr.reshape((count,3))
             
-        return eidolon.listToMatrix(mat,'mat'+str(matrixCounter))
+        return nodes
+    
+    def readCells(self,name,count,size):
+        '''
+        Read a cell list section whose header specified `count' and `size', returning the number of cells, the length
+        of the list, and the list as a single column IndexMatrix in the legacy layout. Version 5 files store offsets 
+        and connectivity separately, these are converted to the legacy layout.
+        '''
+        if self.version>=5.0:
+            offsets=self.readArray(count,self.getDtype(self.readLine().split()[1]))
+            connect=self.readArray(size,self.getDtype(self.readLine().split()[1]))
+            arr=np.insert(connect,offsets[:-1],np.diff(offsets))
+            count-=1
+        else:
+            arr=self.readArray(size,np.int32)
+            
+        mat=IndexMatrix(name,arr.shape[0])
+        if arr.shape[0]>0:
+            np.asarray(mat)[:,0]=arr
+            
+        return count,arr.shape[0],mat
+    
+    def readColors(self,name,count,width):
+        '''Read color values which are stored as unsigned bytes in binary files and as floats in ASCII files.'''
+        if not self.isBinary:
+            return self.readMatrix(name,count,width,np.float64)
+        
+        mat=self.readMatrix(name,count,width,np.uint8)
+        mat.div(255.0)
+        return mat
+    
+    def skipMetadata(self):
+        '''Skip the lines of a METADATA block, which is terminated by an empty line.'''
+        line=self.readLine(False)
+        while line:
+            line=self.readLine(False)
+    
+    def readFieldArrays(self,numarrays):
+        '''Read `numarrays' FIELD arrays, returning a list of (name,width,length,dtype,matrix) tuples.'''
+        arrays=[]
+        while len(arrays)<numarrays:
+            tokens=self.readLine().split()
+            if tokens[0]=='METADATA':
+                self.skipMetadata()
+            elif tokens[0]=='NULL_ARRAY':
+                numarrays-=1
+            else:
+                name,width,length,dtype=tokens[0],int(tokens[1]),int(tokens[2]),tokens[3]
+                mat=self.readMatrix(name,length,width,self.getDtype(dtype))
+                arrays.append((name,width,length,dtype,mat))
+            
+        return arrays
+    
+    def readAttribute(self,tokens,count):
+        '''Read the attribute section whose header line is `tokens' from a POINT_DATA or CELL_DATA block of `count'.'''
+        atype=tokens[0].upper()
+        name=tokens[1]
+        
+        if atype==AttrTypes._SCALARS:
+            dtype=tokens[2]
+            width=int(tokens[3]) if len(tokens)>3 else 1
+            table='default'
+            if self.peekKeyword(AttrTypes._LOOKUP_TABLE):
+                table=self.readLine().split()[1]
+                
+            mat=self.readMatrix(name,count,width,self.getDtype(dtype))
+            return (atype,name,dtype,width,AttrTypes._LOOKUP_TABLE,table,mat)
+        elif atype==AttrTypes._COLOR_SCALARS:
+            width=int(tokens[2])
+            return (atype,name,width,self.readColors(name,count,width))
+        elif atype==AttrTypes._LOOKUP_TABLE:
+            size=int(tokens[2])
+            return (atype,name,size,self.readColors(name,size,4))
+        elif atype in (AttrTypes._VECTORS,AttrTypes._NORMALS,AttrTypes._TENSORS):
+            width=9 if atype==AttrTypes._TENSORS else 3
+            return (atype,name,tokens[2],self.readMatrix(name,count,width,self.getDtype(tokens[2])))
+        elif atype==AttrTypes._TEXTURE_COORDINATES:
+            width=int(tokens[2])
+            return (atype,name,width,tokens[3],self.readMatrix(name,count,width,self.getDtype(tokens[3])))
+        elif atype==AttrTypes._FIELD:
+            numarrays=int(tokens[2])
+            return (atype,name,numarrays)+tuple(self.readFieldArrays(numarrays))
+        else:
+            raise ValueError('Unknown attribute section %r'%atype)
+        
+    def read(self):
+        magic=self.readLine(False)
+        if not magic or not magic.lower().startswith('# vtk datafile version'):
+            raise ValueError('Not a legacy VTK file')
+            
+        self.version=float(magic.split()[-1])
+        desc=self.readLine(False)
+        fileformat=self.readLine().upper()
+        
+        if fileformat not in ('ASCII','BINARY'):
+            raise ValueError('Unknown file format %r'%fileformat)
+            
+        self.isBinary=fileformat=='BINARY'
+        
+        tokens=self.readLine().split()
+        if tokens[0].upper()!='DATASET':
+            raise ValueError('Expected DATASET section but found %r'%tokens[0])
+            
+        dstype=tokens[1].upper()
+        sections={}
+        polyelems=[]
+        attrs=[]
+        
+        line=self.readLine()
+        while line is not None:
+            tokens=line.split()
+            section=tokens[0].upper()
+            
+            if section=='METADATA':
+                self.skipMetadata()
+            elif section in ('POINT_DATA','CELL_DATA'):
+                attrs.append([section,int(tokens[1])])
+            elif attrs: # every section following a POINT_DATA or CELL_DATA header is an attribute
+                attrs[-1].append(self.readAttribute(tokens,attrs[-1][1]))
+            elif section=='POINTS':
+                sections[section]=self.readNodes(int(tokens[1]),self.getDtype(tokens[2]))
+            elif section=='CELLS':
+                sections[section]=self.readCells('cells',int(tokens[1]),int(tokens[2]))[2]
+            elif section=='CELL_TYPES':
+                count=int(tokens[1])
+                mat=IndexMatrix('celltypes',count)
+                if count>0:
+                    np.asarray(mat)[:,0]=self.readArray(count,np.int32)
+                sections[section]=mat
+            elif section in ('VERTICES','LINES','POLYGONS','TRIANGLE_STRIPS'):
+                polyelems.append((section,)+self.readCells(section.lower(),int(tokens[1]),int(tokens[2])))
+            elif section=='DIMENSIONS':
+                sections[section]=tuple(map(int,tokens[1:4]))
+            elif section in ('ORIGIN','SPACING','ASPECT_RATIO'):
+                sections[section]=vec3(*map(float,tokens[1:4]))
+            elif section in ('X_COORDINATES','Y_COORDINATES','Z_COORDINATES'):
+                sections[section]=self.readMatrix(section.lower(),int(tokens[1]),1,self.getDtype(tokens[2]))
+            elif section=='FIELD': # field data for the whole dataset isn't stored anywhere so is read and discarded
+                self.readFieldArrays(int(tokens[2]))
+            else:
+                raise ValueError('Unknown section %r'%section)
+                
+            line=self.readLine()
+        
+        if dstype==DatasetTypes._UNSTRUCTURED_GRID:
+            dataset=(dstype,sections['POINTS'],sections['CELLS'],sections['CELL_TYPES'])
+        elif dstype==DatasetTypes._STRUCTURED_GRID:
+            dataset=(dstype,sections['DIMENSIONS'],sections['POINTS'])
+        elif dstype==DatasetTypes._POLYDATA:
+            dataset=(dstype,sections['POINTS'])+tuple(polyelems)
+        elif dstype=='STRUCTURED_POINTS':
+            spatial=dict((k,v) for k,v in sections.items() if k in ('DIMENSIONS','ORIGIN','SPACING','ASPECT_RATIO'))
+            dataset=(dstype,spatial)+((sections['POINTS'],) if 'POINTS' in sections else ())
+        elif dstype=='RECTILINEAR_GRID':
+            dataset=(dstype,sections['DIMENSIONS'],sections['X_COORDINATES'],sections['Y_COORDINATES'],sections['Z_COORDINATES'])
+        else:
+            raise ValueError('Unknown dataset type %r'%dstype)
+            
+        return [self.version,desc,dataset]+list(map(tuple,attrs))
+    
+    @staticmethod
+    def getDtype(typename):
+        try:
+            return LegacyDataTypes[typename.lower()]
+        except KeyError:
+            raise ValueError('Unsupported data type %r'%typename)
+            
+
+def legacyCellStarts(cells,numcells,celltypes=None):
+    '''
+    Returns the index in `cells', an array of the flat legacy cell list, of the count value starting each of the 
+    `numcells' cells. If every cell has the same length, or if `celltypes' is given and contains only fixed length cell
+    types, the positions are computed directly, otherwise the list is walked cell by cell.
+    '''
+    if numcells==0:
+        return np.zeros((0,),np.intp)
+    
+    widths=None
+    if cells.shape[0]%numcells==0 and np.all(cells[::cells.shape[0]//numcells]==cells[0]):
+        widths=np.full((numcells,),cells[0],np.intp)
+    elif celltypes is not None:
+        typewidths=np.zeros((max(c[1] for c in CellTypes)+1,),np.intp)
+        for _,cid,_,order in CellTypes:
+            typewidths[cid]=len(order) if cid!=CellTypes.Poly[0] else 0
+        
+        if celltypes.max()<typewidths.shape[0]:
+            widths=typewidths[celltypes]
+            if np.any(widths==0):
+                widths=None
+            
+    if widths is not None:
+        starts=np.zeros((numcells,),np.intp)
+        np.cumsum(widths[:-1]+1,out=starts[1:])
+        if starts[-1]<cells.shape[0] and np.all(cells[starts]==widths):
+            return starts
+    
+    starts=np.empty((numcells,),np.intp)
+    cells=cells.tolist()
+    pos=0
+    for i in range(numcells):
+        starts[i]=pos
+        pos+=cells[pos]+1
+        
+    return starts
+
+
+# maps VTK XML type names to numpy types
+XMLDataTypes={
+    'Int8':np.int8,'UInt8':np.uint8,'Int16':np.int16,'UInt16':np.uint16,'Int32':np.int32,'UInt32':np.uint32,
+    'Int64':np.int64,'UInt64':np.uint64,'Float32':np.float32,'Float64':np.float64
+}
+
+XMLCompressors=enum(
+    ('zlib','vtkZLibDataCompressor'),
+    ('lz4','vtkLZ4DataCompressor'),
+    ('lzma','vtkLZMADataCompressor'),
+    desc='Block compressors for binary VTK XML data and the compressor names stored in files'
+)
+
+
+def decodeBase64(text):
+    '''
+    Decode the base64 string `text'. VTK encodes the header and body of binary arrays either together or separately, in
+    the latter case the padded segments are decoded individually and concatenated.
+    '''
+    if isinstance(text,bytes):
+        text=text.decode('ascii')
+        
+    text=''.join(text.split())
+    return b''.join(base64.b64decode(seg) for seg in re.findall(r'[^=]+=*',text))
+
+
+def compressBlock(data,compressor):
+    '''Compress the bytes `data' with the compressor named `compressor' from XMLCompressors.'''
+    if compressor==XMLCompressors.zlib:
+        return zlib.compress(data)
+    elif compressor==XMLCompressors.lz4:
+        if lz4block is None:
+            raise ImportError('Package lz4 is required for LZ4 compression')
+        return lz4block.compress(data,store_size=False)
+    elif compressor==XMLCompressors.lzma:
+        return lzma.compress(data)
+    else:
+        raise ValueError('Unknown compressor %r'%compressor)
+    
+
+def decompressBlock(data,compressor,size):
+    '''Decompress the bytes `data' of uncompressed length `size' with the compressor named `compressor'.'''
+    if compressor==XMLCompressors.zlib:
+        return zlib.decompress(data)
+    elif compressor==XMLCompressors.lz4:
+        if lz4block is None:
+            raise ImportError('Package lz4 is required for LZ4 compressed data')
+        return lz4block.decompress(data,uncompressed_size=size)
+    elif compressor==XMLCompressors.lzma:
+        return lzma.decompress(data)
+    else:
+        raise ValueError('Unknown compressor %r'%compressor)
+    
+
+def readBinaryData(data,pos,dtype,headertype,compressor=None):
+    '''
+    Read a binary array of type `dtype' from the bytes `data' starting at `pos'. This has a header of `headertype' values
+    giving the byte length of the array, or if `compressor' is given, the number of blocks, the uncompressed size of
+    each block and of the last block, and the compressed size of each block. Returns the array and the position in 
+    `data' following it. Uncompressed arrays are views of `data' rather than copies.
+    '''
+    dtype=np.dtype(dtype)
+    headertype=np.dtype(headertype)
+    hsize=headertype.itemsize
+    
+    if not compressor:
+        nbytes=int(np.frombuffer(data,headertype,1,pos)[0])
+        pos+=hsize
+        return np.frombuffer(data,dtype,nbytes//dtype.itemsize,pos),pos+nbytes
+    
+    numblocks=int(np.frombuffer(data,headertype,1,pos)[0])
+    header=np.frombuffer(data,headertype,numblocks+3,pos).astype(np.int64)
+    blocksize=int(header[1])
+    lastsize=int(header[2]) or blocksize # a last size of 0 indicates the last block is full
+    pos+=hsize*(numblocks+3)
+    
+    result=bytearray(blocksize*(numblocks-1)+lastsize if numblocks else 0)
+    view=memoryview(data)
+    outpos=0
     
-    return _split
+    for i,csize in enumerate(header[3:]):
+        usize=lastsize if i==numblocks-1 else blocksize
+        result[outpos:outpos+usize]=decompressBlock(view[pos:pos+csize],compressor,usize)
+        outpos+=usize
+        pos+=csize
+        
+    return np.frombuffer(result,dtype),pos
+
+
+def encodeBinaryData(arr,headertype,compressor=None,blocksize=1<<15):
+    '''
+    Returns the header and body bytes of `arr' in the binary layout read by readBinaryData(), compressing the body in 
+    blocks of `blocksize' bytes if `compressor' is given.
+    '''
+    data=np.ascontiguousarray(arr).tobytes()
     
+    if not compressor:
+        return np.asarray([len(data)],headertype).tobytes(),data
     
-def toTuple(s,l,t):
-    return tuple(t)
+    blocks=[compressBlock(data[i:i+blocksize],compressor) for i in range(0,len(data),blocksize)]
+    lastsize=len(data)-blocksize*(len(blocks)-1) if blocks else 0
+    header=np.asarray([len(blocks),blocksize,lastsize]+[len(b) for b in blocks],headertype)
     
+    return header.tobytes(),b''.join(blocks)
+
+
+def parseXMLFile(filename):
+    '''
+    Parse the VTK XML file `filename', returning the root element and the contents of the AppendedData section, or None
+    if there isn't one. Raw appended data isn't valid XML so it's cut out of the document before parsing.
+    '''
+    with open(filename,'rb') as o:
+        data=o.read()
+        
+    appended=None
+    start=data.find(b'<AppendedData')
+    
+    if start!=-1:
+        tagend=data.index(b'>',start)+1
+        appended=memoryview(data)[data.index(b'_',tagend)+1:data.rindex(b'</AppendedData>')]
+        data=data[:tagend]+b'</AppendedData></VTKFile>'
+        
+    return ET.fromstring(data),appended
+
+
+def readLegacyFile(filename,strdata=None):
+    '''
+    Read the legacy VTK file `filename', or the file contents `strdata' if given, returning the PyDataSet and the file's
+    description line which is evaluated as a Python object if possible.
+    '''
+    if strdata:
+        if not isinstance(strdata,bytes):
+            strdata=strdata.encode('utf-8')
+        # only leading whitespace is removed, trailing bytes may be part of a binary payload
+        result=LegacyVTKReader(BytesIO(strdata.lstrip())).read()
+    else:
+        with open(filename,'rb') as o:
+            result=LegacyVTKReader(o).read()
+            
+    version,desc,data=result[:3]
+    pointattrs=[a for a in result[3:] if a[0]=='POINT_DATA']
+    cellattrs=[a for a in result[3:] if a[0]=='CELL_DATA']
+
+    ds=None
+    indmats=[]
+    metamap={ VTKProps.desc:desc, VTKProps.version : str(version), VTKProps.datasettype : data[0] }
+
+    # interpret dataset blocks
+    if data[0]==DatasetTypes._UNSTRUCTURED_GRID:
+        nodes,cells,celltypes=data[1:]
+        cells=np.asarray(cells)[:,0] if cells.n()>0 else np.zeros((0,),np.uint32)
+        celltypes=np.asarray(celltypes)[:,0] if celltypes.n()>0 else np.zeros((0,),np.uint32)
+        starts=legacyCellStarts(cells,celltypes.shape[0],celltypes)
+
+        # visit cell types in order of first appearance, selecting the starts of the cells of each type
+        _,firstinds=np.unique(celltypes,return_index=True)
+        for ctype in celltypes[np.sort(firstinds)]:
+            typestarts=starts[celltypes==ctype]
+            tname,elemtypename,sortinds=first((n,e,s) for n,i,e,s in CellTypes if i==ctype) or (None,None,None)
+            matname='' if tname==None else uniqueStr(tname,[i.getName() for i in indmats],'')
+            if tname==CellTypes._Poly:
+                lengths=cells[typestarts].astype(np.intp)
+                ends=np.cumsum(lengths)
+
+                # gather the indices of every polygon into one list, polyinds stores the (start,end) of each
+                polyinds=IndexMatrix(matname+'Inds',VTKProps._polyinds,lengths.shape[0],2)
+                np.asarray(polyinds)[:,0]=ends-lengths
+                np.asarray(polyinds)[:,1]=ends
+
+                mat=IndexMatrix(matname,elemtypename,int(ends[-1]))
+                np.asarray(mat)[:,0]=cells[np.repeat(typestarts+1-(ends-lengths),lengths)+np.arange(ends[-1])]
+                mat.meta(VTKProps._polyinds,polyinds.getName())
+                indmats.append(mat)
+                indmats.append(polyinds)
+
+            elif tname!=None:
+                mat=IndexMatrix(matname,elemtypename,typestarts.shape[0],len(sortinds))
+                np.asarray(mat)[:,:]=cells[typestarts[:,np.newaxis]+1+np.asarray(sortinds)]
+                indmats.append(mat)
+
+    elif data[0]==DatasetTypes._STRUCTURED_GRID:
+        dims,nodes=data[1:]
+        dimx,dimy,dimz=map(int,dims)
+
+        assert dimx>1           
+        assert dimy>1           
+        assert dimz>1           
+
+        _,inds=eidolon.generateHexBox(dimx-2,dimy-2,dimz-2)
+
+        inds=eidolon.listToMatrix(inds,'hexes')
+        inds.setType(ElemType._Hex1NL)
+
+        indmats=[inds]
+        metamap[VTKProps._griddims]=repr((dimx,dimy,dimz))
+
+    elif data[0]==DatasetTypes._POLYDATA:
+        nodes=data[1]
+        polyelems=data[2:]
+
+        lines=IndexMatrix('lines',ElemType._Line1NL,0,2)
+        tris=IndexMatrix('tris',ElemType._Tri1NL,0,3)
+        quads=IndexMatrix('quads',ElemType._Quad1NL,0,4)
+
+        for pname,numelems,numvals,ind in polyelems:
+            if pname=='POLYGONS' and numelems>0:
+                ind=np.asarray(ind)[:,0]
+                starts=legacyCellStarts(ind,numelems)
+                lengths=ind[starts]
+
+                for mat,order in ((lines,(0,1)),(tris,(0,1,2)),(quads,CellTypes.Quad[-1])):
+                    polystarts=starts[lengths==len(order)]
+                    if polystarts.shape[0]>0:
+                        arr=ind[polystarts[:,np.newaxis]+1+np.asarray(order)]
+                        mat.setN(arr.shape[0])
+                        np.asarray(mat)[:,:]=arr
+
+        if len(tris)>0:
+            indmats.append(tris)
+        if len(quads)>0:
+            indmats.append(quads)
+        if len(lines)>0:
+            indmats.append(lines)
+    else:
+        raise NotImplementedError('Dataset type %s not understood yet'%str(data[0]))
+
+    ds=PyDataSet('vtk',nodes,indmats)
+    for k,v in metamap.items():
+        ds.meta(k,v)
+
+    # read attributes into fields
+    for attr in list(pointattrs)+list(cellattrs):
+        for attrtype in attr[2:]:
+            atype=str(attrtype[0])
+
+            spatialname=first(ds.indices.keys()) # TODO: choose a better topology
+
+            if atype == AttrTypes._FIELD:
+                for fname,width,length,dtype,dat in attrtype[3:]:
+                    assert width==dat.m() and length==dat.n()
+                    assert length==nodes.n() or length==ds.indices[spatialname].n()                         
+
+                    dat.setName(fname)
+                    dat.meta(StdProps._topology,spatialname)
+                    dat.meta(StdProps._spatial,spatialname)
+                    dat.meta(VTKProps._attrtype,atype)
+                    ds.setDataField(dat)
+            else:
+                dat=attrtype[-1]
+                dat.setName(str(attrtype[1]))
+                dat.meta(StdProps._topology,spatialname)
+                dat.meta(StdProps._spatial,spatialname)
+                dat.meta(VTKProps._attrtype,atype)
+                ds.setDataField(dat)
+
+                # the reader has already shaped each matrix according to its section's width
+                if atype == AttrTypes._SCALARS:
+                    dat.meta(AttrTypes._LOOKUP_TABLE,str(attrtype[5]))
+
+    try:
+        descdata=eval(desc) # if desc is a Python object (eg. timestep number) attempt to evaluate it
+    except:
+        descdata=desc # just a normal string
+            
+    return ds,descdata
+
+
+def readXMLFile(filename):
+    '''Read the VTK XML file `filename', returning the PyDataSet for the first piece of its grid.'''
+    def _get(elem,name):
+        return elem.get(name) or elem.get(name.lower())
+
+    def toIndexMatrix(name,elemtype,arr):
+        mat=IndexMatrix(name,elemtype,*arr.shape)
+        if arr.shape[0]>0:
+            np.asarray(mat)[:,:]=arr
+        return mat
+
+    def selectCells(connect,offsets,width):
+        '''Returns the rows of nodes of those cells with `width' nodes defined by `connect' and `offsets'.'''
+        lengths=np.diff(offsets,prepend=0)
+        ends=offsets[lengths==width]
+        return connect[ends[:,np.newaxis]-width+np.arange(width)]
+
+    ds=None
+
+    root,appended=parseXMLFile(filename)
+    unstruc=root.find('UnstructuredGrid')
+    poly=root.find('PolyData')
+    compressor=_get(root,'compressor')
+    byteorder='<' if root.get('byte_order')=='LittleEndian' else '>'
+    headertype=np.dtype(XMLDataTypes[_get(root,'header_type') or 'UInt32']).newbyteorder(byteorder)
+    appendedelem=root.find('AppendedData')
+    isbase64=appendedelem is not None and _get(appendedelem,'encoding').lower()=='base64'
+
+    # base64 appended arrays have no binary length header so the end of each is the start of the next
+    appendedoffsets=sorted(set(int(_get(a,'offset')) for a in root.iter('DataArray') if _get(a,'offset')))
+    appendedends=dict(zip(appendedoffsets,appendedoffsets[1:]+[len(appended or b'')]))
+
+    def readArray(node):
+        dtype=np.dtype(XMLDataTypes[_get(node,'type')]).newbyteorder(byteorder)
+        fmt=(_get(node,'format') or 'ascii').lower()
+
+        if fmt=='appended':
+            offset=int(_get(node,'offset'))
+            if isbase64:
+                data,pos=decodeBase64(appended[offset:appendedends[offset]].tobytes()),0
+            else:
+                data,pos=appended,offset
+        elif fmt=='binary':
+            data,pos=decodeBase64(node.text),0
+        else:
+            return readTextArray(node.text,dtype)
+
+        return readBinaryData(data,pos,dtype,headertype,compressor)[0]
+
+    def readNodes(nodearray):
+        assert _get(nodearray,'NumberOfComponents')=='3'
+        arr=readArray(nodearray)
+        nodes=eidolon.Vec3Matrix('nodes',arr.shape[0]//3)
+        if nodes.n()>0:
+            np.asarray(nodes)[:,:]=arr.reshape((nodes.n(),3))
+        return nodes
+
+    def readFields(celldata,pointdata):
+        fields=[]
+        celldata=list(celldata if celldata is not None else [])
+        pointdata=list(pointdata if pointdata is not None else [])
+
+        for array in (celldata+pointdata):
+            fname=_get(array,'Name')
+            width=int(_get(array,'NumberOfComponents') or 1)
+            arr=readArray(array)
+            mat=eidolon.RealMatrix(fname,arr.shape[0]//width,width)
+            if mat.n()>0:
+                np.asarray(mat)[:,:]=arr.reshape((mat.n(),width))
+            del arr
+
+            fields.append(mat)
+            if array in celldata:
+                mat.meta(StdProps._elemdata,'True') 
+
+        return fields
+
+    def readConnectedOffsets(conoffsetpair):
+        '''Returns the connectivity and offset arrays from `conoffsetpair', which are empty if not present.'''
+        connect=offsets=None
+        if conoffsetpair is not None:
+            connect=first(c for c in conoffsetpair if _get(c,'Name')=='connectivity')
+            offsets=first(c for c in conoffsetpair if _get(c,'Name')=='offsets')
+
+        if connect is None or offsets is None:
+            return np.zeros((0,),np.intp),np.zeros((0,),np.intp)
+
+        return readArray(connect).astype(np.intp),readArray(offsets).astype(np.intp)
+
+    if unstruc is not None:
+        pieces=list(unstruc)
+
+        points=pieces[0].find('Points')
+        cells=pieces[0].find('Cells')
+        celldata=pieces[0].find('CellData') 
+        pointdata=pieces[0].find('PointData')
+        nodearray=points.find('DataArray')
+
+        if celldata is None:
+            celldata=[]
+        if pointdata is None:
+            pointdata=[]
+
+        connectivity=first(i for i in cells if i.get('Name').lower()=='connectivity')
+        types=first(i for i in cells if i.get('Name').lower()=='types')
+        offsets=first(i for i in cells if i.get('Name').lower()=='offsets')
+
+        nodes=readNodes(nodearray)
+        connect=readArray(connectivity).astype(np.intp)
+        fields=readFields(celldata,pointdata)
+        celltypes=readArray(types)
+        offlist=readArray(offsets).astype(np.intp)
+
+        assert len(celltypes)==len(offlist)
+
+        # select the cells of each understood type (ie. not polygon) and reorder nodes to match CHeart ordering
+        inds=[]
+        for n,i,e,s in CellTypes:
+            ends=offlist[celltypes==i]
+            if i!=CellTypes.Poly[0] and ends.shape[0]>0:
+                rows=connect[ends[:,np.newaxis]-len(s)+np.asarray(s)]
+                inds.append(toIndexMatrix(n+'Inds',e,rows))
+
+        ds=PyDataSet('vtk',nodes,inds,fields)
+
+    elif poly is not None:
+        pieces=list(poly)
+
+        #numPoints=int(_get(pieces[0],'NumberOfPoints')
+
+        points=pieces[0].find('Points')
+        celldata=pieces[0].find('CellData') 
+        pointdata=pieces[0].find('PointData')
+        nodearray=points.find('DataArray')
+        nodes=readNodes(nodearray)
+        inds=[]
+
+        lineconnect,lineoffsets=readConnectedOffsets(pieces[0].find('Lines'))
+        stripconnect,stripoffsets=readConnectedOffsets(pieces[0].find('Strips'))
+        polyconnect,polyoffsets=readConnectedOffsets(pieces[0].find('Polys'))
+
+        lines=[selectCells(lineconnect,lineoffsets,2),selectCells(polyconnect,polyoffsets,2)]
+        tris=[selectCells(polyconnect,polyoffsets,3)]
+        quads=selectCells(polyconnect,polyoffsets,4)
+
+        # TODO: read in arbitrary polygon and triangulate?
+
+        for start,end in zip(np.concatenate(([0],stripoffsets[:-1])),stripoffsets):
+            strip=stripconnect[start:end]
+            tris.append(np.stack([strip[:-2],strip[1:-1],strip[2:]],axis=1))
+
+        lines=np.concatenate(lines)
+        tris=np.concatenate(tris)
+
+        if lines.shape[0]>0:
+            inds.append(toIndexMatrix('lines',ElemType._Line1NL,lines))
+
+        if tris.shape[0]>0:
+            inds.append(toIndexMatrix('tris',ElemType._Tri1NL,tris))
+
+        if quads.shape[0]>0:
+            inds.append(toIndexMatrix('quads',ElemType._Quad1NL,quads[:,CellTypes.Quad[-1]]))
+
+        fields=readFields(celldata,pointdata)
+
+        ds=PyDataSet('vtk',nodes,inds,fields)
+    else:
+        raise NotImplementedError('Dataset not understood yet')
+        
+    return ds
+
+
+@eidolon.concurrent
+def loadSequenceRange(process,filenames):
+    '''
+    Load the VTK files in `filenames' assigned to this process, returning a (dataset,descdata,topohash) triple for each. 
+    The dataset matrices are shared so they can be returned to the calling process. The `topohash' value is a tuple of
+    the name, type, dimensions and content hash of each index matrix, so that the caller can determine whether all
+    the files have the same topologies without comparing the matrices themselves.
+    '''
+    results=[]
     
-ParserElement.setDefaultWhitespaceChars(' \t') # \n and \r are significant in this grammar
-
-# regular expressions for integer and float, including sign and power components
-intregex=r"[+-]?(([1-9]\d*)|0)"
-floatregex=r"[+-]?((\d+(:?\.\d*)?)|(:?\.\d+))(:?[eE][+-]?\d+)?"
-
-# base types
-ident=Word(alphas+"_", alphanums+"_%$&*@#~") # no clear definition of an identifier, there may be other accepted characters
-nls=Suppress(OneOrMore(lineEnd))
-fnum=Regex(floatregex).setParseAction(lambda s,l,t:float(t[0]))
-intnum=Regex(intregex).setParseAction(lambda s,l,t:int(t[0]))
-vec=(fnum*3).setParseAction(lambda s,l,t:vec3(t[0],t[1],t[2]))
-
-# base matrices
-intnums=Regex(r"(%s[ \n\r\t]+)+"%intregex).setParseAction(toMatrix(int))
-nums=Regex(r"(%s[ \n\r\t]+)+"%floatregex).setParseAction(toMatrix(float))
-vecs=Regex(r"(%s[ \n\r\t]+)+"%floatregex).setParseAction(toMatrix(vec3))
-
-metadata=Optional(Suppress(ZeroOrMore(nls)+Keyword('METADATA')+lineEnd+OneOrMore(CharsNotIn('\r\n')+lineEnd)+lineEnd))
-
-# dataset
-spatialvalue=(Keyword('DIMENSIONS')|Keyword('ORIGIN')|Keyword('SPACING')|Keyword('ASPECT_RATIO')) +vec+nls
-spatialvalues=ZeroOrMore(spatialvalue).setParseAction(lambda s,l,t:dict((t[i],t[i+1]) for i in range(0,len(t),2)))
-
-polyelems=(Keyword('VERTICES')|Keyword('LINES')|Keyword('POLYGONS')|Keyword('TRIANGLE_STRIPS'))+intnum+intnum+nls+intnums
-polyelems.setParseAction(toTuple)
-
-# cells and cell types, produces a list of tuples of varying length which is turned into a matrix with as many columns as the largest tuple
-cellline=Regex(r"(%s[ \t]*)+"%intregex).setParseAction(lambda s,l,t:tuple(map(int,t[0].strip().split())))
-cellnums=ZeroOrMore(cellline+nls).setParseAction(toMatrix(None))
-cells=Suppress(Keyword('CELLS')+intnum+intnum)+nls+cellnums+metadata
-celltypes=Suppress(Keyword('CELL_TYPES')+intnum)+nls+intnums+metadata
-
-points=Suppress(Keyword('POINTS')+intnum+ident)+nls+vecs+metadata
-
-strucpts=Keyword('STRUCTURED_POINTS')+nls+spatialvalues+Optional(points)
-strucgrid=Keyword('STRUCTURED_GRID')+nls+Suppress(Keyword('DIMENSIONS'))+vec+nls+points
-rectgrid=(Keyword('RECTILINEAR_GRID')+nls+Suppress(Keyword('DIMENSIONS'))+vec+nls+Suppress(Keyword('X_COORDINATES')+intnum)
-        +ident+nums+Suppress(Keyword('Y_COORDINATES')+intnum)+ident+nums+Suppress(Keyword('Z_COORDINATES')+intnum)+ident+nums)
-polydata=Keyword('POLYDATA')+nls+points+ZeroOrMore(polyelems)
-unstrucgrid=Keyword('UNSTRUCTURED_GRID')+nls+points+cells+celltypes
-dfield=Keyword('FIELD')+ident+nls+nums
-dataset=Suppress(Keyword('DATASET'))+(strucpts|strucgrid|rectgrid|polydata|unstrucgrid|dfield).setParseAction(toTuple)
-
-# attributes
-fieldarray=(ident+intnum+intnum+ident+nls+nums+metadata).setParseAction(toTuple)
-
-scalars=Keyword('SCALARS')+ident+ident+Optional(intnum)+nls+Optional(Keyword('LOOKUP_TABLE')+ident+nls)+nums
-color_scalars=Keyword('COLOR_SCALARS')+ident+intnum+nls+nums+metadata
-lookup=Keyword('LOOKUP_TABLE')+ident+intnum+nls+nums+metadata
-vectors=Keyword('VECTORS')+ident+ident+nls+nums+metadata
-normals=Keyword('NORMALS')+ident+ident+nls+nums+metadata
-tensors=Keyword('TENSORS')+ident+ident+nls+nums+metadata
-texcoords=Keyword('TEXTURE_COORDINATES')+ident+intnum+ident+nls+nums+metadata
-field=Keyword('FIELD')+ident+intnum+nls+ZeroOrMore(fieldarray)
-attrtypes=(scalars|color_scalars|lookup|vectors|normals|texcoords|tensors|field).setParseAction(toTuple)
-
-attrs=((Keyword('POINT_DATA')|Keyword('CELL_DATA'))+intnum+nls+ZeroOrMore(attrtypes)).setParseAction(toTuple)
-
-# header and file
-header=Suppress(Keyword('#')+Keyword('vtk') + Keyword('DataFile') +Keyword('Version')) +fnum+nls + CharsNotIn('\r\n')+nls+Suppress(Keyword('ASCII'))+nls
-vtkfile=header+dataset+ZeroOrMore(attrs)
+    for i,filename in enumerate(filenames[process.startval:process.endval]):
+        if filename.endswith('.vtk'):
+            ds,descdata=readLegacyFile(filename)
+        else:
+            ds,descdata=readXMLFile(filename),''
+            
+        topohash=[]
+        for ind in sorted(ds.enumIndexSets(),key=lambda i:i.getName()):
+            digest=hashlib.md5(np.asarray(ind).tobytes()).hexdigest() if ind.n()>0 else ''
+            topohash.append((ind.getName(),ind.getType(),ind.n(),ind.m(),digest))
+            
+        for mat in [ds.getNodes()]+list(ds.enumIndexSets())+list(ds.enumDataFields()):
+            mat.setShared(True)
+            
+        results.append((ds,descdata,tuple(topohash)))
+        process.setProgress(i+1)
+        
+    return results
 
 
 @contextlib.contextmanager
@@ -258,158 +975,24 @@ class VTKPlugin(MeshScenePlugin):
             obj.kwargs['filenames']=newfiles
 
     def parseString(self,strdata):
-        return vtkfile.parseString(strdata.strip()+'\n').asList()
+        if not isinstance(strdata,bytes):
+            strdata=strdata.encode('utf-8')
+            
+        return LegacyVTKReader(BytesIO(strdata.lstrip())).read()
+    
+    def parseFile(self,filename):
+        with open(filename,'rb') as o:
+            return LegacyVTKReader(o).read()
         
     def loadLegacyFile(self,filename,name=None,strdata=None):
         f=Future()
         @taskroutine('Loading VTK Legacy File')
         def _loadFile(filename,name,strdata,task):
-            result=self.parseString(strdata or open(filename).read())
-            
             basename=name or os.path.basename(filename).split('.')[0]
             name=uniqueStr(basename,[o.getName() for o in self.mgr.enumSceneObjects()])
-    
-            version,desc,data=result[:3]
-            pointattrs=[a for a in result[3:] if a[0]=='POINT_DATA']
-            cellattrs=[a for a in result[3:] if a[0]=='CELL_DATA']
-            
-            ds=None
-            indmats=[]
-            metamap={ VTKProps.desc:desc, VTKProps.version : str(version), VTKProps.datasettype : data[0] }
-            
-            # interpret dataset blocks
-            if data[0]==DatasetTypes._UNSTRUCTURED_GRID:
-                nodes,cells,celltypes=data[1:]
+            ds,descdata=readLegacyFile(filename,strdata)
                 
-                # map cell types to the indices of members of `cells' of that type
-                typeindices={}
-                for i in range(celltypes.n()):
-                    typeindices.setdefault(celltypes.getAt(i),[]).append(i) 
-                
-                for ctype,inds in typeindices.items():
-                    tname,elemtypename,sortinds=first((n,e,s) for n,i,e,s in CellTypes if i==ctype) or (None,None,None)
-                    matname='' if tname==None else uniqueStr(tname,[i.getName() for i in indmats],'')
-                    if tname==CellTypes._Poly:
-                        mat=IndexMatrix(matname,elemtypename,0)
-                        polyinds=IndexMatrix(matname+'Inds',VTKProps._polyinds,0,2)
-                        mat.meta(VTKProps._polyinds,polyinds.getName())
-                        indmats.append(mat)
-                        indmats.append(polyinds)
-                        
-                        for ind in inds:
-                            row=cells.getRow(ind)
-                            length=row[0]
-                            polyinds.append(mat.n(),mat.n()+length)
-                            for r in row[1:length+1]:
-                                mat.append(r)
-                            
-                    elif tname!=None:
-                        elemtype=ElemType[elemtypename]
-                        mat=IndexMatrix(matname,elemtypename,0,elemtype.numNodes())
-                        indmats.append(mat)
-                        for ind in inds:
-                            sortedinds=eidolon.indexList(sortinds,cells.getRow(ind)[1:])
-                            mat.append(*sortedinds)
-                            
-            elif data[0]==DatasetTypes._STRUCTURED_GRID:
-                dims,nodes=data[1:]
-                dimx,dimy,dimz=map(int,dims)
-    
-                assert dimx>1           
-                assert dimy>1           
-                assert dimz>1           
-                
-                _,inds=eidolon.generateHexBox(dimx-2,dimy-2,dimz-2)
-                
-                inds=eidolon.listToMatrix(inds,'hexes')
-                inds.setType(ElemType._Hex1NL)
-                
-                indmats=[inds]
-                metamap[VTKProps._griddims]=repr((dimx,dimy,dimz))
-                
-            elif data[0]==DatasetTypes._POLYDATA:
-                nodes=data[1]
-                polyelems=data[2:]
-                
-                lines=IndexMatrix('lines',ElemType._Line1NL,0,2)
-                tris=IndexMatrix('tris',ElemType._Tri1NL,0,3)
-                quads=IndexMatrix('quads',ElemType._Quad1NL,0,4)
-                
-                for pname,numelems,numvals,ind in polyelems:
-                    n=0
-                    if pname=='POLYGONS':
-                        while n<ind.n():
-                            polylen=ind.getAt(n)
-                            if polylen==2:
-                                lines.append(ind.getAt(n+1),ind.getAt(n+2))
-                            elif polylen==3:
-                                tris.append(ind.getAt(n+1),ind.getAt(n+2),ind.getAt(n+3))
-                            elif polylen==4:
-                                quads.append(ind.getAt(n+1),ind.getAt(n+2),ind.getAt(n+4),ind.getAt(n+3))
-                            
-                            n+=polylen+1
-                            
-                if len(tris)>0:
-                    indmats.append(tris)
-                if len(quads)>0:
-                    indmats.append(quads)
-                if len(lines)>0:
-                    indmats.append(lines)
-            else:
-                raise NotImplementedError('Dataset type %s not understood yet'%str(data[0]))
-                
-            ds=PyDataSet('vtk',nodes,indmats)
-            for k,v in metamap.items():
-                ds.meta(k,v)
-                
-            # read attributes into fields
-            for attr in list(pointattrs)+list(cellattrs):
-                for attrtype in attr[2:]:
-                    atype=str(attrtype[0])
-                    
-                    spatialname=first(ds.indices.keys()) # TODO: choose a better topology
-
-                    if atype == AttrTypes._FIELD:
-                        for fname,width,length,dtype,dat in attrtype[3:]:
-                            assert (width*length)==dat.n()
-                            assert length==nodes.n() or length==ds.indices[spatialname].n()                         
-
-                            dat.setName(fname)
-                            dat.setM(width)
-                            dat.meta(StdProps._topology,spatialname)
-                            dat.meta(StdProps._spatial,spatialname)
-                            dat.meta(VTKProps._attrtype,atype)
-                            ds.setDataField(dat)
-                    else:
-                        dat=attrtype[-1]
-                        dat.setName(str(attrtype[1]))
-                        dat.meta(StdProps._topology,spatialname)
-                        dat.meta(StdProps._spatial,spatialname)
-                        dat.meta(VTKProps._attrtype,atype)
-                        ds.setDataField(dat)
-                            
-                        if atype in (AttrTypes._NORMALS,AttrTypes._VECTORS):
-                            dat.setM(3)
-                        elif atype == AttrTypes._LOOKUP_TABLE:
-                            dat.setM(4)
-                        elif atype == AttrTypes._TENSORS:
-                            dat.setM(9)
-                        elif atype in (AttrTypes._TEXTURE_COORDINATES,AttrTypes._COLOR_SCALARS):
-                            dat.setM(attrtype[2])
-                        elif atype == AttrTypes._SCALARS:
-                            if isinstance(attrtype[3],int):
-                                dat.setM(attrtype[3])
-                            if attrtype[3]==AttrTypes._LOOKUP_TABLE:
-                                dat.meta(AttrTypes._LOOKUP_TABLE,str(attrtype[4]))
-                            elif attrtype[4]==AttrTypes._LOOKUP_TABLE:
-                                dat.meta(AttrTypes._LOOKUP_TABLE,str(attrtype[5]))
-                
-            try:
-                descdata=eval(desc) # if desc is a Python object (eg. timestep number) attempt to evaluate it
-            except:
-                descdata=desc # just a normal string
-                
-            f.setObject(MeshSceneObject(name,ds,self,filename=filename,descdata=descdata,result=result))
+            f.setObject(MeshSceneObject(name,ds,self,filename=filename,descdata=descdata))
                 
         return self.mgr.runTasks([_loadFile(filename,name,strdata)],f)
 
@@ -519,172 +1102,13 @@ class VTKPlugin(MeshScenePlugin):
         return self.mgr.runTasks([_saveFile(filename,ds,datasettype,desc,version)],f)
         
     def loadXMLFile(self,filename,name=None):
-        def _get(elem,name):
-            return elem.get(name) or elem.get(name.lower())
-            
-        def readArray(node,byteorder,compressor):
-            dtype=np.dtype(_get(node,'type')).newbyteorder(byteorder)
-            
-            if _get(node,'format') and _get(node,'format').lower()=='binary':
-                text=base64.decodestring(node.text)[8:] # skip 8 byte header?
-                if compressor:
-                    raise NotImplementedError("Haven't figured out compression yet")
-                    #text=zlib.decompress(text[:24]) # TODO: skip 24 byte header? this refuses to work
-                    
-                return np.frombuffer(text,dtype=dtype)
-            else:
-                return readTextArray(node.text,dtype)
-            
-        def readNodes(nodearray,byteorder,compressor):
-            assert _get(nodearray,'NumberOfComponents')=='3'                    
-            arr=readArray(nodearray,byteorder,compressor)
-            nodes=eidolon.Vec3Matrix('nodes',arr.shape[0]/3)
-            np.asarray(nodes).flat[:]=arr
-            return nodes
-                
-        def readFields(celldata,pointdata,byteorder,compressor):
-            fields=[]
-            celldata=list(celldata)
-            pointdata=list(pointdata)
-            
-            for array in (celldata+pointdata):
-                fname=_get(array,'Name')
-                width=int(_get(array,'NumberOfComponents') or 1)
-                arr=readArray(array,byteorder,compressor)
-                mat=eidolon.RealMatrix(fname,arr.shape[0]/width,width)
-                np.asarray(mat).flat[:]=arr
-                del arr
-                    
-                fields.append(mat)
-                if array in celldata:
-                    mat.meta(StdProps._elemdata,'True') 
-                    
-            return fields
-            
-        def yieldConnectedOffsets(conoffsetpair,byteorder,compressor):
-            connect=first(c for c in conoffsetpair if _get(c,'Name')=='connectivity')
-            offsets=first(c for c in conoffsetpair if _get(c,'Name')=='offsets')
-            start=0
-            if connect is not None and len(connect.text.strip())>0:
-                connect=readArray(connect,byteorder,compressor).tolist()
-                offsets=readArray(offsets,byteorder,compressor).tolist()
-                
-                for off in offsets:
-                    yield connect[start:off]
-                    start=off
-                
         f=Future()
         @taskroutine('Loading VTK XML File')
         @eidolon.timing
         def _loadFile(filename,name,task):
             basename=name or os.path.basename(filename).split('.')[0]
             name=uniqueStr(basename,[o.getName() for o in self.mgr.enumSceneObjects()])
-            ds=None
-            
-            tree=ET.parse(filename)
-            root=tree.getroot()
-            unstruc=root.find('UnstructuredGrid')
-            poly=root.find('PolyData')
-            #appended=root.find('AppendedData')
-            compressor=_get(root,'compressor')
-            byteorder='<' if root.get('byte_order')=='LittleEndian' else '>'
-            
-            #if appended and _get(appended,'encoding').lower()=='base64':
-            #    appended=base64.decodestring(root.find('AppendedData').text)
-                
-            if unstruc is not None:
-                pieces=list(unstruc)
-                
-                points=pieces[0].find('Points')
-                cells=pieces[0].find('Cells')
-                celldata=pieces[0].find('CellData') 
-                pointdata=pieces[0].find('PointData')
-                nodearray=points.find('DataArray')
-                
-                if celldata is None:
-                    celldata=[]
-                if pointdata is None:
-                    pointdata=[]
-                
-                connectivity=first(i for i in cells if i.get('Name').lower()=='connectivity')
-                types=first(i for i in cells if i.get('Name').lower()=='types')
-                offsets=first(i for i in cells if i.get('Name').lower()=='offsets')
-                
-                nodes=readNodes(nodearray,byteorder,compressor)
-            
-                indlist=readArray(connectivity,byteorder,compressor).tolist() # faster as Python list?
-                fields=readFields(celldata,pointdata,byteorder,compressor)
-                
-                celltypes=readArray(types,byteorder,compressor)
-                offlist=readArray(offsets,byteorder,compressor)
-                cellofflist=np.vstack((celltypes,offlist)).T.tolist() # pair each cell type entry with its width entry
-                
-                assert len(celltypes)==len(offlist)
-                
-                # map cell type IDs to IndexMatrix objects for containing the indices of that type and node ordering list
-                indmats={i:(IndexMatrix(n+'Inds',e,0,len(s)),s) for n,i,e,s in CellTypes} 
-                
-                for celltype,off in cellofflist:
-                    indmat,_=indmats.get(celltype,(None,[])) 
-                    if indmat is not None: # only found for those cell types we understand (ie. not polygon)
-                        indmat.append(*indlist[off-indmat.m():off])
-                
-                inds=[]
-                for ind,order in indmats.values(): # collect and reorder all non-empty index matrices
-                    if ind.n()>0:
-                        ind[:,:]=np.asarray(ind)[:,order] # reorder columns to match CHeart node ordering
-                        inds.append(ind)
-                
-                ds=PyDataSet('vtk',nodes,inds,fields)
-                
-            elif poly is not None:
-                pieces=list(poly)
-                
-                #numPoints=int(_get(pieces[0],'NumberOfPoints')
-                
-                points=pieces[0].find('Points')
-                celldata=pieces[0].find('CellData') 
-                pointdata=pieces[0].find('PointData')
-                nodearray=points.find('DataArray')
-                nodes=readNodes(nodearray,byteorder,compressor)
-                inds=[]
-                
-                lines=IndexMatrix('lines',ElemType._Line1NL,0,2)
-                tris=IndexMatrix('tris',ElemType._Tri1NL,0,3)
-                quads=IndexMatrix('quads',ElemType._Quad1NL,0,4)
-                    
-                for a,b in yieldConnectedOffsets(pieces[0].find('Lines'),byteorder,compressor):
-                    lines.append(a,b)
-                    
-                for strip in yieldConnectedOffsets(pieces[0].find('Strips'),byteorder,compressor):
-                    for a,b,c in eidolon.successive(strip,3):
-                        tris.append(a,b,c)
-                    
-                for poly in yieldConnectedOffsets(pieces[0].find('Polys'),byteorder,compressor):
-                    if len(poly)==2:
-                        lines.append(*poly)
-                    elif len(poly)==3:
-                        tris.append(*poly)
-                    elif len(poly)==4:
-                        quads.append(*poly)
-                        
-                    # TODO: read in arbitrary polygon and triangulate?
-                    
-                if len(lines)>0:
-                    inds.append(lines)
-                    
-                if len(tris)>0:
-                    inds.append(tris)
-                    
-                if len(quads)>0:
-                    quads[:,:]=np.asarray(quads)[:,CellTypes.Quad[-1]]
-                    inds.append(quads)
-                
-                fields=readFields(celldata,pointdata,byteorder,compressor)
-                
-                ds=PyDataSet('vtk',nodes,inds,fields)
-            else:
-                raise NotImplementedError('Dataset not understood yet')
+            ds=readXMLFile(filename)
                 
             f.setObject(MeshSceneObject(name,ds,self,filename=filename,isXML=True,descdata=''))
         
@@ -701,78 +1125,101 @@ class VTKPlugin(MeshScenePlugin):
             return self.loadXMLFile(filename,name)
             
     def saveObject(self,obj,path,overwrite=False,setFilenames=False,**kwargs):
-        return self.saveXMLFile(path,obj,setObjArgs=setFilenames)
+        appended=kwargs.get('appended',False)
+        compressor=kwargs.get('compressor',None)
+        return self.saveXMLFile(path,obj,setObjArgs=setFilenames,appended=appended,compressor=compressor)
         
     def loadSequence(self,filenames,name=None):
-        fileobjs=[self.loadObject(f) for f in filenames]
         f=Future()
         
         @taskroutine('Loading VTK File Sequence')
-        def _loadSeq(filenames,fileobjs,name,task):
+        def _loadSeq(filenames,name,task):
             with f:
-                fileobjs=list(map(Future.get,fileobjs))
-                name=name or fileobjs[0].getName()
-                obj=MeshSceneObject(name,[o.datasets[0] for o in fileobjs],self,filenames=filenames)
+                basename=name or os.path.basename(filenames[0]).split('.')[0]
+                name=uniqueStr(basename,[o.getName() for o in self.mgr.enumSceneObjects()])
+                
+                proccount=eidolon.chooseProcCount(len(filenames),0,2)
+                result=loadSequenceRange(len(filenames),proccount,task,filenames)
+                eidolon.checkResultMap(result)
+                result=eidolon.sumResultMap(result)
+                datasets=[ds for ds,_,_ in result]
+                
+                # if every file has the same cells use the first file's topologies for every timestep
+                if all(topohash==result[0][2] for _,_,topohash in result):
+                    for ds in datasets[1:]:
+                        for ind in datasets[0].enumIndexSets():
+                            ds.setIndexSet(ind)
                 
-                for i,o in enumerate(fileobjs):
-                    descdata=o.kwargs['descdata']
-                    if not isinstance(descdata,str) and 'timestep' in descdata:
+                obj=MeshSceneObject(name,datasets,self,filenames=filenames)
+                
+                for i,(_,descdata,_) in enumerate(result):
+                    if isinstance(descdata,dict) and 'timestep' in descdata:
                         obj.timestepList[i]=int(descdata['timestep'])
                         
                 f.setObject(obj)
         
-        return self.mgr.runTasks([_loadSeq(filenames,fileobjs,name)],f)
+        return self.mgr.runTasks([_loadSeq(filenames,name)],f)
         
     def loadPolydataNodes(self,filename): 
         '''Fast load for node data from a polydata .vtk file, this ignores everything but the nodes.'''
-        with open(filename) as o:
-            header=[o.readline(),o.readline(),o.readline(),o.readline(),o.readline()]
-            assert header[2].strip().lower()=='ascii',repr(header)
-            assert header[3].strip().lower()=='dataset polydata',repr(header)
-            
-            nodes=eidolon.Vec3Matrix('nodes',0)
-            nodes.reserveRows(int(header[-1].split()[1])/3)
-            vals=[]
-            
-            for line in o:
-                vals+=line.split() # add numbers to accumulated list, this allows nodes to be split between lines safely
-                while len(vals)>=3: # read a node if there's 3+ values, if the # of values isn't a multiple of 3 retain the last 1 or 2 in vals
-                    nodes.append(vec3(float(vals.pop(0)),float(vals.pop(0)),float(vals.pop(0))))
+        with open(filename,'rb') as o:
+            reader=LegacyVTKReader(o)
+            header=[reader.readLine(False) for i in range(4)]+[reader.readLine()]
+            assert header[2].lower() in ('ascii','binary'),repr(header)
+            assert header[3].lower()=='dataset polydata',repr(header)
+            
+            reader.isBinary=header[2].lower()=='binary'
+            _,numnodes,dtype=header[-1].split()
+            nodes=reader.readNodes(int(numnodes),reader.getDtype(dtype))
                     
             return nodes,header
 
     def savePolydataNodes(self,filename,nodes,vecfunc=tuple):
         return self.saveLegacyFile(filename,PyDataSet('DS',nodes),datasettype=DatasetTypes._POLYDATA,writeFields=False,vecfunc=vecfunc)
             
-    def saveXMLFile(self,filenameprefix,obj,filetype='vtu',setObjArgs=False):
-        def writeArray(xo,mat,**kwargs):
-            with xmltag(xo,'DataArray',**kwargs) as xo1:
-                o=xo1[1]
-                o.write(' '*xo1[0])
-                for n in range(mat.n()):
-                    for r in mat.getRow(n):
-                        o.write(' '+str(r))
-                o.write('\n')
+    def saveXMLFile(self,filenameprefix,obj,filetype='vtu',setObjArgs=False,appended=False,compressor=None):
+        '''
+        Save `obj' to VTK XML file(s) starting with `filenameprefix', one per timestep. Arrays are written as ASCII text
+        unless `appended' is True, in which case they're written as raw binary in an AppendedData section. If `compressor'
+        is a name from XMLCompressors binary data is block compressed with it, and is stored inline as base64 if not
+        appended.
+        '''
+        isbinary=appended or compressor is not None
+        compname=XMLCompressors[compressor] if compressor else None
+        headertype=np.uint64
+        
+        def writeArray(xo,arr,appendblocks,**kwargs):
+            arr=np.asarray(arr)
+            
+            if not isbinary:
+                with xmltag(xo,'DataArray',format='ascii',**kwargs) as xo1:
+                    xo1[1].write('%s%s\n'%(' '*xo1[0],' '.join(map(str,arr.ravel().tolist()))))
+            else:
+                header,body=encodeBinaryData(arr.astype(XMLDataTypes[kwargs['type']]),headertype,compname)
+                
+                if appended:
+                    with xmltag(xo,'DataArray',format='appended',offset=sum(map(len,appendblocks)),**kwargs):
+                        appendblocks.append(header+body)
+                else:
+                    with xmltag(xo,'DataArray',format='binary',**kwargs) as xo1:
+                        # compressed headers are encoded separately from the body to match VTK's writer
+                        text=base64.b64encode(header)+base64.b64encode(body) if compname else base64.b64encode(header+body)
+                        xo1[1].write('%s%s\n'%(' '*xo1[0],text.decode('ascii')))
                 
-        def writeNodes(xo,nodes):
+        def writeNodes(xo,nodes,appendblocks):
             with xmltag(xo,'Points') as xo1:
-                with xmltag(xo1,'DataArray',type="Float32",NumberOfComponents="3",Format="ascii") as xo2:
-                    indents=' '*xo2[0]
-                    o=xo2[1]
-                    for n in range(nodes.n()):
-                        nn=nodes.getAt(n)
-                        o.write('%s%s %s %s\n'%(indents,nn.x(),nn.y(),nn.z()))
+                writeArray(xo1,nodes,appendblocks,type="Float64",NumberOfComponents="3")
                         
-        def writeFields(xo,nodefields,cellfields):
+        def writeFields(xo,nodefields,cellfields,appendblocks):
             if nodefields:
                 with xmltag(xo,'PointData') as xo1:
                     for df in nodefields:
-                        writeArray(xo1,df, type="Float32", Name=df.getName(),NumberOfComponents=df.m(), Format="ascii")
+                        writeArray(xo1,df,appendblocks,type="Float64",Name=df.getName(),NumberOfComponents=df.m())
                         
             if cellfields:
                 with xmltag(xo,'CellData') as xo1:
                     for df in cellfields:
-                        writeArray(xo1,df, type="Float32", Name=df.getName(),NumberOfComponents=df.m(), Format="ascii")
+                        writeArray(xo1,df,appendblocks,type="Float64",Name=df.getName(),NumberOfComponents=df.m())
         
         f=Future()
         @taskroutine('Saving VTK XML File')
@@ -787,6 +1234,15 @@ class VTKPlugin(MeshScenePlugin):
                 
                 knowncelltypes={c[2]:c[1] for c in CellTypes}
                 cellorders={c[2]:c[3] for c in CellTypes}
+                
+                fileargs={'type':'UnstructuredGrid'}
+                if isbinary:
+                    fileargs.update(version='1.0',header_type='UInt64')
+                    fileargs['byte_order']='LittleEndian' if sys.byteorder=='little' else 'BigEndian'
+                    if compname:
+                        fileargs['compressor']=compname
+                else:
+                    fileargs.update(version='0.1',byte_order='BigEndian')
             
                 if len(dds)==1:
                     filenames=[filenameprefix+'.'+filetype]
@@ -795,51 +1251,43 @@ class VTKPlugin(MeshScenePlugin):
                 
                 for fn,ds in zip(filenames,dds):
                     nodes=ds.getNodes()
-                    inds=[i for i in ds.enumIndexSets() if i.getType() in knowncelltypes]
+                    inds=[i for i in ds.enumIndexSets() if i.getType() in knowncelltypes and i.n()>0]
                     numcells=sum(i.n() for i in inds)
-                    numindices=sum(i.n()*i.m() for i in inds)
+                    appendblocks=[]
                     
                     cellfields=[df for df in ds.enumDataFields() if df.n()==numcells]
                     nodefields=[df for df in ds.enumDataFields() if df.n()==nodes.n()]
                     
+                    # combine all the index matrices in inds into one connectivity list with VTK node ordering
+                    connect=[np.asarray(ind)[:,cellorders[ind.getType()]].ravel() for ind in inds]
+                    widths=[np.full((ind.n(),),ind.m(),np.int32) for ind in inds]
+                    types=[np.full((ind.n(),),knowncelltypes[ind.getType()],np.uint8) for ind in inds]
+                    
+                    connect=np.concatenate(connect) if inds else np.zeros((0,),np.int32)
+                    offsets=np.cumsum(np.concatenate(widths)) if inds else np.zeros((0,),np.int32)
+                    types=np.concatenate(types) if inds else np.zeros((0,),np.uint8)
+                    
                     with open(fn,'w') as o:
                         o.write('<?xml version="1.0"?>\n')
                         if filetype=='vtu':
-                            with xmltag(o,'VTKFile',type="UnstructuredGrid", version="0.1", byte_order="BigEndian") as xo:
+                            with xmltag(o,'VTKFile',**fileargs) as xo:
                                 with xmltag(xo,'UnstructuredGrid') as xo1:
                                     with xmltag(xo1,'Piece',NumberOfPoints=nodes.n(),NumberOfCells=numcells) as xo2:
-                                        writeNodes(xo2,nodes)
+                                        writeNodes(xo2,nodes,appendblocks)
                                                     
-                                        # calculate a new indices matrix by combining all those in inds and 
-                                        # reordering the elements to match VTK ordering
                                         with xmltag(xo2,'Cells') as xo3:
-                                            indices=IndexMatrix('indices',numindices)
-                                            offsets=IndexMatrix('offsets',numcells)
-                                            types=IndexMatrix('types',numcells)
+                                            writeArray(xo3,connect,appendblocks,type="Int32",Name="connectivity")
+                                            writeArray(xo3,offsets,appendblocks,type="Int32",Name="offsets")
+                                            writeArray(xo3,types,appendblocks,type="UInt8",Name="types")
                                             
-                                            count=0
-                                            pos=0
-                                            ipos=0
-                                            for ind in inds:
-                                                typenum=knowncelltypes[ind.getType()]
-                                                order=cellorders[ind.getType()]
-                                                for n in range(ind.n()):
-                                                    count+=ind.m()
-                                                    offsets.setAt(count,pos) # add element offset
-                                                    types.setAt(typenum,pos) # add element type
-                                                    pos+=1
-                                                    
-                                                    # reorder the index values of this element to VTK ordering
-                                                    row=ind.getRow(n)
-                                                    for nn in order:
-                                                        indices.setAt(row[nn],ipos)
-                                                        ipos+=1
-                                                    
-                                            writeArray(xo3,indices, type="Int32", Name="connectivity", Format="ascii")
-                                            writeArray(xo3,offsets, type="Int32", Name="offsets", Format="ascii")
-                                            writeArray(xo3,types, type="Int32", Name="types", Format="ascii")
-                                            
-                                        writeFields(xo2,nodefields,cellfields)
+                                        writeFields(xo2,nodefields,cellfields,appendblocks)
+                                        
+                                if appendblocks: # raw data follows the _ character and is written past the text layer
+                                    o.write(' <AppendedData encoding="raw">\n  _')
+                                    o.flush()
+                                    for block in appendblocks:
+                                        o.buffer.write(block)
+                                    o.write('\n </AppendedData>\n')
                     
                 if setObjArgs:
                     if len(dds)==1:
@@ -904,3 +1352,126 @@ class VTKPlugin(MeshScenePlugin):
         
 eidolon.addPlugin(VTKPlugin())
 
+
+### Unit tests
+
+class TestVTKPlugin(unittest.TestCase):
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        self.plugin=eidolon.getSceneMgr().getPlugin('VTK')
+
+        nodes,hexes=eidolon.generateHexBox(1,1,1)
+        self.nodes=eidolon.listToMatrix(nodes,'nodes')
+        self.hexes=eidolon.listToMatrix(hexes,'hexes',ElemType._Hex1NL)
+
+        self.field=eidolon.RealMatrix('field',self.nodes.n(),1)
+        np.asarray(self.field)[:,0]=np.arange(self.nodes.n())
+        self.field.meta(StdProps._topology,'hexes')
+        self.field.meta(StdProps._spatial,'hexes')
+
+        self.ds=PyDataSet('hexds',self.nodes,[self.hexes],[self.field])
+        self.obj=MeshSceneObject('hexobj',self.ds,self.plugin)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def checkDataset(self,ds,fieldvals=None):
+        '''Check that `ds' has the nodes and hexes of the test dataset and a field with `fieldvals' or the test field.'''
+        hexes=first(i for i in ds.enumIndexSets() if i.getType()==ElemType._Hex1NL)
+        field=ds.getDataField('field')
+        fieldvals=np.asarray(self.field) if fieldvals is None else fieldvals
+
+        self.assertIsNotNone(hexes)
+        self.assertIsNotNone(field)
+        self.assertTrue(np.allclose(np.asarray(self.nodes),np.asarray(ds.getNodes())))
+        self.assertTrue(np.array_equal(np.asarray(self.hexes),np.asarray(hexes)))
+        self.assertTrue(np.allclose(np.ravel(fieldvals),np.ravel(field)))
+
+    def createBinaryLegacy(self,fieldvals):
+        '''Returns the contents of a BINARY legacy file of the test dataset whose last section is `fieldvals' as ints.'''
+        cells=np.asarray(self.hexes)[:,CellTypes.Hex[-1]]
+        cells=np.hstack([np.full((cells.shape[0],1),cells.shape[1]),cells])
+
+        return b''.join([
+            b'# vtk DataFile Version 3.0\nbinary test\nBINARY\nDATASET UNSTRUCTURED_GRID\n',
+            b'POINTS %i float\n'%self.nodes.n(),np.asarray(self.nodes).astype('>f4').tobytes(),b'\n',
+            b'CELLS %i %i\n'%(cells.shape[0],cells.size),cells.astype('>i4').tobytes(),b'\n',
+            b'CELL_TYPES %i\n'%cells.shape[0],np.full((cells.shape[0],),CellTypes.Hex[0],'>i4').tobytes(),b'\n',
+            b'POINT_DATA %i\nSCALARS field int 1\nLOOKUP_TABLE default\n'%self.nodes.n(),
+            np.asarray(fieldvals).astype('>i4').tobytes() # no trailing newline, the file ends with the payload
+        ])
+
+    def testSaveLoadLegacyASCII(self):
+        '''Test saving and loading an ASCII legacy file.'''
+        filename=os.path.join(self.tempdir,'test.vtk')
+        Future.get(self.plugin.saveLegacyFile(filename,self.obj))
+
+        obj=Future.get(self.plugin.loadLegacyFile(filename))
+        self.checkDataset(obj.datasets[0])
+
+    def testLoadLegacyASCIIString(self):
+        '''Test loading an ASCII legacy file from a string with surrounding whitespace.'''
+        filename=os.path.join(self.tempdir,'test.vtk')
+        Future.get(self.plugin.saveLegacyFile(filename,self.obj))
+
+        with open(filename) as o:
+            strdata='\n  '+o.read()+'\n\n'
+
+        self.checkDataset(readLegacyFile(None,strdata)[0])
+
+    def testLoadLegacyBinary(self):
+        '''Test loading BINARY legacy files and strings whose payloads end in whitespace or null bytes.'''
+        for lastval in (0x20,0x0a,0):
+            fieldvals=np.arange(self.nodes.n())
+            fieldvals[-1]=lastval
+            data=self.createBinaryLegacy(fieldvals)
+
+            filename=os.path.join(self.tempdir,'binary%i.vtk'%lastval)
+            with open(filename,'wb') as o:
+                o.write(data)
+
+            self.checkDataset(readLegacyFile(filename)[0],fieldvals)
+            self.checkDataset(readLegacyFile(None,data)[0],fieldvals)
+            self.checkDataset(Future.get(self.plugin.loadLegacyFile(filename,strdata=data)).datasets[0],fieldvals)
+
+    def saveLoadXML(self,**kwargs):
+        '''Save the test object as an XML file with the given saveXMLFile arguments, returning the loaded dataset.'''
+        filenames=Future.get(self.plugin.saveXMLFile(os.path.join(self.tempdir,'test'),self.obj,**kwargs))
+        self.assertEqual(1,len(filenames))
+
+        return Future.get(self.plugin.loadXMLFile(filenames[0])).datasets[0]
+
+    def testSaveLoadXMLASCII(self):
+        '''Test saving and loading an ASCII XML file.'''
+        self.checkDataset(self.saveLoadXML())
+
+    def testSaveLoadXMLAppended(self):
+        '''Test saving and loading an XML file with raw appended data.'''
+        self.checkDataset(self.saveLoadXML(appended=True))
+
+    def testSaveLoadXMLCompressed(self):
+        '''Test saving and loading XML files with inline and appended compressed data.'''
+        compressors=['zlib','lzma']+(['lz4'] if lz4block is not None else [])
+
+        for compressor in compressors:
+            for appended in (False,True):
+                self.checkDataset(self.saveLoadXML(appended=appended,compressor=compressor))
+
+    def testLoadSequenceSharedTopology(self):
+        '''Test that loading a sequence of files with the same cells shares the first file's index matrices.'''
+        nodes1=eidolon.Vec3Matrix('nodes1',self.nodes.n())
+        np.asarray(nodes1)[:,:]=np.asarray(self.nodes)*2
+        hexes1=eidolon.IndexMatrix('hexes1',ElemType._Hex1NL,self.hexes.n(),self.hexes.m())
+        np.asarray(hexes1)[:,:]=np.asarray(self.hexes)[::-1]
+
+        for hexes,isShared in ((self.hexes,True),(hexes1,False)):
+            ds1=PyDataSet('hexds1',nodes1,[hexes],[self.field])
+            obj=MeshSceneObject('hexseq',[self.ds,ds1],self.plugin)
+            filenames=Future.get(self.plugin.saveXMLFile(os.path.join(self.tempdir,'seq'),obj))
+
+            seq=Future.get(self.plugin.loadSequence(filenames))
+            ds0,ds1=seq.datasets
+            self.checkDataset(ds0)
+            self.assertTrue(np.allclose(np.asarray(nodes1),np.asarray(ds1.getNodes())))
+            self.assertEqual(isShared,ds0.getIndexSet('HexInds') is ds1.getIndexSet('HexInds'))
+            self.assertTrue(np.array_equal(np.asarray(hexes),np.asarray(ds1.getIndexSet('HexInds'))))
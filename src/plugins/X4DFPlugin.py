@@ -25,13 +25,41 @@ import unittest
 import tempfile
 import shutil
 import glob
+import struct
+import zlib
+import xml.etree.ElementTree as ET
+from multiprocessing import cpu_count
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
+try: # lz4 is only needed for LZ4 blocked array files
+    import lz4.block as lz4block
+except ImportError:
+    lz4block=None
+
 eidolon.addLibraryFile('x4df-0.1.0-py3-none-any')
 
 import x4df
 from x4df import readFile, writeFile, idTransform, validFieldTypes, ASCII, BASE64, BASE64_GZ, BINARY, BINARY_GZ
 
+# Array formats whose files are read and written by this plugin rather than the x4df library. RAW is the x4df binary
+# format (little endian data in C order starting at the array offset) but is memory mapped when loaded. The blocked
+# formats store data as independently compressed blocks with an index so that blocks can be compressed and decompressed
+# in parallel and any byte range read without decompressing the whole file.
+RAW=BINARY
+BLOCKED_ZLIB='blocked_zlib'
+BLOCKED_LZ4='blocked_lz4'
+pluginFormats=(RAW,BLOCKED_ZLIB,BLOCKED_LZ4)
+
+blockMagic=b'X4DFBLK1'
+blockHeader=struct.Struct('<8sIQQQ') # magic, codec (0=zlib, 1=lz4), uncompressed size, number of blocks, index offset
+blockEntry=struct.Struct('<QQ') # uncompressed size and compressed size of each block
+blockCodecs=(BLOCKED_ZLIB,BLOCKED_LZ4)
+defaultBlockSize=1<<22
+
+# array attributes in the order they're given to x4df.array, these are also the XML attribute names
+arrayAttrs=('name','shape','dim','type','format','offset','step','filename')
+
 ConfigArgs=eidolon.enum(
     ('filename','Name of .x4df file the object is stored in'),
     ('filenames','Names of array files, may be [] or not present'),
@@ -45,16 +73,248 @@ def shapeStr(arr):
 
 
 def array2MatrixForm(arr,dtype):
-    '''Return the equivalent of `arr' with a 2D shape and with the given type.'''
+    '''Return the equivalent of `arr' with a 2D shape and with the given type, copying only if the type differs.'''
     shape=arr.shape
     if len(shape)==1:
         arr=arr.reshape((shape[0],1))
     elif len(shape)>2:
-        arr=arr.reshape((sum(shape)/shape[1],shape[1]))
+        arr=arr.reshape((-1,shape[-1]))
+
+    return arr.astype(dtype,copy=False)
+
+
+def _compressBlock(data,codec):
+    if codec==BLOCKED_LZ4:
+        if lz4block is None:
+            raise ImportError('Package lz4 is required for LZ4 compression')
+        return lz4block.compress(data,store_size=False)
+    else:
+        return zlib.compress(data,1)
+
+
+def _decompressBlock(data,codec,rawsize):
+    if codec==BLOCKED_LZ4:
+        if lz4block is None:
+            raise ImportError('Package lz4 is required for LZ4 compression')
+        return lz4block.decompress(data,uncompressed_size=rawsize)
+    else:
+        return zlib.decompress(data)
+
+
+def iterArrayBlocks(arr,dtype,blocksize=defaultBlockSize):
+    '''
+    Yields byte buffers of the contents of `arr' in C order converted to little endian `dtype'. Each is a slab of
+    whole rows along the first axis of about `blocksize' bytes, so only one slab is ever converted at a time.
+    '''
+    dtype=np.dtype(dtype).newbyteorder('<')
+    arr=np.asarray(arr).reshape((-1,)) if np.ndim(arr)<2 else arr
+    rowbytes=max(1,int(np.prod(arr.shape[1:]))*dtype.itemsize)
+    step=max(1,blocksize//rowbytes)
+
+    for i in range(0,arr.shape[0],step):
+        yield memoryview(np.ascontiguousarray(arr[i:i+step],dtype)).cast('B')
+
+
+def writeRawArray(filename,arr,dtype,blocksize=defaultBlockSize):
+    '''Write `arr' to `filename' as raw little endian `dtype' data in C order, converting one slab at a time.'''
+    with open(filename,'wb') as o:
+        for block in iterArrayBlocks(arr,dtype,blocksize):
+            o.write(block)
+
+
+def writeBlockedArray(filename,arr,dtype,codec=BLOCKED_ZLIB,blocksize=defaultBlockSize,numthreads=None):
+    '''
+    Write `arr' to `filename' as little endian `dtype' data in C order compressed in blocks of about `blocksize' bytes
+    using `codec' (BLOCKED_ZLIB or BLOCKED_LZ4). Blocks are compressed in parallel by `numthreads' threads (default
+    CPU count) with only a bounded number in memory at once. The index of block sizes is written after the blocks and
+    its position stored in the header.
+    '''
+    dtype=np.dtype(dtype)
+    numthreads=numthreads or cpu_count()
+    nbytes=int(np.prod(np.shape(arr)))*dtype.itemsize
+    sizes=[]
+
+    with open(filename,'wb') as o, ThreadPoolExecutor(numthreads) as pool:
+        o.seek(blockHeader.size)
+
+        pending=[]
+        for block in iterArrayBlocks(arr,dtype,blocksize):
+            pending.append((len(block),pool.submit(_compressBlock,block,codec)))
+
+            while len(pending)>numthreads*2 or (pending and pending[0][1].done()):
+                rawsize,comp=pending.pop(0)
+                comp=comp.result()
+                o.write(comp)
+                sizes.append((rawsize,len(comp)))
+
+        for rawsize,comp in pending:
+            comp=comp.result()
+            o.write(comp)
+            sizes.append((rawsize,len(comp)))
+
+        indexpos=o.tell()
+        o.write(b''.join(blockEntry.pack(*sz) for sz in sizes))
+        o.seek(0)
+        o.write(blockHeader.pack(blockMagic,blockCodecs.index(codec),nbytes,len(sizes),indexpos))
+
+
+def readBlockIndex(o):
+    '''
+    Read the header and index of the blocked array file object `o', returning the codec name, uncompressed size, and
+    an array with one row per block of uncompressed offset, uncompressed size, file offset, and compressed size.
+    '''
+    o.seek(0)
+    magic,codec,nbytes,numblocks,indexpos=blockHeader.unpack(o.read(blockHeader.size))
+    if magic!=blockMagic:
+        raise IOError('Not a blocked array file')
+
+    o.seek(indexpos)
+    sizes=np.frombuffer(o.read(numblocks*blockEntry.size),dtype='<u8').reshape((numblocks,2)).astype(np.int64)
+    index=np.zeros((numblocks,4),np.int64)
+    index[:,1]=sizes[:,0]
+    index[:,3]=sizes[:,1]
+    index[1:,0]=np.cumsum(sizes[:-1,0])
+    index[:,2]=blockHeader.size+np.cumsum(sizes[:,1])-sizes[:,1]
+
+    return blockCodecs[codec],nbytes,index
+
+
+def readBlockedBytes(filename,start=0,stop=None,numthreads=None,out=None):
+    '''
+    Returns the uncompressed bytes in range [`start',`stop') of the blocked array file `filename', decompressing only
+    the blocks overlapping this range in parallel using `numthreads' threads. If `out' is given it must be a writable
+    byte buffer of the range's length which the data is decompressed into and is returned instead.
+    '''
+    with open(filename,'rb') as o:
+        codec,nbytes,index=readBlockIndex(o)
+        stop=nbytes if stop is None else min(stop,nbytes)
+        out=memoryview(out if out is not None else bytearray(max(0,stop-start))).cast('B')
+        blocks=[b for b in index if b[0]<stop and b[0]+b[1]>start]
+
+        def _decompress(block,data):
+            rawoff,rawsize,_,_=block
+            dat=_decompressBlock(data,codec,int(rawsize))
+            lo=max(start,rawoff)
+            hi=min(stop,rawoff+rawsize)
+            out[lo-start:hi-start]=dat[lo-rawoff:hi-rawoff]
+
+        # read blocks sequentially from the file and decompress them in parallel, bounding the number in memory
+        numthreads=numthreads or cpu_count()
+        with ThreadPoolExecutor(numthreads) as pool:
+            pending=[]
+            for block in blocks:
+                o.seek(block[2])
+                pending.append(pool.submit(_decompress,block,o.read(int(block[3]))))
+
+                if len(pending)>numthreads*2:
+                    pending.pop(0).result()
+
+            for p in pending:
+                p.result()
+
+    return out.obj
+
+
+def readBlockedArray(filename,dtype,shape,numthreads=None):
+    '''Read the array of `shape' and little endian `dtype' from the blocked array file `filename'.'''
+    dat=np.empty(shape,np.dtype(dtype).newbyteorder('<'))
+    readBlockedBytes(filename,0,dat.nbytes,numthreads,dat.reshape((-1,)).view(np.uint8))
+    return dat
+
+
+def readPluginArray(attrs,basedir):
+    '''
+    Returns an x4df.array for the array defined by the XML attributes dictionary `attrs' whose data file is in one of
+    the formats in pluginFormats, relative to `basedir'. Raw files are memory mapped, blocked files are decompressed.
+    '''
+    values=dict(attrs)
+    filename=os.path.join(basedir,values['filename'])
+    shape=tuple(map(int,values['shape'].split()))
+    dtype=np.dtype(values.get('type','f8')).newbyteorder('<')
+    offset=int(values.get('offset',None) or 0)
+
+    if values['format']==RAW:
+        data=np.memmap(filename,dtype,'r',offset,shape)
     else:
-        arr=arr
+        data=readBlockedArray(filename,dtype,shape)
+
+    return x4df.array(*[values.get(a,None) for a in arrayAttrs],data=data)
+
+
+def readX4DF(filename):
+    '''
+    Read the X4DF file `filename' with readFile() except for arrays stored in files in the pluginFormats formats, these
+    are read with readPluginArray() instead. The x4df library is given a copy of the document with these arrays removed
+    and other array file names made absolute, then the arrays read here are added to the returned object.
+    '''
+    basedir=os.path.dirname(os.path.abspath(filename))
+    tree=ET.parse(filename)
+    root=tree.getroot()
+    parents={c:p for p in root.iter() for c in p}
+    arrays=[e for e in root.iter('array') if e.get('filename')]
+    handled=[e for e in arrays if e.get('format') in pluginFormats]
+
+    if not handled:
+        return readFile(filename)
+
+    for e in arrays:
+        if e in handled:
+            parents[e].remove(e)
+        else:
+            e.set('filename',os.path.join(basedir,e.get('filename')))
+
+    fd,tmpname=tempfile.mkstemp('.x4df')
+    try:
+        os.close(fd)
+        tree.write(tmpname)
+        x4=readFile(tmpname)
+    finally:
+        os.remove(tmpname)
+
+    # restore the relative filenames for the arrays read by the library
+    for a in x4.arrays:
+        if a.filename and os.path.dirname(a.filename)==basedir:
+            a.filename=os.path.basename(a.filename)
+
+    x4.arrays+=[readPluginArray(e.attrib,basedir) for e in handled]
+
+    return x4
+
+
+def writeX4DF(x4,filename,blocksize=defaultBlockSize,numthreads=None):
+    '''
+    Write the X4DF object `x4' to `filename' with writeFile() except for arrays stored in separate files in the
+    pluginFormats formats, these have their files written here and are added to the document after the library writes
+    it. Raw arrays are written one slab at a time, blocked arrays compressed in parallel with `numthreads' threads.
+    '''
+    basedir=os.path.dirname(os.path.abspath(filename))
+    handled=[a for a in x4.arrays if a.format in pluginFormats and a.filename]
 
-    return arr.astype(dtype)
+    if not handled:
+        return writeFile(x4,filename)
+
+    for a in handled:
+        afilename=os.path.join(basedir,a.filename)
+        dtype=np.dtype(a.type or 'f8')
+
+        if a.format==RAW:
+            writeRawArray(afilename,a.data,dtype,blocksize)
+        else:
+            writeBlockedArray(afilename,a.data,dtype,a.format,blocksize,numthreads)
+
+    arrays=list(x4.arrays)
+    try:
+        x4.arrays[:]=[a for a in arrays if a not in handled]
+        writeFile(x4,filename)
+    finally:
+        x4.arrays[:]=arrays
+
+    tree=ET.parse(filename)
+    root=tree.getroot()
+    for a in handled:
+        ET.SubElement(root,'array',{n:str(getattr(a,n)) for n in arrayAttrs if getattr(a,n,None) is not None})
+
+    tree.write(filename)
 
 
 @timing
@@ -66,7 +326,7 @@ def convertMesh(obj,arrayformat=ASCII,filenamePrefix=None):
     return value is a single x4df object containing a single mesh.
     '''
     ts=obj.getTimestepList()
-    if arrayformat in (BINARY, BINARY_GZ):
+    if arrayformat in (BINARY, BINARY_GZ)+pluginFormats:
         filenamePrefix=filenamePrefix or obj.getName()
 
     x4=x4df.dataset([],[],[],[])
@@ -140,7 +400,7 @@ def convertImage(obj,plugin,arrayformat=ASCII,datatype='f4',filenamePrefix=None)
     start,step=obj.getTimestepScheme()
     tscheme=(start,step) if start!=0 or step!=0 else None
 
-    if arrayformat in  (BINARY, BINARY_GZ):
+    if arrayformat in (BINARY, BINARY_GZ)+pluginFormats:
         filenamePrefix=filenamePrefix or obj.getName()
 
     filename='%s.dat'%filenamePrefix if filenamePrefix else None
@@ -358,8 +618,7 @@ class X4DFPlugin(CombinedScenePlugin):
 
     @eidolon.taskmethod('Loading X4DF Object')
     def loadObject(self,filename,name=None,task=None,**kwargs):
-        eidolon.printFlush(task)
-        x4=timing(readFile)(filename)
+        x4=timing(readX4DF)(filename)
         objs=timing(importMeshes)(x4)+timing(importImages)(x4,self)
         #basepath=os.path.dirname(filename)
 
@@ -378,11 +637,21 @@ class X4DFPlugin(CombinedScenePlugin):
 
     @eidolon.taskmethod('Saving X4DF Object')
     def saveObject(self,obj,path,overwrite=False,setFilenames=False,task=None,arrayFormat=BASE64_GZ,datatype='f4',separateFiles=False,**kwargs):
+        '''
+        Save `obj' to the X4DF file `path', or a file named after the object if `path' is a directory. Arrays are
+        stored in `arrayFormat', images with element type `datatype'. Arrays are stored in separate files if
+        `separateFiles' is True or the format is one of BINARY, BINARY_GZ, or pluginFormats (RAW, BLOCKED_ZLIB,
+        BLOCKED_LZ4). Keyword arguments `blockSize' and `numThreads' control slab size and compression threads for
+        the formats in pluginFormats.
+        '''
         if os.path.isdir(path):
             path=os.path.join(path,eidolon.getValidFilename(obj.getName()))
         
         path=eidolon.ensureExt(path,'.x4df')
-        fileprefix=os.path.splitext(path) if separateFiles else None
+        fileprefix=None
+
+        if separateFiles or arrayFormat in (BINARY, BINARY_GZ)+pluginFormats:
+            fileprefix=os.path.splitext(os.path.basename(path))[0] # array file names are relative to the x4df file
 
         if not overwrite and os.path.exists(path):
             raise IOError('Cannot overwrite file %r'%path)
@@ -392,7 +661,7 @@ class X4DFPlugin(CombinedScenePlugin):
         else:
             x4=convertImage(obj,self,arrayFormat,datatype,fileprefix)
 
-        timing(writeFile)(x4,path)
+        timing(writeX4DF)(x4,path,kwargs.get('blockSize',defaultBlockSize),kwargs.get('numThreads',None))
 
         # free array data but keep the rest
         for a in x4.arrays:
@@ -401,7 +670,7 @@ class X4DFPlugin(CombinedScenePlugin):
         if setFilenames:
             obj.plugin=self
             obj.kwargs[ConfigArgs._filename]=path
-            obj.kwargs[ConfigArgs._filenames]=[a.filename for a in x4.arrays if a.filename]
+            obj.kwargs[ConfigArgs._filenames]=[os.path.join(os.path.dirname(path),a.filename) for a in x4.arrays if a.filename]
             obj.kwargs[ConfigArgs._loadorder]=0
             obj.kwargs[ConfigArgs._source]=x4
 
@@ -487,4 +756,32 @@ class TestX4DFPlugin(unittest.TestCase):
             
             diff=np.sum(np.abs(self.volarr-arr1))
             self.assertAlmostEqual(diff,0,4,'%r is too large'%(diff,))
-            
\ No newline at end of file
+            
+    def testSaveLoadVolumeRaw(self):
+        '''Test saving a volume image as a raw array file which is memory mapped when loaded.'''
+        f=self.plugin.saveObject(self.vol,self.tempdir,arrayFormat=RAW,datatype='f8')
+        eidolon.getSceneMgr().checkFutureResult(f)
+        
+        filename=eidolon.first(glob.glob(self.tempdir+'/*.x4df'))
+        x4=readX4DF(filename)
+        
+        self.assertIsInstance(x4.arrays[0].data,np.memmap)
+        
+        obj1=self.plugin.loadObject(filename)[0]
+        
+        with eidolon.processImageNp(obj1) as arr1:
+            self.assertEqual(self.volarr.shape,arr1.shape)
+            
+            diff=np.sum(np.abs(self.volarr-arr1))
+            self.assertAlmostEqual(diff,0,4,'%r is too large'%(diff,))
+            
+    def testBlockedArray(self):
+        '''Test writing a blocked zlib array file and reading it whole and by byte range.'''
+        filename=os.path.join(self.tempdir,'blocked.dat')
+        writeBlockedArray(filename,self.volarr,'f8',BLOCKED_ZLIB,10000,4)
+        
+        arr=readBlockedArray(filename,'f8',self.volarr.shape)
+        self.assertTrue(np.all(self.volarr==arr))
+        
+        data=readBlockedBytes(filename,12345,67890)
+        self.assertEqual(bytes(data),self.volarr.astype('<f8').tobytes()[12345:67890])
@@ -414,5 +414,30 @@ cdef class ColorMatrix:
 
 
 ##Extras Color
-# no extra methods for ColorMatrix
+# extra methods for ColorMatrix, the buffer exposes each color as 4 float values in RGBA order
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        cdef Py_ssize_t itemsize = sizeof(float)
+
+        self.shape[0] = self.mat.n()
+        self.shape[1] = self.mat.m()*4
+
+        self.strides[1] = itemsize
+        self.strides[0] = self.mat.m()*4*itemsize
+
+        buffer.buf = <char *>self.mat.dataPtr()
+        buffer.format = 'f'
+        buffer.internal = NULL
+        buffer.itemsize = itemsize
+        buffer.len = self.mat.memSize()
+        buffer.ndim = 2
+        buffer.obj = self
+        buffer.readonly = 0
+        buffer.shape = self.shape
+        buffer.strides = self.strides
+        buffer.suboffsets = NULL
+        self.viewCount+=1
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        self.viewCount-=1
 
@@ -0,0 +1,126 @@
+# Eidolon Biomedical Framework
+# Copyright (C) 2016-8 Eric Kerfoot, King's College London, all rights reserved
+#
+# This file is part of Eidolon.
+#
+# Eidolon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eidolon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program (LICENSE.txt).  If not, see <http://www.gnu.org/licenses/>
+
+# Benchmark loading a series stored uncompressed and with each compressed transfer syntax that can be generated locally.
+
+import os
+import sys
+import struct
+import time
+import tempfile
+import shutil
+import numpy as np
+
+from eidolon import ReprType, Future, printFlush
+from pydicom.dataset import Dataset,FileDataset
+
+plugin=mgr.getPlugin('Dicom')
+dcmmodule=sys.modules[type(plugin).__module__]
+encodeRLEFrame=dcmmodule.encodeRLEFrame
+imagecodecs=dcmmodule.imagecodecs
+
+numslices=60
+dim=256
+uncompressed='1.2.840.10008.1.2.1' # Explicit VR Little Endian
+
+# sphere volume with a noisy background, uint16 values
+z,y,x=np.ogrid[:numslices,:dim,:dim]
+vol=(np.sqrt((x-dim/2)**2+(y-dim/2)**2+((z-numslices/2)*4)**2)<dim/3)*1000
+vol=(vol+np.random.randint(0,50,vol.shape)).astype(np.uint16)
+
+syntaxes=[('Uncompressed',uncompressed,None),('RLE','1.2.840.10008.1.2.5',encodeRLEFrame)]
+
+if imagecodecs is not None:
+    if hasattr(imagecodecs,'jpegls_encode'):
+        syntaxes.append(('JPEG-LS','1.2.840.10008.1.2.4.80',imagecodecs.jpegls_encode))
+    if hasattr(imagecodecs,'jpeg2k_encode'):
+        syntaxes.append(('JPEG2000','1.2.840.10008.1.2.4.90',lambda a:imagecodecs.jpeg2k_encode(a,level=0,codecformat='j2k')))
+
+
+def encapsulateFrame(frame):
+    '''Encapsulate one frame with an empty basic offset table, the sequence delimiter is added when writing.'''
+    frame+=b'\0'*(len(frame)%2)
+    item=lambda data:struct.pack('<HHI',0xFFFE,0xE000,len(data))+data
+    return item(b'')+item(frame)
+
+
+def writeSeries(dirpath,name,tsuid,encode):
+    seriesuid='1.2.826.0.1.3680043.2.1125.%i'%abs(hash(name))
+
+    for i in range(numslices):
+        filename=os.path.join(dirpath,'%s_%03i.dcm'%(name,i))
+
+        meta=Dataset()
+        meta.MediaStorageSOPClassUID='1.2.840.10008.5.1.4.1.1.4'
+        meta.MediaStorageSOPInstanceUID='%s.%i'%(seriesuid,i)
+        meta.TransferSyntaxUID=tsuid
+
+        ds=FileDataset(filename,{},file_meta=meta,preamble=b'\0'*128)
+        ds.is_little_endian=True
+        ds.is_implicit_VR=False
+        ds.SOPInstanceUID=meta.MediaStorageSOPInstanceUID
+        ds.SeriesInstanceUID=seriesuid
+        ds.SeriesDescription=name
+        ds.SeriesNumber=1
+        ds.InstanceNumber=i+1
+        ds.ImagePositionPatient=[0,0,i]
+        ds.ImageOrientationPatient=[1,0,0,0,1,0]
+        ds.PixelSpacing=[1,1]
+        ds.Rows=dim
+        ds.Columns=dim
+        ds.SamplesPerPixel=1
+        ds.PhotometricInterpretation='MONOCHROME2'
+        ds.BitsAllocated=16
+        ds.BitsStored=16
+        ds.HighBit=15
+        ds.PixelRepresentation=0
+
+        if encode is None:
+            ds.add_new(0x7fe00010,'OW',vol[i].tobytes())
+        else:
+            ds.add_new(0x7fe00010,'OB',encapsulateFrame(bytes(encode(vol[i]))))
+            ds['PixelData'].is_undefined_length=True
+
+        ds.save_as(filename)
+
+
+rootdir=tempfile.mkdtemp()
+times={}
+
+try:
+    for name,tsuid,encode in syntaxes:
+        dirpath=os.path.join(rootdir,name)
+        os.mkdir(dirpath)
+        writeSeries(dirpath,name,tsuid,encode)
+
+        dds=plugin.loadDigestFile(dirpath,None)
+
+        start=time.time()
+        obj=Future.get(plugin.loadSeries(dds.series[0],name))
+        times[name]=time.time()-start
+
+        mgr.addSceneObject(obj)
+
+    for name,_,_ in syntaxes:
+        printFlush('%-14s %.3fs (x%.2f uncompressed)'%(name,times[name],times[name]/times['Uncompressed']))
+
+    rep=obj.createRepr(ReprType._imgstack)
+    mgr.addSceneObjectRepr(rep)
+    mgr.setCameraSeeAll()
+finally:
+    shutil.rmtree(rootdir)
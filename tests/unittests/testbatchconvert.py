@@ -0,0 +1,173 @@
+# Eidolon Biomedical Framework
+# Copyright (C) 2016-8 Eric Kerfoot, King's College London, all rights reserved
+#
+# This file is part of Eidolon.
+#
+# Eidolon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eidolon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program (LICENSE.txt).  If not, see <http://www.gnu.org/licenses/>
+
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from eidolon import (
+	ScenePlugin, SceneObject, getSceneMgr, splitPathExt, concurrent, checkResultMap, sumResultMap, createConvertJobs,
+	convertFiles
+)
+
+
+@concurrent
+def copyLines(process,lines):
+	'''Returns the given lines, used by the test plugin to load data through the process server as real plugins do.'''
+	return list(lines)
+
+
+class ConvertTestPlugin(ScenePlugin):
+	'''
+	Stands in for a format plugin, loading a text file into an object and saving it with the number of files which
+	were being saved at the time. Each save leaves a marker file in the "rundir" directory while it's in progress.
+	Files are loaded through an @concurrent routine so that conversions in worker processes use the process server.
+	'''
+	def __init__(self):
+		ScenePlugin.__init__(self,'ConvertTest')
+
+	def acceptFile(self,filename):
+		return filename.endswith('.cvtest')
+
+	def loadObject(self,filename,name=None,**kwargs):
+		if kwargs.get('fail',False):
+			raise IOError('Failed to load %r'%filename)
+
+		with open(filename) as o:
+			lines=o.readlines()
+
+		result=copyLines(len(lines),0,None,lines,partitionArgs=(lines,))
+		checkResultMap(result)
+
+		return SceneObject(name or splitPathExt(filename)[1],self,data=''.join(sumResultMap(result)))
+
+	def saveObject(self,obj,path,overwrite=False,setFilenames=False,**kwargs):
+		rundir=kwargs['rundir']
+		marker=os.path.join(rundir,'%s_%i'%(obj.getName(),os.getpid()))
+
+		with open(marker,'w'):
+			pass
+
+		time.sleep(0.2)
+		running=len(os.listdir(rundir))
+		os.remove(marker)
+
+		with open(path,'w') as o:
+			o.write('%s\n%i'%(obj.kwargs['data'],running))
+
+
+class TestBatchConvert(unittest.TestCase):
+	def setUp(self):
+		self.tempdir=tempfile.mkdtemp()
+		self.outdir=os.path.join(self.tempdir,'out')
+		self.rundir=os.path.join(self.tempdir,'running')
+		self.files=[]
+
+		os.mkdir(self.outdir)
+		os.mkdir(self.rundir)
+
+		mgr=getSceneMgr()
+		mgr.addRuntimePlugin(ConvertTestPlugin())
+		self.plugin=mgr.getPlugin('ConvertTest')
+
+		for i in range(4):
+			filename=os.path.join(self.tempdir,'file%i.cvtest'%i)
+			self.files.append(filename)
+			with open(filename,'w') as o:
+				o.write(str(i)*100)
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+
+	def createJobs(self,files=None,loadargs={}):
+		return createConvertJobs(files or self.files,self.outdir,self.plugin.name,'.out',loadargs,{'rundir':self.rundir})
+
+	def readOutput(self,result):
+		'''Returns the data and running count saved for `result'.'''
+		self.assertIsNone(result.error)
+		self.assertEqual(1,len(result.outpaths))
+
+		with open(result.outpaths[0]) as o:
+			data,running=o.read().rsplit('\n',1)
+
+		return data,int(running)
+
+	def checkResults(self,results):
+		'''Check that `results' are in file order with each file converted, returns the running counts.'''
+		self.assertEqual(self.files,[r.infile for r in results])
+		counts=[]
+
+		for i,r in enumerate(results):
+			data,running=self.readOutput(r)
+			self.assertEqual(str(i)*100,data)
+			self.assertEqual(100,r.size)
+			counts.append(running)
+
+		return counts
+
+	def testCreateJobs(self):
+		'''Test output paths replace the full extension and argument dictionaries are copied for each job.'''
+		loadargs={'a':1}
+		jobs=createConvertJobs(['/a/b/x.nii.gz','y.vtk'],self.outdir,'Nifti','.out',loadargs,{'b':2})
+
+		self.assertEqual([os.path.join(self.outdir,'x.out'),os.path.join(self.outdir,'y.out')],[j.outpath for j in jobs])
+		self.assertEqual(['Nifti','Nifti'],[j.plugin for j in jobs])
+		self.assertEqual(loadargs,jobs[0].loadargs)
+		self.assertIsNot(loadargs,jobs[0].loadargs)
+		self.assertIsNot(jobs[0].saveargs,jobs[1].saveargs)
+
+	def testConvertLocal(self):
+		'''Test converting files one at a time in this process, reporting each result to the callback.'''
+		messages=[]
+		counts=self.checkResults(convertFiles(self.createJobs(),1,callback=messages.append))
+
+		self.assertEqual([1]*len(self.files),counts)
+		self.assertEqual(len(self.files),len(messages))
+
+	def testConvertParallel(self):
+		'''Test converting files in worker processes, whose loads use @concurrent, returns results in job order.'''
+		self.checkResults(convertFiles(self.createJobs(),2,callback=None))
+		self.assertEqual([],os.listdir(self.rundir))
+
+	def testMemoryLimit(self):
+		'''Test only one file is converted at a time when the memory budget only allows one in flight.'''
+		counts=self.checkResults(convertFiles(self.createJobs(),4,150,1.0,None))
+		self.assertEqual([1]*len(self.files),counts)
+
+	def testMemoryLimitOversized(self):
+		'''Test files larger than the memory budget are still converted one at a time.'''
+		counts=self.checkResults(convertFiles(self.createJobs(),4,10,1.0,None))
+		self.assertEqual([1]*len(self.files),counts)
+
+	def testFailures(self):
+		'''Test failed files are recorded in their results without stopping the other files being converted.'''
+		unaccepted=os.path.join(self.tempdir,'file.unaccepted')
+		with open(unaccepted,'w') as o:
+			o.write('data')
+
+		for numprocs in (1,2):
+			messages=[]
+			jobs=self.createJobs([unaccepted]+self.files[:1])+self.createJobs(self.files[1:2],{'fail':True})
+			results=convertFiles(jobs,numprocs,callback=messages.append)
+
+			self.assertIn('No plugin accepts',results[0].error)
+			self.assertEqual('0'*100,self.readOutput(results[1])[0])
+			self.assertIn('Failed to load',results[2].error)
+			self.assertEqual(2,sum(1 for m in messages if m.startswith('FAILED')))
@@ -0,0 +1,84 @@
+# Eidolon Biomedical Framework
+# Copyright (C) 2016-8 Eric Kerfoot, King's College London, all rights reserved
+#
+# This file is part of Eidolon.
+#
+# Eidolon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eidolon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program (LICENSE.txt).  If not, see <http://www.gnu.org/licenses/>
+
+import unittest
+import numpy as np
+from TestUtils import generateTestMeshDS
+from eidolon import ElemType, MatrixType, PyDataSet, calculateTetIsosurfArray, calculateTriIsolineArray, generateIsosurfaceDataSet
+
+
+class TestIsosurface(unittest.TestCase):
+	def setUp(self):
+		self.tetxis=np.asarray(ElemType.Tet1NL.xis,dtype=float)
+		self.tets=np.asarray([range(4)],dtype=np.int32)
+
+	def testTetSingleTriangle(self):
+		'''Test slicing a tet with one vertex above the value produces one triangle on the plane xi0=0.5.'''
+		vals=np.ascontiguousarray(self.tetxis[np.newaxis,:,0])
+		triinds,trixis=calculateTetIsosurfArray(vals,self.tets,self.tetxis,np.asarray([0.5]))
+
+		self.assertEqual((1,2),triinds.shape)
+		self.assertEqual((0,0),tuple(triinds[0]))
+		self.assertTrue(np.allclose(trixis[0,:,0],0.5))
+
+	def testTetTwoTriangles(self):
+		'''Test slicing a tet with two vertices above the value produces two triangles on the plane xi0+xi1=0.5.'''
+		vals=np.ascontiguousarray((self.tetxis[:,0]+self.tetxis[:,1])[np.newaxis])
+		triinds,trixis=calculateTetIsosurfArray(vals,self.tets,self.tetxis,np.asarray([0.5]))
+
+		self.assertEqual(2,triinds.shape[0])
+		self.assertTrue(np.allclose(trixis[:,:,0]+trixis[:,:,1],0.5))
+
+	def testTetMultipleValues(self):
+		'''Test slicing several elements for several values, values outside the field range produce no triangles.'''
+		vals=np.ascontiguousarray(np.stack([self.tetxis[:,0],self.tetxis[:,0]*2]))
+		triinds,trixis=calculateTetIsosurfArray(vals,self.tets,self.tetxis,np.asarray([0.25,1.5,5.0]))
+
+		self.assertEqual([(0,0),(1,0),(1,1)],sorted(map(tuple,triinds)))
+
+		for (elem,val),xis in zip(triinds,trixis):
+			self.assertTrue(np.allclose(xis[:,0]*(elem+1),[0.25,1.5,5.0][val]))
+
+	def testTriIsoline(self):
+		'''Test slicing a triangle produces one segment on the line xi0=0.5.'''
+		trixis=np.asarray([xi+(0.0,) for xi in ElemType.Tri1NL.xis],dtype=float)
+		vals=np.ascontiguousarray(trixis[np.newaxis,:,0])
+		lineinds,linexis=calculateTriIsolineArray(vals,np.asarray([range(3)],dtype=np.int32),trixis,np.asarray([0.5]))
+
+		self.assertEqual((1,2),lineinds.shape)
+		self.assertTrue(np.allclose(linexis[0,:,0],0.5))
+		self.assertFalse(np.allclose(linexis[0,0],linexis[0,1]))
+
+	def testHexIsosurfacePlane(self):
+		'''Test that the isosurface of a linear field in a unit cube hex mesh is the unit square plane.'''
+		ds=generateTestMeshDS(ElemType._Hex1NL,2)
+		nodes=ds.getNodes()
+		xfield=[nodes.getAt(n).x() for n in range(nodes.n())]
+		ds=PyDataSet('XDS',nodes,[ds.getIndexSet('inds')],[('xfield',xfield,'inds','inds')])
+
+		iso,_=generateIsosurfaceDataSet(ds,'iso',1,field='xfield',vals='0.3')
+		isonodes=np.asarray(iso.getNodes())
+		tris=np.asarray(iso.getIndexSet('iso'+MatrixType.tris[1]))
+
+		self.assertGreater(tris.shape[0],0)
+		self.assertTrue(np.allclose(isonodes[:,0],0.3))
+		self.assertTrue(np.allclose(np.abs(isonodes[:,3]),1))
+
+		trinodes=isonodes[:,:3][tris]
+		area=np.linalg.norm(np.cross(trinodes[:,1]-trinodes[:,0],trinodes[:,2]-trinodes[:,0]),axis=1).sum()/2
+		self.assertAlmostEqual(1.0,area,5)
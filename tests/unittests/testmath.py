@@ -18,6 +18,7 @@
 
 
 import unittest
+import numpy as np
 from TestUtils import eq_,eqa_
 from eidolon import ElemType, GeomType
 
@@ -29,4 +30,18 @@ class TestMath(unittest.TestCase):
 		eqa_(0,et.xis[0][0])
 		eqa_(1,et.xis[1][0])
 		self.assertEqual(et.geom,GeomType._Line)
-    
+
+	def testBasisArray(self):
+		'''Test vectorized basis evaluation matches the basis function for each xi point.'''
+		xis=np.random.rand(20,3)
+		for et in (ElemType.Tri2NL,ElemType.Hex2NL,ElemType.Quad2CR,ElemType.Line1CH):
+			coeffs=[et.basis(*xi) for xi in xis]
+			self.assertTrue(np.allclose(et.basisArray(xis),coeffs))
+
+	def testApplyBasisArray(self):
+		'''Test vectorized interpolation of one element and of paired elements.'''
+		et=ElemType.Tri1NL
+		nodes=np.asarray([(0,0,0),(1,0,0),(0,2,0)],dtype=float)
+		xis=np.asarray([(0,0,0),(0.5,0,0),(0,0.5,0)])
+		self.assertTrue(np.allclose(et.applyBasisArray(nodes,xis),[(0,0,0),(0.5,0,0),(0,1,0)]))
+		self.assertTrue(np.allclose(et.applyBasisArray(np.asarray([nodes]*3),xis,paired=True),[(0,0,0),(0.5,0,0),(0,1,0)]))
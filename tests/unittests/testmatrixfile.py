@@ -0,0 +1,90 @@
+# Eidolon Biomedical Framework
+# Copyright (C) 2016-8 Eric Kerfoot, King's College London, all rights reserved
+# 
+# This file is part of Eidolon.
+#
+# Eidolon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Eidolon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License along
+# with this program (LICENSE.txt).  If not, see <http://www.gnu.org/licenses/>
+
+import os
+import unittest
+import tempfile
+import shutil
+import numpy as np
+from eidolon import RealMatrix, IndexMatrix, Vec3Matrix, ColorMatrix, storeMatrixToFile, readMatrixFromFile, mapMatrixFile
+
+
+class TestMatrixFile(unittest.TestCase):
+	def setUp(self):
+		self.tempdir=tempfile.mkdtemp()
+		self.filename=os.path.join(self.tempdir,'mat.bin')
+		
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+		
+	def storeRead(self,mat,**kwargs):
+		np.asarray(mat)[...]=np.arange(np.asarray(mat).size).reshape(np.asarray(mat).shape)
+		mat.meta('key','value')
+		storeMatrixToFile(self.filename,mat)
+		result=readMatrixFromFile(self.filename,**kwargs)
+		
+		self.assertEqual(type(mat),type(result))
+		self.assertEqual(mat.getName(),result.getName())
+		self.assertEqual(mat.getType(),result.getType())
+		self.assertEqual((mat.n(),mat.m()),(result.n(),result.m()))
+		self.assertEqual('value',result.meta('key'))
+		self.assertTrue(np.array_equal(np.asarray(mat),np.asarray(result)))
+		return result
+		
+	def testReal(self):
+		'''Test storing and reading a RealMatrix.'''
+		self.storeRead(RealMatrix('real','type',10,3))
+		
+	def testIndex(self):
+		'''Test storing and reading an IndexMatrix.'''
+		self.storeRead(IndexMatrix('index','type',10,3))
+		
+	def testVec3(self):
+		'''Test storing and reading a Vec3Matrix.'''
+		self.storeRead(Vec3Matrix('vec3','type',10,1))
+		
+	def testColor(self):
+		'''Test storing and reading a ColorMatrix.'''
+		mat=self.storeRead(ColorMatrix('color','type',10,1))
+		self.assertEqual(np.float32,np.asarray(mat).dtype)
+		self.assertEqual((10,4),np.asarray(mat).shape)
+		
+	def testShared(self):
+		'''Test reading a matrix into shared memory.'''
+		mat=self.storeRead(RealMatrix('real','type',10,3),isShared=True)
+		self.assertTrue(mat.isShared())
+		
+	def testMap(self):
+		'''Test memory-mapping a matrix file.'''
+		mat=RealMatrix('real','type',10,3)
+		np.asarray(mat)[...]=5
+		storeMatrixToFile(self.filename,mat)
+		header,arr=mapMatrixFile(self.filename)
+		
+		self.assertEqual('real',header['mtype'])
+		self.assertTrue(np.all(arr==5))
+		
+	def testChecksum(self):
+		'''Test that a corrupted matrix file is detected when read.'''
+		storeMatrixToFile(self.filename,RealMatrix('real','type',10,3))
+		
+		with open(self.filename,'r+b') as o:
+			o.seek(-1,os.SEEK_END)
+			o.write(b'\x01')
+			
+		self.assertRaises(IOError,readMatrixFromFile,self.filename)
@@ -0,0 +1,116 @@
+# Eidolon Biomedical Framework
+# Copyright (C) 2016-8 Eric Kerfoot, King's College London, all rights reserved
+#
+# This file is part of Eidolon.
+#
+# Eidolon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eidolon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program (LICENSE.txt).  If not, see <http://www.gnu.org/licenses/>
+
+import unittest
+import numpy as np
+from TestUtils import generateTestMeshDS
+from eidolon import vec3, ElemType, ReprType, Vec3Matrix, PyDataSet, MeshSceneObject, MeshSceneObjectRepr, TDMeshSceneObjectRepr, \
+		generateTriDataSet, generateSharedTopologyDataSet, fillMorphNodes, interpolateMorphNodes
+
+
+class SoftwareMaterial(object):
+	'''Stands in for a material without the morph vertex program so that the software interpolation path is used.'''
+	def setGPUParamReal(self,ptype,name,value):
+		return False
+
+
+class RecordFigure(object):
+	'''Stands in for a figure, recording the vertex buffer it's filled with.'''
+	def __init__(self):
+		self.vbuff=None
+
+	def fillData(self,vbuff,ibuff,deferFill=False,doubleSided=False):
+		self.vbuff=vbuff
+
+	def setVisible(self,isVisible):
+		pass
+
+
+class TestMorph(unittest.TestCase):
+	def setUp(self):
+		self.ds0=generateTestMeshDS(ElemType._Hex1NL,2)
+
+		nodes=self.ds0.getNodes().clone('nodes1')
+		nodes.mul(vec3(2,0.5,1.5))
+		self.ds1=PyDataSet('TestDS1',nodes,[self.ds0.getIndexSet('inds')],[])
+
+		self.obj=MeshSceneObject('TestObj',[self.ds0,self.ds1])
+		self.obj.setTimestepList([0,10])
+
+		repr0=generateTriDataSet(self.ds0,'repr0',1)
+		repr1=generateSharedTopologyDataSet(repr0,self.ds1,'repr1')
+
+		self.sub0=MeshSceneObjectRepr(self.obj,ReprType._volume,1,1,repr0,self.ds0)
+		self.sub1=MeshSceneObjectRepr(self.obj,ReprType._volume,1,1,repr1,self.ds1)
+
+	def createMorphRepr(self):
+		rep=TDMeshSceneObjectRepr([self.sub0,self.sub1],self.obj,ReprType._volume,1,morph=True)
+		rep.morphNodes=Vec3Matrix('morph',0,4)
+		rep.morphMat=SoftwareMaterial()
+		rep.morphFig=RecordFigure()
+		return rep
+
+	def interpolatedNodes(self,value):
+		return np.asarray(self.sub0.nodes)[:,:3]*(1.0-value)+np.asarray(self.sub1.nodes)[:,:3]*value
+
+	def testNoMorphDefault(self):
+		'''Test that morphing is disabled unless requested.'''
+		rep=TDMeshSceneObjectRepr([self.sub0,self.sub1],self.obj,ReprType._volume,1)
+		self.assertFalse(rep.morph)
+		self.assertFalse(rep.isMorphing())
+
+	def testCanMorph(self):
+		'''Test that only subrepresentations sharing topology can be morphed.'''
+		other=MeshSceneObjectRepr(self.obj,ReprType._volume,1,1,generateTriDataSet(self.ds1,'other',1),self.ds1)
+
+		self.assertTrue(TDMeshSceneObjectRepr([self.sub0,self.sub1],self.obj,ReprType._volume,1).canMorph())
+
+		with self.assertRaises(ValueError):
+			TDMeshSceneObjectRepr([self.sub0,other],self.obj,ReprType._volume,1,morph=True)
+
+	def testMorphPosition(self):
+		'''Test the bracketing subrepresentations and interpolation value for fractional timesteps.'''
+		rep=TDMeshSceneObjectRepr([self.sub0,self.sub1],self.obj,ReprType._volume,1)
+
+		for ts,expected in [(0,(0,1,0.0)),(2.5,(0,1,0.25)),(10,(1,1,0.0))]:
+			rep.timestep=ts
+			self.assertEqual(expected,rep._getMorphPosition())
+
+	def testInterpolateNodes(self):
+		'''Test the software interpolation of morph nodes between timesteps.'''
+		mat=Vec3Matrix('morph',0,4)
+		fillMorphNodes(mat,self.sub0.nodes,self.sub1.nodes)
+
+		self.assertEqual(self.sub0.nodes.n(),mat.n())
+		self.assertTrue(np.allclose(self.interpolatedNodes(0),np.asarray(mat)[:,:3]))
+
+		interpolateMorphNodes(mat,0.25)
+		self.assertTrue(np.allclose(self.interpolatedNodes(0.25),np.asarray(mat)[:,:3]))
+
+		interpolateMorphNodes(mat,1.0)
+		self.assertTrue(np.allclose(self.interpolatedNodes(1.0),np.asarray(mat)[:,:3]))
+
+	def testSoftwarePlayback(self):
+		'''Test that setting fractional timesteps without the vertex program interpolates node positions on the CPU.'''
+		rep=self.createMorphRepr()
+
+		for ts in (0,2.5,7.5,10):
+			rep.setTimestep(ts)
+			self.assertTrue(np.allclose(self.interpolatedNodes(ts/10.0),np.asarray(rep.morphNodes)[:,:3]))
+
+		self.assertIsNotNone(rep.morphFig.vbuff)
@@ -0,0 +1,85 @@
+# Eidolon Biomedical Framework
+# Copyright (C) 2016-8 Eric Kerfoot, King's College London, all rights reserved
+#
+# This file is part of Eidolon.
+#
+# Eidolon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eidolon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program (LICENSE.txt).  If not, see <http://www.gnu.org/licenses/>
+
+import unittest
+import numpy as np
+from TestUtils import generateTestMeshDS
+from eidolon import vec3, ElemType, listToMatrix, isValidXi, pointSearchElems, pointSearchElemArray
+
+
+class TestPointSearch(unittest.TestCase):
+	def setUp(self):
+		self.pts=np.random.RandomState(123).uniform(-0.2,1.2,(60,3))
+
+	def bruteForceSearch(self,ds):
+		'''Returns a list of {element:xi} dictionaries for each point found by searching every element individually.'''
+		nodes=ds.getNodes()
+		ind=ds.getIndexSet('inds')
+		et=ElemType[ind.getType()]
+		results=[]
+
+		for pt in self.pts:
+			found={}
+			for e in range(ind.n()):
+				elemnodes=[nodes.getAt(i) for i in ind.getRow(e)]
+				xi=et.applyPointSearch(elemnodes,vec3(*pt),0)
+				if xi is not None and isValidXi(xi,et.isSimplex):
+					found[e]=np.asarray(list(xi))
+
+			results.append(found)
+
+		return results
+
+	def checkSearch(self,ds):
+		nodes=ds.getNodes()
+		ind=ds.getIndexSet('inds')
+		et=ElemType[ind.getType()]
+
+		elems,xis=pointSearchElems(nodes,ind,listToMatrix([vec3(*p) for p in self.pts],'pts'))
+		elemarr=np.asarray(elems)
+		xiarr=np.asarray(xis)
+
+		for i,brute in enumerate(self.bruteForceSearch(ds)):
+			self.assertEqual(bool(brute),bool(elemarr[i,1]),'Point %r found mismatch'%(tuple(self.pts[i]),))
+
+			if brute:
+				elem=elemarr[i,0]
+				self.assertIn(elem,brute)
+				self.assertTrue(np.allclose(brute[elem],xiarr[i],atol=1e-5))
+
+				elemnodes=[tuple(nodes.getAt(n)) for n in ind.getRow(elem)]
+				self.assertTrue(np.allclose(et.applyBasis(elemnodes,*xiarr[i]),self.pts[i],atol=1e-5))
+
+	def testHexBruteForce(self):
+		'''Test searching a linear hex mesh against searching each element individually.'''
+		self.checkSearch(generateTestMeshDS(ElemType._Hex1NL,2))
+
+	def testTetBruteForce(self):
+		'''Test searching a linear tet mesh against searching each element individually.'''
+		self.checkSearch(generateTestMeshDS(ElemType._Tet1NL,2))
+
+	def testRejectSurface(self):
+		'''Test that searching 2D elements is rejected.'''
+		ds=generateTestMeshDS(ElemType._Tri1NL,2)
+		pts=listToMatrix([vec3(*p) for p in self.pts],'pts')
+
+		with self.assertRaises(ValueError):
+			pointSearchElems(ds.getNodes(),ds.getIndexSet('inds'),pts)
+
+		with self.assertRaises(ValueError):
+			pointSearchElemArray(ElemType.Tri1NL,np.zeros((1,3,3)),np.zeros((1,3)))
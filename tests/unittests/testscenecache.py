@@ -0,0 +1,199 @@
+# Eidolon Biomedical Framework
+# Copyright (C) 2016-8 Eric Kerfoot, King's College London, all rights reserved
+#
+# This file is part of Eidolon.
+#
+# Eidolon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eidolon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program (LICENSE.txt).  If not, see <http://www.gnu.org/licenses/>
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from TestUtils import generateTestMeshDS
+from eidolon import (
+	ElemType, MeshScenePlugin, ImageScenePlugin, MeshSceneObject, ImageSceneObject, generateImageStack,
+	SceneCache, cacheDirName, cacheFileExt, encodeValue, decodeValue, readCacheFile, writeCacheFile
+)
+
+
+class TestSceneCache(unittest.TestCase):
+	def setUp(self):
+		self.tempdir=tempfile.mkdtemp()
+		self.cachedir=os.path.join(self.tempdir,cacheDirName)
+		self.srcfile=os.path.join(self.tempdir,'source.dat')
+		self.plugin=MeshScenePlugin('CacheTestMesh')
+		self.imgplugin=ImageScenePlugin('CacheTestImage')
+		self.numloads=0
+
+		with open(self.srcfile,'w') as o:
+			o.write('source')
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+
+	def loadMesh(self,filename):
+		'''Stands in for a plugin's load method, counting the calls made.'''
+		self.numloads+=1
+		return MeshSceneObject('mesh',generateTestMeshDS(ElemType._Hex1NL,1),self.plugin,filename=filename)
+
+	def loadImage(self,filename):
+		'''Stands in for a plugin's load method returning an image whose source has Numpy values like a Nifti header.'''
+		self.numloads+=1
+		source={'filename':filename,'pixdim':np.arange(8,dtype=np.float32),'datatype':np.int16(4),'descrip':np.array(b'test')}
+		return ImageSceneObject('img',source,generateImageStack(4,5,3),self.imgplugin)
+
+	def load(self,cache,filename=None,isImage=False):
+		plugin,loadfunc=(self.imgplugin,self.loadImage) if isImage else (self.plugin,self.loadMesh)
+		return cache.load(plugin,'loadObject',loadfunc,(filename or self.srcfile,),{})
+
+	def getCacheFiles(self):
+		return sorted(f for f in os.listdir(self.cachedir) if f.endswith(cacheFileExt)) if os.path.isdir(self.cachedir) else []
+
+	def testWriteReadFile(self):
+		'''Test arrays written to a cache file are read back with the same values, types, and aligned offsets.'''
+		filename=os.path.join(self.tempdir,'test'+cacheFileExt)
+		arrays=[np.arange(7,dtype=np.int8),np.random.rand(5,3),np.arange(12,dtype=np.uint32).reshape((3,4))]
+		writeCacheFile(filename,{'test':1},arrays)
+
+		header,readarrays=readCacheFile(filename)
+
+		self.assertEqual(1,header['test'])
+		for a,ra,(offset,_,_) in zip(arrays,readarrays,header['chunks']):
+			self.assertEqual(a.dtype,ra.dtype)
+			self.assertTrue(np.array_equal(a,ra))
+			self.assertEqual(0,offset%64)
+
+	def testEncodeValues(self):
+		'''Test values with Numpy arrays and scalars are encoded and decoded, and other objects are rejected.'''
+		val={'a':[1,'b',None],'arr':np.arange(6,dtype=np.int16).reshape((2,3)),'scalar':np.float32(1.5)}
+		decoded=decodeValue(encodeValue(val))
+
+		self.assertEqual(val['a'],decoded['a'])
+		self.assertEqual(val['arr'].dtype,decoded['arr'].dtype)
+		self.assertTrue(np.array_equal(val['arr'],decoded['arr']))
+		self.assertEqual(np.float32,type(decoded['scalar']))
+		self.assertEqual(1.5,decoded['scalar'])
+
+		with self.assertRaises(ValueError):
+			encodeValue({'obj':object()})
+
+	def testMiss(self):
+		'''Test the first load calls the load method and stores a cache file.'''
+		obj=self.load(SceneCache(self.cachedir))
+
+		self.assertEqual(1,self.numloads)
+		self.assertEqual(self.srcfile,obj.kwargs['filename'])
+		self.assertEqual(1,len(self.getCacheFiles()))
+
+	def testHit(self):
+		'''Test a second load with a new cache reconstructs the object from the cache file.'''
+		obj1=self.load(SceneCache(self.cachedir))
+		obj2=self.load(SceneCache(self.cachedir))
+		ds1=obj1.datasets[0]
+		ds2=obj2.datasets[0]
+
+		self.assertEqual(1,self.numloads)
+		self.assertEqual(obj1.kwargs,obj2.kwargs)
+		self.assertTrue(np.array_equal(np.asarray(ds1.getNodes()),np.asarray(ds2.getNodes())))
+		self.assertEqual(sorted(ds1.getIndexNames()),sorted(ds2.getIndexNames()))
+		self.assertEqual(sorted(ds1.getFieldNames()),sorted(ds2.getFieldNames()))
+
+		for n in ds1.getIndexNames():
+			self.assertTrue(np.array_equal(np.asarray(ds1.getIndexSet(n)),np.asarray(ds2.getIndexSet(n))))
+
+	def testHitImageSource(self):
+		'''Test an image with Numpy values in its source is cached with the source restored.'''
+		obj1=self.load(SceneCache(self.cachedir),isImage=True)
+		obj2=self.load(SceneCache(self.cachedir),isImage=True)
+
+		self.assertEqual(1,self.numloads)
+		self.assertEqual(obj1.source['filename'],obj2.source['filename'])
+		self.assertEqual(obj1.source['pixdim'].dtype,obj2.source['pixdim'].dtype)
+		self.assertTrue(np.array_equal(obj1.source['pixdim'],obj2.source['pixdim']))
+		self.assertEqual(4,int(obj2.source['datatype']))
+		self.assertEqual(obj1.source['descrip'],obj2.source['descrip'])
+		self.assertEqual(len(obj1.images),len(obj2.images))
+
+		for im1,im2 in zip(obj1.images,obj2.images):
+			self.assertEqual(im1.position,im2.position)
+			self.assertTrue(np.array_equal(np.asarray(im1.img),np.asarray(im2.img)))
+
+	def testInvalidation(self):
+		'''Test a changed source file causes the object to be loaded again and the cache entry replaced.'''
+		self.load(SceneCache(self.cachedir))
+
+		with open(self.srcfile,'a') as o:
+			o.write('changed')
+
+		self.load(SceneCache(self.cachedir))
+		self.load(SceneCache(self.cachedir))
+
+		self.assertEqual(2,self.numloads)
+		self.assertEqual(1,len(self.getCacheFiles()))
+
+	def testInvalidationDeleted(self):
+		'''Test the cache entry for a deleted source file is removed.'''
+		self.load(SceneCache(self.cachedir))
+		os.remove(self.srcfile)
+
+		self.load(SceneCache(self.cachedir))
+
+		self.assertEqual(2,self.numloads)
+		self.assertEqual([],self.getCacheFiles())
+
+	def testUncacheableArgs(self):
+		'''Test loads with arguments that have no stable representation aren't cached.'''
+		cache=SceneCache(self.cachedir)
+		cache.load(self.plugin,'loadObject',lambda *args:self.loadMesh(self.srcfile),(self.srcfile,object()),{})
+		cache.load(self.plugin,'loadObject',lambda *args:self.loadMesh(self.srcfile),(self.srcfile,object()),{})
+
+		self.assertEqual(2,self.numloads)
+		self.assertEqual([],self.getCacheFiles())
+
+	def testProxy(self):
+		'''Test a plugin proxy routes cached load methods through the cache and passes other attributes through.'''
+		self.plugin.loadObject=self.loadMesh
+		self.plugin.loadSceneObject=self.loadMesh
+
+		for _ in range(2):
+			proxy=SceneCache(self.cachedir).createProxy(self.plugin)
+			proxy.loadObject(self.srcfile)
+			proxy.loadSceneObject(self.srcfile)
+
+		self.assertEqual(2,self.numloads)
+		self.assertEqual(2,len(self.getCacheFiles()))
+		self.assertEqual(self.plugin.name,proxy.name)
+
+	def testPrune(self):
+		'''Test pruning removes cache files of objects not loaded through the cache and temporary files.'''
+		otherfile=os.path.join(self.tempdir,'other.dat')
+		with open(otherfile,'w') as o:
+			o.write('other')
+
+		cache=SceneCache(self.cachedir)
+		self.load(cache)
+		self.load(cache,otherfile)
+		files=self.getCacheFiles()
+
+		with open(os.path.join(self.cachedir,'partial'+cacheFileExt+'.tmp'),'w') as o:
+			o.write('partial')
+
+		cache=SceneCache(self.cachedir)
+		self.load(cache)
+		cache.prune()
+
+		self.assertEqual(2,len(files))
+		self.assertEqual([os.path.basename(cache.getCacheFile(k)) for k in cache.entries],self.getCacheFiles())
+		self.assertEqual(self.getCacheFiles(),sorted(os.listdir(self.cachedir)))
@@ -0,0 +1,64 @@
+# Eidolon Biomedical Framework
+# Copyright (C) 2016-8 Eric Kerfoot, King's College London, all rights reserved
+#
+# This file is part of Eidolon.
+#
+# Eidolon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eidolon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program (LICENSE.txt).  If not, see <http://www.gnu.org/licenses/>
+
+import unittest
+import numpy as np
+from TestUtils import generateTestMeshDS
+from eidolon import vec3, ElemType, MatrixType, StdProps, PyDataSet, generateTriDataSet, isTopologyShared, generateSharedTopologyDataSet
+
+
+class TestSharedTopology(unittest.TestCase):
+	def setUp(self):
+		self.ds0=generateTestMeshDS(ElemType._Hex1NL,2)
+
+		# second timestep with the same index matrix objects but scaled and translated nodes
+		nodes=self.ds0.getNodes().clone('nodes1')
+		nodes.mul(vec3(2,0.5,1.5))
+		nodes.add(vec3(1,-2,3))
+		self.ds1=PyDataSet('TestDS1',nodes,[self.ds0.getIndexSet('inds')],[])
+
+	def testIsShared(self):
+		'''Test that datasets with the same index matrices are recognized as sharing topology.'''
+		repr0=generateTriDataSet(self.ds0,'repr0',1)
+		self.assertTrue(isTopologyShared(self.ds0,self.ds1,repr0[1]))
+
+	def testIsNotShared(self):
+		'''Test that a dataset with a different index matrix does not share topology.'''
+		repr0=generateTriDataSet(self.ds0,'repr0',1)
+		ind=self.ds0.getIndexSet('inds').clone('inds')
+		ind.setAt(ind.getAt(0,1),0,0)
+		ds2=PyDataSet('TestDS2',self.ds1.getNodes(),[ind],[])
+
+		self.assertFalse(isTopologyShared(self.ds0,ds2,repr0[1]))
+
+	def testSharedMatchesGenerated(self):
+		'''Test that a shared topology dataset has the same nodes as one generated directly and shares its triangles.'''
+		repr0=generateTriDataSet(self.ds0,'repr0',1)
+		shared,_=generateSharedTopologyDataSet(repr0,self.ds1,'shared')
+		direct,_=generateTriDataSet(self.ds1,'direct',1)
+
+		self.assertEqual('True',shared.meta(StdProps._sharedtopology))
+		self.assertIs(repr0[0].getIndexSet('repr0'+MatrixType.tris[1]),shared.getIndexSet('shared'+MatrixType.tris[1]))
+
+		sharednodes=np.asarray(shared.getNodes())
+		directnodes=np.asarray(direct.getNodes())
+
+		self.assertEqual(directnodes.shape,sharednodes.shape)
+		self.assertTrue(np.allclose(directnodes[:,:3],sharednodes[:,:3]))
+		self.assertTrue(np.allclose(directnodes[:,6:9],sharednodes[:,6:9]))
+		self.assertTrue(np.allclose(np.linalg.norm(sharednodes[:,3:6],axis=1),1))